@@ -1,5 +1,4 @@
 import asyncio
-import time
 import traceback
 from datetime import datetime
 from typing import Callable, Dict, Any, Awaitable
@@ -12,38 +11,61 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.dispatcher.event.bases import SkipHandler
 
 from utils.time import get_moscow_now, get_moscow_today
-
-from config import BOT_TOKEN, MASTER_ADMIN_ID
+from utils.telegram_limiter import TELEGRAM_SEND_LIMITER
+from utils.antispam import should_throttle
+from utils.rate_limit import check_flood, make_rate_limit_backend, set_rate_limit_backend
+from utils.fsm_storage import FSMWriteBatchMiddleware, make_fsm_storage
+
+from config import (
+    BOT_TOKEN,
+    MASTER_ADMIN_ID,
+    RATE_LIMIT_BACKEND,
+    FSM_STORAGE,
+    FSM_TTL_SECONDS,
+    BOT_ROLE,
+    BOT_UPDATES_MODE,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+)
 from services.jobs import (
     finalize_party_job,
     daily_credits_grant_job,
     daily_results_publish_job,
     notifications_worker,
     scheduled_photos_activate_job,
+    photo_rating_aggregates_repair_job,
+    activity_rollups_job,
+    log_maintenance_job,
+    rank_recompute_job,
+    fsm_storage_cleanup_job,
+    profile_stats_reconcile_job,
+    support_media_prewarm_job,
 )
+from services.broadcast import broadcast_engine_loop
+from utils.image_pool import shutdown_image_pool
 from database import (
     init_db,
     log_bot_error,
     get_users_with_premium_expiring_tomorrow,
     mark_premium_expiry_reminder_sent,
-    get_user_block_status_by_tg_id,
     set_user_block_status_by_tg_id,
-    is_user_soft_deleted,
     hide_active_photos_for_user,
     restore_photos_from_status,
-    get_user_by_tg_id,
+    get_user_context_by_tg_id,
     get_tech_mode_state,
     get_update_mode_state,
     get_due_scheduled_broadcasts,
-    mark_scheduled_broadcast_sent,
     mark_scheduled_broadcast_failed,
-    get_all_users_tg_ids,
-    get_premium_users,
-    get_moderators,
-    get_support_users,
-    get_helpers,
-    log_activity_event,
+    create_broadcast_job,
+    clear_user_bot_blocked,
+    enqueue_activity_event,
+    close_db,
     get_user_by_id,
+    get_effective_protection_settings,
+    run_as_leader,
 )
 def _premium_expiry_reminder_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
@@ -63,12 +85,10 @@ def _admin_error_kb() -> InlineKeyboardMarkup:
 
 
 # простая анти-спам защита: одинаковая ошибка в том же хендлере не чаще раза в 30 секунд
-_LAST_ADMIN_ERR: dict[str, float] = {}
 _ADMIN_ERR_COOLDOWN_SEC = 30.0
 
 TECH_MODE_PHOTO_FILE_ID = "AgACAgIAAyEFAATVO5BPAAMmaYOxPhK6qvJxaQEXZ6qS4EpKVbMAArYOaxs3vSBI4HK0YtIU5asBAAMCAAN3AAM4BA"
 TECH_MODE_CAPTION = "🛠 Технические работы. Попробуй позже."
-_BROADCAST_SEND_DELAY_SEC = 0.05
 
 
 async def _delete_message_after(bot: Bot, chat_id: int, message_id: int, delay_sec: int = 15) -> None:
@@ -79,6 +99,106 @@ async def _delete_message_after(bot: Bot, chat_id: int, message_id: int, delay_s
         pass
 
 
+async def _get_user_ctx(data: Dict[str, Any], tg_user_id: int) -> dict | None:
+    """user_ctx из data (его кладёт UserContextMiddleware); если нет — догружаем один раз."""
+    ctx = data.get("user_ctx")
+    if ctx is not None and ctx.get("tg_id") == int(tg_user_id):
+        return ctx
+    try:
+        ctx = await get_user_context_by_tg_id(int(tg_user_id))
+    except Exception:
+        return None
+    data["user_ctx"] = ctx
+    return ctx
+
+
+def _is_staff_ctx(ctx: dict | None) -> bool:
+    return bool(ctx and (ctx.get("is_admin") or ctx.get("is_moderator") or ctx.get("is_support")))
+
+
+class ProtectionMiddleware(BaseMiddleware):
+    """
+    Самый первый middleware: флуд-контроль по настройкам protection.* (скользящие окна
+    utils.rate_limit). Работает до любых запросов в БД — настройки берутся из кэша,
+    флуд отбрасывается без похода в users. Включается protection.mode_enabled.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        try:
+            _, tg_user_id = _extract_chat_and_user_from_update(event)
+        except Exception:
+            tg_user_id = None
+        if tg_user_id is None or (MASTER_ADMIN_ID and tg_user_id == MASTER_ADMIN_ID):
+            return await handler(event, data)
+
+        try:
+            protection = await get_effective_protection_settings()
+            if not protection.get("mode_enabled"):
+                return await handler(event, data)
+            drop, spike_started = await check_flood(
+                int(tg_user_id),
+                is_callback=event.callback_query is not None,
+                max_actions_per_10s=int(protection["max_actions_per_10s"]),
+                max_callbacks_per_minute=int(protection["max_callbacks_per_minute_per_user"]),
+                cooldown_seconds=int(protection["cooldown_on_spike_seconds"]),
+            )
+        except Exception:
+            # лимитер не должен ронять бота
+            return await handler(event, data)
+
+        if not drop:
+            return await handler(event, data)
+
+        # один ответ на начало кулдауна, дальше молча режем
+        if spike_started and event.callback_query is not None:
+            try:
+                await event.callback_query.answer("Слишком часто. Подожди немного.", show_alert=False)
+            except Exception:
+                pass
+        raise SkipHandler
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Самый внешний middleware: одним запросом грузит юзера (строка, роли, блок, премиум)
+    и кладёт в data["user_ctx"]. Остальные мидлвари и хендлеры (аргумент `user_ctx`)
+    берут всё оттуда, а не ходят в users повторно.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        tg_user_id: int | None = None
+        try:
+            if isinstance(event, Update):
+                _, tg_user_id = _extract_chat_and_user_from_update(event)
+            elif hasattr(event, "from_user") and getattr(event, "from_user"):
+                tg_user_id = event.from_user.id  # type: ignore[attr-defined]
+        except Exception:
+            tg_user_id = None
+
+        data["user_ctx"] = None
+        if tg_user_id is not None:
+            ctx = await _get_user_ctx(data, int(tg_user_id))
+            # написал боту — значит, снова не заблокировал; вернуть в аудиторию рассылок
+            if ctx and (ctx.get("user") or {}).get("bot_blocked_at"):
+                try:
+                    await clear_user_bot_blocked(int(tg_user_id))
+                except Exception:
+                    pass
+        return await handler(event, data)
+
+
 class UpdateModeMiddleware(BaseMiddleware):
     """
     Режим «Обновление»: при включении полностью игнорируем любые действия обычных пользователей.
@@ -116,12 +236,8 @@ class UpdateModeMiddleware(BaseMiddleware):
         if MASTER_ADMIN_ID and tg_user_id == MASTER_ADMIN_ID:
             return await handler(event, data)
 
-        try:
-            u = await get_user_by_tg_id(int(tg_user_id))
-        except Exception:
-            u = None
-
-        if u and (u.get("is_admin") or u.get("is_moderator") or u.get("is_support")):
+        ctx = await _get_user_ctx(data, int(tg_user_id))
+        if _is_staff_ctx(ctx):
             return await handler(event, data)
 
         # Полный игнор для остальных
@@ -129,7 +245,7 @@ class UpdateModeMiddleware(BaseMiddleware):
 
 
 async def scheduled_broadcast_loop(bot: Bot) -> None:
-    """Периодически отправляет запланированные рассылки."""
+    """Превращает наступившие запланированные рассылки в broadcast_jobs (шлёт services.broadcast)."""
     while True:
         try:
             due = await get_due_scheduled_broadcasts(limit=5)
@@ -142,72 +258,12 @@ async def scheduled_broadcast_loop(bot: Bot) -> None:
 
         for item in due:
             try:
-                target = str(item.get("target") or "")
-                text_body = str(item.get("text") or "")
-                created_by = item.get("created_by_tg_id")
-
-                tg_ids: list[int] = []
-
-                def _is_valid_user(u: dict) -> bool:
-                    if not u:
-                        return False
-                    if u.get("is_deleted"):
-                        return False
-                    if u.get("is_blocked"):
-                        return False
-                    name = (u.get("name") or "").strip()
-                    if not name:
-                        return False
-                    return True
-
-                if target == "all":
-                    tg_ids = await get_all_users_tg_ids()
-                elif target == "premium":
-                    users = await get_premium_users()
-                    tg_ids = [int(u["tg_id"]) for u in users if u.get("tg_id") and _is_valid_user(u)]
-                elif target == "moderators":
-                    users = await get_moderators()
-                    tg_ids = [int(u["tg_id"]) for u in users if u.get("tg_id")]
-                elif target == "support":
-                    users = await get_support_users()
-                    tg_ids = [int(u["tg_id"]) for u in users if u.get("tg_id")]
-                elif target == "helpers":
-                    users = await get_helpers()
-                    tg_ids = [int(u["tg_id"]) for u in users if u.get("tg_id")]
-                elif target == "test" and created_by:
-                    tg_ids = [int(created_by)]
-
-                tg_ids = list({uid for uid in tg_ids if uid})
-
-                if target == "all":
-                    header = ""
-                elif target == "premium":
-                    header = "💎 <b>Сообщение для GlowShot Premium</b>"
-                elif target == "test":
-                    header = "🧪 <b>Тестовая рассылка</b>"
-                else:
-                    header = "👥 <b>Сообщение для команды GlowShot</b>"
-
-                send_text = text_body if not header else f"{header}\n\n{text_body}"
-
-                total = len(tg_ids)
-                sent = 0
-
-                for uid in tg_ids:
-                    try:
-                        await bot.send_message(
-                            chat_id=uid,
-                            text=send_text,
-                        )
-                        sent += 1
-                    except Exception:
-                        continue
-                    await asyncio.sleep(_BROADCAST_SEND_DELAY_SEC)
-
-                await mark_scheduled_broadcast_sent(
-                    int(item["id"]),
-                    total_count=total,
-                    sent_count=sent,
+                await create_broadcast_job(
+                    target=str(item.get("target") or ""),
+                    text=str(item.get("text") or ""),
+                    created_by_tg_id=item.get("created_by_tg_id"),
+                    with_seen_button=False,
+                    scheduled_id=int(item["id"]),
                 )
             except Exception as e:
                 try:
@@ -412,9 +468,11 @@ class BlockGuardMiddleware(BaseMiddleware):
         if tg_user_id is None:
             return await handler(event, data)
 
+        ctx = await _get_user_ctx(data, int(tg_user_id)) or {}
+
         # Если аккаунт удалён — разрешаем только /start (для повторной регистрации), остальное игнорируем.
         try:
-            if await is_user_soft_deleted(int(tg_user_id)):
+            if ctx.get("is_deleted"):
                 # Разрешаем только стартовое сообщение для восстановления
                 if isinstance(event, Update) and event.message:
                     text = (event.message.text or "").strip()
@@ -431,11 +489,11 @@ class BlockGuardMiddleware(BaseMiddleware):
         except Exception:
             pass
 
-        block = {}
-        try:
-            block = await get_user_block_status_by_tg_id(int(tg_user_id))
-        except Exception:
-            block = {}
+        block = {
+            "is_blocked": bool(ctx.get("is_blocked")),
+            "block_reason": ctx.get("block_reason"),
+            "block_until": ctx.get("block_until"),
+        }
 
         is_blocked = bool(block.get("is_blocked"))
         until_dt = None
@@ -450,9 +508,9 @@ class BlockGuardMiddleware(BaseMiddleware):
         if is_blocked and until_dt is not None and until_dt <= get_moscow_now():
             try:
                 await set_user_block_status_by_tg_id(int(tg_user_id), is_blocked=False, reason=None, until_iso=None)
-                user_row = await get_user_by_tg_id(int(tg_user_id))
-                if user_row:
-                    await restore_photos_from_status(int(user_row["id"]), from_status="blocked_by_ban", to_status="active")
+                if ctx.get("user_id"):
+                    await restore_photos_from_status(int(ctx["user_id"]), from_status="blocked_by_ban", to_status="active")
+                data["user_ctx"] = await get_user_context_by_tg_id(int(tg_user_id), use_cache=False)
             except Exception:
                 pass
             is_blocked = False
@@ -462,9 +520,8 @@ class BlockGuardMiddleware(BaseMiddleware):
 
         # Скрываем активные фото заблокированного пользователя из выдачи (однократно, best-effort)
         try:
-            user_row = await get_user_by_tg_id(int(tg_user_id))
-            if user_row:
-                await hide_active_photos_for_user(int(user_row["id"]), new_status="blocked_by_ban")
+            if ctx.get("user_id"):
+                await hide_active_photos_for_user(int(ctx["user_id"]), new_status="blocked_by_ban")
         except Exception:
             pass
 
@@ -536,9 +593,8 @@ class BlockGuardMiddleware(BaseMiddleware):
         return await handler(event, data)
 
 
-# Простое логирование активности для графиков (не чаще 1 раза в минуту на пользователя)
-_ACTIVITY_LAST: dict[int, float] = {}
-_ACTIVITY_COOLDOWN_SEC = 60.0
+# Простое логирование активности для графиков (не чаще 1 раза в минуту на пользователя).
+# Кулдаун и запись — в буфере database.enqueue_activity_event (флашится пачками).
 
 
 class ActivityLogMiddleware(BaseMiddleware):
@@ -567,14 +623,22 @@ class ActivityLogMiddleware(BaseMiddleware):
             tg_user_id = None
 
         if tg_user_id:
-            now_ts = time.time()
-            last_ts = _ACTIVITY_LAST.get(int(tg_user_id), 0.0)
-            if now_ts - last_ts >= _ACTIVITY_COOLDOWN_SEC:
-                _ACTIVITY_LAST[int(tg_user_id)] = now_ts
-                try:
-                    await log_activity_event(int(tg_user_id), kind=kind, username=username)
-                except Exception:
-                    pass
+            # Юзер уже загружен в user_ctx: если строка есть и username не менялся —
+            # событие пишется сразу по users.id, без резолва по tg_id.
+            known_user_id = None
+            ctx = data.get("user_ctx")
+            user_row = (ctx or {}).get("user") if (ctx and ctx.get("tg_id") == int(tg_user_id)) else None
+            if user_row and (not username or user_row.get("username") == username):
+                known_user_id = ctx.get("user_id")
+            try:
+                enqueue_activity_event(
+                    int(tg_user_id),
+                    kind=kind,
+                    username=username,
+                    user_id=known_user_id,
+                )
+            except Exception:
+                pass
 
         return await handler(event, data)
 
@@ -626,12 +690,8 @@ class TechModeMiddleware(BaseMiddleware):
         if MASTER_ADMIN_ID and tg_user_id == MASTER_ADMIN_ID:
             return await handler(event, data)
 
-        try:
-            u = await get_user_by_tg_id(int(tg_user_id))
-        except Exception:
-            u = None
-
-        if u and (u.get("is_admin") or u.get("is_moderator") or u.get("is_support")):
+        ctx = await _get_user_ctx(data, int(tg_user_id))
+        if _is_staff_ctx(ctx):
             return await handler(event, data)
 
         if chat_id is not None:
@@ -738,10 +798,7 @@ class ErrorsToDbMiddleware(BaseMiddleware):
             try:
                 if MASTER_ADMIN_ID:
                     key = _err_key(handler_name, err_type, err_text)
-                    now_ts = datetime.utcnow().timestamp()
-                    last = _LAST_ADMIN_ERR.get(key, 0.0)
-                    if now_ts - last >= _ADMIN_ERR_COOLDOWN_SEC:
-                        _LAST_ADMIN_ERR[key] = now_ts
+                    if not should_throttle(0, f"admin_err:{key}", _ADMIN_ERR_COOLDOWN_SEC):
 
                         handler_label = handler_name or "—"
                         chat_label = str(chat_id) if chat_id is not None else "—"
@@ -770,30 +827,10 @@ class ErrorsToDbMiddleware(BaseMiddleware):
             raise
 
 
-async def main() -> None:
-    if not BOT_TOKEN:
-        raise RuntimeError("BOT_TOKEN is not set in environment (.env)")
+_SCHEDULER_LOCK_KEY = "glowshot_scheduler"
 
-    # Поднимаем БД и таблицы
-    await init_db()
-
-    bot = Bot(
-        BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-    )
-
-    # фоновая проверка: напоминания о скором окончании премиума
-    asyncio.create_task(premium_expiry_reminder_loop(bot))
-    # фоновая отправка запланированных рассылок
-    asyncio.create_task(scheduled_broadcast_loop(bot))
-    # ежедневное обновление кэша итогов за всё время (без видимых сообщений)
-    asyncio.create_task(alltime_cache_refresh_loop())
-    # фоновые джобы жизненного цикла/экономики/итогов
-    asyncio.create_task(finalize_party_job(bot))
-    asyncio.create_task(daily_credits_grant_job(bot))
-    asyncio.create_task(daily_results_publish_job(bot))
-    asyncio.create_task(scheduled_photos_activate_job(bot))
 
+def _make_notification_sender(bot: Bot):
     async def _send_notification(_: int, item: dict):
         """Простой отправитель уведомлений из notification_queue."""
         user_id = int(item.get("user_id"))
@@ -815,14 +852,53 @@ async def main() -> None:
                 "Оценивай других: 1 оценка = +1 credit = 2 показа (в 15–16 — 4)."
             )
         if text:
-            try:
-                await bot.send_message(chat_id=chat_id, text=text)
-            except Exception:
-                pass
-
-    asyncio.create_task(notifications_worker(bot, send_fn=_send_notification))
-
-    dp = Dispatcher()
+            # ошибки отдаём воркеру: он решает, повторять или закрывать
+            await TELEGRAM_SEND_LIMITER.acquire()
+            await bot.send_message(chat_id=chat_id, text=text)
+
+    return _send_notification
+
+
+def _start_background_jobs(bot: Bot) -> list[asyncio.Task]:
+    """Все фоновые циклы; запускаются только в процессе-лидере (run_as_leader)."""
+    return [
+        # фоновая проверка: напоминания о скором окончании премиума
+        asyncio.create_task(premium_expiry_reminder_loop(bot)),
+        # запланированные рассылки -> broadcast_jobs; отправка — движком рассылок
+        asyncio.create_task(scheduled_broadcast_loop(bot)),
+        asyncio.create_task(broadcast_engine_loop(bot)),
+        # ежедневное обновление кэша итогов за всё время (без видимых сообщений)
+        asyncio.create_task(alltime_cache_refresh_loop()),
+        # фоновые джобы жизненного цикла/экономики/итогов
+        asyncio.create_task(finalize_party_job(bot)),
+        asyncio.create_task(daily_credits_grant_job(bot)),
+        asyncio.create_task(daily_results_publish_job(bot)),
+        asyncio.create_task(scheduled_photos_activate_job(bot)),
+        asyncio.create_task(photo_rating_aggregates_repair_job(bot)),
+        asyncio.create_task(activity_rollups_job(bot)),
+        asyncio.create_task(log_maintenance_job(bot)),
+        asyncio.create_task(rank_recompute_job(bot)),
+        asyncio.create_task(fsm_storage_cleanup_job(bot)),
+        asyncio.create_task(profile_stats_reconcile_job(bot)),
+        asyncio.create_task(support_media_prewarm_job(bot)),
+        asyncio.create_task(notifications_worker(bot, send_fn=_make_notification_sender(bot))),
+    ]
+
+
+def _build_dispatcher() -> Dispatcher:
+    # FSM в Postgres: незавершённые сценарии переживают деплой и видны всем воркерам
+    storage = make_fsm_storage(FSM_STORAGE, ttl_seconds=FSM_TTL_SECONDS)
+    dp = Dispatcher(storage=storage)
+
+    # Флуд-контроль (protection.*) — до любых запросов в БД
+    set_rate_limit_backend(make_rate_limit_backend(RATE_LIMIT_BACKEND))
+    dp.update.middleware(ProtectionMiddleware())
+
+    # Записи FSM за апдейт — одним запросом в конце
+    dp.update.middleware(FSMWriteBatchMiddleware(storage))
+
+    # Контекст пользователя (строка, роли, блок, премиум) — один запрос на апдейт
+    dp.update.middleware(UserContextMiddleware())
 
     # Режим обновления: полный игнор для всех, кроме админов/модераторов/поддержки
     dp.update.middleware(UpdateModeMiddleware())
@@ -848,7 +924,7 @@ async def main() -> None:
     dp.include_router(upload.router)
     dp.include_router(rate.router)
     dp.include_router(results.router)
-    dp.include_router(admin_router)    
+    dp.include_router(admin_router)
     dp.include_router(moderator.router)
     dp.include_router(premium.router)
     dp.include_router(payments.router)
@@ -856,26 +932,99 @@ async def main() -> None:
     dp.include_router(feedback.router)
     dp.include_router(help_center_router)
     dp.include_router(streak.router)
+    return dp
+
+
+async def _run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """Webhook-ingress: aiohttp-сервер с SO_REUSEPORT, так что на одном порту можно держать N воркеров."""
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET or None,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT, reuse_port=True)
+    await site.start()
+
+    # регистрируем webhook, только если он ещё не указывает сюда (воркеров может быть несколько)
+    if WEBHOOK_BASE_URL:
+        url = f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}"
+        info = await bot.get_webhook_info()
+        if info.url != url:
+            await bot.set_webhook(
+                url=url,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+
+    print(f"🤖 GlowShot webhook-воркер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
-    print("🤖 GlowShot запущен")
+
+async def main() -> None:
+    if not BOT_TOKEN:
+        raise RuntimeError("BOT_TOKEN is not set in environment (.env)")
+
+    # Поднимаем БД и таблицы
+    await init_db()
+
+    bot = Bot(
+        BOT_TOKEN,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+
+    # Фоновые джобы — в роли all/scheduler, но выполняет их только лидер
+    if BOT_ROLE in ("all", "scheduler"):
+        asyncio.create_task(run_as_leader(_SCHEDULER_LOCK_KEY, lambda: _start_background_jobs(bot)))
 
     try:
-        await dp.start_polling(bot)
-    except Exception as e:
-        tb = traceback.format_exc()
+        if BOT_ROLE == "scheduler":
+            print("🗓 GlowShot scheduler запущен")
+            await asyncio.Event().wait()
+            return
+
+        dp = _build_dispatcher()
+        if BOT_UPDATES_MODE == "webhook":
+            await _run_webhook(dp, bot)
+            return
+
+        print("🤖 GlowShot запущен")
         try:
-            await log_bot_error(
-                chat_id=None,
-                tg_user_id=None,
-                handler="start_polling",
-                update_type=None,
-                error_type=type(e).__name__,
-                error_text=str(e),
-                traceback_text=tb,
-            )
+            # если раньше работали через webhook — polling без этого не стартует
+            await bot.delete_webhook(drop_pending_updates=False)
+            await dp.start_polling(bot)
+        except Exception as e:
+            tb = traceback.format_exc()
+            try:
+                await log_bot_error(
+                    chat_id=None,
+                    tg_user_id=None,
+                    handler="start_polling",
+                    update_type=None,
+                    error_type=type(e).__name__,
+                    error_text=str(e),
+                    traceback_text=tb,
+                )
+            except Exception:
+                pass
+            raise
+    finally:
+        # дописываем буфер activity_events и закрываем пул
+        try:
+            await close_db()
         except Exception:
             pass
-        raise
+        shutdown_image_pool()
 
 
 if __name__ == "__main__":
@@ -33,6 +33,18 @@ if _MODERATION_CHAT_ID_RAW:
     except ValueError:
         MODERATION_CHAT_ID = None
 
+# ===== Support-bot media cache =====
+# Optional: private chat/channel where the support bot uploads photos entering moderation
+# (and deletes them right away) to obtain its own file_id ahead of time. Empty = no prewarm,
+# the support bot uploads on the first card it shows.
+_MEDIA_CACHE_CHAT_ID_RAW = (os.getenv("MEDIA_CACHE_CHAT_ID") or "").strip()
+MEDIA_CACHE_CHAT_ID = None
+if _MEDIA_CACHE_CHAT_ID_RAW:
+    try:
+        MEDIA_CACHE_CHAT_ID = int(_MEDIA_CACHE_CHAT_ID_RAW)
+    except ValueError:
+        MEDIA_CACHE_CHAT_ID = None
+
 # ===== Author verification submissions =====
 # Optional: separate group chat for author verification requests. If empty, bot falls back to MODERATION_CHAT_ID.
 _AUTHOR_APPLICATIONS_CHAT_ID_RAW = (os.getenv("AUTHOR_APPLICATIONS_CHAT_ID") or "").strip()
@@ -111,6 +123,49 @@ RESULTS_WEIGHT_RATINGS = 0.02
 RESULTS_WEIGHT_COMMENTS = 0.01
 RESULTS_PENALTY_REPORT = 5.0
 
+# ===== Log retention (days; 0 = keep forever) =====
+# Партиции логов старше срока удаляются (или отцепляются в схему archive, см. ниже).
+LOG_RETENTION_DAYS = {
+    "activity_events": int(os.getenv("RETENTION_ACTIVITY_EVENTS_DAYS", "180")),
+    "bot_error_logs": int(os.getenv("RETENTION_BOT_ERROR_LOGS_DAYS", "90")),
+    "streak_actions": int(os.getenv("RETENTION_STREAK_ACTIONS_DAYS", "400")),
+    "notification_queue": int(os.getenv("RETENTION_NOTIFICATION_QUEUE_DAYS", "60")),
+    # только просмотры удалённых/истёкших фото (живые — это «уже видел» для ленты)
+    "photo_views": int(os.getenv("RETENTION_PHOTO_VIEWS_DAYS", "0")),
+}
+# Таблицы, чьи старые партиции не удаляются, а уходят в схему archive (через запятую)
+LOG_RETENTION_ARCHIVE = {
+    t.strip() for t in os.getenv("LOG_RETENTION_ARCHIVE", "").split(",") if t.strip()
+}
+
+# ===== Процессы бота =====
+# BOT_ROLE: "all" — апдейты + фоновые джобы (как раньше), "worker" — только апдейты,
+# "scheduler" — только фоновые джобы. Джобы в любом случае выполняет один лидер
+# (advisory lock в Postgres), сколько бы реплик ни было запущено.
+BOT_ROLE = os.getenv("BOT_ROLE", "all").strip().lower()
+# BOT_UPDATES_MODE: "polling" или "webhook" (несколько worker-процессов на одном порту, SO_REUSEPORT)
+BOT_UPDATES_MODE = os.getenv("BOT_UPDATES_MODE", "polling").strip().lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").strip().rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg/webhook").strip() or "/tg/webhook"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0").strip()
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8081"))
+
+# FSM aiogram: "postgres" — переживает деплой и общий для воркеров, "memory" — локально
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres").strip().lower()
+FSM_TTL_SECONDS = int(os.getenv("FSM_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Флуд-контроль (ProtectionMiddleware): "memory" — на процесс, "postgres" — общий для нескольких процессов
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()
+
+# Обработка изображений (водяной знак, конвертация документов) — в пуле процессов, не в event loop.
+# IMAGE_POOL_WORKERS=0 — в потоке текущего процесса (без пула).
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+# сколько задач может ждать/выполняться одновременно; сверх этого — ждём места не дольше IMAGE_QUEUE_WAIT_SECONDS
+IMAGE_POOL_MAX_PENDING = int(os.getenv("IMAGE_POOL_MAX_PENDING", str(max(1, IMAGE_POOL_WORKERS) * 4)))
+IMAGE_QUEUE_WAIT_SECONDS = float(os.getenv("IMAGE_QUEUE_WAIT_SECONDS", "20"))
+IMAGE_JOB_TIMEOUT_SECONDS = float(os.getenv("IMAGE_JOB_TIMEOUT_SECONDS", "30"))
+
 # ===== Manual RUB (card transfer) =====
 # Toggle manual RUB flow (card transfer + user sends receipt)
 MANUAL_RUB_ENABLED = os.getenv("MANUAL_RUB_ENABLED", "1").strip().lower() in ("1", "true", "yes")
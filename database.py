@@ -1,8 +1,13 @@
+import asyncio
+import hashlib
 import json
+import logging
 import os
 import random
 import time
-from datetime import datetime, timedelta, date
+from collections import deque
+from typing import Callable
+from datetime import datetime, timedelta, date, timezone
 
 import asyncpg
 from asyncpg.exceptions import UniqueViolationError
@@ -31,15 +36,23 @@ from config import (
     STREAK_DAILY_UPLOADS,
     STREAK_GRACE_HOURS,
     STREAK_MAX_NUDGES_PER_DAY,
+    BOT_TIMEZONE,
+    LOG_RETENTION_DAYS,
+    LOG_RETENTION_ARCHIVE,
 )
 
+logger = logging.getLogger(__name__)
+
 DB_DSN = os.getenv("DATABASE_URL")
 pool: asyncpg.Pool | None = None
 
 # Cache global rating mean so we don't query it on every profile view.
-# Stored as (ts, mean, count)
+# Stored as (ts, mean, count). Source of truth is the rating_totals running-totals
+# table (O(1) read, shared by all processes), so the TTL can stay short.
 _GLOBAL_RATING_CACHE: tuple[float, float, int] | None = None
-_GLOBAL_RATING_TTL_SECONDS = 300
+_GLOBAL_RATING_TTL_SECONDS = 30
+# rating_totals is sharded by photo_id so concurrent rating writes don't queue on one row.
+_RATING_TOTALS_SHARDS = 16
 _UPLOAD_RULES_ACK_INTERVAL = timedelta(days=14)
 
 
@@ -97,7 +110,7 @@ def _premium_boost_chance() -> float:
 async def _get_global_rating_mean(conn: asyncpg.Connection) -> tuple[float, int]:
     """Return (global_mean, global_count) for all ratings.
 
-    Uses a short in-process cache.
+    Reads running totals from rating_totals; uses a short in-process cache.
     """
     global _GLOBAL_RATING_CACHE
     now = time.time()
@@ -110,10 +123,10 @@ async def _get_global_rating_mean(conn: asyncpg.Connection) -> tuple[float, int]
     row = await conn.fetchrow(
         """
         SELECT
-            COALESCE(SUM(value * CASE WHEN source='link' THEN $1 ELSE 1 END), 0)::float AS sum_w,
-            COALESCE(SUM(CASE WHEN source='link' THEN $1 ELSE 1 END), 0)::float AS cnt_w,
-            COUNT(*)::int AS cnt_raw
-        FROM ratings
+            (COALESCE(SUM(direct_sum), 0) + COALESCE(SUM(link_sum), 0) * $1::float)::float AS sum_w,
+            (COALESCE(SUM(direct_count), 0) + COALESCE(SUM(link_count), 0) * $1::float)::float AS cnt_w,
+            (COALESCE(SUM(direct_count), 0) + COALESCE(SUM(link_count), 0))::bigint AS cnt_raw
+        FROM rating_totals
         """,
         float(w),
     )
@@ -380,28 +393,46 @@ async def add_credits_on_vote(
     p = _assert_pool()
     economy = await get_effective_economy_settings()
     async with p.acquire() as conn:
-        stats = await _ensure_user_stats_row(conn, int(voter_id))
-        now_dt = now or get_bot_now()
-        is_hh = _is_happy_hour_with_settings(now_dt, economy)
-        credits_delta = int(delta)
-        if apply_happy_hour_bonus and is_hh:
-            # Happy Hour reward for rating actions.
-            credits_delta = 4
-        stats = await conn.fetchrow(
-            """
-            UPDATE user_stats
-            SET credits = credits + $2,
-                last_active_at = $3,
-                votes_given_today = votes_given_today + 1,
-                votes_given_happyhour_today = votes_given_happyhour_today + CASE WHEN $4 THEN 1 ELSE 0 END
-            WHERE user_id=$1
-            RETURNING *
-            """,
+        return await _add_credits_on_vote_conn(
+            conn,
             int(voter_id),
-            int(credits_delta),
-            now_dt,
-            is_hh,
+            delta=delta,
+            now_dt=now or get_bot_now(),
+            apply_happy_hour_bonus=apply_happy_hour_bonus,
+            economy=economy,
         )
+
+
+async def _add_credits_on_vote_conn(
+    conn: asyncpg.Connection,
+    voter_id: int,
+    *,
+    delta: int,
+    now_dt: datetime,
+    apply_happy_hour_bonus: bool,
+    economy: dict,
+) -> dict:
+    await _ensure_user_stats_row(conn, int(voter_id))
+    is_hh = _is_happy_hour_with_settings(now_dt, economy)
+    credits_delta = int(delta)
+    if apply_happy_hour_bonus and is_hh:
+        # Happy Hour reward for rating actions.
+        credits_delta = 4
+    stats = await conn.fetchrow(
+        """
+        UPDATE user_stats
+        SET credits = credits + $2,
+            last_active_at = $3,
+            votes_given_today = votes_given_today + 1,
+            votes_given_happyhour_today = votes_given_happyhour_today + CASE WHEN $4 THEN 1 ELSE 0 END
+        WHERE user_id=$1
+        RETURNING *
+        """,
+        int(voter_id),
+        int(credits_delta),
+        now_dt,
+        is_hh,
+    )
     return dict(stats) if stats else {}
 
 
@@ -884,39 +915,50 @@ async def consume_credits_on_rating(author_user_id: int, *, now: datetime | None
     p = _assert_pool()
     now_dt = now or get_bot_now()
     economy = await get_effective_economy_settings()
-    multiplier = _coerce_int(economy.get("credit_to_shows_normal"), 2, min_value=1, max_value=100)
     async with p.acquire() as conn:
         await _ensure_user_stats_row(conn, int(author_user_id))
         async with conn.transaction():
-            row = await conn.fetchrow(
-                "SELECT credits, show_tokens FROM user_stats WHERE user_id=$1 FOR UPDATE",
-                int(author_user_id),
-            )
-            if not row:
-                return False
-            credits = int(row["credits"] or 0)
-            tokens = int(row["show_tokens"] or 0)
-            if tokens <= 0 and credits > 0:
-                credits -= 1
-                tokens += multiplier
-            if tokens <= 0:
-                await conn.execute(
-                    "UPDATE user_stats SET credits=$2, show_tokens=$3, last_active_at=$4 WHERE user_id=$1",
-                    int(author_user_id),
-                    credits,
-                    tokens,
-                    now_dt,
-                )
-                return False
-            tokens -= 1
-            await conn.execute(
-                "UPDATE user_stats SET credits=$2, show_tokens=$3, last_active_at=$4 WHERE user_id=$1",
-                int(author_user_id),
-                credits,
-                tokens,
-                now_dt,
-            )
-            return True
+            return await _consume_credits_on_rating_conn(conn, int(author_user_id), now_dt=now_dt, economy=economy)
+
+
+async def _consume_credits_on_rating_conn(
+    conn: asyncpg.Connection,
+    author_user_id: int,
+    *,
+    now_dt: datetime,
+    economy: dict,
+) -> bool:
+    """Тело consume_credits_on_rating на уже открытой транзакции (строка user_stats должна существовать)."""
+    multiplier = _coerce_int(economy.get("credit_to_shows_normal"), 2, min_value=1, max_value=100)
+    row = await conn.fetchrow(
+        "SELECT credits, show_tokens FROM user_stats WHERE user_id=$1 FOR UPDATE",
+        int(author_user_id),
+    )
+    if not row:
+        return False
+    credits = int(row["credits"] or 0)
+    tokens = int(row["show_tokens"] or 0)
+    if tokens <= 0 and credits > 0:
+        credits -= 1
+        tokens += multiplier
+    if tokens <= 0:
+        await conn.execute(
+            "UPDATE user_stats SET credits=$2, show_tokens=$3, last_active_at=$4 WHERE user_id=$1",
+            int(author_user_id),
+            credits,
+            tokens,
+            now_dt,
+        )
+        return False
+    tokens -= 1
+    await conn.execute(
+        "UPDATE user_stats SET credits=$2, show_tokens=$3, last_active_at=$4 WHERE user_id=$1",
+        int(author_user_id),
+        credits,
+        tokens,
+        now_dt,
+    )
+    return True
 
 
 async def happy_hour_multiplier(now: datetime | None = None) -> int:
@@ -925,36 +967,9 @@ async def happy_hour_multiplier(now: datetime | None = None) -> int:
     return _credit_multiplier_for_moment(now_dt, economy)
 # -------------------- Notifications settings (likes/comments) --------------------
 
-async def _ensure_notify_tables(conn: asyncpg.Connection) -> None:
-    """Create notification tables if they don't exist (safe for Postgres)."""
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS user_notify_settings (
-            tg_id BIGINT PRIMARY KEY,
-            likes_enabled BOOLEAN NOT NULL DEFAULT TRUE,
-            comments_enabled BOOLEAN NOT NULL DEFAULT TRUE,
-            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        );
-        """
-    )
-
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS notify_likes_daily (
-            tg_id BIGINT NOT NULL,
-            day_key TEXT NOT NULL,
-            likes_count INTEGER NOT NULL DEFAULT 0,
-            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-            PRIMARY KEY (tg_id, day_key)
-        );
-        """
-    )
-
-
 async def get_notify_settings_by_tg_id(tg_id: int) -> dict:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_notify_tables(conn)
         await conn.execute(
             """
             INSERT INTO user_notify_settings (tg_id)
@@ -975,7 +990,6 @@ async def get_notify_settings_by_tg_id(tg_id: int) -> dict:
 async def toggle_likes_notify_by_tg_id(tg_id: int) -> dict:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_notify_tables(conn)
         await conn.execute(
             """
             INSERT INTO user_notify_settings (tg_id)
@@ -1000,7 +1014,6 @@ async def toggle_likes_notify_by_tg_id(tg_id: int) -> dict:
 async def toggle_comments_notify_by_tg_id(tg_id: int) -> dict:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_notify_tables(conn)
         await conn.execute(
             """
             INSERT INTO user_notify_settings (tg_id)
@@ -1026,7 +1039,6 @@ async def increment_likes_daily_for_tg_id(tg_id: int, day_key: str, delta: int =
     """Accumulate likes for daily summary notifications."""
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_notify_tables(conn)
         await conn.execute(
             """
             INSERT INTO notify_likes_daily (tg_id, day_key, likes_count)
@@ -1042,121 +1054,247 @@ async def increment_likes_daily_for_tg_id(tg_id: int, day_key: str, delta: int =
 
 # -------------------- UI state (menu / rating keyboard) --------------------
 
-async def _ensure_ui_state_table(conn: asyncpg.Connection) -> None:
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS user_ui_state (
-            tg_id BIGINT PRIMARY KEY,
-            menu_msg_id BIGINT,
-            rate_kb_msg_id BIGINT,
-            screen_msg_id BIGINT,
-            banner_msg_id BIGINT,
-            rate_cards_seen INTEGER NOT NULL DEFAULT 0,
-            rate_tutorial_seen BOOLEAN NOT NULL DEFAULT FALSE,
-            update_notice_seen_ver INTEGER NOT NULL DEFAULT 0,
-            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        );
-        """
-    )
-    await conn.execute(
-        "ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS screen_msg_id BIGINT;"
-    )
-    await conn.execute(
-        "ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS banner_msg_id BIGINT;"
-    )
-    await conn.execute(
-        "ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS rate_cards_seen INTEGER NOT NULL DEFAULT 0;"
-    )
-    await conn.execute(
-        "ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS rate_tutorial_seen BOOLEAN NOT NULL DEFAULT FALSE;"
-    )
-    await conn.execute(
-        "ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS update_notice_seen_ver INTEGER NOT NULL DEFAULT 0;"
-    )
+# -------------------- App settings (tech mode) --------------------
 
+# -------------------- settings cache --------------------
+# Снимок admin_settings + app_settings(id=1) в памяти процесса: геттеры настроек
+# не ходят в БД на каждый апдейт. Писатели шлют NOTIFY, каждый процесс (бот, саппорт,
+# вебхук) держит LISTEN-соединение и сбрасывает снимок; TTL — страховка на случай
+# пропущенного уведомления.
 
-# -------------------- App settings (tech mode) --------------------
+_SETTINGS_CHANNEL = "glowshot_settings"
+_SETTINGS_CACHE_TTL_SECONDS = 60.0
+# {"admin": {key: value}, "app": {column: value}, "ts": monotonic}
+_SETTINGS_CACHE: dict | None = None
+_SETTINGS_CACHE_GEN = 0
+_SETTINGS_CACHE_LOCK: asyncio.Lock | None = None
+_SETTINGS_LISTENER_TASK: asyncio.Task | None = None
 
-async def _ensure_app_settings_table(conn: asyncpg.Connection) -> None:
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS app_settings (
-            id INTEGER PRIMARY KEY,
-            tech_enabled INTEGER NOT NULL DEFAULT 0,
-            tech_start_at TEXT,
-            update_enabled INTEGER NOT NULL DEFAULT 0,
-            update_notice_ver INTEGER NOT NULL DEFAULT 0,
-            update_notice_text TEXT,
-            updated_at TEXT NOT NULL
-        );
-        """
-    )
-    await conn.execute(
-        """
-        INSERT INTO app_settings (id, tech_enabled, tech_start_at, updated_at)
-        VALUES (1, 0, NULL, $1)
-        ON CONFLICT (id) DO NOTHING
-        """,
-        get_moscow_now_iso(),
-    )
-    await conn.execute(
-        "ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS update_enabled INTEGER NOT NULL DEFAULT 0;"
-    )
-    await conn.execute(
-        "ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS update_notice_ver INTEGER NOT NULL DEFAULT 0;"
-    )
-    await conn.execute(
-        "ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS update_notice_text TEXT;"
-    )
-    await conn.execute(
-        "ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS upload_blocked INTEGER NOT NULL DEFAULT 0;"
-    )
-    await conn.execute(
-        "ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS rating_blocked INTEGER NOT NULL DEFAULT 0;"
-    )
-    await conn.execute(
-        "ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS results_blocked INTEGER NOT NULL DEFAULT 0;"
-    )
-    await conn.execute(
-        "ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS profile_blocked INTEGER NOT NULL DEFAULT 0;"
-    )
 
+def invalidate_settings_cache() -> None:
+    global _SETTINGS_CACHE, _SETTINGS_CACHE_GEN
+    _SETTINGS_CACHE = None
+    _SETTINGS_CACHE_GEN += 1
 
-async def _ensure_admin_settings_table(conn: asyncpg.Connection) -> None:
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS admin_settings (
-            key TEXT PRIMARY KEY,
-            value JSONB NOT NULL,
-            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        );
-        """
-    )
-    await conn.execute(
-        """
-        CREATE INDEX IF NOT EXISTS idx_admin_settings_updated_at
-        ON admin_settings (updated_at DESC);
-        """
-    )
 
+async def _notify_settings_changed(conn: asyncpg.Connection, key: str | None = None) -> None:
+    """Сбросить локальный снимок и оповестить остальные процессы (доставится на COMMIT)."""
+    invalidate_settings_cache()
+    try:
+        await conn.execute("SELECT pg_notify($1, $2)", _SETTINGS_CHANNEL, str(key or ""))
+    except Exception:
+        pass
 
-async def get_setting(key: str, default: object = None) -> object:
+
+async def _get_settings_snapshot() -> dict:
+    global _SETTINGS_CACHE, _SETTINGS_CACHE_LOCK
+    cache = _SETTINGS_CACHE
+    if cache is not None and (time.monotonic() - float(cache["ts"])) < _SETTINGS_CACHE_TTL_SECONDS:
+        return cache
+    if _SETTINGS_CACHE_LOCK is None:
+        _SETTINGS_CACHE_LOCK = asyncio.Lock()
+    async with _SETTINGS_CACHE_LOCK:
+        cache = _SETTINGS_CACHE
+        if cache is not None and (time.monotonic() - float(cache["ts"])) < _SETTINGS_CACHE_TTL_SECONDS:
+            return cache
+        gen = _SETTINGS_CACHE_GEN
+        started = time.monotonic()
+        p = _assert_pool()
+        async with p.acquire() as conn:
+            app_row = await conn.fetchrow("SELECT * FROM app_settings WHERE id=1")
+            rows = await conn.fetch("SELECT key, value FROM admin_settings")
+        cache = {
+            "admin": {str(r.get("key")): r.get("value") for r in rows},
+            "app": dict(app_row) if app_row else {},
+            "ts": started,
+        }
+        # Если во время загрузки пришло уведомление — не кэшируем, следующий вызов перечитает.
+        if gen == _SETTINGS_CACHE_GEN:
+            _SETTINGS_CACHE = cache
+        return cache
+
+
+def _on_settings_notify(_conn, _pid, _channel, _payload) -> None:
+    invalidate_settings_cache()
+
+
+async def _settings_listener_loop() -> None:
+    """Держим отдельное LISTEN-соединение (вне пула), переподключаемся при обрыве."""
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn=DB_DSN)
+            await conn.add_listener(_SETTINGS_CHANNEL, _on_settings_notify)
+            # пока не слушали, могли пропустить изменения
+            invalidate_settings_cache()
+            while not conn.is_closed():
+                await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        finally:
+            if conn is not None:
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+        await asyncio.sleep(3)
+
+
+def _start_settings_listener() -> None:
+    global _SETTINGS_LISTENER_TASK
+    if _SETTINGS_LISTENER_TASK is not None and not _SETTINGS_LISTENER_TASK.done():
+        return
+    _SETTINGS_LISTENER_TASK = asyncio.create_task(_settings_listener_loop())
+
+
+async def _stop_settings_listener() -> None:
+    global _SETTINGS_LISTENER_TASK
+    task = _SETTINGS_LISTENER_TASK
+    _SETTINGS_LISTENER_TASK = None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+
+# -------------------- FSM storage (utils.fsm_storage) --------------------
+
+
+async def fsm_storage_load(key: str, ttl_seconds: int) -> tuple[str | None, bytes | None] | None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_admin_settings_table(conn)
         row = await conn.fetchrow(
-            "SELECT value FROM admin_settings WHERE key=$1",
+            """
+            SELECT state, data
+            FROM fsm_storage
+            WHERE key=$1 AND updated_at > NOW() - make_interval(secs => $2)
+            """,
             str(key),
+            float(ttl_seconds),
         )
-    if not row:
-        return default
-    return row.get("value")
+    return (row["state"], row["data"]) if row else None
+
+
+async def fsm_storage_store_many(
+    entries: list[tuple[str, str | None, bytes | None, bool, bool]],
+    ttl_seconds: int,
+) -> None:
+    """[(key, state, data, state_dirty, data_dirty)] одним запросом; нетронутое поле не перезаписываем."""
+    if not entries:
+        return
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        await conn.execute(
+            """
+            WITH x AS (
+                SELECT *
+                FROM unnest($1::text[], $2::text[], $3::bytea[], $4::bool[], $5::bool[])
+                     AS x(key, state, data, state_dirty, data_dirty)
+            ),
+            upd AS (
+                UPDATE fsm_storage f
+                SET state = CASE
+                        WHEN x.state_dirty THEN x.state
+                        WHEN f.updated_at <= NOW() - make_interval(secs => $6) THEN NULL
+                        ELSE f.state
+                    END,
+                    data = CASE
+                        WHEN x.data_dirty THEN x.data
+                        WHEN f.updated_at <= NOW() - make_interval(secs => $6) THEN NULL
+                        ELSE f.data
+                    END,
+                    updated_at = NOW()
+                FROM x
+                WHERE f.key = x.key
+                RETURNING f.key
+            )
+            INSERT INTO fsm_storage (key, state, data, updated_at)
+            SELECT x.key, x.state, x.data, NOW()
+            FROM x
+            WHERE x.key NOT IN (SELECT key FROM upd)
+            ON CONFLICT (key) DO UPDATE
+            SET state=EXCLUDED.state, data=EXCLUDED.data, updated_at=NOW()
+            """,
+            [str(e[0]) for e in entries],
+            [e[1] for e in entries],
+            [e[2] for e in entries],
+            [bool(e[3]) for e in entries],
+            [bool(e[4]) for e in entries],
+            float(ttl_seconds),
+        )
+
+
+async def prune_fsm_storage(ttl_seconds: int) -> int:
+    """Удалить пустые и протухшие FSM-записи."""
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        res = await conn.execute(
+            """
+            DELETE FROM fsm_storage
+            WHERE (state IS NULL AND data IS NULL)
+               OR updated_at < NOW() - make_interval(secs => $1)
+            """,
+            float(ttl_seconds),
+        )
+    try:
+        return int(res.split()[-1])
+    except Exception:
+        return 0
+
+
+# -------------------- scheduler leadership --------------------
+# Фоновые джобы выполняет ровно один процесс: тот, кто держит session-level advisory lock
+# на отдельном соединении. Соединение умерло — Postgres отпускает lock, джобы забирает другой.
+
+_LEADER_CHECK_SECONDS = 5.0
+
+
+async def run_as_leader(name: str, start: Callable[[], list[asyncio.Task]]) -> None:
+    """Ждём лидерства по lock'у name, запускаем start(); потеряли соединение — гасим задачи и снова ждём."""
+    while True:
+        conn = None
+        tasks: list[asyncio.Task] = []
+        try:
+            conn = await asyncpg.connect(dsn=DB_DSN)
+            while not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", name):
+                await asyncio.sleep(_LEADER_CHECK_SECONDS)
+            logger.info("db.leader.acquired", extra={"lock": name})
+            tasks = start()
+            while True:
+                await asyncio.sleep(_LEADER_CHECK_SECONDS)
+                # соединение держит lock: если оно не отвечает, лидерство уже не гарантировано
+                await asyncio.wait_for(conn.fetchval("SELECT 1"), timeout=_LEADER_CHECK_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if tasks:
+                logger.warning("db.leader.lost", extra={"lock": name, "error": f"{type(e).__name__}: {e}"})
+        finally:
+            for t in tasks:
+                t.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            if conn is not None:
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+        await asyncio.sleep(3)
+
+
+async def get_setting(key: str, default: object = None) -> object:
+    snap = await _get_settings_snapshot()
+    return snap["admin"].get(str(key), default)
 
 
 async def set_setting(key: str, value: object) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_admin_settings_table(conn)
         await conn.execute(
             """
             INSERT INTO admin_settings (key, value, updated_at)
@@ -1167,34 +1305,26 @@ async def set_setting(key: str, value: object) -> None:
             str(key),
             json.dumps(value),
         )
+        await _notify_settings_changed(conn, str(key))
 
 
 async def delete_setting(key: str) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_admin_settings_table(conn)
         await conn.execute(
             "DELETE FROM admin_settings WHERE key=$1",
             str(key),
         )
+        await _notify_settings_changed(conn, str(key))
 
 
 async def get_settings_bulk(keys: list[str]) -> dict[str, object]:
     safe_keys = [str(k) for k in keys if str(k).strip()]
     if not safe_keys:
         return {}
-    p = _assert_pool()
-    async with p.acquire() as conn:
-        await _ensure_admin_settings_table(conn)
-        rows = await conn.fetch(
-            """
-            SELECT key, value
-            FROM admin_settings
-            WHERE key = ANY($1::text[])
-            """,
-            safe_keys,
-        )
-    return {str(r.get("key")): r.get("value") for r in rows}
+    snap = await _get_settings_snapshot()
+    saved = snap["admin"]
+    return {k: saved[k] for k in safe_keys if k in saved}
 
 
 async def set_settings_bulk(values: dict[str, object]) -> None:
@@ -1202,7 +1332,6 @@ async def set_settings_bulk(values: dict[str, object]) -> None:
         return
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_admin_settings_table(conn)
         async with conn.transaction():
             for k, v in values.items():
                 await conn.execute(
@@ -1215,6 +1344,7 @@ async def set_settings_bulk(values: dict[str, object]) -> None:
                     str(k),
                     json.dumps(v),
                 )
+            await _notify_settings_changed(conn, "*")
 
 
 _TECH_NOTICE_KEY = "tech.notice_text"
@@ -1274,31 +1404,9 @@ def _coerce_float(
     return out
 
 
-async def _ensure_scheduled_broadcasts_table(conn: asyncpg.Connection) -> None:
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
-            id BIGSERIAL PRIMARY KEY,
-            target TEXT NOT NULL,
-            text TEXT NOT NULL,
-            scheduled_at TEXT NOT NULL,
-            status TEXT NOT NULL DEFAULT 'pending',
-            created_by_tg_id BIGINT,
-            created_at TEXT NOT NULL,
-            sent_at TEXT,
-            total_count INTEGER,
-            sent_count INTEGER,
-            error_text TEXT,
-            updated_at TEXT
-        );
-        """
-    )
-
-
 async def get_user_ui_state(tg_id: int) -> dict:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_ui_state_table(conn)
         row = await conn.fetchrow(
             """
             SELECT menu_msg_id, rate_kb_msg_id, screen_msg_id, banner_msg_id, rate_cards_seen, rate_tutorial_seen, update_notice_seen_ver, updated_at
@@ -1327,7 +1435,6 @@ async def get_user_ui_state(tg_id: int) -> dict:
 async def set_user_menu_msg_id(tg_id: int, menu_msg_id: int | None) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_ui_state_table(conn)
         await conn.execute(
             """
             INSERT INTO user_ui_state (tg_id, menu_msg_id, updated_at)
@@ -1343,7 +1450,6 @@ async def set_user_menu_msg_id(tg_id: int, menu_msg_id: int | None) -> None:
 async def set_user_rate_kb_msg_id(tg_id: int, rate_kb_msg_id: int | None) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_ui_state_table(conn)
         await conn.execute(
             """
             INSERT INTO user_ui_state (tg_id, rate_kb_msg_id, updated_at)
@@ -1359,7 +1465,6 @@ async def set_user_rate_kb_msg_id(tg_id: int, rate_kb_msg_id: int | None) -> Non
 async def set_user_screen_msg_id(tg_id: int, screen_msg_id: int | None) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_ui_state_table(conn)
         await conn.execute(
             """
             INSERT INTO user_ui_state (tg_id, screen_msg_id, updated_at)
@@ -1375,7 +1480,6 @@ async def set_user_screen_msg_id(tg_id: int, screen_msg_id: int | None) -> None:
 async def set_user_banner_msg_id(tg_id: int, banner_msg_id: int | None) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_ui_state_table(conn)
         await conn.execute(
             """
             INSERT INTO user_ui_state (tg_id, banner_msg_id, updated_at)
@@ -1391,7 +1495,6 @@ async def set_user_banner_msg_id(tg_id: int, banner_msg_id: int | None) -> None:
 async def set_user_rate_tutorial_seen(tg_id: int, seen: bool = True) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_ui_state_table(conn)
         await conn.execute(
             """
             INSERT INTO user_ui_state (tg_id, rate_tutorial_seen, updated_at)
@@ -1407,7 +1510,6 @@ async def set_user_rate_tutorial_seen(tg_id: int, seen: bool = True) -> None:
 async def set_user_rate_cards_seen(tg_id: int, value: int) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_ui_state_table(conn)
         await conn.execute(
             """
             INSERT INTO user_ui_state (tg_id, rate_cards_seen, updated_at)
@@ -1422,25 +1524,17 @@ async def set_user_rate_cards_seen(tg_id: int, value: int) -> None:
 # -------------------- Tech mode settings --------------------
 
 async def get_tech_mode_state() -> dict:
-    """Return tech mode state."""
-    p = _assert_pool()
-    async with p.acquire() as conn:
-        await _ensure_app_settings_table(conn)
-        await _ensure_admin_settings_table(conn)
-        row = await conn.fetchrow(
-            "SELECT tech_enabled, tech_start_at FROM app_settings WHERE id=1"
-        )
-        notice = await conn.fetchval(
-            "SELECT value FROM admin_settings WHERE key=$1",
-            _TECH_NOTICE_KEY,
-        )
-        if not row:
-            return {"tech_enabled": False, "tech_start_at": None, "tech_notice_text": None}
-        return {
-            "tech_enabled": bool(row.get("tech_enabled")),
-            "tech_start_at": row.get("tech_start_at"),
-            "tech_notice_text": str(notice).strip() if notice is not None else None,
-        }
+    """Return tech mode state (из снимка настроек, без запроса в БД)."""
+    snap = await _get_settings_snapshot()
+    row = snap["app"]
+    notice = snap["admin"].get(_TECH_NOTICE_KEY)
+    if not row:
+        return {"tech_enabled": False, "tech_start_at": None, "tech_notice_text": None}
+    return {
+        "tech_enabled": bool(row.get("tech_enabled")),
+        "tech_start_at": row.get("tech_start_at"),
+        "tech_notice_text": str(notice).strip() if notice is not None else None,
+    }
 
 
 _UNSET = object()
@@ -1454,8 +1548,6 @@ async def set_tech_mode_state(
 ) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_app_settings_table(conn)
-        await _ensure_admin_settings_table(conn)
         await conn.execute(
             """
             UPDATE app_settings
@@ -1484,6 +1576,7 @@ async def set_tech_mode_state(
                     "DELETE FROM admin_settings WHERE key=$1",
                     _TECH_NOTICE_KEY,
                 )
+        await _notify_settings_changed(conn, "app.tech")
 
 # -------------------- Update mode (обновление) --------------------
 
@@ -1496,19 +1589,15 @@ async def get_update_mode_state() -> dict:
       update_notice_text: str | None
     }
     """
-    p = _assert_pool()
-    async with p.acquire() as conn:
-        await _ensure_app_settings_table(conn)
-        row = await conn.fetchrow(
-            "SELECT update_enabled, update_notice_ver, update_notice_text FROM app_settings WHERE id=1"
-        )
-        if not row:
-            return {"update_enabled": False, "update_notice_ver": 0, "update_notice_text": None}
-        return {
-            "update_enabled": bool(row.get("update_enabled")),
-            "update_notice_ver": int(row.get("update_notice_ver") or 0),
-            "update_notice_text": row.get("update_notice_text"),
-        }
+    snap = await _get_settings_snapshot()
+    row = snap["app"]
+    if not row:
+        return {"update_enabled": False, "update_notice_ver": 0, "update_notice_text": None}
+    return {
+        "update_enabled": bool(row.get("update_enabled")),
+        "update_notice_ver": int(row.get("update_notice_ver") or 0),
+        "update_notice_text": row.get("update_notice_text"),
+    }
 
 
 async def set_update_mode_state(
@@ -1522,7 +1611,6 @@ async def set_update_mode_state(
     """
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_app_settings_table(conn)
         if bump_version:
             await conn.execute(
                 """
@@ -1550,6 +1638,7 @@ async def set_update_mode_state(
                 notice_text,
                 get_moscow_now_iso(),
             )
+        await _notify_settings_changed(conn, "app.update")
 
 
 _SECTION_BLOCK_COLUMNS = {
@@ -1562,58 +1651,37 @@ _SECTION_BLOCK_COLUMNS = {
 
 async def get_section_access_state() -> dict:
     """Return section access flags (True means blocked)."""
+    snap = await _get_settings_snapshot()
+    row = snap["app"]
+    saved = snap["admin"]
+    return {
+        "upload_blocked": _coerce_bool(
+            saved.get(_ACCESS_SETTING_KEYS["upload"]),
+            bool((row or {}).get("upload_blocked")),
+        ),
+        "rating_blocked": _coerce_bool(
+            saved.get(_ACCESS_SETTING_KEYS["rate"]),
+            bool((row or {}).get("rating_blocked")),
+        ),
+        "results_blocked": _coerce_bool(
+            saved.get(_ACCESS_SETTING_KEYS["results"]),
+            bool((row or {}).get("results_blocked")),
+        ),
+        "profile_blocked": _coerce_bool(
+            saved.get(_ACCESS_SETTING_KEYS["profile"]),
+            bool((row or {}).get("profile_blocked")),
+        ),
+    }
+
+
+async def set_section_blocked(section: str, blocked: bool) -> dict:
+    key = str(section or "").strip().lower()
+    column = _SECTION_BLOCK_COLUMNS.get(key)
+    if column is None:
+        raise ValueError("unknown section")
+
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_app_settings_table(conn)
-        await _ensure_admin_settings_table(conn)
-        row = await conn.fetchrow(
-            """
-            SELECT upload_blocked, rating_blocked, results_blocked, profile_blocked
-            FROM app_settings
-            WHERE id=1
-            """
-        )
-        settings_rows = await conn.fetch(
-            """
-            SELECT key, value
-            FROM admin_settings
-            WHERE key = ANY($1::text[])
-            """,
-            list(_ACCESS_SETTING_KEYS.values()),
-        )
-        saved = {str(r.get("key")): r.get("value") for r in settings_rows}
-        if not row:
-            row = {}
-        return {
-            "upload_blocked": _coerce_bool(
-                saved.get(_ACCESS_SETTING_KEYS["upload"]),
-                bool((row or {}).get("upload_blocked")),
-            ),
-            "rating_blocked": _coerce_bool(
-                saved.get(_ACCESS_SETTING_KEYS["rate"]),
-                bool((row or {}).get("rating_blocked")),
-            ),
-            "results_blocked": _coerce_bool(
-                saved.get(_ACCESS_SETTING_KEYS["results"]),
-                bool((row or {}).get("results_blocked")),
-            ),
-            "profile_blocked": _coerce_bool(
-                saved.get(_ACCESS_SETTING_KEYS["profile"]),
-                bool((row or {}).get("profile_blocked")),
-            ),
-        }
-
-
-async def set_section_blocked(section: str, blocked: bool) -> dict:
-    key = str(section or "").strip().lower()
-    column = _SECTION_BLOCK_COLUMNS.get(key)
-    if column is None:
-        raise ValueError("unknown section")
-
-    p = _assert_pool()
-    async with p.acquire() as conn:
-        await _ensure_app_settings_table(conn)
-        await _ensure_admin_settings_table(conn)
         await conn.execute(
             f"UPDATE app_settings SET {column}=$1, updated_at=$2 WHERE id=1",
             1 if blocked else 0,
@@ -1629,6 +1697,7 @@ async def set_section_blocked(section: str, blocked: bool) -> dict:
             _ACCESS_SETTING_KEYS[key],
             json.dumps(bool(blocked)),
         )
+        await _notify_settings_changed(conn, _ACCESS_SETTING_KEYS[key])
     return await get_section_access_state()
 
 
@@ -1839,10 +1908,86 @@ async def get_effective_protection_settings() -> dict:
     }
 
 
+# -------------------- shared rate limit (utils.rate_limit) --------------------
+# Счётчики фиксированных окон для PostgresRateLimitBackend: window_start — эпоха начала окна,
+# длина окна зашита в ключ. Таблицы UNLOGGED: потеря при крэше БД допустима.
+
+
+async def rate_limit_hit(counters: list[tuple[str, int]], cooldown_key: str) -> tuple[list[tuple[int, int, float]], float]:
+    """Инкремент счётчиков одним запросом -> ([(prev, cur, elapsed_fraction)], остаток кулдауна, сек)."""
+    p = _assert_pool()
+    keys = [str(k) for k, _w in counters]
+    windows = [max(1, int(w)) for _k, w in counters]
+    async with p.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            WITH t AS (
+                SELECT EXTRACT(EPOCH FROM clock_timestamp())::float8 AS now
+            ),
+            x AS (
+                SELECT x.key, x.win, x.ord, (floor(t.now / x.win) * x.win)::bigint AS window_start, t.now
+                FROM unnest($1::text[], $2::int[]) WITH ORDINALITY AS x(key, win, ord)
+                CROSS JOIN t
+            ),
+            up AS (
+                INSERT INTO rate_limit_counters (key, window_start, hits)
+                SELECT key, window_start, 1 FROM x
+                ON CONFLICT (key, window_start) DO UPDATE SET hits = rate_limit_counters.hits + 1
+                RETURNING key, hits
+            )
+            SELECT
+                COALESCE(prev.hits, 0) AS prev,
+                up.hits AS cur,
+                (x.now - x.window_start) / x.win AS frac,
+                (
+                    SELECT GREATEST(0, EXTRACT(EPOCH FROM (c.until - clock_timestamp())))::float8
+                    FROM rate_limit_cooldowns c
+                    WHERE c.key = $3
+                ) AS cooldown_left
+            FROM x
+            JOIN up ON up.key = x.key
+            LEFT JOIN rate_limit_counters prev
+                   ON prev.key = x.key AND prev.window_start = x.window_start - x.win
+            ORDER BY x.ord
+            """,
+            keys,
+            windows,
+            str(cooldown_key),
+        )
+    cooldown_left = float(rows[0]["cooldown_left"] or 0.0) if rows else 0.0
+    return [(int(r["prev"]), int(r["cur"]), float(r["frac"])) for r in rows], cooldown_left
+
+
+async def rate_limit_set_cooldown(key: str, seconds: float) -> None:
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO rate_limit_cooldowns (key, until)
+            VALUES ($1, clock_timestamp() + make_interval(secs => $2))
+            ON CONFLICT (key) DO UPDATE SET until = GREATEST(rate_limit_cooldowns.until, EXCLUDED.until)
+            """,
+            str(key),
+            float(seconds),
+        )
+
+
+async def prune_rate_limit_state() -> None:
+    """Чистка отработавших окон и кулдаунов (окна не длиннее минуты, держим час с запасом)."""
+    p = _assert_pool()
+    try:
+        async with p.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM rate_limit_counters WHERE window_start < EXTRACT(EPOCH FROM NOW())::bigint - 3600"
+            )
+            await conn.execute("DELETE FROM rate_limit_cooldowns WHERE until < NOW()")
+    except Exception:
+        logger.exception("db.rate_limit.prune_failed")
+
+
 async def get_user_update_notice_ver(tg_id: int) -> int:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_ui_state_table(conn)
         row = await conn.fetchrow(
             "SELECT update_notice_seen_ver FROM user_ui_state WHERE tg_id=$1",
             int(tg_id),
@@ -1853,7 +1998,6 @@ async def get_user_update_notice_ver(tg_id: int) -> int:
 async def set_user_update_notice_ver(tg_id: int, version: int) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_ui_state_table(conn)
         await conn.execute(
             """
             INSERT INTO user_ui_state (tg_id, update_notice_seen_ver, updated_at)
@@ -1877,7 +2021,6 @@ async def create_scheduled_broadcast(
 ) -> dict:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_scheduled_broadcasts_table(conn)
         now = get_moscow_now_iso()
         row = await conn.fetchrow(
             """
@@ -1897,7 +2040,6 @@ async def create_scheduled_broadcast(
 async def get_due_scheduled_broadcasts(limit: int = 10) -> list[dict]:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_scheduled_broadcasts_table(conn)
         rows = await conn.fetch(
             """
             SELECT *
@@ -1921,7 +2063,6 @@ async def mark_scheduled_broadcast_sent(
 ) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_scheduled_broadcasts_table(conn)
         await conn.execute(
             """
             UPDATE scheduled_broadcasts
@@ -1942,7 +2083,6 @@ async def mark_scheduled_broadcast_sent(
 async def mark_scheduled_broadcast_failed(broadcast_id: int, error_text: str | None = None) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_scheduled_broadcasts_table(conn)
         await conn.execute(
             """
             UPDATE scheduled_broadcasts
@@ -1965,7 +2105,6 @@ async def list_scheduled_broadcasts(
 ) -> tuple[int, list[dict]]:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_scheduled_broadcasts_table(conn)
         if status:
             total = await conn.fetchval(
                 "SELECT COUNT(*) FROM scheduled_broadcasts WHERE status=$1",
@@ -2001,7 +2140,6 @@ async def list_scheduled_broadcasts(
 async def cancel_scheduled_broadcast(broadcast_id: int) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_scheduled_broadcasts_table(conn)
         await conn.execute(
             """
             UPDATE scheduled_broadcasts
@@ -2013,30 +2151,291 @@ async def cancel_scheduled_broadcast(broadcast_id: int) -> None:
             get_moscow_now_iso(),
         )
 
-# -------------------- Feedback ideas --------------------
+# -------------------- broadcast engine --------------------
+# Рассылка = broadcast_jobs + строка broadcast_deliveries на каждого получателя.
+# Отправляет services.broadcast (воркеры + token bucket), сюда пишет пачками.
+
+# Аудитории: target -> условие по users (u). $1 — tg_id создателя (для test).
+_BROADCAST_AUDIENCE_WHERE = {
+    "all": "u.is_deleted=0 AND COALESCE(NULLIF(trim(u.name), ''), NULL) IS NOT NULL AND COALESCE(u.is_blocked,0)=0",
+    "premium": (
+        "u.is_premium=1 AND u.is_deleted=0 AND COALESCE(NULLIF(trim(u.name), ''), NULL) IS NOT NULL "
+        "AND COALESCE(u.is_blocked,0)=0"
+    ),
+    "moderators": "u.is_moderator=1 AND u.is_deleted=0",
+    "support": "u.is_support=1 AND u.is_deleted=0",
+    "helpers": "u.is_helper=1 AND u.is_deleted=0",
+    "test": "u.tg_id=$2",
+}
 
-async def _ensure_feedback_tables(conn: asyncpg.Connection) -> None:
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS feedback_ideas (
-            id BIGSERIAL PRIMARY KEY,
-            idea_code BIGINT UNIQUE NOT NULL,
-            tg_id BIGINT NOT NULL,
-            username TEXT,
-            text TEXT,
-            attachments JSONB,
-            status TEXT NOT NULL DEFAULT 'new',
-            cancel_reason TEXT,
-            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        );
-        """
-    )
-    await conn.execute(
-        "CREATE INDEX IF NOT EXISTS idx_feedback_ideas_tg_id ON feedback_ideas (tg_id);"
-    )
+
+def _broadcast_audience_query(target: str, job_id: int, created_by_tg_id: int | None) -> tuple:
+    """(sql, *args) для материализации получателей: $1 — job_id, $2 — tg_id админа (только для "test")."""
+    where = _BROADCAST_AUDIENCE_WHERE.get(str(target))
+    if where is None:
+        raise ValueError(f"unknown broadcast target: {target}")
+    # кто заблокировал бота — в аудиторию не попадает
+    sql = f"""
+        INSERT INTO broadcast_deliveries (job_id, tg_id)
+        SELECT DISTINCT $1::bigint, u.tg_id
+        FROM users u
+        WHERE {where}
+          AND u.tg_id IS NOT NULL
+          AND u.bot_blocked_at IS NULL
+        ON CONFLICT DO NOTHING
+    """
+    if str(target) == "test":
+        return sql, int(job_id), int(created_by_tg_id or 0)
+    return sql, int(job_id)
+
+
+async def create_broadcast_job(
+    *,
+    target: str,
+    text: str,
+    created_by_tg_id: int | None = None,
+    with_seen_button: bool = True,
+    scheduled_id: int | None = None,
+) -> dict | None:
+    """Создать рассылку и материализовать получателей. None — если для scheduled_id job уже есть."""
+    where = _BROADCAST_AUDIENCE_WHERE.get(str(target))
+    if where is None:
+        raise ValueError(f"unknown broadcast target: {target}")
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        async with conn.transaction():
+            job = await conn.fetchrow(
+                """
+                INSERT INTO broadcast_jobs (source, scheduled_id, target, text, with_seen_button,
+                                            status, created_by_tg_id, started_at)
+                VALUES ($1,$2,$3,$4,$5,'running',$6,NOW())
+                ON CONFLICT (scheduled_id) WHERE scheduled_id IS NOT NULL DO NOTHING
+                RETURNING id
+                """,
+                "scheduled" if scheduled_id is not None else "manual",
+                int(scheduled_id) if scheduled_id is not None else None,
+                str(target),
+                str(text),
+                bool(with_seen_button),
+                int(created_by_tg_id) if created_by_tg_id is not None else None,
+            )
+            if not job:
+                return None
+            job_id = int(job["id"])
+            res = await conn.execute(*_broadcast_audience_query(target, job_id, created_by_tg_id))
+            try:
+                total = int(res.split()[-1])
+            except Exception:
+                total = 0
+            row = await conn.fetchrow(
+                "UPDATE broadcast_jobs SET total_count=$2, updated_at=NOW() WHERE id=$1 RETURNING *",
+                job_id,
+                total,
+            )
+            if scheduled_id is not None:
+                await conn.execute(
+                    "UPDATE scheduled_broadcasts SET status='sending', updated_at=$2 WHERE id=$1",
+                    int(scheduled_id),
+                    get_moscow_now_iso(),
+                )
+    return dict(row) if row else None
+
+
+async def get_broadcast_job(job_id: int) -> dict | None:
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM broadcast_jobs WHERE id=$1", int(job_id))
+    return dict(row) if row else None
+
+
+async def get_running_broadcast_jobs() -> list[dict]:
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        rows = await conn.fetch("SELECT * FROM broadcast_jobs WHERE status='running' ORDER BY id ASC")
+    return [dict(r) for r in rows]
+
+
+async def reset_stale_broadcast_deliveries(job_id: int) -> int:
+    """После рестарта: всё, что висело в 'sending', снова в очередь (at-least-once)."""
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        res = await conn.execute(
+            "UPDATE broadcast_deliveries SET status='pending' WHERE job_id=$1 AND status='sending'",
+            int(job_id),
+        )
+    try:
+        return int(res.split()[-1])
+    except Exception:
+        return 0
+
+
+async def claim_broadcast_deliveries(job_id: int, limit: int = 200) -> list[dict]:
+    """Забрать пачку получателей в работу. Пусто — если job не running или очередь пуста."""
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            UPDATE broadcast_deliveries d
+            SET status='sending', updated_at=NOW()
+            FROM (
+                SELECT bd.job_id, bd.tg_id
+                FROM broadcast_deliveries bd
+                JOIN broadcast_jobs j ON j.id = bd.job_id AND j.status='running'
+                WHERE bd.job_id=$1
+                  AND bd.status='pending'
+                  AND (bd.retry_at IS NULL OR bd.retry_at <= NOW())
+                ORDER BY bd.tg_id
+                LIMIT $2
+                FOR UPDATE OF bd SKIP LOCKED
+            ) c
+            WHERE d.job_id=c.job_id AND d.tg_id=c.tg_id
+            RETURNING d.tg_id, d.attempts
+            """,
+            int(job_id),
+            int(limit),
+        )
+    return [dict(r) for r in rows]
+
+
+async def record_broadcast_results(job_id: int, results: list[tuple[int, str, str | None, float | None]]) -> None:
+    """Чекпоинт пачки: [(tg_id, status, error_text, retry_in_seconds)].
+
+    status: sent | failed | blocked | retry (retry — вернуть в pending с retry_at;
+    retry без error_text — пауза по лимиту, в attempts не считается).
+    Счётчики job и отметка bot_blocked_at у пользователей — в той же транзакции.
+    """
+    if not results:
+        return
+    tg_ids = [int(r[0]) for r in results]
+    statuses = [str(r[1]) for r in results]
+    errors = [(r[2] or "")[:500] if r[2] else None for r in results]
+    retry_in = [float(r[3]) if r[3] is not None else None for r in results]
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                UPDATE broadcast_deliveries d
+                SET status = CASE WHEN x.status='retry' THEN 'pending' ELSE x.status END,
+                    attempts = d.attempts + CASE WHEN x.status='retry' AND x.error_text IS NULL THEN 0 ELSE 1 END,
+                    retry_at = CASE WHEN x.status='retry'
+                                    THEN NOW() + make_interval(secs => COALESCE(x.retry_in, 0))
+                                    ELSE NULL END,
+                    error_text = x.error_text,
+                    updated_at = NOW()
+                FROM unnest($2::bigint[], $3::text[], $4::text[], $5::float8[])
+                     AS x(tg_id, status, error_text, retry_in)
+                WHERE d.job_id=$1 AND d.tg_id=x.tg_id
+                """,
+                int(job_id),
+                tg_ids,
+                statuses,
+                errors,
+                retry_in,
+            )
+            await conn.execute(
+                """
+                UPDATE broadcast_jobs
+                SET sent_count = sent_count + $2,
+                    failed_count = failed_count + $3,
+                    blocked_count = blocked_count + $4,
+                    updated_at = NOW()
+                WHERE id=$1
+                """,
+                int(job_id),
+                statuses.count("sent"),
+                statuses.count("failed"),
+                statuses.count("blocked"),
+            )
+            blocked = [tg for tg, st in zip(tg_ids, statuses) if st == "blocked"]
+            if blocked:
+                await conn.execute(
+                    "UPDATE users SET bot_blocked_at=NOW() WHERE tg_id = ANY($1::bigint[]) AND bot_blocked_at IS NULL",
+                    blocked,
+                )
+
+
+async def finish_broadcast_job_if_complete(job_id: int) -> dict | None:
+    """Закрыть job, если ни pending, ни sending не осталось. Возвращает job при закрытии."""
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            UPDATE broadcast_jobs j
+            SET status='done', finished_at=NOW(), updated_at=NOW()
+            WHERE j.id=$1
+              AND j.status='running'
+              AND NOT EXISTS (
+                  SELECT 1 FROM broadcast_deliveries d
+                  WHERE d.job_id=j.id AND d.status IN ('pending','sending')
+              )
+            RETURNING *
+            """,
+            int(job_id),
+        )
+    return dict(row) if row else None
+
+
+async def cancel_broadcast_job(job_id: int) -> None:
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                UPDATE broadcast_jobs
+                SET status='cancelled', finished_at=NOW(), updated_at=NOW()
+                WHERE id=$1 AND status='running'
+                """,
+                int(job_id),
+            )
+            await conn.execute(
+                "UPDATE broadcast_deliveries SET status='cancelled', updated_at=NOW() WHERE job_id=$1 AND status='pending'",
+                int(job_id),
+            )
 
 
+async def get_broadcast_job_progress(job_id: int, *, window_seconds: int = 30) -> dict | None:
+    """Job + живая скорость (за последние window_seconds) и ETA. Работает из любого процесса."""
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        job = await conn.fetchrow("SELECT * FROM broadcast_jobs WHERE id=$1", int(job_id))
+        if not job:
+            return None
+        recent = await conn.fetchval(
+            """
+            SELECT COUNT(*)
+            FROM broadcast_deliveries
+            WHERE job_id=$1
+              AND status IN ('sent','failed','blocked')
+              AND updated_at >= NOW() - make_interval(secs => $2)
+            """,
+            int(job_id),
+            float(window_seconds),
+        )
+    out = dict(job)
+    done = int(out.get("sent_count") or 0) + int(out.get("failed_count") or 0) + int(out.get("blocked_count") or 0)
+    remaining = max(0, int(out.get("total_count") or 0) - done)
+    rate = float(recent or 0) / float(window_seconds)
+    out["processed_count"] = done
+    out["remaining_count"] = remaining
+    out["rate_per_sec"] = rate
+    out["eta_seconds"] = (remaining / rate) if (rate > 0 and out.get("status") == "running") else None
+    return out
+
+
+async def clear_user_bot_blocked(tg_id: int) -> None:
+    """Пользователь снова пишет боту — значит, разблокировал; возвращаем в аудиторию рассылок."""
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        await conn.execute(
+            "UPDATE users SET bot_blocked_at=NULL WHERE tg_id=$1 AND bot_blocked_at IS NOT NULL",
+            int(tg_id),
+        )
+    invalidate_user_context(int(tg_id))
+
+
+# -------------------- Feedback ideas --------------------
+
 async def create_feedback_idea(
     *,
     tg_id: int,
@@ -2046,7 +2445,6 @@ async def create_feedback_idea(
 ) -> dict:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_feedback_tables(conn)
 
         if attachments is None:
             attachments_json = "[]"
@@ -2097,7 +2495,6 @@ async def create_feedback_idea(
 async def list_feedback_ideas_by_tg_id(tg_id: int, limit: int = 20) -> list[dict]:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_feedback_tables(conn)
         rows = await conn.fetch(
             """
             SELECT id, idea_code, status, cancel_reason, created_at, text
@@ -2115,7 +2512,6 @@ async def list_feedback_ideas_by_tg_id(tg_id: int, limit: int = 20) -> list[dict
 async def get_feedback_idea_by_id(idea_id: int) -> dict | None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_feedback_tables(conn)
         row = await conn.fetchrow(
             "SELECT * FROM feedback_ideas WHERE id=$1",
             int(idea_id),
@@ -2126,7 +2522,6 @@ async def get_feedback_idea_by_id(idea_id: int) -> dict | None:
 async def set_feedback_status(idea_id: int, status: str, reason: str | None = None) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_feedback_tables(conn)
         await conn.execute(
             """
             UPDATE feedback_ideas
@@ -2389,93 +2784,109 @@ async def _grant_streak_reward_if_needed(
 async def streak_record_action_by_tg_id(tg_id: int, action: str) -> dict:
     await streak_ensure_user_row(int(tg_id))
     p = _assert_pool()
+    async with p.acquire() as conn:
+        result, reward_check = await _streak_record_action_conn(conn, int(tg_id), str(action))
+    if reward_check is not None:
+        try:
+            await _grant_streak_reward_if_needed(int(tg_id), reward_check[0], reward_check[1])
+        except Exception:
+            pass
+    return result
+
+
+async def _streak_record_action_conn(
+    conn: asyncpg.Connection,
+    tg_id: int,
+    action: str,
+) -> tuple[dict, tuple[int, int] | None]:
+    """Засчитать действие в стрик на переданном соединении (строка user_streak уже есть).
 
+    Возвращает (статус, (best_before, best_after) | None). Награду за рекорд выдаёт вызывающий
+    через _grant_streak_reward_if_needed — она ходит своим соединением.
+    """
     now_dt = get_moscow_now()
     now_iso = get_moscow_now_iso()
     day_key = _streak_target_day_key(now_dt)
 
-    async with p.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO streak_actions (tg_id, action, created_at) VALUES ($1,$2,$3)",
-            int(tg_id), str(action), now_iso
-        )
-
-        await conn.execute(
-            """
-            INSERT INTO streak_daily (tg_id, day_key)
-            VALUES ($1,$2)
-            ON CONFLICT (tg_id, day_key) DO NOTHING
-            """,
-            int(tg_id), str(day_key)
-        )
+    await conn.execute(
+        "INSERT INTO streak_actions (tg_id, action, created_at, created_ts) VALUES ($1,$2,$3,$4)",
+        int(tg_id), str(action), now_iso, now_dt
+    )
 
-        d = await conn.fetchrow(
-            "SELECT * FROM streak_daily WHERE tg_id=$1 AND day_key=$2",
-            int(tg_id), str(day_key)
-        )
+    await conn.execute(
+        """
+        INSERT INTO streak_daily (tg_id, day_key)
+        VALUES ($1,$2)
+        ON CONFLICT (tg_id, day_key) DO NOTHING
+        """,
+        int(tg_id), str(day_key)
+    )
 
-        rated = int(d["rated_count"] or 0) if d else 0
-        comm = int(d["comment_count"] or 0) if d else 0
-        upl = int(d["upload_count"] or 0) if d else 0
-        goal_before = bool(int(d["goal_done"] or 0)) if d else False
+    d = await conn.fetchrow(
+        "SELECT * FROM streak_daily WHERE tg_id=$1 AND day_key=$2",
+        int(tg_id), str(day_key)
+    )
 
-        if action == "rate":
-            rated += 1
-        elif action == "comment":
-            comm += 1
-        elif action == "upload":
-            upl += 1
+    rated = int(d["rated_count"] or 0) if d else 0
+    comm = int(d["comment_count"] or 0) if d else 0
+    upl = int(d["upload_count"] or 0) if d else 0
+    goal_before = bool(int(d["goal_done"] or 0)) if d else False
 
-        goal_after = _streak_goal_done(rated, comm, upl)
+    if action == "rate":
+        rated += 1
+    elif action == "comment":
+        comm += 1
+    elif action == "upload":
+        upl += 1
 
-        await conn.execute(
-            """
-            UPDATE streak_daily
-            SET rated_count=$3, comment_count=$4, upload_count=$5, goal_done=$6
-            WHERE tg_id=$1 AND day_key=$2
-            """,
-            int(tg_id), str(day_key),
-            int(rated), int(comm), int(upl),
-            1 if goal_after else 0
-        )
+    goal_after = _streak_goal_done(rated, comm, upl)
 
-        streak_changed = False
+    await conn.execute(
+        """
+        UPDATE streak_daily
+        SET rated_count=$3, comment_count=$4, upload_count=$5, goal_done=$6
+        WHERE tg_id=$1 AND day_key=$2
+        """,
+        int(tg_id), str(day_key),
+        int(rated), int(comm), int(upl),
+        1 if goal_after else 0
+    )
 
-        if (not goal_before) and goal_after:
-            u = await conn.fetchrow("SELECT * FROM user_streak WHERE tg_id=$1", int(tg_id))
-            streak = int(_row_val(u, "streak", 0) or 0) if u else 0
-            best = int(_row_val(u, "best_streak", 0) or 0) if u else 0
-            last_completed = str(_row_val(u, "last_completed_day")) if u and _row_val(u, "last_completed_day") else None
-            reward_flag = bool(int(_row_val(u, "reward_111_given", 0) or 0)) if u else False
+    streak_changed = False
+    reward_check: tuple[int, int] | None = None
 
-            if last_completed != str(day_key):
-                if last_completed is None:
-                    new_streak = 1
-                else:
-                    try:
-                        last_d = datetime.fromisoformat(last_completed).date()
-                        cur_d = datetime.fromisoformat(str(day_key)).date()
-                        delta = (cur_d - last_d).days
-                    except Exception:
-                        delta = 999
-                    new_streak = (streak + 1) if delta == 1 else 1
+    if (not goal_before) and goal_after:
+        u = await conn.fetchrow("SELECT * FROM user_streak WHERE tg_id=$1", int(tg_id))
+        streak = int(_row_val(u, "streak", 0) or 0) if u else 0
+        best = int(_row_val(u, "best_streak", 0) or 0) if u else 0
+        last_completed = str(_row_val(u, "last_completed_day")) if u and _row_val(u, "last_completed_day") else None
+        reward_flag = bool(int(_row_val(u, "reward_111_given", 0) or 0)) if u else False
 
-                new_best = max(best, int(new_streak))
-                await conn.execute(
-                    """
-                    UPDATE user_streak
-                    SET streak=$2, best_streak=$3, last_completed_day=$4, updated_at=$5
-                    WHERE tg_id=$1
-                    """,
-                    int(tg_id), int(new_streak), int(new_best), str(day_key), now_iso
-                )
-                streak_changed = True
+        if last_completed != str(day_key):
+            if last_completed is None:
+                new_streak = 1
+            else:
                 try:
-                    await _grant_streak_reward_if_needed(int(tg_id), best, new_best)
+                    last_d = datetime.fromisoformat(last_completed).date()
+                    cur_d = datetime.fromisoformat(str(day_key)).date()
+                    delta = (cur_d - last_d).days
                 except Exception:
-                    pass
+                    delta = 999
+                new_streak = (streak + 1) if delta == 1 else 1
+
+            new_best = max(best, int(new_streak))
+            await conn.execute(
+                """
+                UPDATE user_streak
+                SET streak=$2, best_streak=$3, last_completed_day=$4, updated_at=$5
+                WHERE tg_id=$1
+                """,
+                int(tg_id), int(new_streak), int(new_best), str(day_key), now_iso
+            )
+            streak_changed = True
+            reward_check = (int(best), int(new_best))
 
-        u2 = await conn.fetchrow("SELECT * FROM user_streak WHERE tg_id=$1", int(tg_id))
+    u2 = await conn.fetchrow("SELECT * FROM user_streak WHERE tg_id=$1", int(tg_id))
 
     return {
         "day_key": str(day_key),
@@ -2488,7 +2899,7 @@ async def streak_record_action_by_tg_id(tg_id: int, action: str) -> dict:
         "best": int(_row_val(u2, "best_streak", 0) or 0) if u2 else 0,
         "freeze": int(_row_val(u2, "freeze_tokens", 0) or 0) if u2 else 0,
         "visible": bool(int(_row_val(u2, "visible", 1) or 1)) if u2 else True,
-    }
+    }, reward_check
 
 
 async def streak_add_freeze_by_tg_id(tg_id: int, amount: int = 1) -> int:
@@ -3080,28 +3491,308 @@ async def get_photo_ratings_list(photo_id: int) -> list[dict]:
     return [dict(r) for r in rows] if rows else []
 
 
-async def admin_delete_last_rating_for_photo(photo_id: int) -> dict:
-    """
-    Delete the latest 1..10 rating for a photo and recalc photo counters.
-    Returns: {"deleted": bool, "value": int|None, "user_id": int|None, "votes_count": int}
-    """
-    p = _assert_pool()
-    async with p.acquire() as conn:
-        async with conn.transaction():
-            await conn.execute("SELECT id FROM photos WHERE id=$1 FOR UPDATE", int(photo_id))
-            row = await conn.fetchrow(
-                """
-                SELECT id, user_id, value
-                FROM ratings
-                WHERE photo_id=$1
-                  AND value BETWEEN 1 AND 10
-                ORDER BY created_at DESC, id DESC
-                LIMIT 1
-                """,
-                int(photo_id),
-            )
-            if not row:
-                return {"deleted": False, "value": None, "user_id": None, "votes_count": 0}
+# -------------------- photo rating aggregates --------------------
+# photos.ratings_{direct,link}_{count,sum} — точные агрегаты по ratings, обновляются
+# в той же транзакции, что и запись оценки. Вес ссылочных оценок (LINK_RATING_WEIGHT)
+# применяется при чтении: sum_w = direct_sum + link_sum * w, cnt_w = direct_count + link_count * w.
+
+async def _apply_photo_rating_delta(
+    conn: asyncpg.Connection,
+    photo_id: int,
+    *,
+    source: str | None,
+    count_delta: int,
+    sum_delta: int,
+) -> None:
+    if str(source or "feed") == "link":
+        sql = """
+            UPDATE photos
+            SET ratings_link_count = ratings_link_count + $2,
+                ratings_link_sum = ratings_link_sum + $3
+            WHERE id=$1
+        """
+    else:
+        sql = """
+            UPDATE photos
+            SET ratings_direct_count = ratings_direct_count + $2,
+                ratings_direct_sum = ratings_direct_sum + $3
+            WHERE id=$1
+        """
+    await conn.execute(sql, int(photo_id), int(count_delta), int(sum_delta))
+    await _apply_rating_totals_delta(
+        conn,
+        int(photo_id),
+        direct_count=0 if str(source or "feed") == "link" else int(count_delta),
+        direct_sum=0 if str(source or "feed") == "link" else int(sum_delta),
+        link_count=int(count_delta) if str(source or "feed") == "link" else 0,
+        link_sum=int(sum_delta) if str(source or "feed") == "link" else 0,
+    )
+
+
+async def _apply_rating_totals_delta(
+    conn: asyncpg.Connection,
+    photo_id: int,
+    *,
+    direct_count: int = 0,
+    direct_sum: int = 0,
+    link_count: int = 0,
+    link_sum: int = 0,
+) -> None:
+    """Сдвинуть running totals глобального среднего (шард по photo_id)."""
+    if not (direct_count or direct_sum or link_count or link_sum):
+        return
+    await conn.execute(
+        """
+        INSERT INTO rating_totals (shard, direct_count, direct_sum, link_count, link_sum, updated_at)
+        VALUES ($1,$2,$3,$4,$5,NOW())
+        ON CONFLICT (shard) DO UPDATE SET
+            direct_count = rating_totals.direct_count + EXCLUDED.direct_count,
+            direct_sum = rating_totals.direct_sum + EXCLUDED.direct_sum,
+            link_count = rating_totals.link_count + EXCLUDED.link_count,
+            link_sum = rating_totals.link_sum + EXCLUDED.link_sum,
+            updated_at = NOW()
+        """,
+        int(photo_id) % _RATING_TOTALS_SHARDS,
+        int(direct_count),
+        int(direct_sum),
+        int(link_count),
+        int(link_sum),
+    )
+
+
+async def _rebuild_rating_totals(conn: asyncpg.Connection) -> None:
+    """Сверить rating_totals с сырыми ratings (первичное заполнение и ночная сверка).
+
+    Скан ratings идёт без блокировок в одном снимке (REPEATABLE READ) вместе с чтением
+    rating_totals: запись оценки меняет ratings и rating_totals в одной транзакции, поэтому
+    разница «агрегат − totals» в снимке — это ровно накопленный дрейф. Его прибавляем
+    короткой транзакцией; оценки, записанные после снимка, уже лежат в totals и не теряются.
+    """
+    await conn.execute(
+        """
+        INSERT INTO rating_totals (shard)
+        SELECT g FROM generate_series(0, $1::int - 1) g
+        ON CONFLICT (shard) DO NOTHING
+        """,
+        _RATING_TOTALS_SHARDS,
+    )
+    async with conn.transaction(isolation="repeatable_read", readonly=True):
+        drift = await conn.fetch(
+            """
+            SELECT t.shard,
+                   (COALESCE(a.direct_count, 0) - t.direct_count)::bigint AS direct_count,
+                   (COALESCE(a.direct_sum, 0) - t.direct_sum)::bigint AS direct_sum,
+                   (COALESCE(a.link_count, 0) - t.link_count)::bigint AS link_count,
+                   (COALESCE(a.link_sum, 0) - t.link_sum)::bigint AS link_sum
+            FROM rating_totals t
+            LEFT JOIN (
+                SELECT (photo_id % $1::int)::int AS shard,
+                       COUNT(*) FILTER (WHERE source IS DISTINCT FROM 'link')::bigint AS direct_count,
+                       COALESCE(SUM(value) FILTER (WHERE source IS DISTINCT FROM 'link'), 0)::bigint AS direct_sum,
+                       COUNT(*) FILTER (WHERE source = 'link')::bigint AS link_count,
+                       COALESCE(SUM(value) FILTER (WHERE source = 'link'), 0)::bigint AS link_sum
+                FROM ratings
+                GROUP BY 1
+            ) a ON a.shard = t.shard
+            """,
+            _RATING_TOTALS_SHARDS,
+        )
+    drift = [r for r in drift if r["direct_count"] or r["direct_sum"] or r["link_count"] or r["link_sum"]]
+    if not drift:
+        return
+    await conn.execute(
+        """
+        UPDATE rating_totals t
+        SET direct_count = t.direct_count + d.direct_count,
+            direct_sum = t.direct_sum + d.direct_sum,
+            link_count = t.link_count + d.link_count,
+            link_sum = t.link_sum + d.link_sum,
+            updated_at = NOW()
+        FROM unnest($1::smallint[], $2::bigint[], $3::bigint[], $4::bigint[], $5::bigint[])
+             AS d(shard, direct_count, direct_sum, link_count, link_sum)
+        WHERE t.shard = d.shard
+        """,
+        [int(r["shard"]) for r in drift],
+        [int(r["direct_count"]) for r in drift],
+        [int(r["direct_sum"]) for r in drift],
+        [int(r["link_count"]) for r in drift],
+        [int(r["link_sum"]) for r in drift],
+    )
+
+
+async def _recalc_photo_rating_aggregates(
+    conn: asyncpg.Connection,
+    photo_ids: list[int],
+    *,
+    apply_totals: bool = True,
+) -> int:
+    """Пересчитать агрегаты из ratings для указанных фото. Строки photos должны быть залочены вызывающим.
+
+    apply_totals=False — не сдвигать rating_totals (первичное заполнение: totals потом сверяются целиком).
+    """
+    if not photo_ids:
+        return 0
+    rows = await conn.fetch(
+        """
+        WITH a AS (
+            SELECT ph.id,
+                   COUNT(r.id) FILTER (WHERE r.source IS DISTINCT FROM 'link')::int AS direct_count,
+                   COALESCE(SUM(r.value) FILTER (WHERE r.source IS DISTINCT FROM 'link'), 0)::bigint AS direct_sum,
+                   COUNT(r.id) FILTER (WHERE r.source = 'link')::int AS link_count,
+                   COALESCE(SUM(r.value) FILTER (WHERE r.source = 'link'), 0)::bigint AS link_sum
+            FROM photos ph
+            LEFT JOIN ratings r ON r.photo_id = ph.id
+            WHERE ph.id = ANY($1::bigint[])
+            GROUP BY ph.id
+        ),
+        old AS (
+            SELECT id, ratings_direct_count, ratings_direct_sum, ratings_link_count, ratings_link_sum
+            FROM photos
+            WHERE id = ANY($1::bigint[])
+        ),
+        upd AS (
+            UPDATE photos p
+            SET ratings_direct_count = a.direct_count,
+                ratings_direct_sum = a.direct_sum,
+                ratings_link_count = a.link_count,
+                ratings_link_sum = a.link_sum
+            FROM a
+            WHERE p.id = a.id
+              AND (
+                  p.ratings_direct_count <> a.direct_count
+                  OR p.ratings_direct_sum <> a.direct_sum
+                  OR p.ratings_link_count <> a.link_count
+                  OR p.ratings_link_sum <> a.link_sum
+              )
+            RETURNING p.id, a.direct_count, a.direct_sum, a.link_count, a.link_sum
+        )
+        SELECT upd.id,
+               (upd.direct_count - old.ratings_direct_count)::bigint AS d_direct_count,
+               (upd.direct_sum - old.ratings_direct_sum)::bigint AS d_direct_sum,
+               (upd.link_count - old.ratings_link_count)::bigint AS d_link_count,
+               (upd.link_sum - old.ratings_link_sum)::bigint AS d_link_sum
+        FROM upd
+        JOIN old ON old.id = upd.id
+        """,
+        [int(x) for x in photo_ids],
+    )
+    if not apply_totals:
+        return len(rows)
+    for r in rows:
+        await _apply_rating_totals_delta(
+            conn,
+            int(r["id"]),
+            direct_count=int(r["d_direct_count"] or 0),
+            direct_sum=int(r["d_direct_sum"] or 0),
+            link_count=int(r["d_link_count"] or 0),
+            link_sum=int(r["d_link_sum"] or 0),
+        )
+    return len(rows)
+
+
+async def _rebuild_photo_rating_aggregates(
+    conn: asyncpg.Connection,
+    *,
+    batch_size: int,
+    apply_totals: bool = True,
+) -> int:
+    batch_size = max(1, int(batch_size))
+    fixed = 0
+    last_id = 0
+    while True:
+        async with conn.transaction():
+            ids = await conn.fetch(
+                """
+                SELECT id FROM photos
+                WHERE id > $1
+                ORDER BY id
+                LIMIT $2
+                FOR UPDATE
+                """,
+                int(last_id),
+                batch_size,
+            )
+            if not ids:
+                break
+            photo_ids = [int(r["id"]) for r in ids]
+            fixed += await _recalc_photo_rating_aggregates(conn, photo_ids, apply_totals=apply_totals)
+        last_id = photo_ids[-1]
+        if len(photo_ids) < batch_size:
+            break
+    await _rebuild_rating_totals(conn)
+    return fixed
+
+
+async def rebuild_photo_rating_aggregates(*, batch_size: int = 500) -> int:
+    """
+    Repair job: пересобрать photos.ratings_* и rating_totals из сырых ratings.
+    Идём пачками по id; строки пачки лочим до пересчёта, чтобы не потерять конкурентные оценки.
+    Возвращает число исправленных фото.
+    """
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        return await _rebuild_photo_rating_aggregates(conn, batch_size=batch_size)
+
+
+# Первичное заполнение photos.ratings_* после добавления колонок (DEFAULT 0): делаем его
+# в ensure_schema, до того как процесс начнёт читать агрегаты. Параллельно стартующие
+# процессы ждут на advisory-локе, готовность отмечается в admin_settings.
+_RATING_AGGREGATES_BACKFILL_LOCK_KEY = "glowshot_rating_aggregates_backfill"
+_RATING_AGGREGATES_BACKFILL_DONE_KEY = "rating_aggregates_backfilled"
+
+
+async def _backfill_photo_rating_aggregates_once(conn: asyncpg.Connection) -> None:
+    await conn.execute("SELECT pg_advisory_lock(hashtext($1))", _RATING_AGGREGATES_BACKFILL_LOCK_KEY)
+    try:
+        done = await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM admin_settings WHERE key=$1)", _RATING_AGGREGATES_BACKFILL_DONE_KEY
+        )
+        if done:
+            if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM rating_totals)"):
+                await _rebuild_rating_totals(conn)
+            return
+        started = time.perf_counter()
+        # photos.ratings_* ещё нули: дельты (полный агрегат − 0) по каждому фото задвоили бы
+        # rating_totals, поэтому totals не трогаем и сверяем одним проходом в конце
+        fixed = await _rebuild_photo_rating_aggregates(conn, batch_size=2000, apply_totals=False)
+        await conn.execute(
+            """
+            INSERT INTO admin_settings (key, value, updated_at)
+            VALUES ($1, 'true'::jsonb, NOW())
+            ON CONFLICT (key) DO NOTHING
+            """,
+            _RATING_AGGREGATES_BACKFILL_DONE_KEY,
+        )
+        logger.info(
+            "db.rating_aggregates.backfilled",
+            extra={"photos": fixed, "seconds": round(time.perf_counter() - started, 1)},
+        )
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", _RATING_AGGREGATES_BACKFILL_LOCK_KEY)
+
+
+async def admin_delete_last_rating_for_photo(photo_id: int) -> dict:
+    """
+    Delete the latest 1..10 rating for a photo and recalc photo counters.
+    Returns: {"deleted": bool, "value": int|None, "user_id": int|None, "votes_count": int}
+    """
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT id FROM photos WHERE id=$1 FOR UPDATE", int(photo_id))
+            row = await conn.fetchrow(
+                """
+                SELECT id, user_id, value
+                FROM ratings
+                WHERE photo_id=$1
+                  AND value BETWEEN 1 AND 10
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+                """,
+                int(photo_id),
+            )
+            if not row:
+                return {"deleted": False, "value": None, "user_id": None, "votes_count": 0}
 
             r_user_id = int(row["user_id"])
             r_value = int(row["value"])
@@ -3141,6 +3832,7 @@ async def admin_delete_last_rating_for_photo(photo_id: int) -> dict:
                 sum_score,
                 avg_score,
             )
+            await _recalc_photo_rating_aggregates(conn, [int(photo_id)])
             return {
                 "deleted": True,
                 "value": r_value,
@@ -3175,6 +3867,7 @@ async def admin_clear_ratings_for_photo(photo_id: int) -> dict:
                 "UPDATE photos SET votes_count=0, sum_score=0, avg_score=0 WHERE id=$1",
                 int(photo_id),
             )
+            await _recalc_photo_rating_aggregates(conn, [int(photo_id)])
             return {"removed": int(removed or 0), "votes_count": 0}
 
 
@@ -3235,27 +3928,32 @@ async def set_rating_feed_state(user_id: int, seq: int, *, last_author_id: int |
 async def set_rating_feed_seq(user_id: int, seq: int) -> None:
     await set_rating_feed_state(user_id, seq)
 
+async def _rating_day_stats(conn: asyncpg.Connection, user_id: int, day_key: str) -> dict:
+    """Оценки из ленты и «единицы» пользователя за день (общая часть для анти-спама)."""
+    row = await conn.fetchrow(
+        """
+        SELECT
+            COUNT(*)::int AS total_count,
+            COALESCE(SUM(CASE WHEN value=1 THEN 1 ELSE 0 END), 0)::int AS ones_count
+        FROM ratings
+        WHERE user_id=$1
+          AND COALESCE(source,'feed')='feed'
+          AND value BETWEEN 1 AND 10
+          AND created_at LIKE $2 || '%'
+        """,
+        int(user_id),
+        str(day_key),
+    )
+    if row:
+        return {"total_count": int(row["total_count"] or 0), "ones_count": int(row["ones_count"] or 0)}
+    return {"total_count": 0, "ones_count": 0}
+
+
 async def get_user_rating_day_stats(user_id: int, day_key: str) -> dict:
     """Return counts of ratings and ones for a user for a given Moscow day."""
     p = _assert_pool()
     async with p.acquire() as conn:
-        row = await conn.fetchrow(
-            """
-            SELECT
-                COUNT(*)::int AS total_count,
-                COALESCE(SUM(CASE WHEN value=1 THEN 1 ELSE 0 END), 0)::int AS ones_count
-            FROM ratings
-            WHERE user_id=$1
-              AND COALESCE(source,'feed')='feed'
-              AND value BETWEEN 1 AND 10
-              AND created_at LIKE $2 || '%'
-            """,
-            int(user_id),
-            str(day_key),
-        )
-    if row:
-        return dict(row)
-    return {"total_count": 0, "ones_count": 0}
+        return await _rating_day_stats(conn, user_id, day_key)
 
 
 async def mark_user_suspicious_rating(
@@ -3284,6 +3982,208 @@ async def mark_user_suspicious_rating(
         )
 
 
+# -------------------- migrations --------------------
+
+_MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+_MIGRATIONS_LOCK_KEY = "glowshot_migrations"
+# Всё, что <= этой версии, уже накатывали руками до появления раннера —
+# помечаем как baseline и не исполняем повторно (там есть backfill-UPDATE'ы).
+_MIGRATIONS_BASELINE = "2026-02-18_upload_rules_ack"
+
+
+def _list_migration_files() -> list[tuple[str, str]]:
+    """[(version, path)] отсортированные по имени файла."""
+    try:
+        names = sorted(n for n in os.listdir(_MIGRATIONS_DIR) if n.endswith(".sql"))
+    except FileNotFoundError:
+        return []
+    return [(n[:-4], os.path.join(_MIGRATIONS_DIR, n)) for n in names]
+
+
+async def _apply_migrations(conn: asyncpg.Connection) -> None:
+    """Накатывает новые migrations/*.sql ровно один раз (версия пишется в schema_migrations).
+
+    Несколько процессов (бот, саппорт-бот, вебхук) стартуют одновременно,
+    поэтому раннер сериализуется advisory-локом.
+    """
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            checksum TEXT NOT NULL,
+            baseline BOOLEAN NOT NULL DEFAULT FALSE,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+    await conn.execute("SELECT pg_advisory_lock(hashtext($1))", _MIGRATIONS_LOCK_KEY)
+    try:
+        rows = await conn.fetch("SELECT version, checksum FROM schema_migrations")
+        applied = {str(r["version"]): str(r["checksum"]) for r in rows}
+        for version, path in _list_migration_files():
+            with open(path, "r", encoding="utf-8") as f:
+                sql = f.read()
+            checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+            if version in applied:
+                if applied[version] != checksum:
+                    logger.warning("db.migrations.changed_after_apply", extra={"version": version})
+                continue
+            baseline = version <= _MIGRATIONS_BASELINE
+            async with conn.transaction():
+                if not baseline:
+                    await conn.execute(sql)
+                await conn.execute(
+                    """
+                    INSERT INTO schema_migrations (version, checksum, baseline)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (version) DO NOTHING
+                    """,
+                    version,
+                    checksum,
+                    baseline,
+                )
+            if not baseline:
+                logger.info("db.migrations.applied", extra={"version": version})
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", _MIGRATIONS_LOCK_KEY)
+
+
+# -------------------- created_ts backfill --------------------
+# Миграция 2026-10-16_timestamptz_columns добавила created_ts TIMESTAMPTZ рядом с TEXT created_at.
+# Старые строки заполняем тут: пачками по id (сначала свежие — они нужны дашбордам),
+# потом строим индексы CONCURRENTLY. Делает это один процесс (advisory lock),
+# готовые таблицы отмечаются в admin_settings, чтобы не сканировать их на каждом старте.
+
+_TS_BACKFILL_BATCH = 5000
+_TS_BACKFILL_PAUSE_SECONDS = 0.05
+_TS_BACKFILL_LOCK_KEY = "glowshot_ts_backfill"
+_TS_BACKFILL_DONE_KEY = "ts_backfill_done"
+_TS_BACKFILL_INDEXES: dict[str, list[tuple[str, str]]] = {
+    "activity_events": [
+        ("idx_activity_events_created_ts", "(created_ts)"),
+        ("idx_activity_events_user_created_ts", "(user_id, created_ts)"),
+    ],
+    "bot_error_logs": [
+        ("idx_bot_error_logs_created_ts", "(created_ts)"),
+    ],
+    "ratings": [
+        ("idx_ratings_user_created_ts", "(user_id, created_ts)"),
+    ],
+    "comments": [
+        ("idx_comments_user_created_ts", "(user_id, created_ts)"),
+    ],
+    "streak_actions": [
+        ("idx_streak_actions_tg_created_ts", "(tg_id, created_ts)"),
+    ],
+}
+_TS_BACKFILL_TASK: asyncio.Task | None = None
+
+
+async def _ts_backfill_table(conn: asyncpg.Connection, table: str) -> int:
+    """Заполнить created_ts в table пачками по диапазонам id. Возвращает число обновлённых строк."""
+    hi = await conn.fetchval(f"SELECT MAX(id) FROM {table}")
+    total = 0
+    hi = int(hi or 0)
+    while hi > 0:
+        lo = max(0, hi - _TS_BACKFILL_BATCH)
+        res = await conn.execute(
+            f"""
+            UPDATE {table}
+            SET created_ts = COALESCE(glowshot_text_to_ts(created_at), NOW())
+            WHERE id > $1 AND id <= $2 AND created_ts IS NULL
+            """,
+            lo,
+            hi,
+        )
+        try:
+            total += int(res.split()[-1])
+        except Exception:
+            pass
+        hi = lo
+        await asyncio.sleep(_TS_BACKFILL_PAUSE_SECONDS)
+    return total
+
+
+async def _ts_build_indexes(conn: asyncpg.Connection, table: str) -> None:
+    for name, cols in _TS_BACKFILL_INDEXES.get(table, []):
+        # после упавшего CONCURRENTLY остаётся invalid-индекс: его надо пересоздать
+        valid = await conn.fetchval(
+            """
+            SELECT i.indisvalid
+            FROM pg_class c
+            JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = $1
+            """,
+            name,
+        )
+        if valid:
+            continue
+        if valid is False:
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {cols}")
+
+
+async def _ts_backfill_loop() -> None:
+    p = _assert_pool()
+    try:
+        async with p.acquire() as conn:
+            locked = await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", _TS_BACKFILL_LOCK_KEY)
+            if not locked:
+                return
+            try:
+                raw = await conn.fetchval("SELECT value FROM admin_settings WHERE key=$1", _TS_BACKFILL_DONE_KEY)
+                done = set(json.loads(raw) if isinstance(raw, str) else (raw or []))
+                # строки без смещения в created_at трактуем во времени бота
+                await conn.execute(f"SET TIME ZONE '{BOT_TIMEZONE}'")
+                for table in _TS_BACKFILL_INDEXES:
+                    if table in done:
+                        continue
+                    started = time.perf_counter()
+                    updated = await _ts_backfill_table(conn, table)
+                    await _ts_build_indexes(conn, table)
+                    done.add(table)
+                    await conn.execute(
+                        """
+                        INSERT INTO admin_settings (key, value, updated_at)
+                        VALUES ($1, $2::jsonb, NOW())
+                        ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value, updated_at=NOW()
+                        """,
+                        _TS_BACKFILL_DONE_KEY,
+                        json.dumps(sorted(done)),
+                    )
+                    logger.info(
+                        "db.ts_backfill.table_done",
+                        extra={"table": table, "rows": updated, "seconds": round(time.perf_counter() - started, 1)},
+                    )
+            finally:
+                await conn.execute("RESET TIME ZONE")
+                await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", _TS_BACKFILL_LOCK_KEY)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("db.ts_backfill.failed")
+
+
+def _start_ts_backfill() -> None:
+    global _TS_BACKFILL_TASK
+    if _TS_BACKFILL_TASK is not None and not _TS_BACKFILL_TASK.done():
+        return
+    _TS_BACKFILL_TASK = asyncio.create_task(_ts_backfill_loop())
+
+
+async def _stop_ts_backfill() -> None:
+    global _TS_BACKFILL_TASK
+    task = _TS_BACKFILL_TASK
+    _TS_BACKFILL_TASK = None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+
 async def init_db() -> None:
     global pool
     if not DB_DSN:
@@ -3291,10 +4191,15 @@ async def init_db() -> None:
     if pool is None:
         pool = await asyncpg.create_pool(dsn=DB_DSN, min_size=1, max_size=10)
         await ensure_schema()
+        _start_settings_listener()
+        _start_ts_backfill()
 
 
 async def close_db() -> None:
     global pool
+    await _stop_activity_writer()
+    await _stop_settings_listener()
+    await _stop_ts_backfill()
     if pool is not None:
         await pool.close()
         pool = None
@@ -3939,6 +4844,24 @@ async def ensure_schema() -> None:
         await conn.execute("ALTER TABLE photos ADD COLUMN IF NOT EXISTS deleted_reason TEXT;")
         await conn.execute("ALTER TABLE photos ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;")
         await conn.execute("ALTER TABLE photos ADD COLUMN IF NOT EXISTS ratings_locked INTEGER NOT NULL DEFAULT 0;")
+        # Денормализованные агрегаты оценок (обычные / по ссылке), вес ссылки применяется при чтении.
+        await conn.execute("ALTER TABLE photos ADD COLUMN IF NOT EXISTS ratings_direct_count INTEGER NOT NULL DEFAULT 0;")
+        await conn.execute("ALTER TABLE photos ADD COLUMN IF NOT EXISTS ratings_direct_sum BIGINT NOT NULL DEFAULT 0;")
+        await conn.execute("ALTER TABLE photos ADD COLUMN IF NOT EXISTS ratings_link_count INTEGER NOT NULL DEFAULT 0;")
+        await conn.execute("ALTER TABLE photos ADD COLUMN IF NOT EXISTS ratings_link_sum BIGINT NOT NULL DEFAULT 0;")
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rating_totals (
+              shard SMALLINT PRIMARY KEY,
+              direct_count BIGINT NOT NULL DEFAULT 0,
+              direct_sum BIGINT NOT NULL DEFAULT 0,
+              link_count BIGINT NOT NULL DEFAULT 0,
+              link_sum BIGINT NOT NULL DEFAULT 0,
+              updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        # rating_totals заполняет _backfill_photo_rating_aggregates_once после photos.ratings_*
 
         # ======== CREATE INDEX IF NOT EXISTS ========
         await conn.execute("CREATE INDEX IF NOT EXISTS idx_ratings_photo_source ON ratings(photo_id, source);")
@@ -3995,9 +4918,18 @@ async def ensure_schema() -> None:
         await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_provider_payment_id ON payments(provider, payment_id);")
         
 
-    from database_results import ensure_results_legacy_schema, ensure_results_schema as ensure_results_v2_schema
+    from database_results import (
+        ensure_hof_schema,
+        ensure_results_legacy_schema,
+        ensure_results_schema as ensure_results_v2_schema,
+    )
     await ensure_results_legacy_schema()
     await ensure_results_v2_schema()
+    await ensure_hof_schema()
+
+    async with p.acquire() as conn:
+        await _apply_migrations(conn)
+        await _backfill_photo_rating_aggregates_once(conn)
 
 # -------------------- helpers --------------------
 
@@ -4166,18 +5098,26 @@ async def add_rating_by_tg_id(
             ):
                 return False
 
-            await conn.execute(
-                """
-                INSERT INTO ratings (photo_id, user_id, value, source, source_code, created_at)
-                VALUES ($1,$2,$3,$4,$5,$6)
-                """,
-                int(photo_id),
-                int(u["id"]),
-                int(value),
-                str(source or "feed"),
-                str(source_code) if source_code else None,
-                now,
-            )
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO ratings (photo_id, user_id, value, source, source_code, created_at)
+                    VALUES ($1,$2,$3,$4,$5,$6)
+                    """,
+                    int(photo_id),
+                    int(u["id"]),
+                    int(value),
+                    str(source or "feed"),
+                    str(source_code) if source_code else None,
+                    now,
+                )
+                await _apply_photo_rating_delta(
+                    conn,
+                    int(photo_id),
+                    source=str(source or "feed"),
+                    count_delta=1,
+                    sum_delta=int(value),
+                )
 
             # Invalidate author's rank cache (their photo got a new rating)
             try:
@@ -4208,6 +5148,7 @@ async def _ensure_user_row(tg_id: int, username: str | None = None) -> dict | No
                     "UPDATE users SET username=$1, updated_at=$2 WHERE id=$3",
                     username, get_moscow_now_iso(), int(u["id"])
                 )
+            invalidate_user_context(int(tg_id))
         return u
 
     p = _assert_pool()
@@ -4222,6 +5163,7 @@ async def _ensure_user_row(tg_id: int, username: str | None = None) -> dict | No
             """,
             int(tg_id), username, now
         )
+    invalidate_user_context(int(tg_id))
     return dict(row) if row else None
 
 
@@ -4273,10 +5215,10 @@ async def create_user(tg_id: int, username: str | None, name: str | None, gender
             """,
             int(tg_id), username, name, gender, age, bio, now
         )
+    invalidate_user_context(int(tg_id))
     return dict(row)
 
 
-
 async def get_user_by_tg_id(tg_id: int) -> dict | None:
     p = _assert_pool()
     async with p.acquire() as conn:
@@ -4301,6 +5243,7 @@ async def set_user_author_status_by_tg_id(tg_id: int, is_author: bool) -> None:
             now,
             int(tg_id),
         )
+    invalidate_user_context(int(tg_id))
 
 
 async def is_user_author_by_tg_id(tg_id: int) -> bool:
@@ -4346,6 +5289,69 @@ async def reactivate_user_by_tg_id(tg_id: int) -> None:
             get_moscow_now_iso(),
             int(tg_id),
         )
+    invalidate_user_context(int(tg_id))
+
+
+# -------------------- per-update user context --------------------
+# Один запрос на апдейт: строка юзера + роли + блок + премиум. Мидлвари и
+# хендлеры берут всё из data["user_ctx"], а не дёргают users по 4-6 раз.
+# Между апдейтами держим совсем короткий кэш (пачка колбэков от одного юзера).
+
+_USER_CTX_TTL_SECONDS = 3.0
+_USER_CTX_MAX_ENTRIES = 20000
+_USER_CTX_CACHE: dict[int, tuple[float, dict]] = {}
+
+
+def invalidate_user_context(tg_id: int | None = None) -> None:
+    """Сбросить кэш контекста для одного tg_id (или целиком)."""
+    if tg_id is None:
+        _USER_CTX_CACHE.clear()
+    else:
+        _USER_CTX_CACHE.pop(int(tg_id), None)
+
+
+def _build_user_context(tg_id: int, row: dict | None) -> dict:
+    is_deleted = bool(row and row.get("is_deleted"))
+    user = row if (row and not is_deleted) else None
+    return {
+        "tg_id": int(tg_id),
+        "user": user,
+        "user_id": int(user["id"]) if user else None,
+        "exists": row is not None,
+        "is_deleted": is_deleted,
+        "is_admin": bool(user and user.get("is_admin")),
+        "is_moderator": bool(user and user.get("is_moderator")),
+        "is_support": bool(user and user.get("is_support")),
+        "is_helper": bool(user and user.get("is_helper")),
+        "is_blocked": bool(user and user.get("is_blocked")),
+        "block_reason": user.get("block_reason") if user else None,
+        "block_until": user.get("block_until") if user else None,
+        "is_premium_active": _premium_active_from_row(user),
+    }
+
+
+async def get_user_context_by_tg_id(tg_id: int, *, use_cache: bool = True) -> dict:
+    """Контекст пользователя для мидлварей/хендлеров (см. _build_user_context)."""
+    key = int(tg_id)
+    now_ts = time.monotonic()
+    if use_cache:
+        hit = _USER_CTX_CACHE.get(key)
+        if hit is not None and now_ts - hit[0] < _USER_CTX_TTL_SECONDS:
+            return hit[1]
+
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM users WHERE tg_id=$1", key)
+    ctx = _build_user_context(key, dict(row) if row else None)
+
+    if len(_USER_CTX_CACHE) >= _USER_CTX_MAX_ENTRIES:
+        cutoff = now_ts - _USER_CTX_TTL_SECONDS
+        for k in [k for k, (ts, _) in _USER_CTX_CACHE.items() if ts < cutoff]:
+            _USER_CTX_CACHE.pop(k, None)
+        if len(_USER_CTX_CACHE) >= _USER_CTX_MAX_ENTRIES:
+            _USER_CTX_CACHE.clear()
+    _USER_CTX_CACHE[key] = (now_ts, ctx)
+    return ctx
 
 
 async def get_user_by_username(username: str) -> dict | None:
@@ -4446,6 +5452,7 @@ async def set_user_language_by_tg_id(tg_id: int, lang: str) -> None:
             get_moscow_now_iso(),
             int(tg_id),
         )
+    invalidate_user_context(int(tg_id))
 
 
 async def get_user_by_id(user_id: int) -> dict | None:
@@ -4661,6 +5668,7 @@ async def soft_delete_user(tg_id: int) -> None:
             get_moscow_now_iso(),
             int(tg_id),
         )
+    invalidate_user_context(int(tg_id))
 
 
 # -------------------- roles / blocks --------------------
@@ -4671,6 +5679,7 @@ async def set_user_admin_by_tg_id(tg_id: int, is_admin: bool) -> None:
     async with p.acquire() as conn:
         await conn.execute("UPDATE users SET is_admin=$1, updated_at=$2 WHERE tg_id=$3",
                            1 if is_admin else 0, get_moscow_now_iso(), int(tg_id))
+    invalidate_user_context(int(tg_id))
 
 
 async def is_moderator_by_tg_id(tg_id: int) -> bool:
@@ -4684,6 +5693,7 @@ async def set_user_moderator_by_tg_id(tg_id: int, is_mod: bool) -> None:
     async with p.acquire() as conn:
         await conn.execute("UPDATE users SET is_moderator=$1, updated_at=$2 WHERE tg_id=$3",
                            1 if is_mod else 0, get_moscow_now_iso(), int(tg_id))
+    invalidate_user_context(int(tg_id))
 
 
 async def set_user_helper_by_tg_id(tg_id: int, is_helper: bool) -> None:
@@ -4692,6 +5702,7 @@ async def set_user_helper_by_tg_id(tg_id: int, is_helper: bool) -> None:
     async with p.acquire() as conn:
         await conn.execute("UPDATE users SET is_helper=$1, updated_at=$2 WHERE tg_id=$3",
                            1 if is_helper else 0, get_moscow_now_iso(), int(tg_id))
+    invalidate_user_context(int(tg_id))
 
 
 async def set_user_support_by_tg_id(tg_id: int, is_support: bool) -> None:
@@ -4700,6 +5711,7 @@ async def set_user_support_by_tg_id(tg_id: int, is_support: bool) -> None:
     async with p.acquire() as conn:
         await conn.execute("UPDATE users SET is_support=$1, updated_at=$2 WHERE tg_id=$3",
                            1 if is_support else 0, get_moscow_now_iso(), int(tg_id))
+    invalidate_user_context(int(tg_id))
 
 
 async def get_user_block_status_by_tg_id(tg_id: int) -> dict:
@@ -4724,6 +5736,7 @@ async def set_user_block_status_by_tg_id(tg_id: int, is_blocked: bool,
             """,
             1 if is_blocked else 0, reason, until_iso, get_moscow_now_iso(), int(tg_id)
         )
+    invalidate_user_context(int(tg_id))
 
 
 async def hide_active_photos_for_user(user_id: int, new_status: str = "blocked_by_ban") -> int:
@@ -4743,9 +5756,12 @@ async def hide_active_photos_for_user(user_id: int, new_status: str = "blocked_b
             str(new_status),
         )
     try:
-        return int(res.split()[-1])
+        changed = int(res.split()[-1])
     except Exception:
-        return 0
+        changed = 0
+    if changed:
+        invalidate_feed_candidates(author_id=int(user_id))
+    return changed
 
 
 async def restore_photos_from_status(
@@ -4783,6 +5799,7 @@ async def set_user_premium_status(tg_id: int, is_premium: bool, premium_until: s
     async with p.acquire() as conn:
         await conn.execute("UPDATE users SET is_premium=$1, premium_until=$2, updated_at=$3 WHERE tg_id=$4",
                            1 if is_premium else 0, premium_until, get_moscow_now_iso(), int(tg_id))
+    invalidate_user_context(int(tg_id))
 
 
 async def set_user_premium_role_by_tg_id(tg_id: int, is_premium_role: bool) -> None:
@@ -4799,6 +5816,10 @@ async def get_user_premium_status(tg_id: int) -> dict:
 
 async def is_user_premium_active(tg_id: int) -> bool:
     u = await get_user_by_tg_id(tg_id)
+    return _premium_active_from_row(u)
+
+
+def _premium_active_from_row(u: dict | None) -> bool:
     if not u or not u.get("is_premium"):
         return False
     until_raw = u.get("premium_until")
@@ -5189,144 +6210,153 @@ async def _apply_referral_reward_to_user(
 async def try_award_referral(invited_tg_id: int) -> tuple[bool, int | None, int | None]:
     """Try to award referral bonus for invited user. Idempotent."""
     p = _assert_pool()
-    now_dt = get_bot_now()
-    now_iso = now_dt.isoformat()
-
     async with p.acquire() as conn:
         async with conn.transaction():
-            invited = await conn.fetchrow(
-                """
-                SELECT id, tg_id, name
-                FROM users
-                WHERE tg_id=$1
-                  AND is_deleted=0
-                LIMIT 1
-                """,
-                int(invited_tg_id),
-            )
-            if not invited:
-                return False, None, None
+            return await _try_award_referral_conn(conn, int(invited_tg_id), now_dt=get_bot_now())
 
-            invited_user_id = int(invited["id"])
-            invited_name = str(invited.get("name") or "").strip()
-            if not invited_name:
-                return False, None, None
 
-            has_vote = await conn.fetchval(
-                """
-                SELECT 1
-                FROM votes
-                WHERE voter_id=$1
-                LIMIT 1
-                """,
-                invited_user_id,
-            )
-            if not has_vote:
-                has_vote = await conn.fetchval(
-                    """
-                    SELECT 1
-                    FROM ratings
-                    WHERE user_id=$1
-                    LIMIT 1
-                    """,
-                    invited_user_id,
-                )
-            if not has_vote:
-                return False, None, None
+async def _try_award_referral_conn(
+    conn: asyncpg.Connection,
+    invited_tg_id: int,
+    *,
+    now_dt: datetime,
+) -> tuple[bool, int | None, int | None]:
+    """Тело try_award_referral на уже открытой транзакции."""
+    now_iso = now_dt.isoformat()
 
-            referral = await conn.fetchrow(
-                """
-                SELECT inviter_user_id
-                FROM referrals
-                WHERE invited_user_id=$1
-                FOR UPDATE
-                """,
-                invited_user_id,
-            )
-            if not referral:
-                await _link_referral_from_pending_if_needed(
-                    conn,
-                    invited_tg_id=int(invited_tg_id),
-                    invited_user_id=invited_user_id,
-                    now_iso=now_iso,
-                )
-                referral = await conn.fetchrow(
-                    """
-                    SELECT inviter_user_id
-                    FROM referrals
-                    WHERE invited_user_id=$1
-                    FOR UPDATE
-                    """,
-                    invited_user_id,
-                )
-            if not referral:
-                return False, None, None
+    invited = await conn.fetchrow(
+        """
+        SELECT id, tg_id, name
+        FROM users
+        WHERE tg_id=$1
+          AND is_deleted=0
+        LIMIT 1
+        """,
+        int(invited_tg_id),
+    )
+    if not invited:
+        return False, None, None
 
-            inviter_user_id = int(referral["inviter_user_id"])
-            if inviter_user_id == invited_user_id:
-                return False, None, None
+    invited_user_id = int(invited["id"])
+    invited_name = str(invited.get("name") or "").strip()
+    if not invited_name:
+        return False, None, None
 
-            inviter = await conn.fetchrow(
-                """
-                SELECT id, tg_id
-                FROM users
-                WHERE id=$1
-                  AND is_deleted=0
-                FOR UPDATE
-                """,
-                inviter_user_id,
-            )
-            if not inviter:
-                return False, None, None
-            inviter_tg_id = int(inviter["tg_id"])
-            if inviter_tg_id == int(invited_tg_id):
-                return False, None, None
+    has_vote = await conn.fetchval(
+        """
+        SELECT 1
+        FROM votes
+        WHERE voter_id=$1
+        LIMIT 1
+        """,
+        invited_user_id,
+    )
+    if not has_vote:
+        has_vote = await conn.fetchval(
+            """
+            SELECT 1
+            FROM ratings
+            WHERE user_id=$1
+            LIMIT 1
+            """,
+            invited_user_id,
+        )
+    if not has_vote:
+        return False, None, None
 
-            reward_row = await conn.fetchrow(
-                """
-                INSERT INTO referral_rewards (invited_user_id, inviter_user_id, rewarded_at, reward_type, reward_version)
-                VALUES ($1, $2, $3, 'premium_credits', 'v2_3h_2c')
-                ON CONFLICT (invited_user_id) DO NOTHING
-                RETURNING id
-                """,
-                invited_user_id,
-                inviter_user_id,
-                now_dt,
-            )
-            if not reward_row:
-                return False, None, None
-
-            await _apply_referral_reward_to_user(
-                conn,
-                user_id=invited_user_id,
-                credits=2,
-                premium_hours=3,
-                now_dt=now_dt,
-            )
-            await _apply_referral_reward_to_user(
-                conn,
-                user_id=inviter_user_id,
-                credits=2,
-                premium_hours=3,
-                now_dt=now_dt,
-            )
+    referral = await conn.fetchrow(
+        """
+        SELECT inviter_user_id
+        FROM referrals
+        WHERE invited_user_id=$1
+        FOR UPDATE
+        """,
+        invited_user_id,
+    )
+    if not referral:
+        await _link_referral_from_pending_if_needed(
+            conn,
+            invited_tg_id=int(invited_tg_id),
+            invited_user_id=invited_user_id,
+            now_iso=now_iso,
+        )
+        referral = await conn.fetchrow(
+            """
+            SELECT inviter_user_id
+            FROM referrals
+            WHERE invited_user_id=$1
+            FOR UPDATE
+            """,
+            invited_user_id,
+        )
+    if not referral:
+        return False, None, None
 
-            await conn.execute(
-                """
-                UPDATE referrals
-                SET qualified=1,
-                    qualified_at=$2
-                WHERE invited_user_id=$1
-                """,
-                invited_user_id,
-                now_iso,
-            )
-            await conn.execute(
-                "DELETE FROM pending_referrals WHERE new_user_tg_id=$1",
-                int(invited_tg_id),
-            )
+    inviter_user_id = int(referral["inviter_user_id"])
+    if inviter_user_id == invited_user_id:
+        return False, None, None
+
+    inviter = await conn.fetchrow(
+        """
+        SELECT id, tg_id
+        FROM users
+        WHERE id=$1
+          AND is_deleted=0
+        FOR UPDATE
+        """,
+        inviter_user_id,
+    )
+    if not inviter:
+        return False, None, None
+    inviter_tg_id = int(inviter["tg_id"])
+    if inviter_tg_id == int(invited_tg_id):
+        return False, None, None
+
+    reward_row = await conn.fetchrow(
+        """
+        INSERT INTO referral_rewards (invited_user_id, inviter_user_id, rewarded_at, reward_type, reward_version)
+        VALUES ($1, $2, $3, 'premium_credits', 'v2_3h_2c')
+        ON CONFLICT (invited_user_id) DO NOTHING
+        RETURNING id
+        """,
+        invited_user_id,
+        inviter_user_id,
+        now_dt,
+    )
+    if not reward_row:
+        return False, None, None
+
+    await _apply_referral_reward_to_user(
+        conn,
+        user_id=invited_user_id,
+        credits=2,
+        premium_hours=3,
+        now_dt=now_dt,
+    )
+    await _apply_referral_reward_to_user(
+        conn,
+        user_id=inviter_user_id,
+        credits=2,
+        premium_hours=3,
+        now_dt=now_dt,
+    )
+
+    await conn.execute(
+        """
+        UPDATE referrals
+        SET qualified=1,
+            qualified_at=$2
+        WHERE invited_user_id=$1
+        """,
+        invited_user_id,
+        now_iso,
+    )
+    await conn.execute(
+        "DELETE FROM pending_referrals WHERE new_user_tg_id=$1",
+        int(invited_tg_id),
+    )
 
-            return True, inviter_tg_id, int(invited_tg_id)
+    return True, inviter_tg_id, int(invited_tg_id)
 
 
 async def link_and_reward_referral_if_needed(invited_tg_id: int):
@@ -5744,9 +6774,10 @@ async def log_bot_error(
               error_type,
               error_text,
               traceback_text,
-              created_at
+              created_at,
+              created_ts
             )
-            VALUES ($1,$2,$3,$4,$5,$6,$7,NOW())
+            VALUES ($1,$2,$3,$4,$5,$6,$7,NOW(),NOW())
             """,
             int(chat_id) if chat_id is not None else None,
             int(tg_user_id) if tg_user_id is not None else None,
@@ -5803,7 +6834,8 @@ async def clear_bot_error_logs() -> None:
     """Полностью очищает таблицу bot_error_logs (для админки)."""
     p = _assert_pool()
     async with p.acquire() as conn:
-        await conn.execute("DELETE FROM bot_error_logs")
+        # TRUNCATE, а не DELETE: мгновенно и без мёртвых строк (таблица партиционирована)
+        await conn.execute("TRUNCATE bot_error_logs")
 
 async def log_successful_payment(
     tg_id: int,
@@ -6539,6 +7571,8 @@ async def set_photo_ratings_enabled(photo_id: int, enabled: bool, *, user_id: in
                     int(photo_id),
                     int(user_id),
                 )
+    if not enabled:
+        invalidate_feed_candidates(int(photo_id))
     return res.startswith("UPDATE ") and not res.endswith(" 0")
 
 
@@ -6560,6 +7594,7 @@ async def disable_photo_ratings_forever(photo_id: int, user_id: int) -> bool:
             int(photo_id),
             int(user_id),
         )
+    invalidate_feed_candidates(int(photo_id))
     return res.startswith("UPDATE ") and not res.endswith(" 0")
 
 
@@ -6583,6 +7618,8 @@ async def toggle_photo_ratings_enabled(photo_id: int, user_id: int) -> bool | No
         )
     if not row:
         return None
+    if not bool(row["ratings_enabled"]):
+        invalidate_feed_candidates(int(photo_id))
     return bool(row["ratings_enabled"])
 
 
@@ -6593,10 +7630,12 @@ async def mark_photo_deleted(photo_id: int) -> None:
             "UPDATE photos SET is_deleted=1, status='deleted', deleted_reason=COALESCE(deleted_reason,'system'), deleted_at=NOW() WHERE id=$1",
             int(photo_id),
         )
+    invalidate_feed_candidates(int(photo_id))
 
 
 async def mark_photo_deleted_by_user(photo_id: int, user_id: int) -> None:
     """Мягкое удаление пользователем — блокирует слот дня и вычищает из итогов."""
+    invalidate_feed_candidates(int(photo_id))
     p = _assert_pool()
     async with p.acquire() as conn:
         async with conn.transaction():
@@ -6641,10 +7680,15 @@ async def mark_photo_deleted_by_user(photo_id: int, user_id: int) -> None:
 
 
 async def hard_delete_photo(photo_id: int) -> None:
+    invalidate_feed_candidates(int(photo_id))
     p = _assert_pool()
     async with p.acquire() as conn:
         await conn.execute("DELETE FROM comments WHERE photo_id=$1", int(photo_id))
-        await conn.execute("DELETE FROM ratings WHERE photo_id=$1", int(photo_id))
+        async with conn.transaction():
+            await conn.execute("SELECT id FROM photos WHERE id=$1 FOR UPDATE", int(photo_id))
+            await conn.execute("DELETE FROM ratings WHERE photo_id=$1", int(photo_id))
+            # вычитаем удалённые оценки из rating_totals
+            await _recalc_photo_rating_aggregates(conn, [int(photo_id)])
         await conn.execute("DELETE FROM super_ratings WHERE photo_id=$1", int(photo_id))
         await conn.execute("DELETE FROM photo_reports WHERE photo_id=$1", int(photo_id))
         await conn.execute("DELETE FROM weekly_candidates WHERE photo_id=$1", int(photo_id))
@@ -6733,48 +7777,253 @@ async def _abuse_vote_limit_exceeded(
     return False
 
 
-async def next_photo_for_viewer(viewer_user_id: int) -> dict | None:
+# -------------------- feed candidate pool --------------------
+# Per-viewer очередь заранее отобранных кандидатов для next_photo_for_viewer.
+# Тяжёлый отбор (три anti-join по ratings/votes/photo_views + сортировка) делаем пачкой
+# и в фоне, а на тап остаётся pop из очереди и перепроверка одной строки по PK.
+
+_FEED_POOL_SIZE = 40                 # сколько кандидатов держим в каждой очереди
+_FEED_POOL_LOW_WATER = 10            # меньше — дозаполняем в фоне
+_FEED_POOL_TTL_SECONDS = 120         # после этого пул пересобирается (новые фото, сменились кредиты)
+_FEED_POOL_MIN_REFILL_SECONDS = 5.0  # не чаще, если кандидаты кончились
+_FEED_POOL_MAX_VIEWERS = 5000
+_FEED_POOL_RECHECK_ATTEMPTS = 6
+
+# viewer_id -> {"credit": deque, "rest": deque, "taken": set, "filled_at": float}
+# элементы очередей: (photo_id, author_id, votes_count)
+_FEED_POOLS: dict[int, dict] = {}
+_FEED_REFILLS: dict[int, asyncio.Task] = {}
+# Инвалидации: photo_id/author_id -> monotonic ts. Кандидат мёртв, если инвалидация
+# произошла после начала refill его пула.
+_FEED_DEAD_PHOTOS: dict[int, float] = {}
+_FEED_DEAD_AUTHORS: dict[int, float] = {}
+
+
+def invalidate_feed_candidates(photo_id: int | None = None, *, author_id: int | None = None) -> None:
+    """Убрать фото (или все фото автора) из пулов кандидатов: архив, удаление, модерация, оценки выключены."""
+    now = time.monotonic()
+    if photo_id is not None:
+        _FEED_DEAD_PHOTOS[int(photo_id)] = now
+    if author_id is not None:
+        _FEED_DEAD_AUTHORS[int(author_id)] = now
+    if len(_FEED_DEAD_PHOTOS) + len(_FEED_DEAD_AUTHORS) > 20000:
+        border = now - _FEED_POOL_TTL_SECONDS
+        for dead in (_FEED_DEAD_PHOTOS, _FEED_DEAD_AUTHORS):
+            for key in [k for k, ts in dead.items() if ts < border]:
+                dead.pop(key, None)
+
+
+def drop_feed_pool(viewer_user_id: int | None = None) -> None:
+    """Сбросить пул кандидатов зрителя (или все пулы)."""
+    if viewer_user_id is None:
+        _FEED_POOLS.clear()
+    else:
+        _FEED_POOLS.pop(int(viewer_user_id), None)
+
+
+def _feed_candidate_alive(entry: dict, cand: tuple[int, int, int]) -> bool:
+    photo_id, author_id, _ = cand
+    if photo_id in entry["taken"]:
+        return False
+    filled_at = float(entry["filled_at"])
+    ts = _FEED_DEAD_PHOTOS.get(photo_id)
+    if ts is not None and ts >= filled_at:
+        return False
+    ts = _FEED_DEAD_AUTHORS.get(author_id)
+    if ts is not None and ts >= filled_at:
+        return False
+    return True
+
+
+def feed_photo_invalidated_since(photo_id: int, author_id: int | None, since_ts: float) -> bool:
+    """True, если фото или его автора инвалидировали после since_ts (time.monotonic()).
+
+    Надёжно только для since_ts не старше _FEED_POOL_TTL_SECONDS — более старые отметки чистятся.
+    """
+    ts = _FEED_DEAD_PHOTOS.get(int(photo_id))
+    if ts is not None and ts >= since_ts:
+        return True
+    if author_id is not None:
+        ts = _FEED_DEAD_AUTHORS.get(int(author_id))
+        if ts is not None and ts >= since_ts:
+            return True
+    return False
+
+
+async def get_photo_if_still_rateable(photo_id: int, viewer_user_id: int) -> dict | None:
+    """Строка фото, если её всё ещё можно показать зрителю (одна проверка по PK).
+
+    Для заготовленных заранее карточек: удаление и модерация идут и в других процессах
+    (саппорт-бот, воркеры вебхука), локальных отметок инвалидации для них недостаточно.
+    Фото-передышку (ratings_enabled=0) сверяем с viewonly_views, остальные — с оценками.
+    Повторный показ отсекает record_feed_impression.
+    """
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT p.* FROM photos p
+            WHERE p.id = $2
+              AND p.is_deleted = 0
+              AND COALESCE(p.status,'active') = 'active'
+              AND p.moderation_status IN ('active','good')
+              AND (p.expires_at IS NULL OR p.expires_at > NOW())
+              AND NOT EXISTS (SELECT 1 FROM ratings r WHERE r.photo_id=p.id AND r.user_id=$1)
+              AND (
+                  CASE WHEN COALESCE(p.ratings_enabled,1)=1
+                  THEN NOT EXISTS (SELECT 1 FROM votes v WHERE v.photo_id=p.id AND v.voter_id=$1)
+                  ELSE NOT EXISTS (SELECT 1 FROM viewonly_views vv WHERE vv.photo_id=p.id AND vv.user_id=$1)
+                  END
+              )
+            """,
+            int(viewer_user_id),
+            int(photo_id),
+        )
+    return dict(row) if row else None
+
+
+def _feed_pool_pop(entry: dict, *, require_credit: bool, max_votes: int | None) -> tuple[int, int, int] | None:
+    q: deque = entry["credit"] if require_credit else entry["rest"]
+    while q:
+        cand = q[0]
+        if not _feed_candidate_alive(entry, cand):
+            q.popleft()
+            continue
+        # очереди отсортированы по votes_count ASC — дальше только популярнее
+        if max_votes is not None and int(cand[2]) > int(max_votes):
+            return None
+        return q.popleft()
+    return None
+
+
+async def _feed_pool_refill(viewer_user_id: int) -> dict:
+    """Один проход тяжёлого отбора: кандидаты с кредитами и общий «хвост» по возрастанию голосов."""
+    p = _assert_pool()
+    started = time.monotonic()
+    async with p.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            WITH elig AS (
+                SELECT p.id, p.user_id, COALESCE(p.votes_count,0) AS votes_count, p.created_at,
+                       (COALESCE(us.credits,0)+COALESCE(us.show_tokens,0) > 0) AS has_credit
+                FROM photos p
+                LEFT JOIN user_stats us ON us.user_id = p.user_id
+                WHERE p.is_deleted = 0
+                  AND COALESCE(p.status,'active') = 'active'
+                  AND p.moderation_status IN ('active','good')
+                  AND COALESCE(p.ratings_enabled,1)=1
+                  AND (p.expires_at IS NULL OR p.expires_at > NOW())
+                  AND p.user_id <> $1
+                  AND NOT EXISTS (SELECT 1 FROM ratings r WHERE r.photo_id=p.id AND r.user_id=$1)
+                  AND NOT EXISTS (SELECT 1 FROM votes v WHERE v.photo_id=p.id AND v.voter_id=$1)
+                  AND NOT EXISTS (SELECT 1 FROM photo_views pv WHERE pv.photo_id=p.id AND pv.viewer_id=$1)
+            )
+            SELECT * FROM (
+                (SELECT id, user_id, votes_count, created_at, TRUE AS credit_bucket
+                 FROM elig WHERE has_credit
+                 ORDER BY votes_count ASC, created_at DESC
+                 LIMIT $2)
+                UNION ALL
+                (SELECT id, user_id, votes_count, created_at, FALSE AS credit_bucket
+                 FROM elig
+                 ORDER BY votes_count ASC, created_at DESC
+                 LIMIT $2)
+            ) c
+            ORDER BY credit_bucket DESC, votes_count ASC, created_at DESC
+            """,
+            int(viewer_user_id),
+            int(_FEED_POOL_SIZE),
+        )
+    entry: dict = {"credit": deque(), "rest": deque(), "taken": set(), "filled_at": started}
+    for r in rows:
+        cand = (int(r["id"]), int(r["user_id"]), int(r["votes_count"] or 0))
+        if r["credit_bucket"]:
+            entry["credit"].append(cand)
+        else:
+            entry["rest"].append(cand)
+
+    key = int(viewer_user_id)
+    _FEED_POOLS.pop(key, None)
+    _FEED_POOLS[key] = entry
+    while len(_FEED_POOLS) > _FEED_POOL_MAX_VIEWERS:
+        _FEED_POOLS.pop(next(iter(_FEED_POOLS)), None)
+    return entry
+
+
+async def _feed_pool_refill_bg(viewer_user_id: int) -> None:
+    try:
+        await _feed_pool_refill(viewer_user_id)
+    except Exception:
+        pass
+    finally:
+        _FEED_REFILLS.pop(int(viewer_user_id), None)
+
+
+def _feed_pool_schedule_refill(viewer_user_id: int) -> None:
+    key = int(viewer_user_id)
+    task = _FEED_REFILLS.get(key)
+    if task is not None and not task.done():
+        return
+    entry = _FEED_POOLS.get(key)
+    if entry is not None and (time.monotonic() - float(entry["filled_at"])) < _FEED_POOL_MIN_REFILL_SECONDS:
+        return
+    _FEED_REFILLS[key] = asyncio.create_task(_feed_pool_refill_bg(key))
+
+
+async def _feed_pool_get(viewer_user_id: int) -> dict:
+    key = int(viewer_user_id)
+    entry = _FEED_POOLS.get(key)
+    if entry is None or (time.monotonic() - float(entry["filled_at"])) >= _FEED_POOL_TTL_SECONDS:
+        task = _FEED_REFILLS.get(key)
+        if task is not None and not task.done():
+            try:
+                await task
+            except Exception:
+                pass
+            entry = _FEED_POOLS.get(key)
+        if entry is None or (time.monotonic() - float(entry["filled_at"])) >= _FEED_POOL_TTL_SECONDS:
+            entry = await _feed_pool_refill(key)
+    return entry
+
+
+async def next_photo_for_viewer(viewer_user_id: int, *, record_view: bool = True) -> dict | None:
     """
     Smart выдача:
       - не показываем свои фото и уже оценённые/просмотренные;
       - фото активно (status=active, не истёк expires_at);
       - предпочитаем авторов с кредитами/токенами; иначе «хвост» редких показов.
+      - кандидаты берутся из per-viewer пула (см. feed candidate pool), на тап — перепроверка одной строки;
       - защита от гонок: FOR UPDATE SKIP LOCKED + списание токена в той же транзакции.
+
+    record_view=False — только выбрать (заготовка карточки заранее): просмотр не пишется,
+    кандидат не помечается выданным; записывает его record_feed_impression при показе.
     """
     p = _assert_pool()
     now = get_bot_now()
     economy = await get_effective_economy_settings()
-    async def _pick(require_credit: bool, *, spend_token: bool, max_votes: int | None = None) -> dict | None:
+    viewer_id = int(viewer_user_id)
+
+    async def _take(cand: tuple[int, int, int], require_credit: bool, *, spend_token: bool, max_votes: int | None) -> dict | None:
         async with p.acquire() as conn:
             async with conn.transaction():
                 row = await conn.fetchrow(
                     """
-                    WITH cand AS (
-                        SELECT p.id
-                        FROM photos p
-                        LEFT JOIN user_stats us ON us.user_id = p.user_id
-                        WHERE p.is_deleted = 0
-                          AND COALESCE(p.status,'active') = 'active'
-                          AND p.moderation_status IN ('active','good')
-                          AND COALESCE(p.ratings_enabled,1)=1
-                          AND (p.expires_at IS NULL OR p.expires_at > NOW())
-                          AND p.user_id <> $1
-                          AND NOT EXISTS (SELECT 1 FROM ratings r WHERE r.photo_id=p.id AND r.user_id=$1)
-                          AND NOT EXISTS (SELECT 1 FROM votes v WHERE v.photo_id=p.id AND v.voter_id=$1)
-                          AND NOT EXISTS (SELECT 1 FROM photo_views pv WHERE pv.photo_id=p.id AND pv.viewer_id=$1)
-                          AND ($2::bool = FALSE OR COALESCE(us.credits,0)+COALESCE(us.show_tokens,0) > 0)
-                          AND ($3::int IS NULL OR COALESCE(p.votes_count,0) <= $3)
-                        ORDER BY COALESCE(p.votes_count,0) ASC, p.created_at DESC
-                        LIMIT 50
-                    )
                     SELECT p.* FROM photos p
-                    JOIN cand c ON c.id = p.id
-                    ORDER BY COALESCE(p.votes_count,0) ASC, p.created_at DESC
+                    WHERE p.id = $2
+                      AND p.is_deleted = 0
+                      AND COALESCE(p.status,'active') = 'active'
+                      AND p.moderation_status IN ('active','good')
+                      AND COALESCE(p.ratings_enabled,1)=1
+                      AND (p.expires_at IS NULL OR p.expires_at > NOW())
+                      AND p.user_id <> $1
+                      AND ($3::int IS NULL OR COALESCE(p.votes_count,0) <= $3)
+                      AND NOT EXISTS (SELECT 1 FROM ratings r WHERE r.photo_id=p.id AND r.user_id=$1)
+                      AND NOT EXISTS (SELECT 1 FROM votes v WHERE v.photo_id=p.id AND v.voter_id=$1)
+                      AND NOT EXISTS (SELECT 1 FROM photo_views pv WHERE pv.photo_id=p.id AND pv.viewer_id=$1)
                     FOR UPDATE SKIP LOCKED
-                    LIMIT 1
                     """,
-                    int(viewer_user_id),
-                    bool(require_credit),
+                    viewer_id,
+                    int(cand[0]),
                     None if max_votes is None else int(max_votes),
                 )
                 if not row:
@@ -6791,6 +8040,8 @@ async def next_photo_for_viewer(viewer_user_id: int) -> dict | None:
                 tokens = int((stats_row or {}).get("show_tokens") or 0)
                 if require_credit and credits <= 0 and tokens <= 0:
                     return None
+                if not record_view:
+                    return photo
 
                 multiplier = _credit_multiplier_for_moment(now, economy)
                 new_credits = credits
@@ -6806,7 +8057,7 @@ async def next_photo_for_viewer(viewer_user_id: int) -> dict | None:
                     ON CONFLICT DO NOTHING
                     """,
                     int(photo["id"]),
-                    int(viewer_user_id),
+                    viewer_id,
                     now,
                 )
                 if not res.endswith(" 1"):
@@ -6827,6 +8078,22 @@ async def next_photo_for_viewer(viewer_user_id: int) -> dict | None:
                 )
                 return photo
 
+    async def _pick(require_credit: bool, *, spend_token: bool, max_votes: int | None = None) -> dict | None:
+        entry = await _feed_pool_get(viewer_id)
+        photo = None
+        for _ in range(_FEED_POOL_RECHECK_ATTEMPTS):
+            cand = _feed_pool_pop(entry, require_credit=require_credit, max_votes=max_votes)
+            if cand is None:
+                break
+            photo = await _take(cand, require_credit, spend_token=spend_token, max_votes=max_votes)
+            if photo:
+                if record_view:
+                    entry["taken"].add(int(cand[0]))
+                break
+        if len(entry["rest"]) < _FEED_POOL_LOW_WATER or (require_credit and not entry["credit"]):
+            _feed_pool_schedule_refill(viewer_id)
+        return photo
+
     # Списание показа происходит при действии пользователя (оценка/дальше),
     # а не в момент выдачи карточки.
     photo = await _pick(True, spend_token=False)
@@ -6898,12 +8165,11 @@ async def get_popular_photo_for_rating(
                     u.premium_until AS user_premium_until,
                     u.tg_channel_link AS user_tg_channel_link,
                     u.tg_channel_link AS tg_channel_link,
-                    COUNT(r.id)::int AS ratings_count,
-                    COALESCE(SUM(r.value * CASE WHEN r.source='link' THEN $5 ELSE 1 END), 0)::float AS sum_values,
-                    COALESCE(SUM(CASE WHEN r.source='link' THEN $5 ELSE 1 END), 0)::float AS sum_weights
+                    (p.ratings_direct_count + p.ratings_link_count)::int AS ratings_count,
+                    (p.ratings_direct_sum + p.ratings_link_sum * $5::float)::float AS sum_values,
+                    (p.ratings_direct_count + p.ratings_link_count * $5::float)::float AS sum_weights
                 FROM photos p
                 JOIN users u ON u.id=p.user_id
-                LEFT JOIN ratings r ON r.photo_id=p.id
                 WHERE p.is_deleted=0
                   AND p.moderation_status IN ('active','good')
                   AND COALESCE(p.status,'active')='active'
@@ -6912,7 +8178,6 @@ async def get_popular_photo_for_rating(
                   AND ($6::int IS NULL OR p.user_id <> $6)
                   AND ($7::int IS NULL OR u.is_premium=$7)
                   AND NOT EXISTS (SELECT 1 FROM ratings r2 WHERE r2.photo_id=p.id AND r2.user_id=$1)
-                GROUP BY p.id, u.id, u.is_premium, u.premium_until, u.tg_channel_link
             )
             SELECT *,
                    ((($3::float) * ($4::float)) + sum_values) / (($3::float) + sum_weights) AS bayes_score
@@ -6954,10 +8219,9 @@ async def _get_rateable_photo_by_ratings_count(
                     u.premium_until AS user_premium_until,
                     u.tg_channel_link AS user_tg_channel_link,
                     u.tg_channel_link AS tg_channel_link,
-                    COUNT(r.id)::int AS ratings_count
+                    (p.ratings_direct_count + p.ratings_link_count)::int AS ratings_count
                 FROM photos p
                 JOIN users u ON u.id=p.user_id
-                LEFT JOIN ratings r ON r.photo_id=p.id
                 WHERE p.is_deleted=0
                   AND p.moderation_status IN ('active','good')
                   AND COALESCE(p.status,'active')='active'
@@ -6966,7 +8230,6 @@ async def _get_rateable_photo_by_ratings_count(
                   AND ($4::int IS NULL OR p.user_id <> $4)
                   AND ($5::int IS NULL OR u.is_premium=$5)
                   AND NOT EXISTS (SELECT 1 FROM ratings r2 WHERE r2.photo_id=p.id AND r2.user_id=$1)
-                GROUP BY p.id, u.id, u.is_premium, u.premium_until, u.tg_channel_link
             )
             SELECT *
             FROM stats
@@ -7093,16 +8356,170 @@ async def get_random_photo_for_rating_viewonly(
     return dict(row) if row else None
 
 
-async def get_random_photo_for_rating(viewer_user_id: int) -> dict | None:
+_RATING_BUCKET_ORDERS: dict[int, tuple[str, ...]] = {
+    1: ("fresh", "low", "mid", "popular"),
+    2: ("low", "fresh", "mid", "popular"),
+    3: ("mid", "low", "fresh", "popular"),
+    4: ("popular", "mid", "low", "fresh"),
+    5: ("mid", "popular", "low", "fresh"),
+    0: ("popular", "mid", "low", "fresh"),
+}
+
+
+async def _select_rating_bucket_candidates(viewer_user_id: int, last_author_id: int | None) -> dict[str, list[dict]]:
+    """
+    Один запрос вместо каскада fresh/low/mid/popular/nonpopular/any/viewonly.
+
+    Для каждого бакета возвращает лучшую строку в каждой «ячейке»
+    (автор == last_author или нет) x (премиум или нет) + позицию `pos` в общем порядке бакета,
+    так что любой вариант из каскада (_try_get) выбирается в Python без новых запросов.
+    Порядок внутри бакетов совпадает с get_fresh/low/mid/popular/nonpopular_photo_for_rating.
+    """
+    p = _assert_pool()
+    w = _link_rating_weight()
+    low_max = int(RATE_LOW_RATINGS_MAX)
+    popular_min = int(RATE_POPULAR_MIN_RATINGS)
+    async with p.acquire() as conn:
+        global_mean, _ = await _get_global_rating_mean(conn)
+        prior = _bayes_prior_weight()
+        rows = await conn.fetch(
+            """
+            WITH agg AS (
+                SELECT p.id, p.user_id, p.created_at,
+                       COALESCE(p.ratings_enabled, 1) AS re,
+                       (COALESCE(u.is_premium, 0) = 1) AS prem,
+                       (p.ratings_direct_count + p.ratings_link_count)::int AS ratings_count,
+                       (p.ratings_direct_sum + p.ratings_link_sum * $3::float)::float AS sum_values,
+                       (p.ratings_direct_count + p.ratings_link_count * $3::float)::float AS sum_weights
+                FROM photos p
+                JOIN users u ON u.id=p.user_id
+                WHERE p.is_deleted=0
+                  AND p.moderation_status IN ('active','good')
+                  AND COALESCE(p.status,'active')='active'
+                  AND p.user_id <> $1
+                  AND NOT EXISTS (SELECT 1 FROM ratings r WHERE r.photo_id=p.id AND r.user_id=$1)
+                  AND (
+                      COALESCE(p.ratings_enabled, 1)=1
+                      OR (
+                          COALESCE(p.ratings_enabled, 1)=0
+                          AND NOT EXISTS (
+                              SELECT 1 FROM viewonly_views v
+                              WHERE v.photo_id=p.id AND v.user_id=$1
+                          )
+                      )
+                  )
+            ),
+            tagged AS (
+                SELECT a.*,
+                       bk.bucket,
+                       ($2::bigint IS NOT NULL AND a.user_id = $2::bigint) AS is_last_author,
+                       (($4::float * $5::float) + a.sum_values) / ($4::float + a.sum_weights) AS bayes_score,
+                       random() AS rnd
+                FROM agg a
+                CROSS JOIN LATERAL (
+                    VALUES
+                        (CASE WHEN a.re=1 AND a.ratings_count=0 THEN 'fresh' END),
+                        (CASE WHEN a.re=1 AND $6::int >= 1 AND a.ratings_count BETWEEN 1 AND $6::int THEN 'low' END),
+                        (CASE WHEN a.re=1 AND a.ratings_count BETWEEN $6::int + 1 AND $7::int - 1 THEN 'mid' END),
+                        (CASE WHEN a.re=1 AND a.ratings_count >= $7::int THEN 'popular' END),
+                        (CASE WHEN a.re=1 AND a.ratings_count <= $7::int - 1 THEN 'nonpopular' END),
+                        (CASE WHEN a.re=1 THEN 'any' END),
+                        (CASE WHEN a.re=0 THEN 'viewonly' END)
+                ) AS bk(bucket)
+                WHERE bk.bucket IS NOT NULL
+            ),
+            keyed AS (
+                SELECT t.*,
+                       CASE t.bucket
+                           WHEN 'low' THEN t.ratings_count
+                           WHEN 'popular' THEN -t.ratings_count
+                           ELSE 0
+                       END AS k1,
+                       CASE WHEN t.bucket='popular' THEN -t.bayes_score ELSE 0 END AS k2,
+                       CASE WHEN t.bucket IN ('fresh','low') THEN t.created_at END AS k3,
+                       CASE WHEN t.bucket IN ('fresh','low') THEN t.id END AS k4
+                FROM tagged t
+            ),
+            ranked AS (
+                SELECT k.id, k.bucket, k.is_last_author, k.prem,
+                       k.ratings_count, k.sum_values, k.sum_weights, k.bayes_score,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY k.bucket
+                           ORDER BY k.k1, k.k2, k.k3 DESC NULLS LAST, k.k4 DESC NULLS LAST, k.rnd
+                       ) AS pos,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY k.bucket, k.is_last_author, k.prem
+                           ORDER BY k.k1, k.k2, k.k3 DESC NULLS LAST, k.k4 DESC NULLS LAST, k.rnd
+                       ) AS cell_pos
+                FROM keyed k
+            )
+            SELECT p.*,
+                   u.id AS u_id,
+                   u.is_premium AS user_is_premium,
+                   u.premium_until AS user_premium_until,
+                   u.tg_channel_link AS user_tg_channel_link,
+                   u.tg_channel_link AS tg_channel_link,
+                   rk.ratings_count,
+                   rk.sum_values,
+                   rk.sum_weights,
+                   rk.bayes_score,
+                   rk.bucket AS _bucket,
+                   rk.is_last_author AS _is_last_author,
+                   rk.prem AS _prem,
+                   rk.pos AS _pos
+            FROM ranked rk
+            JOIN photos p ON p.id=rk.id
+            JOIN users u ON u.id=p.user_id
+            WHERE rk.cell_pos=1
+            """,
+            int(viewer_user_id),
+            int(last_author_id) if last_author_id is not None else None,
+            float(w),
+            float(prior),
+            float(global_mean),
+            low_max,
+            popular_min,
+        )
+
+    buckets: dict[str, list[dict]] = {}
+    for r in rows:
+        buckets.setdefault(str(r["_bucket"]), []).append(dict(r))
+    return buckets
+
+
+def _pick_bucket_candidate(
+    cells: list[dict] | None,
+    *,
+    exclude_last_author: bool,
+    require_premium: bool,
+) -> dict | None:
+    best: dict | None = None
+    for row in cells or []:
+        if exclude_last_author and row.get("_is_last_author"):
+            continue
+        if require_premium and not row.get("_prem"):
+            continue
+        if best is None or int(row["_pos"]) < int(best["_pos"]):
+            best = row
+    if best is None:
+        return None
+    return {k: v for k, v in best.items() if not k.startswith("_")}
+
+
+async def get_random_photo_for_rating(viewer_user_id: int, *, record_view: bool = True) -> dict | None:
     """
     Возвращает фото по умной схеме:
     - каждое 10-е: «передышка» (ratings_enabled=0), если доступна;
     - иначе чередование: свежее / низкое / среднее / популярное.
     - если подходящих нет в целевой группе, ищем в соседних, затем в любых.
+
+    Все бакеты fallback-каскада выбираются одним запросом (_select_rating_bucket_candidates).
+    record_view=False — выбор без побочных эффектов (ни просмотра, ни сдвига seq ленты);
+    при показе такой карточки вызывается record_feed_impression.
     """
     # New smart feed (credits / no repeats). Best-effort; fallback на старую схему при ошибках.
     try:
-        smart = await next_photo_for_viewer(int(viewer_user_id))
+        smart = await next_photo_for_viewer(int(viewer_user_id), record_view=record_view)
         if smart:
             return smart
     except Exception:
@@ -7113,144 +8530,64 @@ async def get_random_photo_for_rating(viewer_user_id: int) -> dict | None:
     last_author_id = state.get("last_author_id")
     next_seq = seq + 1
 
-    want_viewonly = (next_seq % 10) == 0
-    if want_viewonly:
-        vo = await get_random_photo_for_rating_viewonly(
-            viewer_user_id,
-            exclude_author_id=last_author_id if last_author_id is not None else None,
-        )
-        if not vo and last_author_id is not None:
-            vo = await get_random_photo_for_rating_viewonly(viewer_user_id)
-        if vo:
-            author_id = int(vo.get("user_id")) if vo and vo.get("user_id") is not None else None
-            await set_rating_feed_state(int(viewer_user_id), int(next_seq), last_author_id=author_id)
-            return vo
-
-    bucket = next_seq % 6
-    if bucket == 1:
-        order = ("fresh", "low", "mid", "popular")
-    elif bucket == 2:
-        order = ("low", "fresh", "mid", "popular")
-    elif bucket == 3:
-        order = ("mid", "low", "fresh", "popular")
-    elif bucket == 4:
-        order = ("popular", "mid", "low", "fresh")
-    elif bucket == 5:
-        order = ("mid", "popular", "low", "fresh")
-    else:
-        order = ("popular", "mid", "low", "fresh")
-
-    getters = {
-        "fresh": get_fresh_photo_for_rating,
-        "low": get_low_photo_for_rating,
-        "mid": get_mid_photo_for_rating,
-        "popular": get_popular_photo_for_rating,
-    }
-
+    candidates = await _select_rating_bucket_candidates(int(viewer_user_id), last_author_id)
     prefer_premium = random.random() < _premium_boost_chance()
 
-    async def _try_get(getter):
-        photo = None
+    def _viewonly() -> dict | None:
+        cells = candidates.get("viewonly")
+        vo = None
         if last_author_id is not None:
-            if prefer_premium:
-                photo = await getter(viewer_user_id, exclude_author_id=last_author_id, require_premium=True)
-                if not photo:
-                    photo = await getter(viewer_user_id, exclude_author_id=last_author_id, require_premium=None)
-            else:
-                photo = await getter(viewer_user_id, exclude_author_id=last_author_id, require_premium=None)
-            if not photo:
-                if prefer_premium:
-                    photo = await getter(viewer_user_id, exclude_author_id=None, require_premium=True)
-                    if not photo:
-                        photo = await getter(viewer_user_id, exclude_author_id=None, require_premium=None)
-                else:
-                    photo = await getter(viewer_user_id, exclude_author_id=None, require_premium=None)
-        else:
-            if prefer_premium:
-                photo = await getter(viewer_user_id, exclude_author_id=None, require_premium=True)
-                if not photo:
-                    photo = await getter(viewer_user_id, exclude_author_id=None, require_premium=None)
-            else:
-                photo = await getter(viewer_user_id, exclude_author_id=None, require_premium=None)
-        return photo
+            vo = _pick_bucket_candidate(cells, exclude_last_author=True, require_premium=False)
+        if not vo:
+            vo = _pick_bucket_candidate(cells, exclude_last_author=False, require_premium=False)
+        return vo
 
-    photo = None
-    for key in order:
-        try:
-            photo = await _try_get(getters[key])
-        except Exception:
-            photo = None
-        if photo:
-            break
+    def _try_get(bucket: str) -> dict | None:
+        cells = candidates.get(bucket)
+        if not cells:
+            return None
+        variants: list[tuple[bool, bool]] = []
+        if last_author_id is not None:
+            if prefer_premium:
+                variants.append((True, True))
+            variants.append((True, False))
+        if prefer_premium:
+            variants.append((False, True))
+        variants.append((False, False))
+        for exclude_last, require_premium in variants:
+            photo = _pick_bucket_candidate(cells, exclude_last_author=exclude_last, require_premium=require_premium)
+            if photo:
+                return photo
+        return None
 
-    if photo:
-        author_id = int(photo.get("user_id")) if photo and photo.get("user_id") is not None else None
+    async def _serve(photo: dict) -> dict:
+        if not record_view:
+            photo["feed_seq"] = int(next_seq)
+            return photo
+        author_id = int(photo.get("user_id")) if photo.get("user_id") is not None else None
         await set_rating_feed_state(int(viewer_user_id), int(next_seq), last_author_id=author_id)
         return photo
 
-    # Fallback: если целевые группы пусты — берём любую непопулярную
-    nonpopular = await _try_get(get_nonpopular_photo_for_rating)
-    if nonpopular:
-        author_id = int(nonpopular.get("user_id")) if nonpopular and nonpopular.get("user_id") is not None else None
-        await set_rating_feed_state(int(viewer_user_id), int(next_seq), last_author_id=author_id)
-        return nonpopular
+    if (next_seq % 10) == 0:
+        vo = _viewonly()
+        if vo:
+            return await _serve(vo)
 
-    # Fallback: любые доступные для оценивания
-    any_rateable = None
-    if last_author_id is not None:
-        if prefer_premium:
-            any_rateable = await get_random_photo_for_rating_rateable(
-                viewer_user_id,
-                exclude_author_id=last_author_id,
-                require_premium=True,
-            )
-            if not any_rateable:
-                any_rateable = await get_random_photo_for_rating_rateable(
-                    viewer_user_id,
-                    exclude_author_id=last_author_id,
-                    require_premium=None,
-                )
-        else:
-            any_rateable = await get_random_photo_for_rating_rateable(
-                viewer_user_id,
-                exclude_author_id=last_author_id,
-                require_premium=None,
-            )
-    if not any_rateable:
-        if prefer_premium:
-            any_rateable = await get_random_photo_for_rating_rateable(
-                viewer_user_id,
-                exclude_author_id=None,
-                require_premium=True,
-            )
-            if not any_rateable:
-                any_rateable = await get_random_photo_for_rating_rateable(
-                    viewer_user_id,
-                    exclude_author_id=None,
-                    require_premium=None,
-                )
-        else:
-            any_rateable = await get_random_photo_for_rating_rateable(
-                viewer_user_id,
-                exclude_author_id=None,
-                require_premium=None,
-            )
-    if any_rateable:
-        author_id = int(any_rateable.get("user_id")) if any_rateable and any_rateable.get("user_id") is not None else None
-        await set_rating_feed_state(int(viewer_user_id), int(next_seq), last_author_id=author_id)
-        return any_rateable
+    for key in _RATING_BUCKET_ORDERS[next_seq % 6]:
+        photo = _try_get(key)
+        if photo:
+            return await _serve(photo)
+
+    # Fallback: если целевые группы пусты — берём любую непопулярную, затем любые доступные для оценивания
+    for key in ("nonpopular", "any"):
+        photo = _try_get(key)
+        if photo:
+            return await _serve(photo)
 
     # Fallback: если подходящих нет — попробуем передышку
-    vo = await get_random_photo_for_rating_viewonly(
-        viewer_user_id,
-        exclude_author_id=last_author_id if last_author_id is not None else None,
-    )
-    if not vo and last_author_id is not None:
-        vo = await get_random_photo_for_rating_viewonly(viewer_user_id)
+    vo = _viewonly()
     if vo:
-        author_id = int(vo.get("user_id")) if vo and vo.get("user_id") is not None else None
-        await set_rating_feed_state(int(viewer_user_id), int(next_seq), last_author_id=author_id)
-        return vo
+        return await _serve(vo)
     return None
 
 
@@ -7271,13 +8608,16 @@ async def mark_viewonly_seen(user_id: int, photo_id: int) -> None:
         )
 
 
-async def record_photo_view(photo_id: int, viewer_id: int) -> None:
-    """Запомнить показ фото конкретному пользователю и инкрементировать счётчик просмотров."""
+async def record_photo_view(photo_id: int, viewer_id: int) -> bool:
+    """Запомнить показ фото конкретному пользователю и инкрементировать счётчик просмотров.
+
+    False — просмотр уже был записан (счётчик не трогаем).
+    """
     p = _assert_pool()
-    now = get_bot_now_iso()
+    now = get_bot_now()
     async with p.acquire() as conn:
         async with conn.transaction():
-            await conn.execute(
+            res = await conn.execute(
                 """
                 INSERT INTO photo_views (photo_id, viewer_id, created_at)
                 VALUES ($1,$2,$3)
@@ -7287,10 +8627,27 @@ async def record_photo_view(photo_id: int, viewer_id: int) -> None:
                 int(viewer_id),
                 now,
             )
+            if not res.endswith(" 1"):
+                return False
             await conn.execute(
                 "UPDATE photos SET views_count = views_count + 1 WHERE id=$1",
                 int(photo_id),
             )
+    return True
+
+
+async def record_feed_impression(viewer_user_id: int, photo: dict) -> bool:
+    """Побочные эффекты выдачи для карточки, выбранной с record_view=False (см. get_random_photo_for_rating).
+
+    Старая схема двигает seq ленты, smart-выдача пишет просмотр. False — фото этому зрителю
+    уже показали (например, с другого устройства), карточку надо выбросить.
+    """
+    feed_seq = photo.get("feed_seq")
+    if feed_seq is not None:
+        author_id = int(photo["user_id"]) if photo.get("user_id") is not None else None
+        await set_rating_feed_state(int(viewer_user_id), int(feed_seq), last_author_id=author_id)
+        return True
+    return await record_photo_view(int(photo["id"]), int(viewer_user_id))
 
 
 async def has_viewonly_seen(user_id: int, photo_id: int) -> bool:
@@ -7307,19 +8664,26 @@ async def has_viewonly_seen(user_id: int, photo_id: int) -> bool:
 # -------------------- parties / recap / notifications --------------------
 
 
+# Воркер уведомлений слушает этот канал и просыпается сразу после enqueue
+_NOTIFICATION_QUEUE_CHANNEL = "glowshot_notifications"
+
+
 async def enqueue_notification(user_id: int, n_type: str, payload: dict, *, run_after: datetime | None = None) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO notification_queue (user_id, type, payload, run_after, status)
-            VALUES ($1,$2,$3,$4,'pending')
-            """,
-            int(user_id),
-            str(n_type),
-            json.dumps(payload or {}),
-            run_after or get_bot_now(),
-        )
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO notification_queue (user_id, type, payload, run_after, status)
+                VALUES ($1,$2,$3,$4,'pending')
+                """,
+                int(user_id),
+                str(n_type),
+                json.dumps(payload or {}),
+                run_after or get_bot_now(),
+            )
+            # доставится на COMMIT, вместе со строкой
+            await conn.execute("SELECT pg_notify($1, '')", _NOTIFICATION_QUEUE_CHANNEL)
 
 
 async def fetch_pending_notifications(limit: int = 50) -> list[dict]:
@@ -7349,6 +8713,94 @@ async def fetch_pending_notifications(limit: int = 50) -> list[dict]:
     return [dict(r) for r in rows]
 
 
+async def ack_notifications(results: list[tuple[int, str, str | None, float | None]]) -> None:
+    """Закрыть пачку одним UPDATE: [(id, status, error, retry_in_seconds)].
+
+    retry_in задан — строка возвращается в pending с run_after = NOW() + retry_in.
+    Трогаем только строки в 'sending' — чужие/переразобранные не перетираем.
+    """
+    if not results:
+        return
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        await conn.execute(
+            """
+            UPDATE notification_queue n
+            SET status = CASE WHEN x.retry_in IS NOT NULL THEN 'pending' ELSE x.status END,
+                run_after = CASE WHEN x.retry_in IS NOT NULL
+                                 THEN NOW() + make_interval(secs => x.retry_in)
+                                 ELSE n.run_after END,
+                last_error = x.error,
+                updated_at = NOW()
+            FROM unnest($1::bigint[], $2::text[], $3::text[], $4::float8[]) AS x(id, status, error, retry_in)
+            WHERE n.id = x.id AND n.status = 'sending'
+            """,
+            [int(r[0]) for r in results],
+            [str(r[1]) for r in results],
+            [(str(r[2])[:1000] if r[2] else None) for r in results],
+            [(float(r[3]) if r[3] is not None else None) for r in results],
+        )
+
+
+async def reclaim_stuck_notifications(older_than_seconds: int = 300) -> int:
+    """Вернуть в pending строки, зависшие в 'sending' (воркер упал посреди пачки)."""
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        res = await conn.execute(
+            """
+            UPDATE notification_queue
+            SET status='pending', updated_at=NOW()
+            WHERE status='sending'
+              AND updated_at < NOW() - make_interval(secs => $1)
+            """,
+            float(older_than_seconds),
+        )
+    try:
+        return int(res.split()[-1])
+    except Exception:
+        return 0
+
+
+async def get_next_notification_due_in() -> float | None:
+    """Через сколько секунд наступит ближайший run_after среди pending (None — очередь пуста)."""
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        v = await conn.fetchval(
+            """
+            SELECT EXTRACT(EPOCH FROM (MIN(run_after) - NOW()))
+            FROM notification_queue
+            WHERE status='pending'
+            """
+        )
+    return None if v is None else max(0.0, float(v))
+
+
+async def listen_notification_queue(on_notify: Callable[[], None]) -> None:
+    """LISTEN на очередь уведомлений в отдельном соединении; переподключается при обрыве.
+
+    После (пере)подключения on_notify вызывается сразу — пока не слушали, могли что-то пропустить.
+    """
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn=DB_DSN)
+            await conn.add_listener(_NOTIFICATION_QUEUE_CHANNEL, lambda *_: on_notify())
+            on_notify()
+            while not conn.is_closed():
+                await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        finally:
+            if conn is not None:
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+        await asyncio.sleep(3)
+
+
 async def mark_notification_done(
     notification_id: int,
     status: str = "sent",
@@ -7679,71 +9131,97 @@ async def grant_daily_credits_once(day: date | None = None, *, batch_size: int =
     }
 
 
+# Один чанк закрытия партий целиком в SQL: выборка под FOR UPDATE, ранжирование окном
+# по дню, upsert в result_ranks и архивирование. $4/$5 — уже выданные в этом прогоне
+# места по дням (чанки продолжают нумерацию, как раньше продолжал счётчик в Python).
+# Фото без submit_day получают день из created_at и идут после фото с явным днём.
+_FINALIZE_PARTY_CHUNK_SQL = """
+WITH picked AS (
+    SELECT id
+    FROM photos
+    WHERE is_deleted=0
+      AND status='active'
+      AND expires_at <= NOW()
+      AND ($1::date IS NULL OR submit_day=$1::date)
+    ORDER BY submit_day NULLS LAST, avg_score DESC, votes_count DESC, created_at ASC, id ASC
+    LIMIT $2
+    FOR UPDATE
+),
+ranked AS (
+    SELECT
+        ph.id,
+        d.eff_day,
+        CASE WHEN ph.ratings_enabled <> 0 THEN
+            (COALESCE(o.taken, 0) + ROW_NUMBER() OVER (
+                PARTITION BY d.eff_day, (ph.ratings_enabled <> 0)
+                ORDER BY (ph.submit_day IS NULL), ph.avg_score DESC, ph.votes_count DESC, ph.created_at ASC, ph.id ASC
+            ))::int
+        END AS final_rank
+    FROM photos ph
+    JOIN picked USING (id)
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(
+            ph.submit_day,
+            CASE WHEN ph.created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN left(ph.created_at, 10)::date END,
+            $3::date
+        ) AS eff_day
+    ) d
+    LEFT JOIN unnest($4::date[], $5::int[]) AS o(day, taken) ON o.day = d.eff_day
+),
+upserted AS (
+    INSERT INTO result_ranks (photo_id, submit_day, final_rank, finalized_at)
+    SELECT id, eff_day, final_rank, NOW()
+    FROM ranked
+    WHERE final_rank IS NOT NULL
+    ON CONFLICT (photo_id, submit_day)
+    DO UPDATE SET final_rank=EXCLUDED.final_rank, finalized_at=EXCLUDED.finalized_at
+),
+archived AS (
+    UPDATE photos ph
+    SET status='archived'
+    FROM ranked r
+    WHERE ph.id = r.id
+)
+SELECT ph.*, r.final_rank AS final_rank, r.eff_day AS eff_day
+FROM photos ph
+JOIN ranked r ON r.id = ph.id
+"""
+
+
 async def finalize_party(submit_day: date | None = None, *, min_votes: int = 7, limit: int = 500) -> list[dict]:
     """
     Закрываем партии:
       - если submit_day задан, закрываем её, но только если истёкла;
       - иначе закрываем все истёкшие (expires_at <= now) активные фото пачкой.
+
+    Каждый чанк (limit фото) — один запрос и короткая транзакция. Повторный запуск
+    безопасен: архивные фото не выбираются, result_ranks upsert'ится.
     """
     p = _assert_pool()
     results: list[dict] = []
-    now = get_bot_now()
-    rank_by_day: dict[str, int] = {}
+    today = get_bot_now().date()
+    rank_by_day: dict[date, int] = {}
     async with p.acquire() as conn:
         while True:
             async with conn.transaction():
                 rows = await conn.fetch(
-                    """
-                    SELECT *
-                    FROM photos
-                    WHERE is_deleted=0
-                      AND COALESCE(status,'active')='active'
-                      AND (expires_at <= NOW())
-                      AND ($1::date IS NULL OR submit_day=$1::date)
-                    ORDER BY submit_day NULLS LAST, avg_score DESC, votes_count DESC, created_at ASC
-                    LIMIT $2
-                    """,
+                    _FINALIZE_PARTY_CHUNK_SQL,
                     submit_day,
                     int(limit),
+                    today,
+                    list(rank_by_day.keys()),
+                    list(rank_by_day.values()),
                 )
-                if not rows:
-                    break
-                batch_results: list[dict] = []
-                for r in rows:
-                    sd = r.get("submit_day")
-                    if sd is None:
-                        try:
-                            created = datetime.fromisoformat(str(r.get("created_at")))
-                            sd = created.date()
-                        except Exception:
-                            sd = now.date()
-                    day_key = str(sd)
-                    rank: int | None = None
-                    if bool(r.get("ratings_enabled", 1)):
-                        rank_by_day.setdefault(day_key, 0)
-                        rank_by_day[day_key] += 1
-                        rank = rank_by_day[day_key]
-
-                    photo_id = int(r["id"])
-                    if rank is not None:
-                        await conn.execute(
-                            """
-                            INSERT INTO result_ranks (photo_id, submit_day, final_rank, finalized_at)
-                            VALUES ($1,$2,$3,NOW())
-                            ON CONFLICT (photo_id, submit_day)
-                            DO UPDATE SET final_rank=EXCLUDED.final_rank, finalized_at=EXCLUDED.finalized_at
-                            """,
-                            photo_id,
-                            sd,
-                            rank,
-                        )
-                    await conn.execute(
-                        "UPDATE photos SET status='archived' WHERE id=$1",
-                        photo_id,
-                    )
-                    batch_results.append(dict(r) | {"final_rank": rank, "submit_day": sd})
-
-                results.extend(batch_results)
+            if not rows:
+                break
+            for r in rows:
+                row = dict(r)
+                sd = row.pop("eff_day")
+                rank = row.get("final_rank")
+                if rank is not None:
+                    rank_by_day[sd] = max(rank_by_day.get(sd, 0), int(rank))
+                invalidate_feed_candidates(int(row["id"]))
+                results.append(row | {"submit_day": sd})
             if len(rows) < limit:
                 break
     return results
@@ -7777,98 +9255,308 @@ async def daily_recap(submit_day: date, *, min_votes: int = 7, top_n: int = 3) -
 
 async def add_rating(user_id: int, photo_id: int, value: int) -> bool:
     p = _assert_pool()
-    now_dt = get_bot_now()
-    now_iso = get_bot_now_iso()
-    today = get_bot_today()
+    economy = await get_effective_economy_settings()
     async with p.acquire() as conn:
         async with conn.transaction():
             photo_row = await conn.fetchrow(
                 "SELECT id, user_id, ratings_enabled, is_deleted, moderation_status, votes_count, sum_score FROM photos WHERE id=$1 FOR UPDATE",
                 int(photo_id),
             )
-            if not photo_row:
-                return False
-            status = str(photo_row.get("moderation_status") or "").lower()
-            if (
-                int(photo_row.get("is_deleted") or 0) != 0
-                or status not in ("active", "good")
-                or not bool(photo_row.get("ratings_enabled", 1))
-            ):
-                return False
+            return await _add_rating_conn(conn, photo_row, int(user_id), int(value), economy=economy)
 
-            author_id = int(photo_row["user_id"])
-            if await _abuse_vote_limit_exceeded(conn, int(user_id), author_id, today):
-                return False
 
-            prev_score = await conn.fetchval(
-                "SELECT score FROM votes WHERE photo_id=$1 AND voter_id=$2",
-                int(photo_id),
-                int(user_id),
-            )
-            if prev_score is not None:
-                return False  # уникальность голоса
+async def _add_rating_conn(
+    conn: asyncpg.Connection,
+    photo_row,
+    user_id: int,
+    value: int,
+    *,
+    economy: dict,
+) -> bool:
+    """Тело add_rating на открытой транзакции; photo_row уже взят FOR UPDATE."""
+    now_dt = get_bot_now()
+    now_iso = get_bot_now_iso()
+    today = get_bot_today()
+    if not photo_row:
+        return False
+    photo_id = int(photo_row["id"])
+    status = str(photo_row.get("moderation_status") or "").lower()
+    if (
+        int(photo_row.get("is_deleted") or 0) != 0
+        or status not in ("active", "good")
+        or not bool(photo_row.get("ratings_enabled", 1))
+    ):
+        return False
 
-            await conn.execute(
-                """
-                INSERT INTO ratings (photo_id, user_id, value, created_at)
-                VALUES ($1,$2,$3,$4)
-                ON CONFLICT (photo_id, user_id)
-                DO UPDATE SET value=EXCLUDED.value, created_at=EXCLUDED.created_at
-                """,
-                int(photo_id), int(user_id), int(value), now_iso
-            )
+    author_id = int(photo_row["user_id"])
+    if await _abuse_vote_limit_exceeded(conn, int(user_id), author_id, today):
+        return False
 
-            await conn.execute(
-                """
-                INSERT INTO votes (photo_id, voter_id, score, created_at)
-                VALUES ($1,$2,$3,$4)
-                ON CONFLICT (photo_id, voter_id)
-                DO UPDATE SET score=EXCLUDED.score, created_at=EXCLUDED.created_at
-                """,
-                int(photo_id), int(user_id), int(value), now_dt
-            )
+    prev_score = await conn.fetchval(
+        "SELECT score FROM votes WHERE photo_id=$1 AND voter_id=$2",
+        int(photo_id),
+        int(user_id),
+    )
+    if prev_score is not None:
+        return False  # уникальность голоса
 
-            votes_count = int(photo_row.get("votes_count") or 0)
-            sum_score = int(photo_row.get("sum_score") or 0)
+    prev_rating = await conn.fetchrow(
+        "SELECT value, source FROM ratings WHERE photo_id=$1 AND user_id=$2",
+        int(photo_id),
+        int(user_id),
+    )
 
-            votes_count += 1
-            sum_score += int(value)
+    await conn.execute(
+        """
+        INSERT INTO ratings (photo_id, user_id, value, created_at)
+        VALUES ($1,$2,$3,$4)
+        ON CONFLICT (photo_id, user_id)
+        DO UPDATE SET value=EXCLUDED.value, created_at=EXCLUDED.created_at
+        """,
+        int(photo_id), int(user_id), int(value), now_iso
+    )
+    if prev_rating is None:
+        await _apply_photo_rating_delta(conn, int(photo_id), source="feed", count_delta=1, sum_delta=int(value))
+    else:
+        # ON CONFLICT перезаписал value, source остался прежним
+        await _apply_photo_rating_delta(
+            conn,
+            int(photo_id),
+            source=prev_rating.get("source"),
+            count_delta=0,
+            sum_delta=int(value) - int(prev_rating.get("value") or 0),
+        )
 
-            avg_score = float(sum_score) / votes_count if votes_count > 0 else 0.0
+    await conn.execute(
+        """
+        INSERT INTO votes (photo_id, voter_id, score, created_at)
+        VALUES ($1,$2,$3,$4)
+        ON CONFLICT (photo_id, voter_id)
+        DO UPDATE SET score=EXCLUDED.score, created_at=EXCLUDED.created_at
+        """,
+        int(photo_id), int(user_id), int(value), now_dt
+    )
 
-            await conn.execute(
+    votes_count = int(photo_row.get("votes_count") or 0)
+    sum_score = int(photo_row.get("sum_score") or 0)
+
+    votes_count += 1
+    sum_score += int(value)
+
+    avg_score = float(sum_score) / votes_count if votes_count > 0 else 0.0
+
+    await conn.execute(
+        """
+        UPDATE photos
+        SET votes_count=$2, sum_score=$3, avg_score=$4
+        WHERE id=$1
+        """,
+        int(photo_id),
+        votes_count,
+        sum_score,
+        avg_score,
+    )
+
+    # Invalidate author's rank cache (their photo got a new rating)
+    try:
+        await conn.execute(
+            "UPDATE users SET rank_updated_at=NULL, updated_at=$2 WHERE id=$1",
+            int(author_id),
+            now_iso,
+        )
+    except Exception:
+        pass
+
+    # credits to voter (savepoint: сбой начисления не откатывает сам голос)
+    if int(value) > 0:
+        try:
+            async with conn.transaction():
+                await _add_credits_on_vote_conn(
+                    conn,
+                    int(user_id),
+                    delta=1,
+                    now_dt=now_dt,
+                    apply_happy_hour_bonus=True,
+                    economy=economy,
+                )
+        except Exception:
+            pass
+    return True
+
+
+async def submit_rating(
+    *,
+    voter_user_id: int,
+    voter_tg_id: int,
+    photo_id: int,
+    value: int,
+    day_key: str,
+    spam_guard: Callable[[int, int], bool] | None = None,
+) -> dict:
+    """Оценка из ленты целиком: одно соединение, одна транзакция.
+
+    Порядок как был в rate_score: анти-спам по единицам (spam_guard(ones, total) -> blocked),
+    проверка фото, голос + кредиты голосующему, показ автора, стрик, счётчик лайков
+    для дневной сводки, рефералка. Побочные шаги — в savepoint'ах: их сбой не откатывает голос.
+
+    status: ok | blocked | not_found | ratings_disabled.
+    """
+    p = _assert_pool()
+    economy = await get_effective_economy_settings()
+    result: dict = {
+        "status": "ok",
+        "vote_saved": False,
+        "photo": None,
+        "author_user_id": None,
+        "author_tg_id": None,
+        "ones_count": 0,
+        "total_count": 0,
+        "streak": None,
+        "referral": (False, None, None),
+    }
+    reward_check: tuple[int, int] | None = None
+    voter_user_id = int(voter_user_id)
+    voter_tg_id = int(voter_tg_id)
+
+    async with p.acquire() as conn:
+        async with conn.transaction():
+            if spam_guard is not None:
+                stats = await _rating_day_stats(conn, voter_user_id, day_key)
+                ones, total = stats["ones_count"], stats["total_count"]
+                result["ones_count"], result["total_count"] = ones, total
+                if spam_guard(ones, total):
+                    await conn.execute(
+                        """
+                        INSERT INTO rating_suspicious (user_id, day_key, ones_count, total_count, created_at)
+                        VALUES ($1,$2,$3,$4,$5)
+                        ON CONFLICT (user_id, day_key)
+                        DO UPDATE SET ones_count=EXCLUDED.ones_count,
+                                      total_count=EXCLUDED.total_count,
+                                      created_at=EXCLUDED.created_at
+                        """,
+                        voter_user_id,
+                        str(day_key),
+                        ones,
+                        total,
+                        get_moscow_now_iso(),
+                    )
+                    result["status"] = "blocked"
+                    return result
+
+            photo_row = await conn.fetchrow(
                 """
-                UPDATE photos
-                SET votes_count=$2, sum_score=$3, avg_score=$4
-                WHERE id=$1
+                SELECT p.id, p.user_id, p.ratings_enabled, p.is_deleted, p.moderation_status,
+                       p.votes_count, p.sum_score, u.tg_id AS author_tg_id
+                FROM photos p
+                LEFT JOIN users u ON u.id = p.user_id
+                WHERE p.id=$1
+                FOR UPDATE OF p
                 """,
                 int(photo_id),
-                votes_count,
-                sum_score,
-                avg_score,
             )
+            if not photo_row or int(photo_row["is_deleted"] or 0) != 0:
+                result["status"] = "not_found"
+                return result
+            author_user_id = int(photo_row["user_id"]) if photo_row["user_id"] is not None else None
+            author_tg_id = int(photo_row["author_tg_id"]) if photo_row["author_tg_id"] is not None else None
+            result["photo"] = {"id": int(photo_row["id"]), "user_id": author_user_id}
+            result["author_user_id"] = author_user_id
+            result["author_tg_id"] = author_tg_id
+            if not bool(photo_row["ratings_enabled"] if photo_row["ratings_enabled"] is not None else True):
+                result["status"] = "ratings_disabled"
+                return result
+
+            vote_saved = await _add_rating_conn(conn, photo_row, voter_user_id, int(value), economy=economy)
+            result["vote_saved"] = bool(vote_saved)
+            is_foreign = bool(author_user_id and author_user_id > 0 and author_user_id != voter_user_id)
+
+            # показ автора: 2 показа = 1 кредит
+            if vote_saved and is_foreign:
+                try:
+                    async with conn.transaction():
+                        await _ensure_user_stats_row(conn, int(author_user_id))
+                        await _consume_credits_on_rating_conn(
+                            conn,
+                            int(author_user_id),
+                            now_dt=get_bot_now(),
+                            economy=economy,
+                        )
+                except Exception:
+                    pass
 
-            # Invalidate author's rank cache (their photo got a new rating)
+            # streak: rating counts as daily activity
             try:
-                await conn.execute(
-                    "UPDATE users SET rank_updated_at=NULL, updated_at=$2 WHERE id=$1",
-                    int(author_id),
-                    now_iso,
-                )
+                async with conn.transaction():
+                    await conn.execute(
+                        """
+                        INSERT INTO user_streak (tg_id, visible, reward_111_given, created_at, updated_at)
+                        VALUES ($1,1,0,$2,$2)
+                        ON CONFLICT (tg_id) DO NOTHING
+                        """,
+                        voter_tg_id,
+                        get_moscow_now_iso(),
+                    )
+                    result["streak"], reward_check = await _streak_record_action_conn(conn, voter_tg_id, "rate")
             except Exception:
-                pass
+                reward_check = None
 
-            # credits to voter
-            if int(value) > 0:
+            # лайки автору для дневной сводки (если он их не выключил)
+            if is_foreign and author_tg_id:
                 try:
-                    await add_credits_on_vote(
-                        int(user_id),
-                        now=now_dt,
-                        apply_happy_hour_bonus=True,
-                    )
+                    async with conn.transaction():
+                        await conn.execute(
+                            """
+                            INSERT INTO notify_likes_daily (tg_id, day_key, likes_count)
+                            SELECT $1, $2, 1
+                            WHERE COALESCE(
+                                (SELECT likes_enabled FROM user_notify_settings WHERE tg_id=$1),
+                                TRUE
+                            )
+                            ON CONFLICT (tg_id, day_key)
+                            DO UPDATE SET likes_count = notify_likes_daily.likes_count + EXCLUDED.likes_count,
+                                          updated_at = NOW()
+                            """,
+                            author_tg_id,
+                            str(day_key),
+                        )
                 except Exception:
                     pass
-    return True
+
+            # рефералка: полный путь только если у голосующего есть невыданная рефералка
+            if vote_saved:
+                try:
+                    async with conn.transaction():
+                        pending = await conn.fetchval(
+                            """
+                            SELECT NOT EXISTS (SELECT 1 FROM referral_rewards WHERE invited_user_id=$1)
+                               AND (
+                                    EXISTS (SELECT 1 FROM referrals WHERE invited_user_id=$1)
+                                 OR EXISTS (SELECT 1 FROM pending_referrals WHERE new_user_tg_id=$2)
+                               )
+                            """,
+                            voter_user_id,
+                            voter_tg_id,
+                        )
+                        if pending:
+                            result["referral"] = await _try_award_referral_conn(
+                                conn,
+                                voter_tg_id,
+                                now_dt=get_bot_now(),
+                            )
+                except Exception:
+                    result["referral"] = (False, None, None)
+
+    if reward_check is not None:
+        try:
+            await _grant_streak_reward_if_needed(voter_tg_id, reward_check[0], reward_check[1])
+        except Exception:
+            pass
+    rewarded, referrer_tg_id, referee_tg_id = result["referral"]
+    if rewarded:
+        for tg in (referrer_tg_id, referee_tg_id):
+            if tg:
+                invalidate_user_context(int(tg))
+    return result
 
 
 async def set_super_rating(user_id: int, photo_id: int) -> bool:
@@ -8010,22 +9698,9 @@ async def get_user_reports_since(user_id: int, since_iso: str, limit: int | None
 # Used to edit the same moderation card when new reports arrive.
 # =====================
 
-async def _ensure_moderation_messages_table(conn) -> None:
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS moderation_messages (
-            photo_id BIGINT PRIMARY KEY,
-            chat_id BIGINT NOT NULL,
-            message_id BIGINT NOT NULL,
-            updated_at TIMESTAMP DEFAULT NOW()
-        )
-        """
-    )
-
 async def get_moderation_message_for_photo(photo_id: int) -> dict | None:
     """Return mapping for a photo moderation message: {chat_id, message_id}."""
     async with pool.acquire() as conn:
-        await _ensure_moderation_messages_table(conn)
         row = await conn.fetchrow(
             "SELECT chat_id, message_id FROM moderation_messages WHERE photo_id=$1",
             int(photo_id),
@@ -8037,7 +9712,6 @@ async def get_moderation_message_for_photo(photo_id: int) -> dict | None:
 async def upsert_moderation_message_for_photo(photo_id: int, chat_id: int, message_id: int) -> None:
     """Create/update mapping for a photo moderation message."""
     async with pool.acquire() as conn:
-        await _ensure_moderation_messages_table(conn)
         await conn.execute(
             """
             INSERT INTO moderation_messages(photo_id, chat_id, message_id, updated_at)
@@ -8053,7 +9727,6 @@ async def upsert_moderation_message_for_photo(photo_id: int, chat_id: int, messa
 async def delete_moderation_message_for_photo(photo_id: int) -> None:
     """Remove mapping so next report creates a fresh card."""
     async with pool.acquire() as conn:
-        await _ensure_moderation_messages_table(conn)
         await conn.execute(
             "DELETE FROM moderation_messages WHERE photo_id=$1",
             int(photo_id),
@@ -8147,37 +9820,224 @@ async def get_photo_report_stats(photo_id: int) -> dict:
 async def set_photo_moderation_status(photo_id: int, status: str) -> None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await conn.execute("UPDATE photos SET moderation_status=$1 WHERE id=$2", str(status), int(photo_id))
+        # решение модератора снимает аренду в очереди модерации
+        await conn.execute(
+            "UPDATE photos SET moderation_status=$1, mod_claimed_by=NULL, mod_claim_until=NULL WHERE id=$2",
+            str(status),
+            int(photo_id),
+        )
+    if str(status) not in ("active", "good"):
+        invalidate_feed_candidates(int(photo_id))
 
 
-async def set_photo_file_id_support(photo_id: int, file_id_support: str) -> None:
-    if not file_id_support:
-        return
+async def set_photo_file_id_support(photo_id: int, file_id_support: str | None) -> None:
+    """Сохранить file_id бота поддержки; None сбрасывает протухший."""
     p = _assert_pool()
     async with p.acquire() as conn:
         await conn.execute(
             "UPDATE photos SET file_id_support=$1 WHERE id=$2",
-            str(file_id_support),
+            str(file_id_support) if file_id_support else None,
             int(photo_id),
         )
 
 
-async def add_moderator_review(moderator_user_id: int, photo_id: int, action: str, note: str | None = None) -> None:
+async def get_photo_file_id_support(photo_id: int) -> str | None:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO moderator_reviews (moderator_user_id, photo_id, action, note, created_at) VALUES ($1,$2,$3,$4,$5)",
-            int(moderator_user_id), int(photo_id), str(action), note, get_moscow_now_iso()
-        )
+        value = await conn.fetchval("SELECT file_id_support FROM photos WHERE id=$1", int(photo_id))
+    return str(value) if value else None
 
 
-async def get_next_photo_for_moderation() -> dict | None:
+async def get_moderation_photos_missing_support_file_id(limit: int = 20) -> list[dict]:
+    """Фото в очередях модерации, для которых у бота поддержки ещё нет своего file_id."""
     p = _assert_pool()
     async with p.acquire() as conn:
-        row = await conn.fetchrow(
+        rows = await conn.fetch(
+            """
+            SELECT id, file_id, file_id_public, file_id_support
+            FROM photos
+            WHERE is_deleted=0
+              AND moderation_status IN ('under_review','under_detailed_review')
+              AND file_id_support IS NULL
+            ORDER BY created_at ASC, id ASC
+            LIMIT $1
+            """,
+            int(limit),
+        )
+    return [dict(r) for r in rows]
+
+
+async def add_moderator_review(moderator_user_id: int, photo_id: int, action: str, note: str | None = None) -> None:
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO moderator_reviews (moderator_user_id, photo_id, action, note, created_at) VALUES ($1,$2,$3,$4,$5)",
+            int(moderator_user_id), int(photo_id), str(action), note, get_moscow_now_iso()
+        )
+
+
+_MODERATION_LEASE_SECONDS = 600
+_MODERATION_PREFETCH = 1  # сколько фото держим за модератором сверх текущего
+_MODERATION_QUEUE_STATUS = {
+    "queue": "under_review",
+    "deep": "under_detailed_review",
+    "self": "active",
+}
+
+# $1 moderator users.id, $2 lease seconds, $3 limit, $4 status (queue/deep) или pivot id (self)
+_MODERATION_CLAIM_SQL = """
+UPDATE photos p
+SET mod_claimed_by = $1,
+    mod_claim_until = NOW() + make_interval(secs => $2),
+    mod_skipped_by = NULL
+WHERE p.id IN (
+    SELECT id
+    FROM photos
+    WHERE {where}
+      AND (mod_claim_until IS NULL OR mod_claim_until < NOW())
+      {skipped}
+    ORDER BY {order}
+    LIMIT $3
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING p.*
+"""
+
+_MODERATION_QUEUE_WHERE = "is_deleted=0 AND moderation_status=$4::text"
+_MODERATION_SELF_WHERE = """is_deleted=0 AND moderation_status='active'
+      AND user_id <> $1
+      AND NOT EXISTS (
+          SELECT 1 FROM moderator_reviews mr
+          WHERE mr.moderator_user_id=$1 AND mr.photo_id=photos.id
+      )
+      AND id {cmp} $4::bigint"""
+
+
+def _moderation_sort_key(row) -> tuple:
+    return (str(row.get("created_at") or ""), int(row["id"]))
+
+
+async def _random_active_photo_pivot(conn: asyncpg.Connection) -> int | None:
+    # min/max по частичному индексу — два обращения к краям индекса, без скана
+    return await conn.fetchval(
+        """
+        SELECT lo + floor(random() * (hi - lo + 1))::bigint
+        FROM (
+            SELECT MIN(id) AS lo, MAX(id) AS hi
+            FROM photos
+            WHERE is_deleted=0 AND moderation_status='active'
+        ) b
+        WHERE lo IS NOT NULL
+        """
+    )
+
+
+async def _claim_moderation_photos(
+    conn: asyncpg.Connection,
+    moderator_user_id: int,
+    queue: str,
+    limit: int,
+    *,
+    include_skipped: bool,
+) -> list[dict]:
+    skipped = "" if include_skipped else "AND mod_skipped_by IS DISTINCT FROM $1"
+    if queue != "self":
+        sql = _MODERATION_CLAIM_SQL.format(where=_MODERATION_QUEUE_WHERE, skipped=skipped, order="created_at ASC, id ASC")
+        rows = await conn.fetch(sql, int(moderator_user_id), float(_MODERATION_LEASE_SECONDS), int(limit), _MODERATION_QUEUE_STATUS[queue])
+        return sorted((dict(r) for r in rows), key=_moderation_sort_key)
+
+    # самопроверка: случайная точка в диапазоне id и скан вперёд по индексу, с переходом на начало
+    pivot = await _random_active_photo_pivot(conn)
+    if pivot is None:
+        return []
+    out: list[dict] = []
+    for cmp in (">=", "<"):
+        if len(out) >= limit:
+            break
+        sql = _MODERATION_CLAIM_SQL.format(where=_MODERATION_SELF_WHERE.format(cmp=cmp), skipped=skipped, order="id ASC")
+        rows = await conn.fetch(sql, int(moderator_user_id), float(_MODERATION_LEASE_SECONDS), int(limit - len(out)), int(pivot))
+        out.extend(sorted((dict(r) for r in rows), key=lambda r: int(r["id"])))
+    return out
+
+
+async def claim_next_photo_for_moderation(
+    moderator_user_id: int,
+    queue: str,
+    *,
+    release_photo_id: int | None = None,
+    prefetch: int = _MODERATION_PREFETCH,
+) -> dict | None:
+    """Следующее фото для модератора из очереди queue ('queue' | 'deep' | 'self').
+
+    Фото выдаются под аренду (mod_claim_until) через FOR UPDATE SKIP LOCKED, так что
+    параллельные модераторы не получают одно и то же; просроченная аренда возвращает фото
+    в очередь. За модератором держится текущее фото + prefetch следующих, каждое обращение
+    продлевает аренду. release_photo_id — фото, пропущенное кнопкой «Следующее»: оно
+    освобождается и уходит сначала другим модераторам.
+    """
+    if queue not in _MODERATION_QUEUE_STATUS:
+        raise ValueError(f"unknown moderation queue: {queue}")
+    p = _assert_pool()
+    m = int(moderator_user_id)
+    status = _MODERATION_QUEUE_STATUS[queue]
+    want = 1 + max(0, int(prefetch))
+
+    async with p.acquire() as conn:
+        async with conn.transaction():
+            if release_photo_id:
+                await conn.execute(
+                    """
+                    UPDATE photos
+                    SET mod_claimed_by=NULL, mod_claim_until=NULL, mod_skipped_by=$1
+                    WHERE id=$2 AND mod_claimed_by=$1
+                    """,
+                    m,
+                    int(release_photo_id),
+                )
+            # аренды из других очередей (модератор переключился) отпускаем сразу
+            held = await conn.fetch(
+                """
+                WITH released AS (
+                    UPDATE photos
+                    SET mod_claimed_by=NULL, mod_claim_until=NULL
+                    WHERE mod_claimed_by=$1
+                      AND (is_deleted<>0 OR moderation_status IS DISTINCT FROM $3)
+                )
+                UPDATE photos
+                SET mod_claim_until = NOW() + make_interval(secs => $2)
+                WHERE mod_claimed_by=$1
+                  AND mod_claim_until > NOW()
+                  AND is_deleted=0
+                  AND moderation_status=$3
+                RETURNING *
+                """,
+                m,
+                float(_MODERATION_LEASE_SECONDS),
+                status,
+            )
+            items = sorted((dict(r) for r in held), key=_moderation_sort_key)
+            if len(items) < want:
+                items.extend(await _claim_moderation_photos(conn, m, queue, want - len(items), include_skipped=False))
+            if not items:
+                # кроме пропущенных самим модератором ничего нет — отдаём их
+                items = await _claim_moderation_photos(conn, m, queue, want, include_skipped=True)
+    return items[0] if items else None
+
+
+async def get_next_photo_for_moderation(
+    moderator_user_id: int | None = None,
+    *,
+    release_photo_id: int | None = None,
+) -> dict | None:
+    if moderator_user_id is not None:
+        return await claim_next_photo_for_moderation(moderator_user_id, "queue", release_photo_id=release_photo_id)
+    p = _assert_pool()
+    async with p.acquire() as conn:
+        row = await conn.fetchrow(
             """
             SELECT * FROM photos
             WHERE is_deleted=0 AND moderation_status='under_review'
+              AND (mod_claim_until IS NULL OR mod_claim_until < NOW())
             ORDER BY created_at ASC, id ASC
             LIMIT 1
             """
@@ -8185,13 +10045,20 @@ async def get_next_photo_for_moderation() -> dict | None:
     return dict(row) if row else None
 
 
-async def get_next_photo_for_detailed_moderation() -> dict | None:
+async def get_next_photo_for_detailed_moderation(
+    moderator_user_id: int | None = None,
+    *,
+    release_photo_id: int | None = None,
+) -> dict | None:
+    if moderator_user_id is not None:
+        return await claim_next_photo_for_moderation(moderator_user_id, "deep", release_photo_id=release_photo_id)
     p = _assert_pool()
     async with p.acquire() as conn:
         row = await conn.fetchrow(
             """
             SELECT * FROM photos
             WHERE is_deleted=0 AND moderation_status='under_detailed_review'
+              AND (mod_claim_until IS NULL OR mod_claim_until < NOW())
             ORDER BY created_at ASC, id ASC
             LIMIT 1
             """
@@ -8199,37 +10066,33 @@ async def get_next_photo_for_detailed_moderation() -> dict | None:
     return dict(row) if row else None
 
 
-async def get_next_photo_for_self_moderation(user_id: int | None = None) -> dict | None:
+async def get_next_photo_for_self_moderation(
+    user_id: int | None = None,
+    *,
+    release_photo_id: int | None = None,
+) -> dict | None:
+    if user_id is not None:
+        return await claim_next_photo_for_moderation(user_id, "self", release_photo_id=release_photo_id)
     p = _assert_pool()
     async with p.acquire() as conn:
-        if user_id is None:
+        pivot = await _random_active_photo_pivot(conn)
+        if pivot is None:
+            return None
+        for cmp in (">=", "<"):
             row = await conn.fetchrow(
-                """
+                f"""
                 SELECT * FROM photos
                 WHERE is_deleted=0 AND moderation_status='active'
-                ORDER BY random()
-                LIMIT 1
-                """
-            )
-        else:
-            row = await conn.fetchrow(
-                """
-                SELECT p.*
-                FROM photos p
-                WHERE p.is_deleted=0
-                  AND p.moderation_status='active'
-                  AND p.user_id <> $1
-                  AND NOT EXISTS (
-                      SELECT 1
-                      FROM moderator_reviews mr
-                      WHERE mr.moderator_user_id=$1 AND mr.photo_id=p.id
-                  )
-                ORDER BY random()
+                  AND (mod_claim_until IS NULL OR mod_claim_until < NOW())
+                  AND id {cmp} $1
+                ORDER BY id ASC
                 LIMIT 1
                 """,
-                int(user_id),
+                int(pivot),
             )
-    return dict(row) if row else None
+            if row:
+                return dict(row)
+    return None
 
 
 # ====================================================
@@ -8239,6 +10102,15 @@ async def get_next_photo_for_self_moderation(user_id: int | None = None) -> dict
 
 # -------------------- ranks --------------------
 
+_RANK_ACTIVITY_WINDOW_DAYS = 30
+_RANK_COMMENT_MIN_LEN = 15
+_RANK_RATINGS_DAILY_CAP = 40   # антиспам: сколько оценок в день засчитываем
+_RANK_COMMENTS_DAILY_CAP = 8   # антиспам: сколько комментов в день засчитываем
+_RANK_RESOLVED_REPORT_STATUSES = ('approved', 'accepted', 'resolved', 'done', 'action_taken', 'confirmed')
+_RANK_MAX_AGE_SECONDS = 6 * 60 * 60
+_RANK_BATCH = 500
+
+
 async def calc_user_rank_points(user_id: int, *, limit_photos: int = 10) -> int:
     """Calculate rank points for a user.
 
@@ -8255,6 +10127,9 @@ async def calc_user_rank_points(user_id: int, *, limit_photos: int = 10) -> int:
     We DO filter moderation_status in ('active','good') to exclude rejected/hidden content.
 
     Returns an int suitable for caching in users.rank_points.
+
+    Per-user reference implementation: ranks are written by recompute_dirty_ranks
+    (same formula, set-based); scripts/check_rank_equivalence.py compares the two.
     """
     p = _assert_pool()
     limit_photos = int(limit_photos or 10)
@@ -8274,10 +10149,10 @@ async def calc_user_rank_points(user_id: int, *, limit_photos: int = 10) -> int:
     prior = _bayes_prior_weight()
 
     # Смотрим активность за последние N дней для бонусов/штрафов
-    activity_window_days = 30
-    comment_min_len = 15
-    ratings_daily_cap = 40   # антиспам: сколько оценок в день засчитываем
-    comments_daily_cap = 8   # антиспам: сколько комментов в день засчитываем
+    activity_window_days = _RANK_ACTIVITY_WINDOW_DAYS
+    comment_min_len = _RANK_COMMENT_MIN_LEN
+    ratings_daily_cap = _RANK_RATINGS_DAILY_CAP
+    comments_daily_cap = _RANK_COMMENTS_DAILY_CAP
 
     now_dt = get_moscow_now()
     since_dt = now_dt - timedelta(days=activity_window_days)
@@ -8302,16 +10177,14 @@ async def calc_user_rank_points(user_id: int, *, limit_photos: int = 10) -> int:
             """
             SELECT
               ph.id AS photo_id,
-              COUNT(r.id)::int AS ratings_count,
-              COALESCE(SUM(r.value * CASE WHEN r.source='link' THEN $2 ELSE 1 END), 0)::float AS sum_values_weighted,
-              COALESCE(SUM(CASE WHEN r.source='link' THEN $2 ELSE 1 END), 0)::float AS ratings_weighted_count,
-              MAX(ph.created_at) AS created_at_max
+              (ph.ratings_direct_count + ph.ratings_link_count)::int AS ratings_count,
+              (ph.ratings_direct_sum + ph.ratings_link_sum * $2::float)::float AS sum_values_weighted,
+              (ph.ratings_direct_count + ph.ratings_link_count * $2::float)::float AS ratings_weighted_count,
+              ph.created_at AS created_at_max
             FROM photos ph
-            LEFT JOIN ratings r ON r.photo_id = ph.id
             WHERE ph.user_id=$1
               AND ph.moderation_status IN ('active','good')
-            GROUP BY ph.id
-            ORDER BY created_at_max DESC NULLS LAST, ph.id DESC
+            ORDER BY ph.created_at DESC NULLS LAST, ph.id DESC
             LIMIT $3
             """,
             int(user_id),
@@ -8331,9 +10204,9 @@ async def calc_user_rank_points(user_id: int, *, limit_photos: int = 10) -> int:
     try:
         async with p.acquire() as conn:
             ratings_rows = await conn.fetch(
-                "SELECT created_at FROM ratings WHERE user_id=$1 AND created_at >= $2",
+                "SELECT created_at FROM ratings WHERE user_id=$1 AND created_ts >= $2",
                 int(user_id),
-                since_iso,
+                since_dt,
             )
     except Exception:
         ratings_rows = []
@@ -8350,9 +10223,9 @@ async def calc_user_rank_points(user_id: int, *, limit_photos: int = 10) -> int:
     try:
         async with p.acquire() as conn:
             comments_rows = await conn.fetch(
-                "SELECT created_at, text FROM comments WHERE user_id=$1 AND created_at >= $2",
+                "SELECT created_at, text FROM comments WHERE user_id=$1 AND created_ts >= $2",
                 int(user_id),
-                since_iso,
+                since_dt,
             )
     except Exception:
         comments_rows = []
@@ -8407,45 +10280,220 @@ async def calc_user_rank_points(user_id: int, *, limit_photos: int = 10) -> int:
     return _points_to_int(total_points)
 
 
+# Всё, что нужно для очков ранга, одной выборкой на пачку пользователей.
+# Дневные лимиты оценок/комментов считаются в БД (день = первые 10 символов created_at,
+# как в calc_user_rank_points).
+_RANK_INPUTS_SQL = """
+WITH u AS (
+    SELECT id, tg_id FROM users WHERE id = ANY($1::bigint[])
+),
+ph AS (
+    SELECT u.id AS user_id,
+           array_agg(x.n_weighted) AS n_weighted,
+           array_agg(x.sum_weighted) AS sum_weighted
+    FROM u
+    CROSS JOIN LATERAL (
+        SELECT
+          (ph.ratings_direct_count + ph.ratings_link_count * $2::float)::float AS n_weighted,
+          (ph.ratings_direct_sum + ph.ratings_link_sum * $2::float)::float AS sum_weighted
+        FROM photos ph
+        WHERE ph.user_id = u.id
+          AND ph.moderation_status IN ('active','good')
+        ORDER BY ph.created_at DESC NULLS LAST, ph.id DESC
+        LIMIT $3
+    ) x
+    GROUP BY u.id
+),
+rt AS (
+    SELECT user_id, SUM(LEAST(cnt, $6))::int AS effective
+    FROM (
+        SELECT user_id, left(created_at::text, 10) AS day_key, COUNT(*) AS cnt
+        FROM ratings
+        WHERE user_id = ANY($1::bigint[]) AND created_ts >= $4
+        GROUP BY 1, 2
+    ) d
+    GROUP BY user_id
+),
+cm AS (
+    SELECT user_id, SUM(LEAST(cnt, $7))::int AS effective
+    FROM (
+        SELECT user_id, left(created_at::text, 10) AS day_key, COUNT(*) AS cnt
+        FROM comments
+        WHERE user_id = ANY($1::bigint[]) AND created_ts >= $4
+          AND char_length(regexp_replace(COALESCE(text, ''), '^\\s+|\\s+$', '', 'g')) >= $8
+        GROUP BY 1, 2
+    ) d
+    GROUP BY user_id
+),
+rp AS (
+    SELECT user_id, COUNT(*)::int AS resolved
+    FROM photo_reports
+    WHERE user_id = ANY($1::bigint[])
+      AND created_at >= $5
+      AND status = ANY($9::text[])
+    GROUP BY user_id
+)
+SELECT
+    u.id AS user_id,
+    ph.n_weighted,
+    ph.sum_weighted,
+    COALESCE(rt.effective, 0) AS effective_ratings,
+    COALESCE(cm.effective, 0) AS effective_comments,
+    COALESCE(rp.resolved, 0) AS resolved_reports,
+    COALESCE(us.streak, 0) AS streak_days
+FROM u
+LEFT JOIN ph ON ph.user_id = u.id
+LEFT JOIN rt ON rt.user_id = u.id
+LEFT JOIN cm ON cm.user_id = u.id
+LEFT JOIN rp ON rp.user_id = u.id
+LEFT JOIN user_streak us ON us.tg_id = u.tg_id
+"""
+
+
+async def _calc_rank_points_bulk(
+    conn: asyncpg.Connection,
+    user_ids: list[int],
+    *,
+    limit_photos: int = 10,
+) -> dict[int, int]:
+    """rank_points для пачки пользователей: один запрос + чистая математика utils.ranks."""
+    from utils.ranks import (
+        photo_points as _photo_points,
+        points_to_int as _points_to_int,
+        ratings_activity_points as _ratings_bonus,
+        comments_activity_points as _comments_bonus,
+        reports_penalty as _reports_penalty,
+        streak_bonus_points as _streak_bonus,
+    )
+
+    if not user_ids:
+        return {}
+    prior = _bayes_prior_weight()
+    global_mean, _global_cnt = await _get_global_rating_mean(conn)
+    since_dt = get_moscow_now() - timedelta(days=_RANK_ACTIVITY_WINDOW_DAYS)
+
+    rows = await conn.fetch(
+        _RANK_INPUTS_SQL,
+        [int(x) for x in user_ids],
+        float(_link_rating_weight()),
+        int(limit_photos or 10),
+        since_dt,
+        since_dt.isoformat(),
+        int(_RANK_RATINGS_DAILY_CAP),
+        int(_RANK_COMMENTS_DAILY_CAP),
+        int(_RANK_COMMENT_MIN_LEN),
+        list(_RANK_RESOLVED_REPORT_STATUSES),
+    )
+
+    out: dict[int, int] = {}
+    for r in rows:
+        total = 0.0
+        for n_weighted, s in zip(r["n_weighted"] or [], r["sum_weighted"] or []):
+            n_weighted = float(n_weighted or 0.0)
+            bayes = _bayes_score(sum_values=float(s or 0.0), n=n_weighted, global_mean=global_mean, prior=prior)
+            total += _photo_points(bayes_score=bayes, ratings_count=int(round(n_weighted)))
+        total += _ratings_bonus(int(r["effective_ratings"]))
+        total += _comments_bonus(int(r["effective_comments"]))
+        total += _streak_bonus(int(r["streak_days"] or 0))
+        total -= _reports_penalty(int(r["resolved_reports"]))
+        out[int(r["user_id"])] = _points_to_int(total)
+    return out
+
+
+async def _store_rank_points(conn: asyncpg.Connection, points: dict[int, int], claimed_at: str | None) -> int:
+    """Записать очки пачкой. claimed_at задан — только тем, кого не инвалидировали после захвата."""
+    from utils.ranks import rank_from_points
+
+    if not points:
+        return 0
+    ids = list(points.keys())
+    now_iso = get_moscow_now_iso()
+    res = await conn.execute(
+        """
+        UPDATE users u
+        SET rank_points = x.points,
+            rank_code = x.code,
+            rank_updated_at = $4
+        FROM unnest($1::bigint[], $2::int[], $3::text[]) AS x(id, points, code)
+        WHERE u.id = x.id
+          AND ($5::text IS NULL OR u.rank_updated_at = $5::text)
+        """,
+        ids,
+        [int(points[i]) for i in ids],
+        [str(rank_from_points(points[i]).code) for i in ids],
+        now_iso,
+        claimed_at,
+    )
+    try:
+        return int(res.split()[-1])
+    except Exception:
+        return 0
+
+
+async def recompute_dirty_ranks(*, batch: int = _RANK_BATCH, max_batches: int = 20) -> int:
+    """Фоновый пересчёт рангов: сначала инвалидированные (rank_updated_at IS NULL), потом устаревшие.
+
+    Захват ставит rank_updated_at = время захвата; итог пишется только если метка не изменилась,
+    так что инвалидация во время пересчёта (add_rating -> NULL) не теряется. Несколько
+    процессов делят работу через SKIP LOCKED. Возвращает число записанных пользователей.
+    """
+    p = _assert_pool()
+    written = 0
+    for _ in range(max(1, int(max_batches))):
+        claimed_at = get_moscow_now_iso()
+        stale_before = (get_moscow_now() - timedelta(seconds=_RANK_MAX_AGE_SECONDS)).isoformat()
+        async with p.acquire() as conn:
+            ids = await conn.fetch(
+                """
+                UPDATE users u
+                SET rank_updated_at = $1
+                WHERE u.id IN (
+                    SELECT id
+                    FROM users
+                    WHERE is_deleted=0
+                      AND (rank_updated_at IS NULL OR rank_updated_at < $2)
+                    ORDER BY rank_updated_at ASC NULLS FIRST, id ASC
+                    LIMIT $3
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING u.id
+                """,
+                claimed_at,
+                stale_before,
+                int(batch),
+            )
+            if not ids:
+                break
+            points = await _calc_rank_points_bulk(conn, [int(r["id"]) for r in ids])
+            written += await _store_rank_points(conn, points, claimed_at)
+        if len(ids) < int(batch):
+            break
+    return written
+
+
 async def refresh_user_rank_cache(user_id: int, *, limit_photos: int = 10) -> dict:
     """Recalculate and store user's rank cache in DB."""
     p = _assert_pool()
     from utils.ranks import rank_from_points, format_rank
 
-    points = await calc_user_rank_points(int(user_id), limit_photos=limit_photos)
-    rank = rank_from_points(points)
-    now_iso = get_moscow_now_iso()
-
     async with p.acquire() as conn:
-        await conn.execute(
-            """
-            UPDATE users
-            SET rank_points=$1,
-                rank_code=$2,
-                rank_updated_at=$3,
-                updated_at=$3
-            WHERE id=$4
-            """,
-            int(points),
-            str(rank.code),
-            now_iso,
-            int(user_id),
-        )
+        points = (await _calc_rank_points_bulk(conn, [int(user_id)], limit_photos=limit_photos)).get(int(user_id), 0)
+        await _store_rank_points(conn, {int(user_id): int(points)}, None)
 
-    return {"rank_points": int(points), "rank_code": str(rank.code), "rank_label": format_rank(points)}
+    return {"rank_points": int(points), "rank_code": str(rank_from_points(points).code), "rank_label": format_rank(points)}
 
 
-async def get_user_rank_cached(user_id: int, *, max_age_seconds: int = 6 * 60 * 60) -> dict:
-    """Return user's cached rank; refresh if stale."""
-    p = _assert_pool()
-    max_age_seconds = int(max_age_seconds or 0)
-    if max_age_seconds <= 0:
-        max_age_seconds = 6 * 60 * 60
+async def get_user_rank_cached(user_id: int, *, max_age_seconds: int = _RANK_MAX_AGE_SECONDS) -> dict:
+    """Return user's cached rank.
 
+    Never computes inline: stale/invalidated ranks are refreshed by recompute_dirty_ranks
+    (max_age_seconds is kept for callers; freshness is the engine's job).
+    """
+    p = _assert_pool()
     async with p.acquire() as conn:
         row = await conn.fetchrow(
             """
-            SELECT rank_points, rank_code, rank_updated_at
+            SELECT rank_points, rank_code
             FROM users
             WHERE id=$1 AND is_deleted=0
             """,
@@ -8455,25 +10503,12 @@ async def get_user_rank_cached(user_id: int, *, max_age_seconds: int = 6 * 60 *
     if not row:
         return {"rank_points": 0, "rank_code": None, "rank_label": "🟢 Начинающий"}
 
-    points = int(row["rank_points"] or 0)
-    updated_at = row["rank_updated_at"]
-
-    stale = True
-    if updated_at:
-        try:
-            dt = datetime.fromisoformat(str(updated_at))
-            stale = (get_moscow_now() - dt).total_seconds() > max_age_seconds
-        except Exception:
-            stale = True
-
-    if stale:
-        return await refresh_user_rank_cache(int(user_id))
-
     from utils.ranks import format_rank
+    points = int(row["rank_points"] or 0)
     return {"rank_points": points, "rank_code": row["rank_code"], "rank_label": format_rank(points)}
 
 
-async def get_user_rank_by_tg_id(tg_id: int, *, max_age_seconds: int = 6 * 60 * 60) -> dict:
+async def get_user_rank_by_tg_id(tg_id: int, *, max_age_seconds: int = _RANK_MAX_AGE_SECONDS) -> dict:
     u = await get_user_by_tg_id(int(tg_id))
     if not u:
         return {"rank_points": 0, "rank_code": None, "rank_label": "🟢 Начинающий"}
@@ -8578,87 +10613,172 @@ async def get_user_rating_summary(user_id: int) -> dict:
     }
 
 
+# -------------------- profile stats --------------------
+# user_profile_stats держат триггеры (migrations/2026-10-16_user_profile_stats.sql):
+# загрузка/удаление фото, оценки, голоса, итоги партий. Сверка с сырыми таблицами —
+# reconcile_user_profile_stats (бэкфилл после деплоя и ночная джоба). Просмотры сюда не
+# пишутся (каждый показ в ленте лочил бы строку автора) — их суммируем при чтении.
+
+_PROFILE_STATS_BATCH = 500
+
+# Полный пересчёт строк для пачки users.id ($1). Легаси-фото с tg_id в photos.user_id учитываются.
+_PROFILE_STATS_RECONCILE_SQL = """
+INSERT INTO user_profile_stats AS s (
+    user_id, photos_uploaded, active_votes_total,
+    rating_sum_all, rating_votes_all, votes_given,
+    best_rank, rank_sum, rank_count, top10_count,
+    positive_votes_received, votes_received, reconciled_at, updated_at
+)
+SELECT
+    u.id,
+    ph.photos_uploaded, ph.active_votes_total,
+    ph.rating_sum_all, ph.rating_votes_all, vg.votes_given,
+    rk.best_rank, rk.rank_sum, rk.rank_count, rk.top10_count,
+    pv.positive_votes, pv.total_votes, NOW(), NOW()
+FROM users u
+CROSS JOIN LATERAL (
+    SELECT
+        COUNT(*)::int AS photos_uploaded,
+        COALESCE(SUM(votes_count) FILTER (WHERE COALESCE(is_deleted,0)=0), 0)::bigint AS active_votes_total,
+        COALESCE(SUM(sum_score), 0)::float AS rating_sum_all,
+        COALESCE(SUM(votes_count), 0)::float AS rating_votes_all
+    FROM photos
+    WHERE user_id IN (u.id, u.tg_id)
+) ph
+CROSS JOIN LATERAL (
+    SELECT COUNT(*)::int AS votes_given FROM votes WHERE voter_id = u.id
+) vg
+CROSS JOIN LATERAL (
+    SELECT
+        MIN(rr.final_rank)::int AS best_rank,
+        COALESCE(SUM(rr.final_rank), 0)::bigint AS rank_sum,
+        COUNT(*)::int AS rank_count,
+        COUNT(*) FILTER (WHERE rr.final_rank <= 10)::int AS top10_count
+    FROM result_ranks rr
+    JOIN photos p ON p.id = rr.photo_id
+    WHERE p.user_id IN (u.id, u.tg_id)
+      AND COALESCE(p.is_deleted,0)=0
+) rk
+CROSS JOIN LATERAL (
+    SELECT
+        COUNT(*) FILTER (WHERE v.score BETWEEN 6 AND 10)::bigint AS positive_votes,
+        COUNT(*)::bigint AS total_votes
+    FROM photos p
+    JOIN votes v ON v.photo_id = p.id
+    WHERE p.user_id IN (u.id, u.tg_id)
+      AND COALESCE(p.is_deleted,0)=0
+) pv
+WHERE u.id = ANY($1::bigint[])
+ON CONFLICT (user_id) DO UPDATE SET
+    photos_uploaded = EXCLUDED.photos_uploaded,
+    active_votes_total = EXCLUDED.active_votes_total,
+    rating_sum_all = EXCLUDED.rating_sum_all,
+    rating_votes_all = EXCLUDED.rating_votes_all,
+    votes_given = EXCLUDED.votes_given,
+    best_rank = EXCLUDED.best_rank,
+    rank_sum = EXCLUDED.rank_sum,
+    rank_count = EXCLUDED.rank_count,
+    top10_count = EXCLUDED.top10_count,
+    positive_votes_received = EXCLUDED.positive_votes_received,
+    votes_received = EXCLUDED.votes_received,
+    reconciled_at = EXCLUDED.reconciled_at,
+    updated_at = EXCLUDED.updated_at
+"""
+
+
+async def _reconcile_profile_stats_batch(conn: asyncpg.Connection, user_ids: list[int]) -> None:
+    # строки пачки лочим до пересчёта: триггеры конкурентных оценок/голосов дождутся
+    # и применят свои дельты поверх, а не потеряются
+    async with conn.transaction():
+        await conn.execute(
+            "SELECT 1 FROM user_profile_stats WHERE user_id = ANY($1::bigint[]) ORDER BY user_id FOR UPDATE",
+            user_ids,
+        )
+        await conn.execute(_PROFILE_STATS_RECONCILE_SQL, user_ids)
+
+
+async def reconcile_user_profile_stats(*, only_missing: bool = False, batch_size: int = _PROFILE_STATS_BATCH) -> int:
+    """Пересобрать user_profile_stats из photos/votes/result_ranks пачками по users.id.
+
+    only_missing=True — только пользователи без строки (бэкфилл после деплоя).
+    Возвращает число пересчитанных пользователей.
+    """
+    p = _assert_pool()
+    batch_size = max(1, int(batch_size))
+    done = 0
+    last_id = 0
+    missing_sql = "AND NOT EXISTS (SELECT 1 FROM user_profile_stats s WHERE s.user_id = u.id)" if only_missing else ""
+    async with p.acquire() as conn:
+        while True:
+            rows = await conn.fetch(
+                f"""
+                SELECT u.id
+                FROM users u
+                WHERE u.id > $1
+                  {missing_sql}
+                ORDER BY u.id
+                LIMIT $2
+                """,
+                int(last_id),
+                batch_size,
+            )
+            if not rows:
+                break
+            user_ids = [int(r["id"]) for r in rows]
+            await _reconcile_profile_stats_batch(conn, user_ids)
+            done += len(user_ids)
+            last_id = user_ids[-1]
+            if len(user_ids) < batch_size:
+                break
+    return done
+
+
 async def get_user_stats_overview(
     user_id: int,
     *,
     include_premium_metrics: bool = False,
     include_author_metrics: bool = False,
 ) -> dict:
-    """Compact profile stats overview for the "Моя статистика" screen."""
+    """Compact profile stats overview for the "Моя статистика" screen.
+
+    Reads one user_profile_stats row plus the author's live views_count sum (idx_photos_user_id);
+    only the premium 7-day voting metrics hit votes (idx_votes_voter_created, bounded to a week).
+    """
     p = _assert_pool()
     uid = int(user_id)
-    since_7d = get_bot_now() - timedelta(days=7)
 
     async with p.acquire() as conn:
-        stats_row = await _ensure_user_stats_row(conn, uid)
-        credits = int((stats_row or {}).get("credits") or 0)
-        u = await conn.fetchrow(
-            """
-            SELECT id, tg_id
-            FROM users
-            WHERE id=$1 OR tg_id=$1
+        query = """
+            SELECT u.id AS db_user_id, s.*, COALESCE(us.credits, 0)::int AS credits,
+                   (
+                       SELECT COALESCE(SUM(p.views_count), 0)::bigint
+                       FROM photos p
+                       WHERE p.user_id IN (u.id, u.tg_id) AND COALESCE(p.is_deleted,0)=0
+                   ) AS active_views_total
+            FROM users u
+            LEFT JOIN user_profile_stats s ON s.user_id = u.id
+            LEFT JOIN user_stats us ON us.user_id = u.id
+            WHERE u.id=$1 OR u.tg_id=$1
+            ORDER BY (u.id=$1) DESC
             LIMIT 1
-            """,
-            uid,
-        )
-        candidate_user_ids: list[int] = [uid]
-        if u:
-            try:
-                db_uid = int(u.get("id"))
-                if db_uid not in candidate_user_ids:
-                    candidate_user_ids.append(db_uid)
-            except Exception:
-                pass
-            try:
-                db_tg = int(u.get("tg_id"))
-                if db_tg not in candidate_user_ids:
-                    candidate_user_ids.append(db_tg)
-            except Exception:
-                pass
+        """
+        row = await conn.fetchrow(query, uid)
+        if row is not None and row["user_id"] is None:
+            # строки ещё нет (новый пользователь до бэкфилла) — собираем разово
+            await _reconcile_profile_stats_batch(conn, [int(row["db_user_id"])])
+            row = await conn.fetchrow(query, uid)
+        db_uid = int(row["db_user_id"]) if row else uid
+        stats = dict(row) if row else {}
 
-        photos_row = await conn.fetchrow(
-            """
-            SELECT
-                COUNT(*)::int AS photos_uploaded,
-                COALESCE(SUM(votes_count) FILTER (WHERE COALESCE(is_deleted,0)=0), 0)::int AS my_votes_total,
-                COALESCE(SUM(views_count) FILTER (WHERE COALESCE(is_deleted,0)=0), 0)::int AS my_views_total,
-                COALESCE(SUM(sum_score), 0)::float AS rating_sum_all,
-                COALESCE(SUM(votes_count), 0)::float AS rating_votes_all
-            FROM photos
-            WHERE user_id = ANY($1::bigint[])
-            """,
-            candidate_user_ids,
-        )
         global_mean, _ = await _get_global_rating_mean(conn)
         prior = _bayes_prior_weight()
-        rating_sum_all = float((photos_row or {}).get("rating_sum_all") or 0.0)
-        rating_votes_all = float((photos_row or {}).get("rating_votes_all") or 0.0)
         my_bayes_score = _bayes_score(
-            sum_values=rating_sum_all,
-            n=rating_votes_all,
+            sum_values=float(stats.get("rating_sum_all") or 0.0),
+            n=float(stats.get("rating_votes_all") or 0.0),
             global_mean=global_mean,
             prior=prior,
         )
 
-        votes_given = await conn.fetchval(
-            "SELECT COUNT(*)::int FROM votes WHERE voter_id=$1",
-            uid,
-        )
-
-        ranks_row = await conn.fetchrow(
-            """
-            SELECT
-                MIN(rr.final_rank)::int AS best_rank,
-                AVG(rr.final_rank)::float AS avg_rank,
-                COUNT(*) FILTER (WHERE rr.final_rank <= 10)::int AS top10_count
-            FROM result_ranks rr
-            JOIN photos p ON p.id = rr.photo_id
-            WHERE p.user_id = ANY($1::bigint[])
-              AND COALESCE(p.is_deleted,0)=0
-            """,
-            candidate_user_ids,
-        )
-
         votes_7d = 0
         active_days_7d = 0
         if include_premium_metrics:
@@ -8671,43 +10791,31 @@ async def get_user_stats_overview(
                 WHERE voter_id=$1
                   AND created_at >= $2
                 """,
-                uid,
-                since_7d,
+                db_uid,
+                get_bot_now() - timedelta(days=7),
             )
             votes_7d = int((v7_row or {}).get("votes_7d") or 0)
             active_days_7d = int((v7_row or {}).get("active_days_7d") or 0)
 
-        positive_percent = None
-        if include_author_metrics:
-            pos_row = await conn.fetchrow(
-                """
-                SELECT
-                    COALESCE(SUM(CASE WHEN v.score BETWEEN 6 AND 10 THEN 1 ELSE 0 END), 0)::int AS positive_votes,
-                    COUNT(v.*)::int AS total_votes
-                FROM photos p
-                LEFT JOIN votes v ON v.photo_id = p.id
-                WHERE p.user_id = ANY($1::bigint[])
-                  AND COALESCE(p.is_deleted,0)=0
-                """,
-                candidate_user_ids,
-            )
-            pos_votes = int((pos_row or {}).get("positive_votes") or 0)
-            total_votes = int((pos_row or {}).get("total_votes") or 0)
-            if total_votes > 0:
-                positive_percent = int(round((pos_votes / total_votes) * 100))
+    positive_percent = None
+    if include_author_metrics:
+        total_votes = int(stats.get("votes_received") or 0)
+        if total_votes > 0:
+            positive_percent = int(round((int(stats.get("positive_votes_received") or 0) / total_votes) * 100))
 
+    rank_count = int(stats.get("rank_count") or 0)
     return {
-        "votes_given": int(votes_given or 0),
-        "photos_uploaded": int((photos_row or {}).get("photos_uploaded") or 0),
+        "votes_given": int(stats.get("votes_given") or 0),
+        "photos_uploaded": int(stats.get("photos_uploaded") or 0),
         "my_avg_score": float(my_bayes_score) if my_bayes_score is not None else None,
-        "best_rank": int((ranks_row or {}).get("best_rank") or 0) or None,
-        "my_votes_total": int((photos_row or {}).get("my_votes_total") or 0),
-        "my_views_total": int((photos_row or {}).get("my_views_total") or 0),
-        "credits": int(credits),
+        "best_rank": int(stats.get("best_rank") or 0) or None,
+        "my_votes_total": int(stats.get("active_votes_total") or 0),
+        "my_views_total": int(stats.get("active_views_total") or 0),
+        "credits": int(stats.get("credits") or 0),
         "votes_7d": int(votes_7d),
         "active_days_7d": int(active_days_7d),
-        "avg_rank": float((ranks_row or {}).get("avg_rank")) if (ranks_row and ranks_row.get("avg_rank") is not None) else None,
-        "top10_count": int((ranks_row or {}).get("top10_count") or 0),
+        "avg_rank": (int(stats.get("rank_sum") or 0) / rank_count) if rank_count > 0 else None,
+        "top10_count": int(stats.get("top10_count") or 0),
         "positive_percent": positive_percent,
     }
 
@@ -9030,6 +11138,7 @@ async def get_all_users_tg_ids() -> list[int]:
             WHERE is_deleted=0
               AND COALESCE(NULLIF(trim(name), ''), NULL) IS NOT NULL
               AND COALESCE(is_blocked, 0)=0
+              AND bot_blocked_at IS NULL
             """
         )
     return [int(r["tg_id"]) for r in rows]
@@ -9154,36 +11263,268 @@ async def get_users_sample(
 
 
 # --- activity / online ---
+# activity_events пишем не по INSERT'у на событие, а через write-behind буфер:
+# события копятся в памяти и раз в несколько секунд уходят одним INSERT ... unnest.
+
+_ACTIVITY_COOLDOWN_SECONDS = 60.0       # не чаще 1 события в минуту на юзера
+_ACTIVITY_COOLDOWN_MAX_ENTRIES = 50000
+_ACTIVITY_UID_CACHE_MAX_ENTRIES = 50000
+_ACTIVITY_BUFFER_MAX = 20000            # сверх этого — выкидываем самые старые
+_ACTIVITY_FLUSH_INTERVAL_SECONDS = 3.0
+_ACTIVITY_FLUSH_BATCH = 1000            # при такой глубине флашим, не дожидаясь интервала
+
+# (tg_id, user_id | None, username | None, kind, created_at)
+_ACTIVITY_BUFFER: deque[tuple[int, int | None, str | None, str, datetime]] = deque()
+_ACTIVITY_LAST: dict[int, float] = {}
+_ACTIVITY_UID_CACHE: dict[int, int] = {}
+_ACTIVITY_WAKE: asyncio.Event | None = None
+_ACTIVITY_WRITER_TASK: asyncio.Task | None = None
+_ACTIVITY_STATS: dict[str, float] = {
+    "enqueued": 0,
+    "flushed": 0,
+    "dropped": 0,
+    "flush_count": 0,
+    "flush_errors": 0,
+    "max_depth": 0,
+    "last_flush_ms": 0.0,
+    "max_flush_ms": 0.0,
+    "total_flush_ms": 0.0,
+}
 
-async def log_activity_event(
+
+def _bounded_put(d: dict, key, value, max_entries: int) -> None:
+    """dict с порядком вставки как LRU: при переполнении выкидываем старейшие 10%."""
+    d.pop(key, None)
+    d[key] = value
+    if len(d) > max_entries:
+        for k in list(d.keys())[: max(1, max_entries // 10)]:
+            d.pop(k, None)
+
+
+def _activity_cooldown_hit(tg_id: int, now_ts: float) -> bool:
+    last = _ACTIVITY_LAST.get(tg_id)
+    if last is not None and now_ts - last < _ACTIVITY_COOLDOWN_SECONDS:
+        return True
+    _bounded_put(_ACTIVITY_LAST, tg_id, now_ts, _ACTIVITY_COOLDOWN_MAX_ENTRIES)
+    return False
+
+
+def enqueue_activity_event(
     tg_id: int,
     *,
     kind: str = "any",
     username: str | None = None,
-) -> None:
-    """Log a lightweight activity event for online/activity charts."""
-    try:
-        user = await ensure_user_minimal_row(int(tg_id), username=username)
-    except Exception:
-        user = None
-    if not user or not user.get("id"):
-        return
-    p = _assert_pool()
-    async with p.acquire() as conn:
-        await conn.execute(
-            """
-            INSERT INTO activity_events (user_id, kind, created_at)
-            VALUES ($1, $2, NOW())
-            """,
-            int(user["id"]),
-            str(kind or "any"),
+    user_id: int | None = None,
+    respect_cooldown: bool = True,
+) -> bool:
+    """Положить событие активности в буфер (без IO). True — если событие принято.
+
+    `user_id` — если вызывающий уже знает users.id (из user_ctx), резолв по tg_id не нужен.
+    """
+    key = int(tg_id)
+    if respect_cooldown and _activity_cooldown_hit(key, time.monotonic()):
+        return False
+    if user_id:
+        _bounded_put(_ACTIVITY_UID_CACHE, key, int(user_id), _ACTIVITY_UID_CACHE_MAX_ENTRIES)
+    if len(_ACTIVITY_BUFFER) >= _ACTIVITY_BUFFER_MAX:
+        _ACTIVITY_BUFFER.popleft()
+        _ACTIVITY_STATS["dropped"] += 1
+    _ACTIVITY_BUFFER.append(
+        (key, int(user_id) if user_id else None, username, str(kind or "any"), datetime.now(timezone.utc))
+    )
+    _ACTIVITY_STATS["enqueued"] += 1
+    depth = len(_ACTIVITY_BUFFER)
+    if depth > _ACTIVITY_STATS["max_depth"]:
+        _ACTIVITY_STATS["max_depth"] = depth
+    _ensure_activity_writer()
+    if depth >= _ACTIVITY_FLUSH_BATCH and _ACTIVITY_WAKE is not None:
+        _ACTIVITY_WAKE.set()
+    return True
+
+
+async def log_activity_event(
+    tg_id: int,
+    *,
+    kind: str = "any",
+    username: str | None = None,
+    user_id: int | None = None,
+) -> None:
+    """Log a lightweight activity event for online/activity charts (buffered, no cooldown)."""
+    enqueue_activity_event(
+        int(tg_id),
+        kind=kind,
+        username=username,
+        user_id=user_id,
+        respect_cooldown=False,
+    )
+
+
+def get_activity_writer_stats() -> dict:
+    """Счётчики буфера activity_events: глубина, сброшено/потеряно, латентность флаша."""
+    stats = dict(_ACTIVITY_STATS)
+    flushes = int(stats["flush_count"])
+    stats["depth"] = len(_ACTIVITY_BUFFER)
+    stats["avg_flush_ms"] = (stats["total_flush_ms"] / flushes) if flushes else 0.0
+    stats["cooldown_entries"] = len(_ACTIVITY_LAST)
+    stats["uid_cache_entries"] = len(_ACTIVITY_UID_CACHE)
+    return stats
+
+
+async def _resolve_activity_user_ids(
+    conn: asyncpg.Connection,
+    batch: list[tuple[int, int | None, str | None, str, datetime]],
+) -> dict[int, int]:
+    """tg_id -> users.id для пачки; недостающих юзеров создаём минимальной строкой."""
+    resolved: dict[int, int] = {}
+    usernames: dict[int, str] = {}
+    for tg_id, user_id, username, _, _ in batch:
+        if user_id:
+            resolved[tg_id] = user_id
+        elif tg_id in _ACTIVITY_UID_CACHE and not username:
+            resolved[tg_id] = _ACTIVITY_UID_CACHE[tg_id]
+        if username and not user_id:
+            usernames[tg_id] = username
+
+    missing = [tg for tg, _, _, _, _ in batch if tg not in resolved]
+    if usernames:
+        # как раньше в ensure_user_minimal_row: подтягиваем свежий username
+        tg_list = list(usernames.keys())
+        await conn.execute(
+            """
+            UPDATE users u
+            SET username = x.username, updated_at = $3
+            FROM unnest($1::bigint[], $2::text[]) AS x(tg_id, username)
+            WHERE u.tg_id = x.tg_id AND u.username IS DISTINCT FROM x.username
+            """,
+            tg_list,
+            [usernames[tg] for tg in tg_list],
+            get_moscow_now_iso(),
         )
+        for tg in tg_list:
+            invalidate_user_context(tg)
+
+    if missing:
+        missing = list(dict.fromkeys(missing))
+        await conn.execute(
+            """
+            INSERT INTO users (tg_id, username, created_at)
+            SELECT x.tg_id, x.username, $3
+            FROM unnest($1::bigint[], $2::text[]) AS x(tg_id, username)
+            ON CONFLICT (tg_id) DO NOTHING
+            """,
+            missing,
+            [usernames.get(tg) for tg in missing],
+            get_moscow_now_iso(),
+        )
+        rows = await conn.fetch(
+            "SELECT id, tg_id FROM users WHERE tg_id = ANY($1::bigint[])",
+            missing,
+        )
+        for r in rows:
+            resolved[int(r["tg_id"])] = int(r["id"])
+
+    for tg_id, uid in resolved.items():
+        _bounded_put(_ACTIVITY_UID_CACHE, tg_id, uid, _ACTIVITY_UID_CACHE_MAX_ENTRIES)
+    return resolved
+
+
+async def flush_activity_events() -> int:
+    """Сбросить накопленные события одним INSERT. Возвращает число записанных строк."""
+    if not _ACTIVITY_BUFFER or pool is None:
+        return 0
+    batch = list(_ACTIVITY_BUFFER)
+    _ACTIVITY_BUFFER.clear()
+    started = time.perf_counter()
+    try:
+        p = _assert_pool()
+        async with p.acquire() as conn:
+            async with conn.transaction():
+                uids = await _resolve_activity_user_ids(conn, batch)
+                rows = [(uids[tg], kind, ts) for tg, _, _, kind, ts in batch if tg in uids]
+                if rows:
+                    # created_at — TEXT (ts::text, тот же формат, что и прежний NOW()), created_ts — как есть
+                    await conn.execute(
+                        """
+                        INSERT INTO activity_events (user_id, kind, created_at, created_ts)
+                        SELECT x.user_id, x.kind, x.ts::text, x.ts
+                        FROM unnest($1::bigint[], $2::text[], $3::timestamptz[]) AS x(user_id, kind, ts)
+                        """,
+                        [r[0] for r in rows],
+                        [r[1] for r in rows],
+                        [r[2] for r in rows],
+                    )
+    except BaseException:
+        # BaseException: отмена посреди флаша (остановка бота) тоже не должна терять пачку —
+        # _stop_activity_writer допишет её последним флашем
+        _ACTIVITY_STATS["flush_errors"] += 1
+        # возвращаем пачку в начало очереди (в пределах лимита), чтобы не потерять на сбое
+        room = max(0, _ACTIVITY_BUFFER_MAX - len(_ACTIVITY_BUFFER))
+        keep = batch[-room:] if room else []
+        _ACTIVITY_STATS["dropped"] += len(batch) - len(keep)
+        _ACTIVITY_BUFFER.extendleft(reversed(keep))
+        raise
+
+    elapsed_ms = (time.perf_counter() - started) * 1000.0
+    _ACTIVITY_STATS["flush_count"] += 1
+    _ACTIVITY_STATS["flushed"] += len(rows)
+    _ACTIVITY_STATS["last_flush_ms"] = elapsed_ms
+    _ACTIVITY_STATS["total_flush_ms"] += elapsed_ms
+    if elapsed_ms > _ACTIVITY_STATS["max_flush_ms"]:
+        _ACTIVITY_STATS["max_flush_ms"] = elapsed_ms
+    return len(rows)
+
+
+async def _activity_writer_loop() -> None:
+    global _ACTIVITY_WAKE
+    _ACTIVITY_WAKE = asyncio.Event()
+    while True:
+        try:
+            await asyncio.wait_for(_ACTIVITY_WAKE.wait(), timeout=_ACTIVITY_FLUSH_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _ACTIVITY_WAKE.clear()
+        try:
+            await flush_activity_events()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await asyncio.sleep(_ACTIVITY_FLUSH_INTERVAL_SECONDS)
+
+
+def _ensure_activity_writer() -> None:
+    global _ACTIVITY_WRITER_TASK
+    if _ACTIVITY_WRITER_TASK is not None and not _ACTIVITY_WRITER_TASK.done():
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    _ACTIVITY_WRITER_TASK = loop.create_task(_activity_writer_loop())
+
+
+async def _stop_activity_writer() -> None:
+    """Останавливает фоновый флашер и дописывает остаток буфера (вызывается из close_db)."""
+    global _ACTIVITY_WRITER_TASK, _ACTIVITY_WAKE
+    task = _ACTIVITY_WRITER_TASK
+    _ACTIVITY_WRITER_TASK = None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+    _ACTIVITY_WAKE = None
+    try:
+        await flush_activity_events()
+    except Exception:
+        pass
 
 
 async def get_active_users_last_24h(limit: int = 20, offset: int = 0) -> tuple[int, list[dict]]:
     """(total, sample) of users with any activity in last 24h."""
     p = _assert_pool()
-    since_iso = (get_moscow_now() - timedelta(hours=24)).isoformat()
+    since_dt = get_moscow_now() - timedelta(hours=24)
+    since_iso = since_dt.isoformat()
     async with p.acquire() as conn:
         total = await conn.fetchval(
             """
@@ -9192,7 +11533,7 @@ async def get_active_users_last_24h(limit: int = 20, offset: int = 0) -> tuple[i
               FROM users u
               LEFT JOIN LATERAL (
                 SELECT 1 FROM activity_events ae
-                WHERE ae.user_id = u.id AND ae.created_at >= $1
+                WHERE ae.user_id = u.id AND ae.created_ts >= $2
                 LIMIT 1
               ) ae ON TRUE
               WHERE u.is_deleted=0
@@ -9205,6 +11546,7 @@ async def get_active_users_last_24h(limit: int = 20, offset: int = 0) -> tuple[i
             ) t
             """,
             since_iso,
+            since_dt,
         )
         rows = await conn.fetch(
             """
@@ -9212,7 +11554,7 @@ async def get_active_users_last_24h(limit: int = 20, offset: int = 0) -> tuple[i
             FROM users u
             LEFT JOIN LATERAL (
               SELECT 1 FROM activity_events ae
-              WHERE ae.user_id = u.id AND ae.created_at >= $1
+              WHERE ae.user_id = u.id AND ae.created_ts >= $4
               LIMIT 1
             ) ae ON TRUE
             WHERE u.is_deleted=0
@@ -9228,13 +11570,15 @@ async def get_active_users_last_24h(limit: int = 20, offset: int = 0) -> tuple[i
             since_iso,
             int(offset or 0),
             int(limit),
+            since_dt,
         )
     return int(total or 0), [dict(r) for r in rows]
 
 async def get_active_users_today(limit: int = 20, offset: int = 0) -> tuple[int, list[dict]]:
     """(total, sample) of users with any activity since start of Moscow day."""
     p = _assert_pool()
-    since_iso = get_moscow_now().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+    since_dt = get_moscow_now().replace(hour=0, minute=0, second=0, microsecond=0)
+    since_iso = since_dt.isoformat()
     async with p.acquire() as conn:
         total = await conn.fetchval(
             """
@@ -9243,7 +11587,7 @@ async def get_active_users_today(limit: int = 20, offset: int = 0) -> tuple[int,
               FROM users u
               LEFT JOIN LATERAL (
                 SELECT 1 FROM activity_events ae
-                WHERE ae.user_id = u.id AND ae.created_at >= $1
+                WHERE ae.user_id = u.id AND ae.created_ts >= $2
                 LIMIT 1
               ) ae ON TRUE
               WHERE u.is_deleted=0
@@ -9256,6 +11600,7 @@ async def get_active_users_today(limit: int = 20, offset: int = 0) -> tuple[int,
             ) t
             """,
             since_iso,
+            since_dt,
         )
         rows = await conn.fetch(
             """
@@ -9263,7 +11608,7 @@ async def get_active_users_today(limit: int = 20, offset: int = 0) -> tuple[int,
             FROM users u
             LEFT JOIN LATERAL (
               SELECT 1 FROM activity_events ae
-              WHERE ae.user_id = u.id AND ae.created_at >= $1
+              WHERE ae.user_id = u.id AND ae.created_ts >= $4
               LIMIT 1
             ) ae ON TRUE
             WHERE u.is_deleted=0
@@ -9279,6 +11624,7 @@ async def get_active_users_today(limit: int = 20, offset: int = 0) -> tuple[int,
             since_iso,
             int(offset or 0),
             int(limit),
+            since_dt,
         )
     return int(total or 0), [dict(r) for r in rows]
 
@@ -9292,7 +11638,8 @@ async def get_online_users_recent(window_minutes: int = 5, limit: int = 20, offs
       get_online_users_recent(window_minutes=5, limit=20)
     """
     p = _assert_pool()
-    since_iso = (get_moscow_now() - timedelta(minutes=int(window_minutes))).isoformat()
+    since_dt = get_moscow_now() - timedelta(minutes=int(window_minutes))
+    since_iso = since_dt.isoformat()
     async with p.acquire() as conn:
         total = await conn.fetchval(
             """
@@ -9301,7 +11648,7 @@ async def get_online_users_recent(window_minutes: int = 5, limit: int = 20, offs
               FROM users u
               LEFT JOIN LATERAL (
                 SELECT 1 FROM activity_events ae
-                WHERE ae.user_id = u.id AND ae.created_at >= $1
+                WHERE ae.user_id = u.id AND ae.created_ts >= $2
                 LIMIT 1
               ) ae ON TRUE
               WHERE u.is_deleted=0
@@ -9314,6 +11661,7 @@ async def get_online_users_recent(window_minutes: int = 5, limit: int = 20, offs
             ) t
             """,
             since_iso,
+            since_dt,
         )
         rows = await conn.fetch(
             """
@@ -9321,7 +11669,7 @@ async def get_online_users_recent(window_minutes: int = 5, limit: int = 20, offs
             FROM users u
             LEFT JOIN LATERAL (
               SELECT 1 FROM activity_events ae
-              WHERE ae.user_id = u.id AND ae.created_at >= $1
+              WHERE ae.user_id = u.id AND ae.created_ts >= $4
               LIMIT 1
             ) ae ON TRUE
             WHERE u.is_deleted=0
@@ -9337,6 +11685,7 @@ async def get_online_users_recent(window_minutes: int = 5, limit: int = 20, offs
             since_iso,
             int(offset or 0),
             int(limit),
+            since_dt,
         )
     return int(total or 0), [dict(r) for r in rows]
 
@@ -9352,11 +11701,11 @@ async def get_total_activity_events() -> int:
 async def get_total_activity_events_last_days(days: int = 7) -> int:
     """Total events for last N days (for graphs)."""
     p = _assert_pool()
-    since_iso = (get_moscow_now() - timedelta(days=int(days))).isoformat()
+    since_dt = get_moscow_now() - timedelta(days=int(days))
     async with p.acquire() as conn:
         v = await conn.fetchval(
-            "SELECT COUNT(*) FROM activity_events WHERE created_at >= $1",
-            since_iso,
+            "SELECT COUNT(*) FROM activity_events WHERE created_ts >= $1",
+            since_dt,
         )
     return int(v or 0)
 
@@ -9373,102 +11722,324 @@ def _coerce_datetime(value: object) -> datetime:
                 dt = datetime.fromisoformat(str(value) + "T00:00:00")
             except Exception:
                 raise
-    # Queries below cast params to timestamp (without timezone), so pass naive datetime.
-    if dt.tzinfo is not None:
-        return dt.replace(tzinfo=None)
+    # Queries below compare with created_ts (TIMESTAMPTZ): naive values are bot-local time.
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=get_bot_now().tzinfo)
     return dt
 
 
+# -------------------- activity rollups --------------------
+# Дашборд активности читает только свёртки (почасовые / дневные счётчики),
+# а не сырые activity_events / bot_error_logs. Свёртки докатывает refresh_activity_rollups
+# по id-водяному знаку; бакеты — настенное время в таймзоне бота.
+
+_ROLLUP_BATCH = 50000
+# строки, вставленные позже этого, не сворачиваем: у соседних id транзакция может ещё не
+# закоммититься. Считаем по inserted_at (время INSERT на сервере), а не по created_ts —
+# буферизованный писатель кладёт события со временем постановки в очередь.
+_ROLLUP_LAG_SECONDS = 10
+_ROLLUP_MINUTES_KEEP_DAYS = 2
+
+_ACTIVITY_VOTE_SQL = "lower(coalesce(kind,'')) LIKE '%rate%' OR lower(coalesce(kind,'')) LIKE '%vote%'"
+_ACTIVITY_UPLOAD_SQL = "lower(coalesce(kind,'')) LIKE '%upload%' OR lower(coalesce(kind,'')) LIKE '%photo%'"
+_ACTIVITY_REPORT_SQL = "lower(coalesce(kind,'')) LIKE '%report%' OR lower(coalesce(kind,'')) LIKE '%complaint%'"
+
+
+def _activity_section_case_sql() -> str:
+    return """
+        CASE
+          WHEN lower(coalesce(kind, '')) LIKE '%rate%' OR lower(coalesce(kind, '')) LIKE '%vote%' THEN 'rate'
+          WHEN lower(coalesce(kind, '')) LIKE '%upload%' OR lower(coalesce(kind, '')) LIKE '%photo%' THEN 'upload'
+          WHEN lower(coalesce(kind, '')) LIKE '%profile%' THEN 'profile'
+          WHEN lower(coalesce(kind, '')) LIKE '%result%' THEN 'results'
+          WHEN lower(coalesce(kind, '')) LIKE '%support%' THEN 'support'
+          WHEN lower(coalesce(kind, '')) LIKE '%admin%' THEN 'admin'
+          WHEN lower(coalesce(kind, '')) = 'callback' THEN 'menu'
+          WHEN lower(coalesce(kind, '')) = 'message' THEN 'messages'
+          ELSE 'other'
+        END
+    """
+
+
+async def _rollup_claim_range(conn: asyncpg.Connection, source: str) -> tuple[int, int] | None:
+    """(last_id, hi] для следующей пачки source; водяной знак залочен до конца транзакции."""
+    last_id = await conn.fetchval(
+        "SELECT last_id FROM rollup_watermarks WHERE name=$1 FOR UPDATE",
+        source,
+    )
+    last_id = int(last_id or 0)
+    # пачка обрывается на первой молодой строке: id за ней могут обогнать ещё открытую транзакцию
+    hi = await conn.fetchval(
+        f"""
+        SELECT MAX(id)
+        FROM (
+            SELECT id,
+                   bool_or(COALESCE(inserted_at >= NOW() - make_interval(secs => $3), FALSE))
+                       OVER (ORDER BY id) AS blocked
+            FROM (
+                SELECT id, inserted_at
+                FROM {source}
+                WHERE id > $1
+                ORDER BY id
+                LIMIT $2
+            ) b
+        ) x
+        WHERE NOT x.blocked
+        """,
+        last_id,
+        int(_ROLLUP_BATCH),
+        float(_ROLLUP_LAG_SECONDS),
+    )
+    if hi is None:
+        return None
+    return last_id, int(hi)
+
+
+async def _rollup_set_watermark(conn: asyncpg.Connection, source: str, hi: int) -> None:
+    await conn.execute(
+        "UPDATE rollup_watermarks SET last_id=$2, updated_at=NOW() WHERE name=$1",
+        source,
+        int(hi),
+    )
+
+
+async def _rollup_activity_batch(conn: asyncpg.Connection) -> int:
+    rng = await _rollup_claim_range(conn, "activity_events")
+    if rng is None:
+        return 0
+    lo, hi = rng
+    ev = """
+        SELECT user_id, kind,
+               COALESCE(created_ts, glowshot_text_to_ts(created_at)) AT TIME ZONE $3 AS ts
+        FROM activity_events
+        WHERE id > $1 AND id <= $2
+    """
+    await conn.execute(
+        f"""
+        WITH ev AS ({ev})
+        INSERT INTO activity_rollup_hourly (bucket, section, events)
+        SELECT date_trunc('hour', ts), {_activity_section_case_sql()}, COUNT(*)
+        FROM ev
+        WHERE ts IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (bucket, section)
+        DO UPDATE SET events = activity_rollup_hourly.events + EXCLUDED.events
+        """,
+        lo,
+        hi,
+        BOT_TIMEZONE,
+    )
+    # минутные счётчики нужны только для точных peak_per_minute / active_minutes между пачками
+    await conn.execute(
+        f"""
+        WITH ev AS ({ev}),
+        m AS (
+            INSERT INTO activity_rollup_user_minute (minute, user_id, cnt)
+            SELECT date_trunc('minute', ts), user_id, COUNT(*)
+            FROM ev
+            WHERE ts IS NOT NULL AND user_id IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (minute, user_id)
+            DO UPDATE SET cnt = activity_rollup_user_minute.cnt + EXCLUDED.cnt
+            RETURNING minute, user_id, cnt, (xmax = 0) AS inserted
+        ),
+        mm AS (
+            SELECT minute::date AS day, user_id,
+                   MAX(cnt)::int AS peak,
+                   COUNT(*) FILTER (WHERE inserted)::int AS new_minutes
+            FROM m
+            GROUP BY 1, 2
+        ),
+        d AS (
+            SELECT ts::date AS day, user_id,
+                   COUNT(*)::int AS events,
+                   COUNT(*) FILTER (WHERE {_ACTIVITY_VOTE_SQL})::int AS votes,
+                   COUNT(*) FILTER (WHERE {_ACTIVITY_UPLOAD_SQL})::int AS uploads,
+                   COUNT(*) FILTER (WHERE {_ACTIVITY_REPORT_SQL})::int AS reports,
+                   COUNT(*) FILTER (WHERE lower(coalesce(kind,''))='callback')::int AS callback_events,
+                   COUNT(*) FILTER (WHERE lower(coalesce(kind,''))='message')::int AS message_events
+            FROM ev
+            WHERE ts IS NOT NULL AND user_id IS NOT NULL
+            GROUP BY 1, 2
+        )
+        INSERT INTO activity_rollup_user_daily AS t (
+            day, user_id, events, votes, uploads, reports,
+            callback_events, message_events, peak_per_minute, active_minutes
+        )
+        SELECT d.day, d.user_id, d.events, d.votes, d.uploads, d.reports,
+               d.callback_events, d.message_events,
+               COALESCE(mm.peak, 0), COALESCE(mm.new_minutes, 0)
+        FROM d
+        LEFT JOIN mm ON mm.day = d.day AND mm.user_id = d.user_id
+        ON CONFLICT (day, user_id) DO UPDATE SET
+            events = t.events + EXCLUDED.events,
+            votes = t.votes + EXCLUDED.votes,
+            uploads = t.uploads + EXCLUDED.uploads,
+            reports = t.reports + EXCLUDED.reports,
+            callback_events = t.callback_events + EXCLUDED.callback_events,
+            message_events = t.message_events + EXCLUDED.message_events,
+            peak_per_minute = GREATEST(t.peak_per_minute, EXCLUDED.peak_per_minute),
+            active_minutes = t.active_minutes + EXCLUDED.active_minutes
+        """,
+        lo,
+        hi,
+        BOT_TIMEZONE,
+    )
+    await _rollup_set_watermark(conn, "activity_events", hi)
+    return hi - lo
+
+
+async def _rollup_errors_batch(conn: asyncpg.Connection) -> int:
+    rng = await _rollup_claim_range(conn, "bot_error_logs")
+    if rng is None:
+        return 0
+    lo, hi = rng
+    ev = """
+        SELECT tg_user_id,
+               COALESCE(NULLIF(error_type, ''), 'Error') AS error_type,
+               COALESCE(NULLIF(handler, ''), 'unknown') AS handler,
+               COALESCE(created_ts, glowshot_text_to_ts(created_at)) AT TIME ZONE $3 AS ts
+        FROM bot_error_logs
+        WHERE id > $1 AND id <= $2
+    """
+    await conn.execute(
+        f"""
+        WITH ev AS ({ev})
+        INSERT INTO error_rollup_hourly (bucket, error_type, handler, errors)
+        SELECT date_trunc('hour', ts), error_type, handler, COUNT(*)
+        FROM ev
+        WHERE ts IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (bucket, error_type, handler)
+        DO UPDATE SET errors = error_rollup_hourly.errors + EXCLUDED.errors
+        """,
+        lo,
+        hi,
+        BOT_TIMEZONE,
+    )
+    await conn.execute(
+        f"""
+        WITH ev AS ({ev})
+        INSERT INTO error_rollup_user_daily AS t (day, tg_user_id, errors, bad_request, flood)
+        SELECT ts::date, tg_user_id,
+               COUNT(*),
+               COUNT(*) FILTER (WHERE lower(error_type) LIKE '%badrequest%'),
+               COUNT(*) FILTER (WHERE lower(error_type) LIKE '%flood%')
+        FROM ev
+        WHERE ts IS NOT NULL AND tg_user_id IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (day, tg_user_id) DO UPDATE SET
+            errors = t.errors + EXCLUDED.errors,
+            bad_request = t.bad_request + EXCLUDED.bad_request,
+            flood = t.flood + EXCLUDED.flood
+        """,
+        lo,
+        hi,
+        BOT_TIMEZONE,
+    )
+    await _rollup_set_watermark(conn, "bot_error_logs", hi)
+    return hi - lo
+
+
+async def refresh_activity_rollups(*, max_batches: int = 20) -> dict:
+    """Докатить свёртки до текущего момента (не больше max_batches пачек на источник).
+
+    Каждая пачка — отдельная транзакция вместе со сдвигом водяного знака,
+    поэтому параллельные вызовы из разных процессов просто сериализуются.
+    """
+    p = _assert_pool()
+    out = {"activity_events": 0, "bot_error_logs": 0}
+    for source, fn in (("activity_events", _rollup_activity_batch), ("bot_error_logs", _rollup_errors_batch)):
+        for _ in range(max(1, int(max_batches))):
+            async with p.acquire() as conn:
+                async with conn.transaction():
+                    n = await fn(conn)
+            if n <= 0:
+                break
+            out[source] += n
+    async with p.acquire() as conn:
+        await conn.execute(
+            "DELETE FROM activity_rollup_user_minute WHERE minute < (NOW() AT TIME ZONE $1) - make_interval(days => $2)",
+            BOT_TIMEZONE,
+            int(_ROLLUP_MINUTES_KEEP_DAYS),
+        )
+    return out
+
+
+def _rollup_window(start_iso: object, end_iso: object) -> tuple[datetime, datetime, date, date]:
+    """Границы окна в настенном времени бота: (start, end) для почасовых, [start_day, end_day) для дневных."""
+    tz = get_bot_now().tzinfo
+    start = _coerce_datetime(start_iso).astimezone(tz).replace(tzinfo=None)
+    end = _coerce_datetime(end_iso).astimezone(tz).replace(tzinfo=None)
+    end_day = end.date() if end.time() == datetime.min.time() else end.date() + timedelta(days=1)
+    return start, end, start.date(), end_day
+
+
 async def get_activity_counts_by_hour(start_iso: object, end_iso: object) -> list[dict]:
-    """Counts of activity_events grouped by hour for [start, end)."""
+    """Counts of activity events grouped by hour for [start, end) (from rollups)."""
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
+    start, end, _, _ = _rollup_window(start_iso, end_iso)
     async with p.acquire() as conn:
         rows = await conn.fetch(
             """
-            SELECT date_trunc('hour', created_at::timestamp) AS bucket, COUNT(*) AS cnt
-            FROM activity_events
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
+            SELECT bucket, SUM(events)::int AS cnt
+            FROM activity_rollup_hourly
+            WHERE bucket >= $1 AND bucket < $2
             GROUP BY 1
             ORDER BY 1 ASC
             """,
-            start_dt,
-            end_dt,
+            start,
+            end,
         )
     return [dict(r) for r in rows]
 
 
 async def get_activity_counts_by_day(start_iso: object, end_iso: object) -> list[dict]:
-    """Counts of activity_events grouped by day for [start, end)."""
+    """Counts of activity events grouped by day for [start, end) (from rollups)."""
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
+    start, end, _, _ = _rollup_window(start_iso, end_iso)
     async with p.acquire() as conn:
         rows = await conn.fetch(
             """
-            SELECT date_trunc('day', created_at::timestamp) AS bucket, COUNT(*) AS cnt
-            FROM activity_events
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
+            SELECT date_trunc('day', bucket) AS bucket, SUM(events)::int AS cnt
+            FROM activity_rollup_hourly
+            WHERE bucket >= $1 AND bucket < $2
             GROUP BY 1
             ORDER BY 1 ASC
             """,
-            start_dt,
-            end_dt,
+            start,
+            end,
         )
     return [dict(r) for r in rows]
 
 
-def _activity_section_case_sql() -> str:
-    return """
-        CASE
-          WHEN lower(coalesce(kind, '')) LIKE '%rate%' OR lower(coalesce(kind, '')) LIKE '%vote%' THEN 'rate'
-          WHEN lower(coalesce(kind, '')) LIKE '%upload%' OR lower(coalesce(kind, '')) LIKE '%photo%' THEN 'upload'
-          WHEN lower(coalesce(kind, '')) LIKE '%profile%' THEN 'profile'
-          WHEN lower(coalesce(kind, '')) LIKE '%result%' THEN 'results'
-          WHEN lower(coalesce(kind, '')) LIKE '%support%' THEN 'support'
-          WHEN lower(coalesce(kind, '')) LIKE '%admin%' THEN 'admin'
-          WHEN lower(coalesce(kind, '')) = 'callback' THEN 'menu'
-          WHEN lower(coalesce(kind, '')) = 'message' THEN 'messages'
-          ELSE 'other'
-        END
-    """
-
-
 async def get_activity_overview(start_iso: object, end_iso: object) -> dict:
-    """Overview metrics for admin activity dashboard."""
+    """Overview metrics for admin activity dashboard (from rollups)."""
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
-    section_case = _activity_section_case_sql()
+    start, end, start_day, end_day = _rollup_window(start_iso, end_iso)
 
     async with p.acquire() as conn:
-        totals = await conn.fetchrow(
-            """
-            SELECT
-              COUNT(*)::int AS total_events,
-              COUNT(DISTINCT user_id)::int AS unique_users
-            FROM activity_events
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
-            """,
-            start_dt,
-            end_dt,
+        total_events = await conn.fetchval(
+            "SELECT COALESCE(SUM(events), 0)::int FROM activity_rollup_hourly WHERE bucket >= $1 AND bucket < $2",
+            start,
+            end,
+        )
+        unique_users = await conn.fetchval(
+            "SELECT COUNT(DISTINCT user_id)::int FROM activity_rollup_user_daily WHERE day >= $1 AND day < $2",
+            start_day,
+            end_day,
         )
         top_section = await conn.fetchrow(
-            f"""
-            SELECT {section_case} AS section, COUNT(*)::int AS cnt
-            FROM activity_events
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
+            """
+            SELECT section, SUM(events)::int AS cnt
+            FROM activity_rollup_hourly
+            WHERE bucket >= $1 AND bucket < $2
             GROUP BY 1
             ORDER BY cnt DESC, section ASC
             LIMIT 1
             """,
-            start_dt,
-            end_dt,
+            start,
+            end,
         )
         top_user = await conn.fetchrow(
             """
@@ -9478,33 +12049,29 @@ async def get_activity_overview(start_iso: object, end_iso: object) -> dict:
               u.name AS name,
               u.username AS username,
               u.author_code AS author_code,
-              COUNT(*)::int AS cnt
-            FROM activity_events ae
-            JOIN users u ON u.id = ae.user_id
-            WHERE ae.created_at::timestamp >= $1::timestamp
-              AND ae.created_at::timestamp < $2::timestamp
-              AND ae.user_id IS NOT NULL
-            GROUP BY u.id
-            ORDER BY cnt DESC, u.id DESC
-            LIMIT 1
+              t.cnt
+            FROM (
+              SELECT user_id, SUM(events)::int AS cnt
+              FROM activity_rollup_user_daily
+              WHERE day >= $1 AND day < $2
+              GROUP BY user_id
+              ORDER BY cnt DESC, user_id DESC
+              LIMIT 1
+            ) t
+            JOIN users u ON u.id = t.user_id
             """,
-            start_dt,
-            end_dt,
+            start_day,
+            end_day,
         )
         errors_total = await conn.fetchval(
-            """
-            SELECT COUNT(*)::int
-            FROM bot_error_logs
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
-            """,
-            start_dt,
-            end_dt,
+            "SELECT COALESCE(SUM(errors), 0)::int FROM error_rollup_hourly WHERE bucket >= $1 AND bucket < $2",
+            start,
+            end,
         )
 
     return {
-        "total_events": int((totals or {}).get("total_events") or 0),
-        "unique_users": int((totals or {}).get("unique_users") or 0),
+        "total_events": int(total_events or 0),
+        "unique_users": int(unique_users or 0),
         "errors_total": int(errors_total or 0),
         "top_section": (top_section or {}).get("section"),
         "top_section_cnt": int((top_section or {}).get("cnt") or 0),
@@ -9519,22 +12086,17 @@ async def get_top_users_activity(
     limit: int = 10,
     kind: str = "events",
 ) -> list[dict]:
-    """Top users for selected activity metric from activity_events logs."""
+    """Top users for selected activity metric (from daily per-user rollups)."""
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
+    _, _, start_day, end_day = _rollup_window(start_iso, end_iso)
     lim = max(1, min(int(limit or 10), 100))
-
-    vote_expr = "SUM(CASE WHEN lower(coalesce(ae.kind,'')) LIKE '%rate%' OR lower(coalesce(ae.kind,'')) LIKE '%vote%' THEN 1 ELSE 0 END)"
-    upload_expr = "SUM(CASE WHEN lower(coalesce(ae.kind,'')) LIKE '%upload%' OR lower(coalesce(ae.kind,'')) LIKE '%photo%' THEN 1 ELSE 0 END)"
-    report_expr = "SUM(CASE WHEN lower(coalesce(ae.kind,'')) LIKE '%report%' OR lower(coalesce(ae.kind,'')) LIKE '%complaint%' THEN 1 ELSE 0 END)"
     metric_map = {
-        "events": "COUNT(*)",
-        "votes": vote_expr,
-        "uploads": upload_expr,
-        "reports": report_expr,
+        "events": "SUM(events)",
+        "votes": "SUM(votes)",
+        "uploads": "SUM(uploads)",
+        "reports": "SUM(reports)",
     }
-    metric_expr = metric_map.get(str(kind or "events").strip().lower(), "COUNT(*)")
+    metric_expr = metric_map.get(str(kind or "events").strip().lower(), "SUM(events)")
 
     query = f"""
         SELECT
@@ -9543,98 +12105,84 @@ async def get_top_users_activity(
           u.name AS name,
           u.username AS username,
           u.author_code AS author_code,
-          COUNT(*)::int AS total_events,
-          {vote_expr}::int AS votes_count,
-          {upload_expr}::int AS uploads_count,
-          {report_expr}::int AS reports_count,
-          {metric_expr}::int AS metric_count
-        FROM activity_events ae
-        JOIN users u ON u.id = ae.user_id
-        WHERE ae.created_at::timestamp >= $1::timestamp
-          AND ae.created_at::timestamp < $2::timestamp
-          AND ae.user_id IS NOT NULL
-        GROUP BY u.id
-        HAVING {metric_expr} > 0
-        ORDER BY metric_count DESC, total_events DESC, u.id DESC
+          t.total_events,
+          t.votes_count,
+          t.uploads_count,
+          t.reports_count,
+          t.metric_count
+        FROM (
+          SELECT
+            user_id,
+            SUM(events)::int AS total_events,
+            SUM(votes)::int AS votes_count,
+            SUM(uploads)::int AS uploads_count,
+            SUM(reports)::int AS reports_count,
+            {metric_expr}::int AS metric_count
+          FROM activity_rollup_user_daily
+          WHERE day >= $1 AND day < $2
+          GROUP BY user_id
+          HAVING {metric_expr} > 0
+        ) t
+        JOIN users u ON u.id = t.user_id
+        ORDER BY t.metric_count DESC, t.total_events DESC, u.id DESC
         LIMIT $3
     """
     async with p.acquire() as conn:
-        rows = await conn.fetch(query, start_dt, end_dt, lim)
+        rows = await conn.fetch(query, start_day, end_day, lim)
     return [dict(r) for r in rows]
 
 
 async def get_top_sections(start_iso: object, end_iso: object, limit: int = 10) -> list[dict]:
-    """Top activity sections from activity_events.kind (mapped)."""
+    """Top activity sections (from hourly rollups)."""
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
+    start, end, _, _ = _rollup_window(start_iso, end_iso)
     lim = max(1, min(int(limit or 10), 100))
-    section_case = _activity_section_case_sql()
-    query = f"""
-        SELECT {section_case} AS section, COUNT(*)::int AS cnt
-        FROM activity_events
-        WHERE created_at::timestamp >= $1::timestamp
-          AND created_at::timestamp < $2::timestamp
-        GROUP BY 1
-        ORDER BY cnt DESC, section ASC
-        LIMIT $3
-    """
     async with p.acquire() as conn:
-        rows = await conn.fetch(query, start_dt, end_dt, lim)
+        rows = await conn.fetch(
+            """
+            SELECT section, SUM(events)::int AS cnt
+            FROM activity_rollup_hourly
+            WHERE bucket >= $1 AND bucket < $2
+            GROUP BY 1
+            ORDER BY cnt DESC, section ASC
+            LIMIT $3
+            """,
+            start,
+            end,
+            lim,
+        )
     return [dict(r) for r in rows]
 
 
 async def get_spam_suspects(start_iso: object, end_iso: object, limit: int = 10) -> list[dict]:
-    """Suspicious users based on activity/error burst aggregates."""
+    """Suspicious users based on activity/error burst aggregates (from daily rollups)."""
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
+    _, _, start_day, end_day = _rollup_window(start_iso, end_iso)
     lim = max(1, min(int(limit or 10), 100))
 
     async with p.acquire() as conn:
         rows = await conn.fetch(
             """
-            WITH act_min AS (
+            WITH act AS (
               SELECT
                 user_id,
-                date_trunc('minute', created_at::timestamp) AS minute_bucket,
-                COUNT(*)::int AS cnt
-              FROM activity_events
-              WHERE created_at::timestamp >= $1::timestamp
-                AND created_at::timestamp < $2::timestamp
-                AND user_id IS NOT NULL
-              GROUP BY user_id, minute_bucket
-            ),
-            act_agg AS (
-              SELECT
-                user_id,
-                SUM(cnt)::int AS total_events,
-                MAX(cnt)::int AS peak_per_minute,
-                COUNT(*)::int AS active_minutes
-              FROM act_min
-              GROUP BY user_id
-            ),
-            act_kind AS (
-              SELECT
-                user_id,
-                SUM(CASE WHEN lower(coalesce(kind,''))='callback' THEN 1 ELSE 0 END)::int AS callback_events,
-                SUM(CASE WHEN lower(coalesce(kind,''))='message' THEN 1 ELSE 0 END)::int AS message_events
-              FROM activity_events
-              WHERE created_at::timestamp >= $1::timestamp
-                AND created_at::timestamp < $2::timestamp
-                AND user_id IS NOT NULL
+                SUM(events)::int AS total_events,
+                MAX(peak_per_minute)::int AS peak_per_minute,
+                SUM(active_minutes)::int AS active_minutes,
+                SUM(callback_events)::int AS callback_events,
+                SUM(message_events)::int AS message_events
+              FROM activity_rollup_user_daily
+              WHERE day >= $1 AND day < $2
               GROUP BY user_id
             ),
             err AS (
               SELECT
                 tg_user_id,
-                COUNT(*)::int AS errors_total,
-                SUM(CASE WHEN lower(coalesce(error_type,'')) LIKE '%badrequest%' THEN 1 ELSE 0 END)::int AS bad_request_cnt,
-                SUM(CASE WHEN lower(coalesce(error_type,'')) LIKE '%flood%' THEN 1 ELSE 0 END)::int AS flood_cnt
-              FROM bot_error_logs
-              WHERE created_at::timestamp >= $1::timestamp
-                AND created_at::timestamp < $2::timestamp
-                AND tg_user_id IS NOT NULL
+                SUM(errors)::int AS errors_total,
+                SUM(bad_request)::int AS bad_request_cnt,
+                SUM(flood)::int AS flood_cnt
+              FROM error_rollup_user_daily
+              WHERE day >= $1 AND day < $2
               GROUP BY tg_user_id
             )
             SELECT
@@ -9646,8 +12194,8 @@ async def get_spam_suspects(start_iso: object, end_iso: object, limit: int = 10)
               COALESCE(a.total_events, 0)::int AS total_events,
               COALESCE(a.peak_per_minute, 0)::int AS peak_per_minute,
               COALESCE(a.active_minutes, 0)::int AS active_minutes,
-              COALESCE(k.callback_events, 0)::int AS callback_events,
-              COALESCE(k.message_events, 0)::int AS message_events,
+              COALESCE(a.callback_events, 0)::int AS callback_events,
+              COALESCE(a.message_events, 0)::int AS message_events,
               COALESCE(e.errors_total, 0)::int AS errors_total,
               COALESCE(e.bad_request_cnt, 0)::int AS bad_request_cnt,
               COALESCE(e.flood_cnt, 0)::int AS flood_cnt,
@@ -9658,16 +12206,15 @@ async def get_spam_suspects(start_iso: object, end_iso: object, limit: int = 10)
                 + COALESCE(e.flood_cnt, 0) * 4
               )::int AS score
             FROM users u
-            LEFT JOIN act_agg a ON a.user_id = u.id
-            LEFT JOIN act_kind k ON k.user_id = u.id
+            LEFT JOIN act a ON a.user_id = u.id
             LEFT JOIN err e ON e.tg_user_id = u.tg_id
-            WHERE COALESCE(a.total_events, 0) > 0
-               OR COALESCE(e.errors_total, 0) > 0
+            WHERE a.user_id IS NOT NULL
+               OR e.tg_user_id IS NOT NULL
             ORDER BY score DESC, errors_total DESC, total_events DESC, u.id DESC
             LIMIT $3
             """,
-            start_dt,
-            end_dt,
+            start_day,
+            end_day,
             lim,
         )
     return [dict(r) for r in rows]
@@ -9675,22 +12222,20 @@ async def get_spam_suspects(start_iso: object, end_iso: object, limit: int = 10)
 
 async def get_error_counts_by_type(start_iso: object, end_iso: object, limit: int = 10) -> list[dict]:
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
+    start, end, _, _ = _rollup_window(start_iso, end_iso)
     lim = max(1, min(int(limit or 10), 100))
     async with p.acquire() as conn:
         rows = await conn.fetch(
             """
-            SELECT COALESCE(NULLIF(error_type, ''), 'Error') AS error_type, COUNT(*)::int AS cnt
-            FROM bot_error_logs
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
+            SELECT error_type, SUM(errors)::int AS cnt
+            FROM error_rollup_hourly
+            WHERE bucket >= $1 AND bucket < $2
             GROUP BY 1
             ORDER BY cnt DESC, error_type ASC
             LIMIT $3
             """,
-            start_dt,
-            end_dt,
+            start,
+            end,
             lim,
         )
     return [dict(r) for r in rows]
@@ -9698,22 +12243,20 @@ async def get_error_counts_by_type(start_iso: object, end_iso: object, limit: in
 
 async def get_error_counts_by_handler(start_iso: object, end_iso: object, limit: int = 10) -> list[dict]:
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
+    start, end, _, _ = _rollup_window(start_iso, end_iso)
     lim = max(1, min(int(limit or 10), 100))
     async with p.acquire() as conn:
         rows = await conn.fetch(
             """
-            SELECT COALESCE(NULLIF(handler, ''), 'unknown') AS handler, COUNT(*)::int AS cnt
-            FROM bot_error_logs
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
+            SELECT handler, SUM(errors)::int AS cnt
+            FROM error_rollup_hourly
+            WHERE bucket >= $1 AND bucket < $2
             GROUP BY 1
             ORDER BY cnt DESC, handler ASC
             LIMIT $3
             """,
-            start_dt,
-            end_dt,
+            start,
+            end,
             lim,
         )
     return [dict(r) for r in rows]
@@ -9721,28 +12264,17 @@ async def get_error_counts_by_handler(start_iso: object, end_iso: object, limit:
 
 async def get_error_rate(start_iso: object, end_iso: object) -> float:
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
+    start, end, _, _ = _rollup_window(start_iso, end_iso)
     async with p.acquire() as conn:
         errors_total = await conn.fetchval(
-            """
-            SELECT COUNT(*)::int
-            FROM bot_error_logs
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
-            """,
-            start_dt,
-            end_dt,
+            "SELECT COALESCE(SUM(errors), 0)::int FROM error_rollup_hourly WHERE bucket >= $1 AND bucket < $2",
+            start,
+            end,
         )
         events_total = await conn.fetchval(
-            """
-            SELECT COUNT(*)::int
-            FROM activity_events
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
-            """,
-            start_dt,
-            end_dt,
+            "SELECT COALESCE(SUM(events), 0)::int FROM activity_rollup_hourly WHERE bucket >= $1 AND bucket < $2",
+            start,
+            end,
         )
     events_val = int(events_total or 0)
     if events_val <= 0:
@@ -9752,22 +12284,16 @@ async def get_error_rate(start_iso: object, end_iso: object) -> float:
 
 async def get_errors_summary(start_iso: object, end_iso: object, limit: int = 10) -> dict:
     p = _assert_pool()
-    start_dt = _coerce_datetime(start_iso)
-    end_dt = _coerce_datetime(end_iso)
+    start, end, _, _ = _rollup_window(start_iso, end_iso)
     lim = max(1, min(int(limit or 10), 100))
-    by_type = await get_error_counts_by_type(start_dt, end_dt, lim)
-    by_handler = await get_error_counts_by_handler(start_dt, end_dt, lim)
-    rate = await get_error_rate(start_dt, end_dt)
+    by_type = await get_error_counts_by_type(start_iso, end_iso, lim)
+    by_handler = await get_error_counts_by_handler(start_iso, end_iso, lim)
+    rate = await get_error_rate(start_iso, end_iso)
     async with p.acquire() as conn:
         total = await conn.fetchval(
-            """
-            SELECT COUNT(*)::int
-            FROM bot_error_logs
-            WHERE created_at::timestamp >= $1::timestamp
-              AND created_at::timestamp < $2::timestamp
-            """,
-            start_dt,
-            end_dt,
+            "SELECT COALESCE(SUM(errors), 0)::int FROM error_rollup_hourly WHERE bucket >= $1 AND bucket < $2",
+            start,
+            end,
         )
     return {
         "total_errors": int(total or 0),
@@ -9776,6 +12302,344 @@ async def get_errors_summary(start_iso: object, end_iso: object, limit: int = 10
         "by_handler": by_handler,
     }
 
+# -------------------- log partitions / retention --------------------
+# activity_events, bot_error_logs, streak_actions, notification_queue — помесячные RANGE-партиции.
+# Обычная таблица конвертируется онлайн: рядом создаётся <t>__part (партиционированная),
+# данные копируются пачками по id, затем в одной короткой транзакции (EXCLUSIVE lock,
+# чтение не блокируется) докопируется хвост и таблицы меняются именами.
+# Старые партиции удаляются (или отцепляются в схему archive) по LOG_RETENTION_DAYS.
+# photo_views не партиционируем: её PK (photo_id, viewer_id) — защита от повторного показа
+# и списания, а уникальность по партициям требует ключ партиции в PK. Retention там чистит
+# только просмотры удалённых/истёкших фото: живое фото без expires_at иначе вернулось бы в ленту.
+
+_PARTITION_MONTHS_AHEAD = 3
+_PARTITION_MONTHS_BACK_MAX = 24
+_PARTITION_COPY_BATCH = 20000
+_PARTITION_LOCK_KEY = "glowshot_log_maintenance"
+_RETENTION_DELETE_BATCH = 5000
+
+_PARTITIONED_LOGS: dict[str, dict] = {
+    "activity_events": {"key": "created_ts", "append_only": True},
+    "bot_error_logs": {"key": "created_ts", "append_only": True},
+    "streak_actions": {"key": "created_ts", "append_only": True},
+    # очередь обновляется (status/attempts): при свопе пересинхронизируем строки по updated_at
+    "notification_queue": {"key": "created_at", "append_only": False},
+}
+
+
+def _month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _next_month(d: date) -> date:
+    return date(d.year + 1, 1, 1) if d.month == 12 else date(d.year, d.month + 1, 1)
+
+
+def _month_bound_sql(d: date) -> str:
+    """Граница партиции: полночь 1-го числа в таймзоне бота."""
+    tz = get_bot_now().tzinfo
+    return "'" + datetime(d.year, d.month, d.day, tzinfo=tz).isoformat() + "'"
+
+
+async def _relkind(conn: asyncpg.Connection, name: str) -> str | None:
+    return await conn.fetchval(
+        """
+        SELECT c.relkind::text
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = $1
+        """,
+        name,
+    )
+
+
+async def _ensure_month_partitions(
+    conn: asyncpg.Connection,
+    table: str,
+    start: date,
+    end: date,
+    *,
+    prefix: str | None = None,
+) -> None:
+    """Партиции [start, end) помесячно + default для строк вне диапазона.
+
+    prefix — имя итоговой таблицы, если партиции вешаются на временный <t>__part.
+    """
+    prefix = prefix or table
+    m = _month_start(start)
+    while m < end:
+        name = f"{prefix}_p{m.strftime('%Y%m')}"
+        if await _relkind(conn, name) is None:
+            await conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ({_month_bound_sql(m)}) TO ({_month_bound_sql(_next_month(m))})"
+            )
+        m = _next_month(m)
+    await conn.execute(f"CREATE TABLE IF NOT EXISTS {prefix}_pdefault PARTITION OF {table} DEFAULT")
+
+
+async def _partition_columns(conn: asyncpg.Connection, table: str, key: str) -> tuple[str, str]:
+    """(список колонок, select-список) — ключ партиции всегда заполнен."""
+    cols = await conn.fetch(
+        """
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = $1
+        ORDER BY ordinal_position
+        """,
+        table,
+    )
+    names = [str(r["column_name"]) for r in cols]
+    select = []
+    for c in names:
+        if c == key and key == "created_ts":
+            select.append("COALESCE(created_ts, glowshot_text_to_ts(created_at), NOW())")
+        else:
+            select.append(c)
+    return ", ".join(names), ", ".join(select)
+
+
+async def _partition_copy_range(conn: asyncpg.Connection, table: str, key: str, lo: int, hi: int) -> None:
+    cols, select = await _partition_columns(conn, table, key)
+    await conn.execute(
+        f"INSERT INTO {table}__part ({cols}) SELECT {select} FROM {table} WHERE id > $1 AND id <= $2",
+        int(lo),
+        int(hi),
+    )
+
+
+async def _partition_convert(conn: asyncpg.Connection, table: str, spec: dict, ts_done: set[str]) -> bool:
+    """Перевести table на партиции. True — если конвертация завершена в этом вызове."""
+    key = str(spec["key"])
+    if await _relkind(conn, table) != "r":
+        return False
+    if key == "created_ts" and table not in ts_done:
+        # ждём, пока _ts_backfill_loop заполнит created_ts
+        return False
+    part = f"{table}__part"
+    now_d = get_bot_now().date()
+
+    if await _relkind(conn, part) is None:
+        lo_ts = await conn.fetchval(f"SELECT MIN({key}) FROM {table}")
+        first = _month_start(now_d)
+        if lo_ts is not None:
+            first = max(
+                _month_start(lo_ts.astimezone(get_bot_now().tzinfo).date()),
+                _month_start(now_d - timedelta(days=31 * _PARTITION_MONTHS_BACK_MAX)),
+            )
+        last = now_d
+        for _ in range(_PARTITION_MONTHS_AHEAD + 1):
+            last = _next_month(last)
+        async with conn.transaction():
+            await conn.execute(f"CREATE TABLE {part} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE ({key})")
+            if key == "created_ts":
+                await conn.execute(f"ALTER TABLE {part} ALTER COLUMN created_ts SET DEFAULT NOW()")
+                await conn.execute(f"ALTER TABLE {part} ALTER COLUMN created_ts SET NOT NULL")
+            await conn.execute(f"ALTER TABLE {part} ADD CONSTRAINT {table}__part_pkey PRIMARY KEY (id, {key})")
+            fks = await conn.fetch(
+                "SELECT conname, pg_get_constraintdef(oid) AS def FROM pg_constraint WHERE conrelid = $1::regclass AND contype = 'f'",
+                table,
+            )
+            for fk in fks:
+                await conn.execute(f"ALTER TABLE {part} ADD CONSTRAINT {fk['conname']}__p {fk['def']}")
+            await _ensure_month_partitions(conn, part, first, last, prefix=table)
+    elif not spec.get("append_only"):
+        # изменяемую таблицу после рестарта копируем заново
+        await conn.execute(f"TRUNCATE {part}")
+
+    copy_started = await conn.fetchval("SELECT NOW()")
+    copied = int(await conn.fetchval(f"SELECT COALESCE(MAX(id), 0) FROM {part}") or 0)
+    hi_src = int(await conn.fetchval(f"SELECT COALESCE(MAX(id), 0) FROM {table}") or 0)
+    while copied < hi_src:
+        nxt = min(hi_src, copied + _PARTITION_COPY_BATCH)
+        await _partition_copy_range(conn, table, key, copied, nxt)
+        copied = nxt
+        await asyncio.sleep(0.05)
+
+    # индексы как у исходной таблицы (кроме PK; уникальные без ключа партиции невозможны)
+    idx_rows = await conn.fetch(
+        """
+        SELECT i.relname AS name, pg_get_indexdef(x.indexrelid) AS def, x.indisunique
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = $1::regclass AND NOT x.indisprimary
+        """,
+        table,
+    )
+    renames: list[tuple[str, str]] = []
+    for r in idx_rows:
+        name = str(r["name"])
+        if r["indisunique"]:
+            logger.warning("db.partitions.unique_index_skipped", extra={"table": table, "index": name})
+            continue
+        tmp = f"{name}__p"
+        ddl = str(r["def"]).replace(f"INDEX {name} ON ", f"INDEX IF NOT EXISTS {tmp} ON ", 1)
+        ddl = ddl.replace(f" ON public.{table} ", f" ON public.{part} ", 1).replace(" ON ONLY ", " ON ", 1)
+        await conn.execute(ddl)
+        renames.append((tmp, name))
+
+    cols, select = await _partition_columns(conn, table, key)
+    seq = await conn.fetchval("SELECT pg_get_serial_sequence($1, 'id')", f"public.{table}")
+    async with conn.transaction():
+        await conn.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+        tail_from = int(await conn.fetchval(f"SELECT COALESCE(MAX(id), 0) FROM {part}") or 0)
+        if not spec.get("append_only"):
+            await conn.execute(
+                f"DELETE FROM {part} p WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.id = p.id)"
+            )
+            await conn.execute(
+                f"DELETE FROM {part} WHERE id IN (SELECT id FROM {table} WHERE updated_at >= $1 AND id <= $2)",
+                copy_started,
+                tail_from,
+            )
+            await conn.execute(
+                f"INSERT INTO {part} ({cols}) SELECT {select} FROM {table} WHERE updated_at >= $1 AND id <= $2",
+                copy_started,
+                tail_from,
+            )
+        # не только хвост id > tail_from: строки ниже водяного знака, закоммиченные после
+        # их пачки копирования, тоже ещё не в part
+        await conn.execute(
+            f"INSERT INTO {part} ({cols}) SELECT {select} FROM {table} t "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {part} p WHERE p.id = t.id)"
+        )
+        if seq:
+            await conn.execute(f"ALTER SEQUENCE {seq} OWNED BY {part}.id")
+        await conn.execute(f"DROP TABLE {table}")
+        await conn.execute(f"ALTER TABLE {part} RENAME TO {table}")
+        await conn.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {table}__part_pkey TO {table}_pkey")
+        await conn.execute(f"ALTER INDEX IF EXISTS {table}__part_pkey RENAME TO {table}_pkey")
+        for tmp, name in renames:
+            await conn.execute(f"ALTER INDEX IF EXISTS {tmp} RENAME TO {name}")
+        for fk in await conn.fetch(
+            "SELECT conname FROM pg_constraint WHERE conrelid = $1::regclass AND contype = 'f' AND conname LIKE '%\\_\\_p'",
+            table,
+        ):
+            old_name = str(fk["conname"])
+            await conn.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {old_name} TO {old_name[:-3]}")
+    logger.info("db.partitions.converted", extra={"table": table})
+    return True
+
+
+async def _partition_retention(conn: asyncpg.Connection, table: str, keep_days: int, archive: bool) -> list[str]:
+    """Удалить/отцепить партиции, целиком старше keep_days. Возвращает имена обработанных."""
+    if keep_days <= 0:
+        return []
+    cutoff = get_bot_now().date() - timedelta(days=int(keep_days))
+    rows = await conn.fetch(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::regclass
+        ORDER BY c.relname
+        """,
+        table,
+    )
+    done: list[str] = []
+    for r in rows:
+        name = str(r["relname"])
+        suffix = name.rsplit("_p", 1)[-1]
+        if not suffix.isdigit() or len(suffix) != 6:
+            continue
+        month = date(int(suffix[:4]), int(suffix[4:]), 1)
+        if _next_month(month) > cutoff:
+            continue
+        if table == "notification_queue":
+            alive = await conn.fetchval(
+                f"SELECT 1 FROM {name} WHERE status IN ('pending','sending') LIMIT 1"
+            )
+            if alive:
+                continue
+        if archive:
+            await conn.execute("CREATE SCHEMA IF NOT EXISTS archive")
+            await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            await conn.execute(f"ALTER TABLE {name} SET SCHEMA archive")
+        else:
+            await conn.execute(f"DROP TABLE {name}")
+        done.append(name)
+    return done
+
+
+async def _photo_views_retention(conn: asyncpg.Connection, keep_days: int) -> int:
+    """Удалить просмотры старше keep_days у фото, которые больше не попадут в ленту."""
+    if keep_days <= 0:
+        return 0
+    cutoff = get_bot_now() - timedelta(days=int(keep_days))
+    batch = max(1, _RETENTION_DELETE_BATCH // 10)
+    total = 0
+    last_id = 0
+    while True:
+        rows = await conn.fetch(
+            """
+            SELECT id FROM photos
+            WHERE id > $1
+              AND (is_deleted <> 0 OR (expires_at IS NOT NULL AND expires_at <= NOW()))
+            ORDER BY id
+            LIMIT $2
+            """,
+            int(last_id),
+            batch,
+        )
+        if not rows:
+            return total
+        photo_ids = [int(r["id"]) for r in rows]
+        res = await conn.execute(
+            "DELETE FROM photo_views WHERE photo_id = ANY($1::bigint[]) AND created_at < $2",
+            photo_ids,
+            cutoff,
+        )
+        total += int(res.split()[-1]) if res else 0
+        last_id = photo_ids[-1]
+        if len(photo_ids) < batch:
+            return total
+        await asyncio.sleep(0.05)
+
+
+async def run_log_maintenance() -> dict:
+    """Партиции логов: конвертация, партиции на будущее, retention. Один процесс за раз."""
+    p = _assert_pool()
+    out: dict[str, object] = {"converted": [], "pending": [], "dropped": [], "photo_views_deleted": 0}
+    async with p.acquire() as conn:
+        locked = await conn.fetchval("SELECT pg_try_advisory_lock(hashtext($1))", _PARTITION_LOCK_KEY)
+        if not locked:
+            return out
+        try:
+            raw = await conn.fetchval("SELECT value FROM admin_settings WHERE key=$1", _TS_BACKFILL_DONE_KEY)
+            ts_done = set(json.loads(raw) if isinstance(raw, str) else (raw or []))
+            now_d = get_bot_now().date()
+            ahead = now_d
+            for _ in range(_PARTITION_MONTHS_AHEAD + 1):
+                ahead = _next_month(ahead)
+            for table, spec in _PARTITIONED_LOGS.items():
+                try:
+                    if await _partition_convert(conn, table, spec, ts_done):
+                        out["converted"].append(table)
+                    if await _relkind(conn, table) != "p":
+                        out["pending"].append(table)
+                        continue
+                    await _ensure_month_partitions(conn, table, now_d, ahead)
+                    out["dropped"].extend(
+                        await _partition_retention(
+                            conn,
+                            table,
+                            int(LOG_RETENTION_DAYS.get(table, 0)),
+                            table in LOG_RETENTION_ARCHIVE,
+                        )
+                    )
+                except Exception:
+                    logger.exception("db.partitions.maintenance_failed", extra={"table": table})
+            try:
+                out["photo_views_deleted"] = await _photo_views_retention(
+                    conn, int(LOG_RETENTION_DAYS.get("photo_views", 0))
+                )
+            except Exception:
+                logger.exception("db.partitions.photo_views_retention_failed")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext($1))", _PARTITION_LOCK_KEY)
+    return out
+
+
 # --- premium / new / blocked ---
 
 
@@ -9979,36 +12843,9 @@ async def ensure_user_minimal_row(tg_id: int, username: str | None = None) -> di
 
 # -------------------- Notifications settings (likes/comments) --------------------
 
-async def _ensure_notify_tables(conn) -> None:
-    """Create notification tables if they don't exist (safe for Postgres)."""
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS user_notify_settings (
-            tg_id BIGINT PRIMARY KEY,
-            likes_enabled BOOLEAN NOT NULL DEFAULT TRUE,
-            comments_enabled BOOLEAN NOT NULL DEFAULT TRUE,
-            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-        );
-        """
-    )
-
-    await conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS notify_likes_daily (
-            tg_id BIGINT NOT NULL,
-            day_key TEXT NOT NULL,
-            likes_count INTEGER NOT NULL DEFAULT 0,
-            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-            PRIMARY KEY (tg_id, day_key)
-        );
-        """
-    )
-
-
 async def get_notify_settings_by_tg_id(tg_id: int) -> dict:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_notify_tables(conn)
         await conn.execute(
             """
             INSERT INTO user_notify_settings (tg_id)
@@ -10029,7 +12866,6 @@ async def get_notify_settings_by_tg_id(tg_id: int) -> dict:
 async def toggle_likes_notify_by_tg_id(tg_id: int) -> dict:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_notify_tables(conn)
         await conn.execute(
             """
             INSERT INTO user_notify_settings (tg_id)
@@ -10054,7 +12890,6 @@ async def toggle_likes_notify_by_tg_id(tg_id: int) -> dict:
 async def toggle_comments_notify_by_tg_id(tg_id: int) -> dict:
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_notify_tables(conn)
         await conn.execute(
             """
             INSERT INTO user_notify_settings (tg_id)
@@ -10080,7 +12915,6 @@ async def increment_likes_daily_for_tg_id(tg_id: int, day_key: str, delta: int =
     """Accumulate likes for daily summary notifications."""
     p = _assert_pool()
     async with p.acquire() as conn:
-        await _ensure_notify_tables(conn)
         await conn.execute(
             """
             INSERT INTO notify_likes_daily (tg_id, day_key, likes_count)
@@ -87,15 +87,13 @@ async def get_all_time_top(limit: int = 50, min_votes: int = ALL_TIME_MIN_VOTES)
                     ph.is_deleted,
                     u.username,
                     u.name AS author_name,
-                    COUNT(r.id)::int AS ratings_count,
-                    COALESCE(SUM(r.value * CASE WHEN r.source='link' THEN $5 ELSE 1 END), 0)::float AS ratings_sum,
-                    COALESCE(SUM(CASE WHEN r.source='link' THEN $5 ELSE 1 END), 0)::float AS ratings_weighted_count
+                    (ph.ratings_direct_count + ph.ratings_link_count)::int AS ratings_count,
+                    (ph.ratings_direct_sum + ph.ratings_link_sum * $5::float)::float AS ratings_sum,
+                    (ph.ratings_direct_count + ph.ratings_link_count * $5::float)::float AS ratings_weighted_count
                 FROM photos ph
-                LEFT JOIN ratings r ON r.photo_id = ph.id
                 LEFT JOIN users u ON u.id = ph.user_id
                 WHERE ph.is_deleted = 0
                   AND ph.moderation_status IN ('active','good')
-                GROUP BY ph.id, ph.user_id, ph.title, ph.file_id_public, ph.file_id, ph.created_at, ph.moderation_status, ph.is_deleted, u.username, u.name
             ),
             filtered AS (
                 SELECT *,
@@ -161,15 +159,13 @@ async def get_all_time_user_rank(user_id: int, min_votes: int = ALL_TIME_MIN_VOT
                     ph.is_deleted,
                     u.username,
                     u.name AS author_name,
-                    COUNT(r.id)::int AS ratings_count,
-                    COALESCE(SUM(r.value * CASE WHEN r.source='link' THEN $5 ELSE 1 END), 0)::float AS ratings_sum,
-                    COALESCE(SUM(CASE WHEN r.source='link' THEN $5 ELSE 1 END), 0)::float AS ratings_weighted_count
+                    (ph.ratings_direct_count + ph.ratings_link_count)::int AS ratings_count,
+                    (ph.ratings_direct_sum + ph.ratings_link_sum * $5::float)::float AS ratings_sum,
+                    (ph.ratings_direct_count + ph.ratings_link_count * $5::float)::float AS ratings_weighted_count
                 FROM photos ph
-                LEFT JOIN ratings r ON r.photo_id = ph.id
                 LEFT JOIN users u ON u.id = ph.user_id
                 WHERE ph.is_deleted = 0
                   AND ph.moderation_status IN ('active','good')
-                GROUP BY ph.id, ph.user_id, ph.title, ph.file_id_public, ph.file_id, ph.created_at, ph.moderation_status, ph.is_deleted, u.username, u.name
             ),
             filtered AS (
                 SELECT *,
@@ -224,7 +220,6 @@ async def update_hall_of_fame_from_top(top_items: list[dict]) -> None:
     if not top_items:
         return
     p = _pool()
-    await ensure_hof_schema()
     async with p.acquire() as conn:
         # Build quick status map for photos
         photo_ids = [int(i.get("photo_id")) for i in top_items if i.get("photo_id")]
@@ -299,7 +294,6 @@ async def update_hall_of_fame_from_top(top_items: list[dict]) -> None:
 async def refresh_hof_statuses() -> None:
     """Refresh statuses for all hall_of_fame rows based on current photo state."""
     p = _pool()
-    await ensure_hof_schema()
     async with p.acquire() as conn:
         await conn.execute(
             """
@@ -323,7 +317,6 @@ async def refresh_hof_statuses() -> None:
 
 async def get_hof_items(limit: int = 50) -> list[dict]:
     p = _pool()
-    await ensure_hof_schema()
     async with p.acquire() as conn:
         rows = await conn.fetch(
             """
@@ -633,7 +626,6 @@ async def upsert_results_items(
     """Upsert a full ordered list of result items. Places are taken from items[i]['place'] or enumerate+1."""
     p = _pool()
     async with p.acquire() as conn:
-        await ensure_results_schema()
         # Upsert each row (lists are small: top-10/top-50)
         place_num = 1
         for it in items:
@@ -683,7 +675,6 @@ async def get_results_items(
 ) -> list[dict]:
     p = _pool()
     async with p.acquire() as conn:
-        await ensure_results_schema()
         rows = await conn.fetch(
             """
             SELECT place, photo_id, user_id, score, payload
@@ -713,7 +704,6 @@ async def has_results(
 ) -> bool:
     p = _pool()
     async with p.acquire() as conn:
-        await ensure_results_schema()
         row = await conn.fetchrow(
             """
             SELECT 1
@@ -9,10 +9,8 @@ from __future__ import annotations
 import asyncio
 from typing import Optional
 
-from aiogram import Router, F, Bot
-from aiogram.client.default import DefaultBotProperties
+from aiogram import Router, F
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.enums import ParseMode
 from aiogram.types import CallbackQuery, Message
 from datetime import datetime
 from utils.time import get_moscow_now
@@ -21,23 +19,17 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from .common import _ensure_admin, BroadcastStates
 from database import (
-    get_moderators,
-    get_support_users,
-    get_helpers,
-    get_all_users_tg_ids,
-    get_premium_users,
     get_user_by_tg_id_any,
     create_scheduled_broadcast,
     list_scheduled_broadcasts,
     cancel_scheduled_broadcast,
+    create_broadcast_job,
+    cancel_broadcast_job,
+    get_broadcast_job_progress,
 )
-from config import BOT_TOKEN
 
 router = Router()
 
-# Сколько задержки между отправками (чтобы не словить flood)
-_SEND_DELAY_SEC = 0.05
-_PRIMARY_BROADCAST_BOT: Bot | None = None
 _SCHEDULED_PAGE_LIMIT = 10
 
 
@@ -78,27 +70,6 @@ def _parse_schedule_datetime(raw: str) -> datetime | None:
     return None
 
 
-def _get_send_bot(current_bot: Bot) -> Bot:
-    """
-    В саппорт-боте отправляем рассылку через основной бот (BOT_TOKEN),
-    чтобы сообщения приходили от него. В обычном режиме возвращаем текущий.
-    """
-    global _PRIMARY_BROADCAST_BOT
-    try:
-        current_token = current_bot.token  # type: ignore[attr-defined]
-    except Exception:
-        current_token = None
-
-    if BOT_TOKEN and current_token != BOT_TOKEN:
-        if _PRIMARY_BROADCAST_BOT is None:
-            _PRIMARY_BROADCAST_BOT = Bot(
-                BOT_TOKEN,
-                default=DefaultBotProperties(parse_mode=ParseMode.HTML),
-            )
-        return _PRIMARY_BROADCAST_BOT
-    return current_bot
-
-
 def _audience_label(target: str) -> str:
     if target == "all":
         return "всем пользователям"
@@ -687,7 +658,7 @@ async def admin_broadcast_cancel(callback: CallbackQuery, state: FSMContext):
 async def admin_broadcast_send(callback: CallbackQuery, state: FSMContext):
     """
     Подтверждение отправки рассылки.
-    Реально шлём сообщение выбранной аудитории с кнопкой «Просмотрено».
+    Ставим рассылку в очередь движка (services.broadcast) и показываем прогресс.
     """
     data = await state.get_data()
     target = data.get("broadcast_target")
@@ -709,102 +680,128 @@ async def admin_broadcast_send(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         return
 
-    # Собираем аудиторию
-    tg_ids: list[int] = []
-
-    def _is_valid_user(u: dict) -> bool:
-        # Фильтр: активный (is_deleted=0), не заблокирован, есть имя
-        if not u:
-            return False
-        if u.get("is_deleted"):
-            return False
-        if u.get("is_blocked"):
-            return False
-        name = (u.get("name") or "").strip()
-        if not name:
-            return False
-        return True
-
-    if target == "all":
-        # get_all_users_tg_ids уже фильтрует is_deleted/is_blocked/empty name
-        tg_ids = await get_all_users_tg_ids()
-    elif target == "premium":
-        users = await get_premium_users()
-        tg_ids = [int(u["tg_id"]) for u in users if u.get("tg_id") and _is_valid_user(u)]
-    elif target == "test":
-        tg_ids = [callback.from_user.id]
-    elif target == "moderators":
-        users = await get_moderators()
-        tg_ids = [int(u["tg_id"]) for u in users if u.get("tg_id")]
-    elif target == "support":
-        users = await get_support_users()
-        tg_ids = [int(u["tg_id"]) for u in users if u.get("tg_id")]
-    elif target == "helpers":
-        users = await get_helpers()
-        tg_ids = [int(u["tg_id"]) for u in users if u.get("tg_id")]
-
-    # Убираем дубликаты и нули
-    tg_ids = list({uid for uid in tg_ids if uid})
-
-    if target == "all":
-        header = ""
-    elif target == "premium":
-        header = "💎 <b>Сообщение для GlowShot Premium</b>"
-    elif target == "test":
-        header = "🧪 <b>Тестовая рассылка</b>"
-    else:
-        header = "👥 <b>Сообщение для команды GlowShot</b>"
+    await state.clear()
 
-    send_text = text_body if not header else f"{header}\n\n{text_body}"
+    try:
+        job = await create_broadcast_job(
+            target=str(target),
+            text=str(text_body),
+            created_by_tg_id=int(callback.from_user.id),
+            with_seen_button=True,
+        )
+    except Exception as e:
+        await callback.answer(f"Не удалось запустить рассылку: {e}", show_alert=True)
+        return
 
-    notif_kb = InlineKeyboardBuilder()
-    notif_kb.button(text="✅ Просмотрено", callback_data="admin:notif_read")
-    notif_kb.adjust(1)
-    notif_markup = notif_kb.as_markup()
+    await _render_job_progress(callback, int(job["id"]), chat_id=chat_id, msg_id=msg_id)
+    await callback.answer("Рассылка запущена")
 
-    total = len(tg_ids)
-    sent = 0
-    send_bot = _get_send_bot(callback.message.bot)
 
-    for uid in tg_ids:
-        try:
-            await send_bot.send_message(
-                chat_id=uid,
-                text=send_text,
-                reply_markup=notif_markup,
-            )
-            sent += 1
-        except Exception:
-            # заблокировал бота / ограничил сообщения и т.п. — просто пропускаем
-            continue
+# =============================================================
+# ==== ПРОГРЕСС РАССЫЛКИ ======================================
+# =============================================================
 
-    await state.clear()
+def _format_eta(seconds: float | None) -> str:
+    if seconds is None:
+        return "—"
+    sec = int(seconds)
+    if sec < 60:
+        return f"~{sec} с"
+    if sec < 3600:
+        return f"~{sec // 60} мин"
+    return f"~{sec // 3600} ч {sec % 3600 // 60} мин"
+
+
+def _job_progress_text(job: dict) -> str:
+    status = str(job.get("status") or "")
+    title = {
+        "running": "📤 Рассылка идёт",
+        "done": "✅ Рассылка завершена",
+        "cancelled": "⛔ Рассылка остановлена",
+    }.get(status, f"Рассылка: {status}")
+    total = int(job.get("total_count") or 0)
+    done = int(job.get("processed_count") or 0)
+    pct = int(done * 100 / total) if total else 100
+    lines = [
+        f"<b>{title}</b> (#{job.get('id')})",
+        f"Аудитория: {_audience_label(str(job.get('target') or ''))}",
+        "",
+        f"Обработано: <b>{done}</b> из <b>{total}</b> ({pct}%)",
+        f"✅ Доставлено: <b>{int(job.get('sent_count') or 0)}</b>",
+        f"🚫 Заблокировали бота: <b>{int(job.get('blocked_count') or 0)}</b>",
+        f"⚠️ Ошибки: <b>{int(job.get('failed_count') or 0)}</b>",
+    ]
+    if status == "running":
+        lines.append("")
+        lines.append(f"Скорость: <b>{float(job.get('rate_per_sec') or 0):.1f}</b> сообщ./с")
+        lines.append(f"Осталось: {_format_eta(job.get('eta_seconds'))}")
+    return "\n".join(lines)
 
-    summary = (
-        "✅ Рассылка завершена.\n\n"
-        f"Всего получателей в выборке: <b>{total}</b>.\n"
-        f"Успешно отправлено (по данным Telegram) как минимум <b>{sent}</b> пользователям.\n\n"
-        "Можешь вернуться в раздел «Рассылка» или в главное админ-меню."
-    )
 
+def _job_progress_kb(job: dict):
     kb = InlineKeyboardBuilder()
+    job_id = int(job["id"])
+    if job.get("status") == "running":
+        kb.button(text="🔄 Обновить", callback_data=f"admin:broadcast:job:{job_id}")
+        kb.button(text="⛔ Остановить", callback_data=f"admin:broadcast:job:stop:{job_id}")
     kb.button(text="📢 В раздел «Рассылка»", callback_data="admin:broadcast")
     kb.button(text="⬅️ В админ-меню", callback_data="admin:menu")
-    kb.adjust(1, 1)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+async def _render_job_progress(
+    callback: CallbackQuery,
+    job_id: int,
+    *,
+    chat_id: int | None = None,
+    msg_id: int | None = None,
+) -> None:
+    job = await get_broadcast_job_progress(int(job_id))
+    if not job:
+        await callback.answer("Рассылка не найдена.", show_alert=True)
+        return
+    text = _job_progress_text(job)
+    kb = _job_progress_kb(job)
+    chat_id = chat_id or callback.message.chat.id
+    msg_id = msg_id or callback.message.message_id
+    try:
+        await callback.message.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=msg_id,
+            text=text,
+            reply_markup=kb,
+        )
+    except TelegramBadRequest as e:
+        # «message is not modified» — прогресс не сдвинулся, это ок
+        if "not modified" not in str(e):
+            await callback.message.answer(text, reply_markup=kb)
+    except Exception:
+        await callback.message.answer(text, reply_markup=kb)
+
 
+@router.callback_query(F.data.startswith("admin:broadcast:job:stop:"))
+async def admin_broadcast_job_stop(callback: CallbackQuery, state: FSMContext):
+    user = await _ensure_admin(callback)
+    if user is None:
+        return
     try:
-        if chat_id and msg_id:
-            await callback.message.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=msg_id,
-                text=summary,
-                reply_markup=kb.as_markup(),
-            )
-        else:
-            await callback.message.answer(summary, reply_markup=kb.as_markup())
+        job_id = int(callback.data.rsplit(":", 1)[-1])
     except Exception:
-        await callback.message.answer(summary, reply_markup=kb.as_markup())
+        await callback.answer("Некорректная рассылка.", show_alert=True)
+        return
+    await cancel_broadcast_job(job_id)
+    await _render_job_progress(callback, job_id)
+    await callback.answer("Рассылка остановлена")
+
 
+@router.callback_query(F.data.regexp(r"^admin:broadcast:job:\d+$"))
+async def admin_broadcast_job_refresh(callback: CallbackQuery, state: FSMContext):
+    user = await _ensure_admin(callback)
+    if user is None:
+        return
+    job_id = int(callback.data.rsplit(":", 1)[-1])
+    await _render_job_progress(callback, job_id)
     await callback.answer()
 
 
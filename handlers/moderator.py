@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from aiogram import Router, F, Bot
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InputMediaPhoto, BufferedInputFile
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InputMediaPhoto
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.state import State, StatesGroup
@@ -10,7 +10,6 @@ from aiogram.fsm.context import FSMContext
 from datetime import timedelta, datetime
 from utils.time import get_moscow_now, format_party_id
 from html import escape
-import io
 
 from database import (
     get_user_by_tg_id,
@@ -32,10 +31,9 @@ from database import (
     get_user_by_username,
     hide_active_photos_for_user,
     restore_photos_from_status,
-    set_photo_file_id_support,
     get_moderation_author_metrics,
 )
-from config import BOT_TOKEN, SUPPORT_BOT_TOKEN
+from services import media_identity
 from utils.moderation import (
     REPORT_REASON_LABELS,
     MODERATION_REASON_TEXTS,
@@ -46,80 +44,6 @@ from utils.moderation import (
 # Роутер раздела модерации
 router = Router()
 
-_main_media_bot: Bot | None = None
-
-
-def _is_support_bot(bot: Bot) -> bool:
-    try:
-        return bool(SUPPORT_BOT_TOKEN) and getattr(bot, "token", None) == SUPPORT_BOT_TOKEN
-    except Exception:
-        return False
-
-
-async def _get_main_media_bot() -> Bot | None:
-    global _main_media_bot
-    if not BOT_TOKEN:
-        return None
-    if _main_media_bot is None:
-        _main_media_bot = Bot(BOT_TOKEN)
-    return _main_media_bot
-
-
-async def _download_photo_bytes_from_main_bot(file_id: str) -> bytes | None:
-    main_bot = await _get_main_media_bot()
-    if main_bot is None:
-        return None
-    try:
-        tg_file = await main_bot.get_file(file_id)
-        buff = io.BytesIO()
-        await main_bot.download_file(tg_file.file_path, destination=buff)
-        return buff.getvalue()
-    except Exception:
-        return None
-
-
-async def _send_photo_with_fallback(
-    *,
-    bot: Bot,
-    chat_id: int,
-    file_id: str,
-    caption: str,
-    reply_markup: InlineKeyboardMarkup,
-    parse_mode: str = "HTML",
-) -> tuple[bool, str | None]:
-    try:
-        await bot.send_photo(
-            chat_id=chat_id,
-            photo=file_id,
-            caption=caption,
-            reply_markup=reply_markup,
-            parse_mode=parse_mode,
-            disable_notification=True,
-        )
-        return True, None
-    except Exception:
-        pass
-
-    if _is_support_bot(bot):
-        data = await _download_photo_bytes_from_main_bot(file_id)
-        if data:
-            try:
-                sent = await bot.send_photo(
-                    chat_id=chat_id,
-                    photo=BufferedInputFile(data, filename="photo.jpg"),
-                    caption=caption,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode,
-                    disable_notification=True,
-                )
-                support_file_id = sent.photo[-1].file_id if sent and sent.photo else None
-                return True, support_file_id
-            except Exception:
-                pass
-
-    return False, None
-
-
 class ModeratorStates(StatesGroup):
     """Состояния FSM для модератора."""
     # Ввод причины удаления/бана
@@ -194,7 +118,7 @@ def build_moderation_photo_keyboard(photo_id: int, source: str) -> InlineKeyboar
     kb.button(text="🗑 Удалить", callback_data=f"mod:photo_delete:{source}:{photo_id}")
     kb.button(text="⛔ Удалить + бан", callback_data=f"mod:photo_delete_ban:{source}:{photo_id}")
     kb.button(text="👤 Автор", callback_data=f"mod:photo_profile:{source}:{photo_id}")
-    kb.button(text="⏭ Следующее", callback_data=f"mod:next:{source}")
+    kb.button(text="⏭ Следующее", callback_data=f"mod:next:{source}:{photo_id}")
     kb.button(text="⬅️ Меню", callback_data="mod:menu")
     kb.adjust(1)
     return kb.as_markup()
@@ -533,14 +457,6 @@ async def _build_self_check_caption(photo: dict) -> str:
     return await _build_moderation_caption(photo, show_reports=True, show_stats=True)
 
 
-def _pick_photo_file_id(photo: dict, bot: Bot) -> str | None:
-    is_support = _is_support_bot(bot)
-    if is_support and photo.get("file_id_support"):
-        return str(photo.get("file_id_support"))
-    raw = photo.get("file_id_public") or photo.get("file_id")
-    return str(raw) if raw else None
-
-
 async def _render_moderation_photo(
     callback: CallbackQuery,
     *,
@@ -550,7 +466,8 @@ async def _render_moderation_photo(
     source = _normalize_source(source)
     caption = await _build_moderation_caption(photo, show_reports=True, show_stats=True)
     kb = build_moderation_photo_keyboard(int(photo["id"]), source=source)
-    file_id = _pick_photo_file_id(photo, callback.message.bot)
+    # file_id, который этот бот может показать без переноса картинки (у бота поддержки — свой)
+    file_id = media_identity.cached_file_id(photo, callback.message.bot)
 
     if callback.message.photo and file_id:
         try:
@@ -562,7 +479,7 @@ async def _render_moderation_photo(
         except Exception:
             pass
 
-    if callback.message.photo and not file_id:
+    if callback.message.photo and not media_identity.main_file_id(photo):
         await _edit_or_replace_text(
             callback,
             text=caption + "\n\n⚠️ Не удалось получить file_id фотографии.",
@@ -575,19 +492,14 @@ async def _render_moderation_photo(
     except Exception:
         pass
 
-    if file_id:
-        sent, new_support_id = await _send_photo_with_fallback(
-            bot=callback.message.bot,
+    if media_identity.main_file_id(photo):
+        sent = await media_identity.send_photo(
+            callback.message.bot,
             chat_id=callback.message.chat.id,
-            file_id=file_id,
+            photo=photo,
             caption=caption,
             reply_markup=kb,
         )
-        if new_support_id:
-            try:
-                await set_photo_file_id_support(int(photo["id"]), str(new_support_id))
-            except Exception:
-                pass
         if sent:
             return
 
@@ -611,22 +523,28 @@ async def _show_empty_moderation_source(callback: CallbackQuery, source: str) ->
     await _edit_or_replace_text(callback, text=text, reply_markup=build_moderator_menu())
 
 
-async def _get_next_photo_by_source(callback: CallbackQuery, source: str) -> dict | None:
+async def _get_next_photo_by_source(
+    callback: CallbackQuery,
+    source: str,
+    *,
+    release_photo_id: int | None = None,
+) -> dict | None:
+    # фото выдаются под аренду конкретному модератору — параллельные модераторы не пересекаются
     src = _normalize_source(source)
+    user = await get_user_by_tg_id(callback.from_user.id)
+    if not user:
+        await callback.answer("Сначала зарегистрируйся в боте через /start.", show_alert=True)
+        return None
     if src == "self":
-        user = await get_user_by_tg_id(callback.from_user.id)
-        if not user:
-            await callback.answer("Сначала зарегистрируйся в боте через /start.", show_alert=True)
-            return None
-        return await get_next_photo_for_self_moderation(int(user["id"]))
+        return await get_next_photo_for_self_moderation(int(user["id"]), release_photo_id=release_photo_id)
     if src == "deep":
-        return await get_next_photo_for_detailed_moderation()
-    return await get_next_photo_for_moderation()
+        return await get_next_photo_for_detailed_moderation(int(user["id"]), release_photo_id=release_photo_id)
+    return await get_next_photo_for_moderation(int(user["id"]), release_photo_id=release_photo_id)
 
 
-async def _show_next_by_source(callback: CallbackQuery, source: str) -> None:
+async def _show_next_by_source(callback: CallbackQuery, source: str, *, release_photo_id: int | None = None) -> None:
     src = _normalize_source(source)
-    photo = await _get_next_photo_by_source(callback, src)
+    photo = await _get_next_photo_by_source(callback, src, release_photo_id=release_photo_id)
     if not photo:
         await _show_empty_moderation_source(callback, src)
         return
@@ -1304,7 +1222,14 @@ async def moderator_next_by_source(callback: CallbackQuery) -> None:
         return
     parts = (callback.data or "").split(":")
     source = _normalize_source(parts[2] if len(parts) > 2 else "queue")
-    await _show_next_by_source(callback, source)
+    # mod:next:<source>:<photo_id> — пропущенное фото отпускаем другим модераторам
+    release_photo_id = None
+    if len(parts) > 3:
+        try:
+            release_photo_id = int(parts[3])
+        except Exception:
+            release_photo_id = None
+    await _show_next_by_source(callback, source, release_photo_id=release_photo_id)
     await callback.answer()
 
 
@@ -1607,7 +1532,7 @@ async def moderator_photo_skip_legacy(callback: CallbackQuery) -> None:
         photo_id=photo_id,
         action=f"{_normalize_source(source)}:skip",
     )
-    await _show_next_by_source(callback, source)
+    await _show_next_by_source(callback, source, release_photo_id=photo_id)
     await callback.answer("Пропущено")
 
 
@@ -2132,14 +2057,14 @@ async def moderator_ban_reason_input(message: Message, state: FSMContext) -> Non
 
     # Показываем следующий экран в том же режиме.
     next_photo = None
-    if source == "self":
-        user = await get_user_by_tg_id(message.from_user.id)
-        if user:
+    user = await get_user_by_tg_id(message.from_user.id)
+    if user:
+        if source == "self":
             next_photo = await get_next_photo_for_self_moderation(int(user["id"]))
-    elif source == "deep":
-        next_photo = await get_next_photo_for_detailed_moderation()
-    else:
-        next_photo = await get_next_photo_for_moderation()
+        elif source == "deep":
+            next_photo = await get_next_photo_for_detailed_moderation(int(user["id"]))
+        else:
+            next_photo = await get_next_photo_for_moderation(int(user["id"]))
 
     if not next_photo:
         empty_text = (
@@ -2159,20 +2084,14 @@ async def moderator_ban_reason_input(message: Message, state: FSMContext) -> Non
         return
 
     caption = await _build_moderation_caption(next_photo, show_reports=True, show_stats=True)
-    file_id = _pick_photo_file_id(next_photo, message.bot)
-    if file_id:
-        sent, new_support_id = await _send_photo_with_fallback(
-            bot=message.bot,
+    if media_identity.main_file_id(next_photo):
+        sent = await media_identity.send_photo(
+            message.bot,
             chat_id=message.chat.id,
-            file_id=file_id,
+            photo=next_photo,
             caption=caption,
             reply_markup=build_moderation_photo_keyboard(int(next_photo["id"]), source=source),
         )
-        if new_support_id:
-            try:
-                await set_photo_file_id_support(int(next_photo["id"]), str(new_support_id))
-            except Exception:
-                pass
         if not sent:
             await message.bot.send_message(
                 chat_id=message.chat.id,
@@ -2097,6 +2097,10 @@ async def profile_settings_toggle_lang(callback: CallbackQuery):
 
     user = await get_user_by_tg_id(tg_id)
     lang = _get_lang(user)
+    if user:
+        # заготовленная карточка оценки собрана на старом языке
+        from handlers.rate import drop_prefetched_rating_card
+        drop_prefetched_rating_card(int(user["id"]))
     notify = await get_notify_settings_by_tg_id(tg_id)
     streak_status = await get_profile_streak_status(tg_id)
     ads_enabled = await get_ads_enabled_by_tg_id(tg_id)
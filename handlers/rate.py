@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import time
 
 from aiogram import Router, F
 from aiogram.dispatcher.event.bases import SkipHandler
@@ -26,6 +28,8 @@ from utils.moderation import (
 )
 
 from database import (
+    feed_photo_invalidated_since,
+    submit_rating,
     get_user_by_tg_id,
     get_random_photo_for_rating,
     add_rating,
@@ -34,6 +38,8 @@ from database import (
     get_photo_report_stats,
     set_photo_moderation_status,
     get_photo_by_id,
+    get_photo_if_still_rateable,
+    record_feed_impression,
     get_user_by_id,
     is_user_premium_active,
     get_awards_for_user,
@@ -538,7 +544,19 @@ async def build_mod_report_caption(
     return "\n".join(lines)
 
 
-async def _deny_if_full_banned(callback: CallbackQuery | None = None, message: Message | None = None) -> bool:
+async def _load_rater(tg_id: int, user_ctx: dict | None = None) -> dict | None:
+    """Строка юзера из user_ctx (кладёт UserContextMiddleware), иначе — запрос в БД."""
+    if user_ctx is not None and user_ctx.get("tg_id") == int(tg_id):
+        return user_ctx.get("user")
+    return await get_user_by_tg_id(int(tg_id))
+
+
+async def _deny_if_full_banned(
+    callback: CallbackQuery | None = None,
+    message: Message | None = None,
+    *,
+    user_ctx: dict | None = None,
+) -> bool:
     actor_id = None
     if callback is not None:
         actor_id = callback.from_user.id
@@ -548,10 +566,13 @@ async def _deny_if_full_banned(callback: CallbackQuery | None = None, message: M
     if not actor_id:
         return False
 
-    try:
-        block = await get_user_block_status_by_tg_id(int(actor_id))
-    except Exception:
-        return False
+    if user_ctx is not None and user_ctx.get("tg_id") == int(actor_id):
+        block = user_ctx
+    else:
+        try:
+            block = await get_user_block_status_by_tg_id(int(actor_id))
+        except Exception:
+            return False
 
     is_blocked = bool(block.get("is_blocked"))
     until_str = block.get("block_until")
@@ -622,6 +643,30 @@ _RATE_ONES_DAILY_HARD_CAP = int(RATE_ONES_DAILY_HARD_CAP)
 _RATE_ONES_DAILY_RATIO = float(RATE_ONES_DAILY_RATIO)
 
 
+_RATE_SPAM_BLOCK_TEXT = (
+    "Сегодня достаточно плохих оценок.\n\n"
+    "Сделай паузу и возвращайся позже."
+)
+
+
+def _rate_ones_blocked(ones: int, total: int, *, value: int) -> bool:
+    """Лимит «единиц» за день: (ones, total) — оценки из ленты за сегодня, value — текущая."""
+    if ones >= _RATE_ONES_DAILY_HARD_CAP:
+        return True
+    if total >= _RATE_ONES_DAILY_MIN_TOTAL and ones >= _RATE_ONES_DAILY_LIMIT:
+        ratio = (ones / total) if total > 0 else 0.0
+        return ratio >= _RATE_ONES_DAILY_RATIO
+    if value == 1:
+        ones_next = ones + 1
+        total_next = total + 1
+        if ones_next >= _RATE_ONES_DAILY_HARD_CAP:
+            return True
+        if total_next >= _RATE_ONES_DAILY_MIN_TOTAL and ones_next >= _RATE_ONES_DAILY_LIMIT:
+            ratio_next = (ones_next / total_next) if total_next > 0 else 0.0
+            return ratio_next >= _RATE_ONES_DAILY_RATIO
+    return False
+
+
 async def _check_rate_spam_block(user: dict, *, value: int) -> tuple[bool, str | None]:
     if not user:
         return False, None
@@ -635,24 +680,7 @@ async def _check_rate_spam_block(user: dict, *, value: int) -> tuple[bool, str |
     except Exception:
         return False, None
 
-    blocked = False
-    if ones >= _RATE_ONES_DAILY_HARD_CAP:
-        blocked = True
-    elif total >= _RATE_ONES_DAILY_MIN_TOTAL and ones >= _RATE_ONES_DAILY_LIMIT:
-        ratio = (ones / total) if total > 0 else 0.0
-        if ratio >= _RATE_ONES_DAILY_RATIO:
-            blocked = True
-    elif value == 1:
-        ones_next = ones + 1
-        total_next = total + 1
-        if ones_next >= _RATE_ONES_DAILY_HARD_CAP:
-            blocked = True
-        elif total_next >= _RATE_ONES_DAILY_MIN_TOTAL and ones_next >= _RATE_ONES_DAILY_LIMIT:
-            ratio_next = (ones_next / total_next) if total_next > 0 else 0.0
-            if ratio_next >= _RATE_ONES_DAILY_RATIO:
-                blocked = True
-
-    if not blocked:
+    if not _rate_ones_blocked(ones, total, value=value):
         return False, None
 
     try:
@@ -665,11 +693,7 @@ async def _check_rate_spam_block(user: dict, *, value: int) -> tuple[bool, str |
     except Exception:
         pass
 
-    msg = (
-        "Сегодня достаточно плохих оценок.\n\n"
-        "Сделай паузу и возвращайся позже."
-    )
-    return True, msg
+    return True, _RATE_SPAM_BLOCK_TEXT
 
 
 def _plural_ru(value: int, one: str, few: str, many: str) -> str:
@@ -916,8 +940,14 @@ async def _build_rate_view(
     return caption, kb, is_rateable
 
 
-async def _build_next_rating_card(rater_user_id: int, viewer_tg_id: int, *, show_ad: bool = False) -> RatingCard:
-    photo = await get_random_photo_for_rating(rater_user_id)
+async def _build_next_rating_card(
+    rater_user_id: int,
+    viewer_tg_id: int,
+    *,
+    show_ad: bool = False,
+    record_view: bool = True,
+) -> RatingCard:
+    photo = await get_random_photo_for_rating(rater_user_id, record_view=record_view)
     if photo is None:
         viewer_user = await get_user_by_id(int(rater_user_id))
         lang = _lang(viewer_user)
@@ -930,6 +960,116 @@ async def _build_next_rating_card(rater_user_id: int, viewer_tg_id: int, *, show
 
     return await _build_rating_card_from_photo(photo, rater_user_id, viewer_tg_id, show_ad=show_ad)
 
+
+# -------------------- prefetched next card --------------------
+# Пока юзер смотрит текущую карточку, следующую (caption, клавиатура, file_id, protect)
+# собираем в фоне. На тап остаётся проверить, что она ещё валидна, и отправить.
+# Фон только выбирает фото: просмотр, views_count и seq ленты пишутся в момент показа
+# (record_feed_impression), иначе выброшенная заготовка «сжигала» бы фото для зрителя.
+
+_NEXT_CARD_TTL_SECONDS = 90.0    # меньше TTL отметок инвалидации в database (120с)
+_NEXT_CARD_WAIT_SECONDS = 2.0    # сколько ждём недостроенную фоновую карточку
+_NEXT_CARD_MAX_RATERS = 5000
+
+# rater users.id -> (monotonic ts, show_ad, card)
+_NEXT_CARDS: dict[int, tuple[float, bool, RatingCard]] = {}
+_NEXT_CARD_TASKS: dict[int, asyncio.Task] = {}
+
+
+def drop_prefetched_rating_card(rater_user_id: int | None = None) -> None:
+    """Выбросить заготовленную карточку (например, после смены языка)."""
+    if rater_user_id is None:
+        _NEXT_CARDS.clear()
+    else:
+        _NEXT_CARDS.pop(int(rater_user_id), None)
+
+
+async def _rate_show_ad(rate_cards_seen: int) -> bool:
+    ad_cfg = await get_effective_ads_settings()
+    freq = int(ad_cfg.get("frequency_n") or 3)
+    if freq <= 0:
+        freq = 1
+    return bool(ad_cfg.get("enabled", True)) and ((int(rate_cards_seen) + 1) % int(freq) == 0)
+
+
+async def _prefetch_next_card_bg(rater_user_id: int, viewer_tg_id: int, rate_cards_seen: int) -> None:
+    try:
+        show_ad = await _rate_show_ad(rate_cards_seen)
+        card = await _build_next_rating_card(
+            rater_user_id,
+            viewer_tg_id=viewer_tg_id,
+            show_ad=show_ad,
+            record_view=False,
+        )
+    except Exception:
+        return
+    finally:
+        if _NEXT_CARD_TASKS.get(rater_user_id) is asyncio.current_task():
+            _NEXT_CARD_TASKS.pop(rater_user_id, None)
+    if card.photo is None:
+        # «фото нет» не кэшируем — новые могут появиться в любой момент
+        return
+    if len(_NEXT_CARDS) >= _NEXT_CARD_MAX_RATERS:
+        border = time.monotonic() - _NEXT_CARD_TTL_SECONDS
+        for key in [k for k, (ts, _, _) in _NEXT_CARDS.items() if ts < border]:
+            _NEXT_CARDS.pop(key, None)
+        if len(_NEXT_CARDS) >= _NEXT_CARD_MAX_RATERS:
+            _NEXT_CARDS.pop(next(iter(_NEXT_CARDS)), None)
+    _NEXT_CARDS[rater_user_id] = (time.monotonic(), bool(show_ad), card)
+
+
+def _schedule_next_card_prefetch(rater_user_id: int, viewer_tg_id: int, rate_cards_seen: int) -> None:
+    key = int(rater_user_id)
+    task = _NEXT_CARD_TASKS.get(key)
+    if (task is not None and not task.done()) or key in _NEXT_CARDS:
+        return
+    _NEXT_CARD_TASKS[key] = asyncio.create_task(
+        _prefetch_next_card_bg(key, int(viewer_tg_id), int(rate_cards_seen))
+    )
+
+
+async def _take_prefetched_card(rater_user_id: int, viewer_tg_id: int, *, show_ad: bool) -> RatingCard | None:
+    """Заготовленная карточка, если она ещё годится; иначе None (и вызывающий строит сам)."""
+    key = int(rater_user_id)
+    task = _NEXT_CARD_TASKS.get(key)
+    if task is not None and not task.done():
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=_NEXT_CARD_WAIT_SECONDS)
+        except Exception:
+            return None
+    entry = _NEXT_CARDS.pop(key, None)
+    if entry is None:
+        return None
+    created_at, card_show_ad, card = entry
+    photo = card.photo or {}
+    try:
+        photo_id = int(photo.get("id") or 0)
+        author_id = int(photo["user_id"]) if photo.get("user_id") is not None else None
+    except Exception:
+        return None
+    if photo_id <= 0:
+        return None
+
+    fresh = (time.monotonic() - created_at) <= _NEXT_CARD_TTL_SECONDS
+    if fresh and feed_photo_invalidated_since(photo_id, author_id, created_at):
+        return None
+    # Перед показом перепроверяем строку по БД: удалить/заблокировать фото могли в другом процессе.
+    try:
+        current = await get_photo_if_still_rateable(photo_id, key)
+        if not current or not await record_feed_impression(key, photo):
+            return None
+    except Exception:
+        return None
+    same_mode = (current.get("ratings_enabled") in (None, 1)) == (photo.get("ratings_enabled") in (None, 1))
+    if fresh and same_mode and card_show_ad == bool(show_ad):
+        return card
+    # протухла или поменялась рекламная вставка — перерисовываем подпись по свежей строке
+    try:
+        return await _build_rating_card_from_photo(current, key, int(viewer_tg_id), show_ad=show_ad)
+    except Exception:
+        return None
+
+
 def _build_rate_reply_keyboard(lang: str = "ru") -> ReplyKeyboardMarkup:
     """Reply‑клавиатура для оценок 1–10."""
     row1 = [KeyboardButton(text=str(i)) for i in range(1, 6)]
@@ -1891,12 +2031,43 @@ async def build_rate_caption(
 
     return "\n".join(lines)
 
+async def _prepare_next_rating_card(
+    user_id: int,
+    viewer_tg_id: int,
+    state: FSMContext | None,
+) -> tuple[RatingCard, int]:
+    """Выбор следующей карточки (с учётом частоты рекламы). Возвращает (card, rate_cards_seen)."""
+    rate_cards_seen = 0
+    try:
+        if state is not None:
+            st = await state.get_data()
+            if st.get("rate_cards_seen") is not None:
+                rate_cards_seen = max(0, int(st.get("rate_cards_seen") or 0))
+            else:
+                ui_state = await get_user_ui_state(int(viewer_tg_id))
+                rate_cards_seen = max(0, int(ui_state.get("rate_cards_seen") or 0))
+        else:
+            ui_state = await get_user_ui_state(int(viewer_tg_id))
+            rate_cards_seen = max(0, int(ui_state.get("rate_cards_seen") or 0))
+    except Exception:
+        rate_cards_seen = 0
+
+    show_ad = await _rate_show_ad(rate_cards_seen)
+    card = await _take_prefetched_card(user_id, viewer_tg_id, show_ad=show_ad)
+    if card is None:
+        card = await _build_next_rating_card(user_id, viewer_tg_id=viewer_tg_id, show_ad=show_ad)
+    return card, rate_cards_seen
+
+
 async def show_next_photo_for_rating(
     callback: CallbackQuery | Message,
     user_id: int,
     *,
     replace_message: bool = False,
     state: FSMContext | None = None,
+    prefetched: "asyncio.Task[tuple[RatingCard, int]] | None" = None,
+    skip_photo_id: int | None = None,
+    user_ctx: dict | None = None,
 ) -> None:
     """
     Показать следующую фотографию для оценивания, стараясь переиспользовать текущее сообщение.
@@ -1905,10 +2076,15 @@ async def show_next_photo_for_rating(
     • Если фотография есть:
       – если текущее сообщение уже с фото — меняем медиа;
       – если текущее сообщение текстовое — удаляем его и отправляем новое с фото.
+
+    `prefetched` — задача _prepare_next_rating_card, запущенная заранее (параллельно с записью
+    оценки). Если она упала или вернула `skip_photo_id` (только что оценённое фото) — выбираем заново.
     """
     is_cb = isinstance(callback, CallbackQuery)
     if is_cb:
-        if await _deny_if_full_banned(callback=callback):
+        if await _deny_if_full_banned(callback=callback, user_ctx=user_ctx):
+            if prefetched is not None:
+                prefetched.cancel()
             return
         bot = callback.message.bot
         chat_id = callback.message.chat.id
@@ -1917,7 +2093,9 @@ async def show_next_photo_for_rating(
         old_msg = callback.message
         viewer_tg_id = int(callback.from_user.id)
     else:
-        if await _deny_if_full_banned(message=callback):
+        if await _deny_if_full_banned(message=callback, user_ctx=user_ctx):
+            if prefetched is not None:
+                prefetched.cancel()
             return
         bot = callback.bot
         chat_id = callback.chat.id
@@ -1937,29 +2115,22 @@ async def show_next_photo_for_rating(
             except Exception:
                 msg_id = None
 
-    viewer = await get_user_by_tg_id(viewer_tg_id)
-
-    rate_cards_seen = 0
-    try:
-        if state is not None:
-            st = await state.get_data()
-            if st.get("rate_cards_seen") is not None:
-                rate_cards_seen = max(0, int(st.get("rate_cards_seen") or 0))
-            else:
-                ui_state = await get_user_ui_state(int(viewer_tg_id))
-                rate_cards_seen = max(0, int(ui_state.get("rate_cards_seen") or 0))
-        else:
-            ui_state = await get_user_ui_state(int(viewer_tg_id))
-            rate_cards_seen = max(0, int(ui_state.get("rate_cards_seen") or 0))
-    except Exception:
-        rate_cards_seen = 0
-
-    ad_cfg = await get_effective_ads_settings()
-    freq = int(ad_cfg.get("frequency_n") or 3)
-    if freq <= 0:
-        freq = 1
-    show_ad = bool(ad_cfg.get("enabled", True)) and ((rate_cards_seen + 1) % int(freq) == 0)
-    card = await _build_next_rating_card(user_id, viewer_tg_id=viewer_tg_id, show_ad=show_ad)
+    prepared: tuple[RatingCard, int] | None = None
+    if prefetched is not None:
+        try:
+            prepared = await prefetched
+        except Exception:
+            prepared = None
+        if (
+            prepared is not None
+            and skip_photo_id is not None
+            and prepared[0].photo is not None
+            and int(prepared[0].photo.get("id") or 0) == int(skip_photo_id)
+        ):
+            prepared = None
+    if prepared is None:
+        prepared = await _prepare_next_rating_card(user_id, viewer_tg_id, state)
+    card, rate_cards_seen = prepared
 
     if state is not None:
         data = await state.get_data()
@@ -2015,6 +2186,8 @@ async def show_next_photo_for_rating(
 
     if card.photo is not None:
         new_seen = rate_cards_seen + 1
+        # пока смотрит эту — готовим следующую
+        _schedule_next_card_prefetch(int(user_id), int(viewer_tg_id), int(new_seen))
         try:
             await set_user_rate_cards_seen(int(viewer_tg_id), int(new_seen))
         except Exception:
@@ -3071,7 +3244,7 @@ async def rate_report_text(message: Message, state: FSMContext) -> None:
     return
 
 @router.callback_query(F.data.startswith("rate:score:"))
-async def rate_score(callback: CallbackQuery, state: FSMContext) -> None:
+async def rate_score(callback: CallbackQuery, state: FSMContext, user_ctx: dict | None = None) -> None:
     if should_throttle(callback.from_user.id, "rate:score", 0.4):
         try:
             await callback.answer()
@@ -3103,38 +3276,79 @@ async def rate_score(callback: CallbackQuery, state: FSMContext) -> None:
         await callback.answer("Оценка должна быть от 1 до 10.", show_alert=True)
         return
 
-    user = await get_user_by_tg_id(callback.from_user.id)
+    user = await _load_rater(callback.from_user.id, user_ctx)
     if user is None:
         await callback.answer("Тебя нет в базе, попробуй /start.", show_alert=True)
         return
-    blocked, block_msg = await _check_rate_spam_block(user, value=value)
-    if blocked:
+
+    # Голос, кредиты, анти-спам, стрик, лайки автору и рефералка — одной транзакцией.
+    is_staff = bool(user.get("is_admin") or user.get("is_moderator"))
+    try:
+        outcome = await submit_rating(
+            voter_user_id=int(user["id"]),
+            voter_tg_id=int(callback.from_user.id),
+            photo_id=int(photo_id),
+            value=int(value),
+            day_key=str(_moscow_day_key()),
+            spam_guard=None if is_staff else (lambda ones, total: _rate_ones_blocked(ones, total, value=value)),
+        )
+    except Exception as e:
+        try:
+            await log_bot_error(
+                chat_id=callback.message.chat.id if callback.message else None,
+                tg_user_id=callback.from_user.id if callback.from_user else None,
+                handler="rate_score:submit_rating",
+                update_type="callback",
+                error_type=type(e).__name__,
+                error_text=str(e),
+                traceback_text=traceback.format_exc(),
+            )
+        except Exception:
+            pass
+        try:
+            await callback.answer("Не удалось сохранить оценку. Попробуй ещё раз.", show_alert=True)
+        except Exception:
+            pass
+        return
+
+    status = outcome.get("status")
+    if status == "blocked":
         try:
             await _show_rate_block_banner(
                 bot=callback.message.bot,
                 chat_id=callback.message.chat.id,
                 state=state,
-                text=block_msg or "Сегодня лимит оценок исчерпан. Попробуй позже.",
+                text=_RATE_SPAM_BLOCK_TEXT,
             )
             await callback.answer()
         except Exception:
             pass
         return
 
-    photo = await get_photo_by_id(photo_id)
-    if photo is None or photo.get("is_deleted"):
+    # Следующую карточку выбираем только после принятой оценки: выбор пишет просмотр и двигает
+    # курсор ленты, отклонённый голос не должен сжигать следующее фото. Параллельно с ним идут
+    # комментарий и уведомления ниже.
+    next_card = asyncio.create_task(
+        _prepare_next_rating_card(int(user["id"]), int(callback.from_user.id), state)
+    )
+
+    if status == "not_found":
         await callback.answer("Фото не найдено.", show_alert=True)
-        await show_next_photo_for_rating(callback, user["id"], state=state)
+        await show_next_photo_for_rating(
+            callback, user["id"], state=state, prefetched=next_card, skip_photo_id=photo_id, user_ctx=user_ctx
+        )
         await _clear_rate_comment_draft(state)
         return
 
-    if not bool(photo.get("ratings_enabled", True)):
+    if status == "ratings_disabled":
         await callback.answer("Автор отключил оценки для этого фото.", show_alert=True)
         try:
             await mark_viewonly_seen(int(user["id"]), int(photo_id))
         except Exception:
             pass
-        await show_next_photo_for_rating(callback, user["id"], state=state)
+        await show_next_photo_for_rating(
+            callback, user["id"], state=state, prefetched=next_card, skip_photo_id=photo_id, user_ctx=user_ctx
+        )
         await _clear_rate_comment_draft(state)
         return
 
@@ -3156,90 +3370,31 @@ async def rate_score(callback: CallbackQuery, state: FSMContext) -> None:
             handler="rate_score:create_comment",
         )
 
-        if photo is not None:
-            author_user_id = photo.get("user_id")
+        author_user_id = outcome.get("author_user_id")
+        author_tg_id = outcome.get("author_tg_id")
+        # Не шлём уведомление самому себе
+        if author_user_id and author_user_id != user["id"] and author_tg_id:
+            notify_text_lines = [
+                "🔔 <b>Новый комментарий к вашей фотографии</b>",
+                "",
+                f"Текст: {comment_text}",
+                f"Оценка: {value}",
+            ]
+            notify_text = "\n".join(notify_text_lines)
 
-            # Не шлём уведомление самому себе
-            if author_user_id and author_user_id != user["id"]:
-                try:
-                    author = await get_user_by_id(author_user_id)
-                except Exception:
-                    author = None
-
-                if author is not None:
-                    author_tg_id = author.get("tg_id")
-                    if author_tg_id:
-                        notify_text_lines = [
-                            "🔔 <b>Новый комментарий к вашей фотографии</b>",
-                            "",
-                            f"Текст: {comment_text}",
-                            f"Оценка: {value}",
-                        ]
-                        notify_text = "\n".join(notify_text_lines)
-
-                        try:
-                            await callback.message.bot.send_message(
-                                chat_id=author_tg_id,
-                                text=notify_text,
-                                reply_markup=build_comment_notification_keyboard(),
-                                parse_mode="HTML",
-                            )
-                        except Exception:
-                            # Если не получилось доставить уведомление автору — просто игнорируем.
-                            pass
-
-    # ✅ ВАЖНО: Всегда сохраняем оценку (даже если комментария не было)
-    try:
-        vote_saved = await add_rating(user["id"], photo_id, value)
-    except Exception as e:
-        try:
-            await log_bot_error(
-                chat_id=callback.message.chat.id if callback.message else None,
-                tg_user_id=callback.from_user.id if callback.from_user else None,
-                handler="rate_score:add_rating",
-                update_type="callback",
-                error_type=type(e).__name__,
-                error_text=str(e),
-                traceback_text=traceback.format_exc(),
-            )
-        except Exception:
-            pass
-        try:
-            await callback.answer("Не удалось сохранить оценку. Попробуй ещё раз.", show_alert=True)
-        except Exception:
-            pass
-        return
-    if vote_saved:
-        await _consume_author_impression_on_vote(photo, int(user["id"]))
-    # streak: rating counts as daily activity
-    try:
-        await streak_record_action_by_tg_id(int(callback.from_user.id), "rate")
-    except Exception:
-        pass
-        # notifications: accumulate likes for daily summary (best-effort)
-    try:
-        author_user_id = photo.get("user_id") if photo else None
-        if author_user_id and int(author_user_id) != int(user["id"]):
-            author = await get_user_by_id(int(author_user_id))
-            author_tg = (author or {}).get("tg_id")
-            if author_tg:
-                prefs = await get_notify_settings_by_tg_id(int(author_tg))
-                if bool(prefs.get("likes_enabled", True)):
-                    await increment_likes_daily_for_tg_id(int(author_tg), _moscow_day_key(), 1)
-    except Exception:
-        pass
-    # Рефералка: проверяем, не пора ли выдать бонусы
-    rewarded = False
-    referrer_tg_id = None
-    referee_tg_id = None
-    if vote_saved:
-        try:
-            rewarded, referrer_tg_id, referee_tg_id = await try_award_referral(user["tg_id"])
-        except Exception:
-            rewarded = False
-            referrer_tg_id = None
-            referee_tg_id = None
+            try:
+                await callback.message.bot.send_message(
+                    chat_id=author_tg_id,
+                    text=notify_text,
+                    reply_markup=build_comment_notification_keyboard(),
+                    parse_mode="HTML",
+                )
+            except Exception:
+                # Если не получилось доставить уведомление автору — просто игнорируем.
+                pass
 
+    # Рефералка: бонусы уже начислены внутри submit_rating, здесь только уведомления
+    rewarded, referrer_tg_id, referee_tg_id = outcome.get("referral") or (False, None, None)
     if rewarded:
         if referrer_tg_id:
             try:
@@ -3261,15 +3416,17 @@ async def rate_score(callback: CallbackQuery, state: FSMContext) -> None:
             except Exception:
                 pass
 
-    # Показываем следующую фотографию
-    await show_next_photo_for_rating(callback, user["id"], state=state)
+    # Показываем следующую фотографию (уже выбранную параллельно)
+    await show_next_photo_for_rating(
+        callback, user["id"], state=state, prefetched=next_card, skip_photo_id=photo_id, user_ctx=user_ctx
+    )
 
     # Чистим состояние (комментарий больше не нужен)
     await _clear_rate_comment_draft(state)
 
 
 @router.message(F.text & ~F.text.startswith("/"))
-async def rate_score_from_keyboard(message: Message, state: FSMContext) -> None:
+async def rate_score_from_keyboard(message: Message, state: FSMContext, user_ctx: dict | None = None) -> None:
     text = (message.text or "").strip()
     if text.startswith("/"):
         raise SkipHandler
@@ -3290,7 +3447,7 @@ async def rate_score_from_keyboard(message: Message, state: FSMContext) -> None:
             pass
         return
 
-    if await _deny_if_full_banned(message=message):
+    if await _deny_if_full_banned(message=message, user_ctx=user_ctx):
         return
     try:
         if not await require_user_name(message):
@@ -3302,7 +3459,7 @@ async def rate_score_from_keyboard(message: Message, state: FSMContext) -> None:
         data = await state.get_data()
         photo_id = data.get("rate_current_photo_id")
         if not photo_id:
-            user = await get_user_by_tg_id(message.from_user.id)
+            user = await _load_rater(message.from_user.id, user_ctx)
             try:
                 await message.delete()
             except Exception:
@@ -3317,7 +3474,7 @@ async def rate_score_from_keyboard(message: Message, state: FSMContext) -> None:
                 pass
             return
 
-        user = await get_user_by_tg_id(message.from_user.id)
+        user = await _load_rater(message.from_user.id, user_ctx)
         if user is None:
             try:
                 await message.delete()
@@ -3358,7 +3515,7 @@ async def rate_score_from_keyboard(message: Message, state: FSMContext) -> None:
     data = await state.get_data()
     photo_id = data.get("rate_current_photo_id")
     if not photo_id:
-        user = await get_user_by_tg_id(message.from_user.id)
+        user = await _load_rater(message.from_user.id, user_ctx)
         try:
             await message.delete()
         except Exception:
@@ -3374,7 +3531,7 @@ async def rate_score_from_keyboard(message: Message, state: FSMContext) -> None:
             pass
         return
 
-    user = await get_user_by_tg_id(message.from_user.id)
+    user = await _load_rater(message.from_user.id, user_ctx)
     if user is None:
         try:
             await message.delete()
@@ -387,7 +387,7 @@ async def _build_dynamic_main_menu(
 
     try:
         if user and user.get("id"):
-            candidate = await db.get_random_photo_for_rating(int(user["id"]))
+            candidate = await db.get_random_photo_for_rating(int(user["id"]), record_view=False)
             has_rate_targets = candidate is not None
     except Exception:
         has_rate_targets = True
@@ -1,8 +1,8 @@
 import io
+import logging
 import random
 import asyncio
 import re
-from PIL import Image  # type: ignore
 from utils.validation import has_links_or_usernames, has_promo_channel_invite
 from datetime import date, datetime, timedelta
 from asyncpg.exceptions import UniqueViolationError
@@ -63,11 +63,13 @@ from database_results import (
 )
 
 from utils.time import get_moscow_now, format_party_id
-from utils.watermark import apply_text_watermark
+from utils.image_pool import watermark_image, to_jpeg
+from utils.watermark import read_image_size
 from utils.ui import cleanup_previous_screen, remember_screen
 
 
 router = Router()
+logger = logging.getLogger(__name__)
 SECTION_BLOCKED_TEXT = (
     "Пока что вход в этот раздел запрещен. Возможно ведутся улучшения или исправления багов. "
     "Подождите пожалуйста!"
@@ -373,14 +375,12 @@ async def _accept_image_for_upload(message: Message, state: FSMContext, source:
         try:
             buf = await message.bot.download(message.document)
             raw_bytes = buf.read()
-            # Конвертируем документ в JPEG, чтобы Telegram принял как фото
+            # Конвертируем документ в JPEG, чтобы Telegram принял как фото (в пуле, не в event loop)
             try:
-                img = Image.open(io.BytesIO(raw_bytes))
-                img = img.convert("RGB")
-                out = io.BytesIO()
-                img.save(out, format="JPEG", quality=95, subsampling=0, optimize=True)
-                photo_bytes = out.getvalue()
+                photo_bytes = await to_jpeg(raw_bytes)
             except Exception:
+                photo_bytes = None
+            if photo_bytes is None:
                 # если не смогли конвертировать — используем как есть, может пройти
                 photo_bytes = raw_bytes
         except Exception:
@@ -996,11 +996,11 @@ def _photo_public_id(photo: dict) -> str:
 
 def _is_photo_quality_ok(image_bytes: bytes) -> tuple[bool, str | None]:
     """Проверяем базовое качество: разрешение не меньше 1200x800 (любая ориентация)."""
-    try:
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            w, h = img.size
-    except Exception:
+    # только заголовок, без декодирования пикселей — в event loop это дёшево
+    size = read_image_size(image_bytes)
+    if size is None:
         return False, "Не удалось прочитать изображение."
+    w, h = size
 
     min_side = min(w, h)
     max_side = max(w, h)
@@ -4075,12 +4075,20 @@ async def _finalize_photo_creation(event: Message | CallbackQuery, state: FSMCon
         )
         return
 
-    watermarked_bytes = apply_text_watermark(
-        original_bytes,
-        watermark_text,
-        highlight_text=wm_highlight,
-        max_side=4096,
-    )
+    try:
+        watermarked_bytes = await watermark_image(
+            original_bytes,
+            watermark_text,
+            highlight_text=wm_highlight,
+            max_side=4096,
+        )
+    except Exception as e:
+        # очередь переполнена / таймаут / упал воркер пула
+        logger.warning(
+            "upload.watermark_failed",
+            extra={"chat_id": chat_id, "error_type": type(e).__name__, "error": str(e)},
+        )
+        watermarked_bytes = None
     if not watermarked_bytes:
         await _show_upload_processing_error(
             state=state,
@@ -0,0 +1,63 @@
+-- Pre-aggregated counters for the admin activity dashboard.
+-- Filled incrementally from activity_events / bot_error_logs by database.refresh_activity_rollups
+-- (id watermark per source). Buckets are wall-clock time in the bot timezone.
+-- Safe to run multiple times.
+
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    name TEXT PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+INSERT INTO rollup_watermarks (name, last_id) VALUES ('activity_events', 0) ON CONFLICT (name) DO NOTHING;
+INSERT INTO rollup_watermarks (name, last_id) VALUES ('bot_error_logs', 0) ON CONFLICT (name) DO NOTHING;
+
+-- events per hour and section
+CREATE TABLE IF NOT EXISTS activity_rollup_hourly (
+    bucket TIMESTAMP NOT NULL,
+    section TEXT NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, section)
+);
+
+-- per-user daily counters: exact daily unique-user sets + top users + spam signals
+CREATE TABLE IF NOT EXISTS activity_rollup_user_daily (
+    day DATE NOT NULL,
+    user_id BIGINT NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    votes INTEGER NOT NULL DEFAULT 0,
+    uploads INTEGER NOT NULL DEFAULT 0,
+    reports INTEGER NOT NULL DEFAULT 0,
+    callback_events INTEGER NOT NULL DEFAULT 0,
+    message_events INTEGER NOT NULL DEFAULT 0,
+    peak_per_minute INTEGER NOT NULL DEFAULT 0,
+    active_minutes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, user_id)
+);
+
+-- per-user per-minute counts, only to keep peak_per_minute / active_minutes exact
+-- across batches; pruned after two days
+CREATE TABLE IF NOT EXISTS activity_rollup_user_minute (
+    minute TIMESTAMP NOT NULL,
+    user_id BIGINT NOT NULL,
+    cnt INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (minute, user_id)
+);
+
+-- errors per hour, type and handler
+CREATE TABLE IF NOT EXISTS error_rollup_hourly (
+    bucket TIMESTAMP NOT NULL,
+    error_type TEXT NOT NULL,
+    handler TEXT NOT NULL,
+    errors INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, error_type, handler)
+);
+
+-- per-user daily error counters (spam signals)
+CREATE TABLE IF NOT EXISTS error_rollup_user_daily (
+    day DATE NOT NULL,
+    tg_user_id BIGINT NOT NULL,
+    errors INTEGER NOT NULL DEFAULT 0,
+    bad_request INTEGER NOT NULL DEFAULT 0,
+    flood INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, tg_user_id)
+);
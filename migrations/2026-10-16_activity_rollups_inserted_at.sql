@@ -0,0 +1,17 @@
+-- Server-side insert time for the rollup lag (database._rollup_claim_range).
+-- created_ts is event time: the buffered activity writer stamps it at enqueue, a batch that is
+-- flushed (or retried) later lands with old timestamps above ids the rollup already passed.
+-- inserted_at is taken by the server at INSERT, so "younger than the lag" means what it says.
+-- Existing rows stay NULL (they are old), the column is added without a table rewrite.
+-- Safe to run multiple times.
+
+ALTER TABLE activity_events ADD COLUMN IF NOT EXISTS inserted_at TIMESTAMPTZ;
+ALTER TABLE activity_events ALTER COLUMN inserted_at SET DEFAULT clock_timestamp();
+ALTER TABLE bot_error_logs ADD COLUMN IF NOT EXISTS inserted_at TIMESTAMPTZ;
+ALTER TABLE bot_error_logs ALTER COLUMN inserted_at SET DEFAULT clock_timestamp();
+
+-- недоделанная конвертация на партиции (database._partition_convert) копирует колонки источника
+ALTER TABLE IF EXISTS activity_events__part ADD COLUMN IF NOT EXISTS inserted_at TIMESTAMPTZ;
+ALTER TABLE IF EXISTS activity_events__part ALTER COLUMN inserted_at SET DEFAULT clock_timestamp();
+ALTER TABLE IF EXISTS bot_error_logs__part ADD COLUMN IF NOT EXISTS inserted_at TIMESTAMPTZ;
+ALTER TABLE IF EXISTS bot_error_logs__part ALTER COLUMN inserted_at SET DEFAULT clock_timestamp();
@@ -0,0 +1,43 @@
+-- Broadcast engine: one job per broadcast plus one delivery row per recipient,
+-- so sending can be paced, checkpointed and resumed after a restart.
+-- Safe to run multiple times.
+
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    source TEXT NOT NULL DEFAULT 'manual',          -- manual | scheduled
+    scheduled_id BIGINT,
+    target TEXT NOT NULL,
+    text TEXT NOT NULL,
+    with_seen_button BOOLEAN NOT NULL DEFAULT TRUE,
+    status TEXT NOT NULL DEFAULT 'running',         -- running | done | cancelled
+    total_count INTEGER NOT NULL DEFAULT 0,
+    sent_count INTEGER NOT NULL DEFAULT 0,
+    failed_count INTEGER NOT NULL DEFAULT 0,
+    blocked_count INTEGER NOT NULL DEFAULT 0,
+    created_by_tg_id BIGINT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_broadcast_jobs_scheduled_id
+    ON broadcast_jobs (scheduled_id) WHERE scheduled_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status, id);
+
+CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+    job_id BIGINT NOT NULL REFERENCES broadcast_jobs(id) ON DELETE CASCADE,
+    tg_id BIGINT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',         -- pending | sending | sent | failed | blocked | cancelled
+    attempts SMALLINT NOT NULL DEFAULT 0,
+    retry_at TIMESTAMPTZ,
+    error_text TEXT,
+    updated_at TIMESTAMPTZ,
+    PRIMARY KEY (job_id, tg_id)
+);
+CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_pending
+    ON broadcast_deliveries (job_id, tg_id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_updated
+    ON broadcast_deliveries (job_id, updated_at);
+
+-- Users who blocked the bot (403 on send). Cleared on their next update.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS bot_blocked_at TIMESTAMPTZ;
@@ -0,0 +1,12 @@
+-- aiogram FSM state/data for utils.fsm_storage.PostgresStorage.
+-- data is a pickled dict (BYTEA); empty and stale rows are pruned by database.prune_fsm_storage.
+-- Safe to run multiple times.
+
+CREATE TABLE IF NOT EXISTS fsm_storage (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data BYTEA,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage (updated_at);
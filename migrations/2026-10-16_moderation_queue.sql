@@ -0,0 +1,26 @@
+-- Moderation work-queue (database.claim_next_photo_for_moderation).
+-- mod_claimed_by / mod_claim_until: lease of a moderator on a photo; an expired lease is
+-- simply eligible again, no cleanup needed. mod_skipped_by: last moderator who pressed
+-- "next" on the photo, so it goes to someone else first.
+-- Safe to run multiple times.
+
+ALTER TABLE photos ADD COLUMN IF NOT EXISTS mod_claimed_by BIGINT;
+ALTER TABLE photos ADD COLUMN IF NOT EXISTS mod_claim_until TIMESTAMPTZ;
+ALTER TABLE photos ADD COLUMN IF NOT EXISTS mod_skipped_by BIGINT;
+
+-- report / detailed queues: oldest first
+CREATE INDEX IF NOT EXISTS idx_photos_mod_review_queue
+    ON photos (moderation_status, created_at, id)
+    WHERE is_deleted = 0 AND moderation_status IN ('under_review', 'under_detailed_review');
+
+-- self-check sampler: random pivot + range scan over active ids
+CREATE INDEX IF NOT EXISTS idx_photos_mod_active_ids
+    ON photos (id)
+    WHERE is_deleted = 0 AND moderation_status = 'active';
+
+CREATE INDEX IF NOT EXISTS idx_photos_mod_claimed_by
+    ON photos (mod_claimed_by)
+    WHERE mod_claimed_by IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_moderator_reviews_moderator_photo
+    ON moderator_reviews (moderator_user_id, photo_id);
@@ -0,0 +1,7 @@
+-- Background rank engine (database.recompute_dirty_ranks) picks users by
+-- rank_updated_at: NULL = invalidated, old ISO timestamp = stale.
+-- Safe to run multiple times.
+
+CREATE INDEX IF NOT EXISTS idx_users_rank_updated_at
+    ON users (rank_updated_at ASC NULLS FIRST, id)
+    WHERE is_deleted = 0;
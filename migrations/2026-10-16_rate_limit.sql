@@ -0,0 +1,17 @@
+-- Shared flood-control state for utils.rate_limit.PostgresRateLimitBackend
+-- (RATE_LIMIT_BACKEND=postgres). UNLOGGED: counters are disposable.
+-- Safe to run multiple times.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_counters (
+    key TEXT NOT NULL,
+    window_start BIGINT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (key, window_start)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_counters_window ON rate_limit_counters (window_start);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_cooldowns (
+    key TEXT PRIMARY KEY,
+    until TIMESTAMPTZ NOT NULL
+);
@@ -0,0 +1,104 @@
+-- Runtime tables that used to be created lazily by database._ensure_* helpers
+-- on every call (ui state, settings, notify, broadcasts, feedback, moderation cards).
+-- Safe to run multiple times.
+
+-- UI state (menu / rating keyboard)
+CREATE TABLE IF NOT EXISTS user_ui_state (
+    tg_id BIGINT PRIMARY KEY,
+    menu_msg_id BIGINT,
+    rate_kb_msg_id BIGINT,
+    screen_msg_id BIGINT,
+    banner_msg_id BIGINT,
+    rate_cards_seen INTEGER NOT NULL DEFAULT 0,
+    rate_tutorial_seen BOOLEAN NOT NULL DEFAULT FALSE,
+    update_notice_seen_ver INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS screen_msg_id BIGINT;
+ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS banner_msg_id BIGINT;
+ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS rate_cards_seen INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS rate_tutorial_seen BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE user_ui_state ADD COLUMN IF NOT EXISTS update_notice_seen_ver INTEGER NOT NULL DEFAULT 0;
+
+-- App settings (tech / update mode, section access)
+CREATE TABLE IF NOT EXISTS app_settings (
+    id INTEGER PRIMARY KEY,
+    tech_enabled INTEGER NOT NULL DEFAULT 0,
+    tech_start_at TEXT,
+    update_enabled INTEGER NOT NULL DEFAULT 0,
+    update_notice_ver INTEGER NOT NULL DEFAULT 0,
+    update_notice_text TEXT,
+    updated_at TEXT NOT NULL
+);
+ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS update_enabled INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS update_notice_ver INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS update_notice_text TEXT;
+ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS upload_blocked INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS rating_blocked INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS results_blocked INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE app_settings ADD COLUMN IF NOT EXISTS profile_blocked INTEGER NOT NULL DEFAULT 0;
+INSERT INTO app_settings (id, tech_enabled, tech_start_at, updated_at)
+VALUES (1, 0, NULL, NOW()::text)
+ON CONFLICT (id) DO NOTHING;
+
+-- Admin key/value settings
+CREATE TABLE IF NOT EXISTS admin_settings (
+    key TEXT PRIMARY KEY,
+    value JSONB NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_admin_settings_updated_at ON admin_settings (updated_at DESC);
+
+-- Notifications settings (likes/comments)
+CREATE TABLE IF NOT EXISTS user_notify_settings (
+    tg_id BIGINT PRIMARY KEY,
+    likes_enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    comments_enabled BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE TABLE IF NOT EXISTS notify_likes_daily (
+    tg_id BIGINT NOT NULL,
+    day_key TEXT NOT NULL,
+    likes_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (tg_id, day_key)
+);
+
+-- Scheduled broadcasts
+CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
+    id BIGSERIAL PRIMARY KEY,
+    target TEXT NOT NULL,
+    text TEXT NOT NULL,
+    scheduled_at TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_by_tg_id BIGINT,
+    created_at TEXT NOT NULL,
+    sent_at TEXT,
+    total_count INTEGER,
+    sent_count INTEGER,
+    error_text TEXT,
+    updated_at TEXT
+);
+
+-- Feedback ideas
+CREATE TABLE IF NOT EXISTS feedback_ideas (
+    id BIGSERIAL PRIMARY KEY,
+    idea_code BIGINT UNIQUE NOT NULL,
+    tg_id BIGINT NOT NULL,
+    username TEXT,
+    text TEXT,
+    attachments JSONB,
+    status TEXT NOT NULL DEFAULT 'new',
+    cancel_reason TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_feedback_ideas_tg_id ON feedback_ideas (tg_id);
+
+-- Moderation chat message mapping (photo_id -> (chat_id, message_id))
+CREATE TABLE IF NOT EXISTS moderation_messages (
+    photo_id BIGINT PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    message_id BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
@@ -0,0 +1,64 @@
+-- Native timestamps for time-range queries (admin dashboards, rank activity window).
+-- created_at stays TEXT for existing readers; created_ts TIMESTAMPTZ is added next to it:
+--   * new rows get created_ts from a BEFORE INSERT/UPDATE trigger;
+--   * old rows are backfilled in small batches by database._ts_backfill_loop;
+--   * indexes on created_ts are built CONCURRENTLY after the backfill (not here,
+--     so this migration never holds a long lock on the big tables).
+-- Safe to run multiple times.
+
+CREATE OR REPLACE FUNCTION glowshot_text_to_ts(v TEXT) RETURNS TIMESTAMPTZ
+LANGUAGE plpgsql STABLE AS $$
+BEGIN
+    IF v IS NULL OR btrim(v) = '' THEN
+        RETURN NULL;
+    END IF;
+    RETURN v::timestamptz;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION glowshot_fill_created_ts() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.created_ts IS NULL THEN
+            NEW.created_ts := COALESCE(glowshot_text_to_ts(NEW.created_at), NOW());
+        END IF;
+    ELSIF NEW.created_at IS DISTINCT FROM OLD.created_at AND NEW.created_ts IS NOT DISTINCT FROM OLD.created_ts THEN
+        NEW.created_ts := COALESCE(glowshot_text_to_ts(NEW.created_at), NEW.created_ts);
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+ALTER TABLE activity_events ADD COLUMN IF NOT EXISTS created_ts TIMESTAMPTZ;
+ALTER TABLE bot_error_logs ADD COLUMN IF NOT EXISTS created_ts TIMESTAMPTZ;
+ALTER TABLE ratings ADD COLUMN IF NOT EXISTS created_ts TIMESTAMPTZ;
+ALTER TABLE comments ADD COLUMN IF NOT EXISTS created_ts TIMESTAMPTZ;
+ALTER TABLE streak_actions ADD COLUMN IF NOT EXISTS created_ts TIMESTAMPTZ;
+
+DROP TRIGGER IF EXISTS trg_activity_events_created_ts ON activity_events;
+CREATE TRIGGER trg_activity_events_created_ts
+    BEFORE INSERT OR UPDATE OF created_at ON activity_events
+    FOR EACH ROW EXECUTE FUNCTION glowshot_fill_created_ts();
+
+DROP TRIGGER IF EXISTS trg_bot_error_logs_created_ts ON bot_error_logs;
+CREATE TRIGGER trg_bot_error_logs_created_ts
+    BEFORE INSERT OR UPDATE OF created_at ON bot_error_logs
+    FOR EACH ROW EXECUTE FUNCTION glowshot_fill_created_ts();
+
+DROP TRIGGER IF EXISTS trg_ratings_created_ts ON ratings;
+CREATE TRIGGER trg_ratings_created_ts
+    BEFORE INSERT OR UPDATE OF created_at ON ratings
+    FOR EACH ROW EXECUTE FUNCTION glowshot_fill_created_ts();
+
+DROP TRIGGER IF EXISTS trg_comments_created_ts ON comments;
+CREATE TRIGGER trg_comments_created_ts
+    BEFORE INSERT OR UPDATE OF created_at ON comments
+    FOR EACH ROW EXECUTE FUNCTION glowshot_fill_created_ts();
+
+DROP TRIGGER IF EXISTS trg_streak_actions_created_ts ON streak_actions;
+CREATE TRIGGER trg_streak_actions_created_ts
+    BEFORE INSERT OR UPDATE OF created_at ON streak_actions
+    FOR EACH ROW EXECUTE FUNCTION glowshot_fill_created_ts();
@@ -0,0 +1,218 @@
+-- Materialized per-user profile stats (database.get_user_stats_overview reads one row).
+-- Kept incrementally by triggers on the tables the upload / rating / vote / finalize paths write:
+--   photos        (row)       uploads, votes_count/sum_score/views_count, deletions;
+--   votes         (row)       votes given by the voter, positive/total received by the author;
+--   result_ranks  (statement) best/avg rank and top-10 count, batched for set-based finalize.
+-- Triggers only UPDATE existing rows; rows are created and drift is corrected by
+-- database.reconcile_user_profile_stats (backfill after deploy + nightly job).
+-- Safe to run multiple times.
+
+CREATE TABLE IF NOT EXISTS user_profile_stats (
+    user_id BIGINT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    photos_uploaded INTEGER NOT NULL DEFAULT 0,
+    active_votes_total BIGINT NOT NULL DEFAULT 0,
+    active_views_total BIGINT NOT NULL DEFAULT 0,
+    rating_sum_all DOUBLE PRECISION NOT NULL DEFAULT 0,
+    rating_votes_all DOUBLE PRECISION NOT NULL DEFAULT 0,
+    votes_given INTEGER NOT NULL DEFAULT 0,
+    best_rank INTEGER,
+    rank_sum BIGINT NOT NULL DEFAULT 0,
+    rank_count INTEGER NOT NULL DEFAULT 0,
+    top10_count INTEGER NOT NULL DEFAULT 0,
+    positive_votes_received BIGINT NOT NULL DEFAULT 0,
+    votes_received BIGINT NOT NULL DEFAULT 0,
+    reconciled_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- rank and received-vote aggregates depend on photos.is_deleted: recomputed for one user
+-- when a photo is (un)deleted or a rank is changed/removed (rare).
+-- Legacy photos may carry users.tg_id in photos.user_id, so both ids are matched here.
+CREATE OR REPLACE FUNCTION glowshot_ups_refresh_derived(uid BIGINT) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE user_profile_stats s
+    SET best_rank = r.best_rank,
+        rank_sum = r.rank_sum,
+        rank_count = r.rank_count,
+        top10_count = r.top10_count,
+        positive_votes_received = v.positive_votes,
+        votes_received = v.total_votes,
+        updated_at = NOW()
+    FROM (
+        SELECT MIN(rr.final_rank)::int AS best_rank,
+               COALESCE(SUM(rr.final_rank), 0)::bigint AS rank_sum,
+               COUNT(*)::int AS rank_count,
+               COUNT(*) FILTER (WHERE rr.final_rank <= 10)::int AS top10_count
+        FROM result_ranks rr
+        JOIN photos p ON p.id = rr.photo_id
+        WHERE p.user_id = ANY(ARRAY[uid, (SELECT tg_id FROM users WHERE id = uid)]) AND p.is_deleted = 0
+    ) r,
+    (
+        SELECT COUNT(*) FILTER (WHERE v.score BETWEEN 6 AND 10)::bigint AS positive_votes,
+               COUNT(*)::bigint AS total_votes
+        FROM photos p
+        JOIN votes v ON v.photo_id = p.id
+        WHERE p.user_id = ANY(ARRAY[uid, (SELECT tg_id FROM users WHERE id = uid)]) AND p.is_deleted = 0
+    ) v
+    WHERE s.user_id = uid;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION glowshot_ups_photos() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.user_id = OLD.user_id THEN
+        UPDATE user_profile_stats
+        SET rating_sum_all = rating_sum_all + (NEW.sum_score - OLD.sum_score),
+            rating_votes_all = rating_votes_all + (NEW.votes_count - OLD.votes_count),
+            active_votes_total = active_votes_total
+                + CASE WHEN NEW.is_deleted = 0 THEN NEW.votes_count ELSE 0 END
+                - CASE WHEN OLD.is_deleted = 0 THEN OLD.votes_count ELSE 0 END,
+            active_views_total = active_views_total
+                + CASE WHEN NEW.is_deleted = 0 THEN NEW.views_count ELSE 0 END
+                - CASE WHEN OLD.is_deleted = 0 THEN OLD.views_count ELSE 0 END,
+            updated_at = NOW()
+        WHERE user_id = NEW.user_id;
+        IF NEW.is_deleted IS DISTINCT FROM OLD.is_deleted THEN
+            PERFORM glowshot_ups_refresh_derived(NEW.user_id);
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE user_profile_stats
+        SET photos_uploaded = photos_uploaded - 1,
+            rating_sum_all = rating_sum_all - OLD.sum_score,
+            rating_votes_all = rating_votes_all - OLD.votes_count,
+            active_votes_total = active_votes_total - CASE WHEN OLD.is_deleted = 0 THEN OLD.votes_count ELSE 0 END,
+            active_views_total = active_views_total - CASE WHEN OLD.is_deleted = 0 THEN OLD.views_count ELSE 0 END,
+            updated_at = NOW()
+        WHERE user_id = OLD.user_id;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        UPDATE user_profile_stats
+        SET photos_uploaded = photos_uploaded + 1,
+            rating_sum_all = rating_sum_all + NEW.sum_score,
+            rating_votes_all = rating_votes_all + NEW.votes_count,
+            active_votes_total = active_votes_total + CASE WHEN NEW.is_deleted = 0 THEN NEW.votes_count ELSE 0 END,
+            active_views_total = active_views_total + CASE WHEN NEW.is_deleted = 0 THEN NEW.views_count ELSE 0 END,
+            updated_at = NOW()
+        WHERE user_id = NEW.user_id;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        PERFORM glowshot_ups_refresh_derived(OLD.user_id);
+        PERFORM glowshot_ups_refresh_derived(NEW.user_id);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_photos_profile_stats ON photos;
+CREATE TRIGGER trg_photos_profile_stats
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, votes_count, sum_score, views_count, is_deleted ON photos
+    FOR EACH ROW EXECUTE FUNCTION glowshot_ups_photos();
+
+CREATE OR REPLACE FUNCTION glowshot_ups_vote_apply(v_photo_id BIGINT, v_voter_id BIGINT, v_score INTEGER, sign INTEGER) RETURNS void
+LANGUAGE plpgsql AS $$
+DECLARE
+    author_id BIGINT;
+BEGIN
+    UPDATE user_profile_stats
+    SET votes_given = votes_given + sign, updated_at = NOW()
+    WHERE user_id = v_voter_id;
+
+    SELECT p.user_id INTO author_id FROM photos p WHERE p.id = v_photo_id AND p.is_deleted = 0;
+    IF author_id IS NOT NULL THEN
+        UPDATE user_profile_stats
+        SET votes_received = votes_received + sign,
+            positive_votes_received = positive_votes_received
+                + CASE WHEN v_score BETWEEN 6 AND 10 THEN sign ELSE 0 END,
+            updated_at = NOW()
+        WHERE user_id = author_id;
+    END IF;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION glowshot_ups_votes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND NEW.photo_id = OLD.photo_id AND NEW.voter_id = OLD.voter_id
+       AND (NEW.score BETWEEN 6 AND 10) = (OLD.score BETWEEN 6 AND 10) THEN
+        RETURN NULL;  -- перезапись оценки без смены знака: счётчики не меняются
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM glowshot_ups_vote_apply(OLD.photo_id, OLD.voter_id, OLD.score, -1);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        PERFORM glowshot_ups_vote_apply(NEW.photo_id, NEW.voter_id, NEW.score, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_votes_profile_stats ON votes;
+CREATE TRIGGER trg_votes_profile_stats
+    AFTER INSERT OR DELETE OR UPDATE OF photo_id, voter_id, score ON votes
+    FOR EACH ROW EXECUTE FUNCTION glowshot_ups_votes();
+
+-- result_ranks: statement-level, one UPDATE per finalize chunk instead of one per photo
+CREATE OR REPLACE FUNCTION glowshot_ups_ranks_insert() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE user_profile_stats s
+    SET rank_sum = s.rank_sum + a.rank_sum,
+        rank_count = s.rank_count + a.rank_count,
+        top10_count = s.top10_count + a.top10_count,
+        best_rank = LEAST(COALESCE(s.best_rank, a.best_rank), a.best_rank),
+        updated_at = NOW()
+    FROM (
+        SELECT p.user_id,
+               MIN(n.final_rank)::int AS best_rank,
+               SUM(n.final_rank)::bigint AS rank_sum,
+               COUNT(*)::int AS rank_count,
+               COUNT(*) FILTER (WHERE n.final_rank <= 10)::int AS top10_count
+        FROM new_ranks n
+        JOIN photos p ON p.id = n.photo_id
+        WHERE p.is_deleted = 0
+        GROUP BY p.user_id
+    ) a
+    WHERE s.user_id = a.user_id;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION glowshot_ups_ranks_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    uid BIGINT;
+BEGIN
+    FOR uid IN
+        SELECT DISTINCT p.user_id FROM old_ranks o JOIN photos p ON p.id = o.photo_id
+    LOOP
+        PERFORM glowshot_ups_refresh_derived(uid);
+    END LOOP;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_result_ranks_profile_stats_ins ON result_ranks;
+CREATE TRIGGER trg_result_ranks_profile_stats_ins
+    AFTER INSERT ON result_ranks
+    REFERENCING NEW TABLE AS new_ranks
+    FOR EACH STATEMENT EXECUTE FUNCTION glowshot_ups_ranks_insert();
+
+DROP TRIGGER IF EXISTS trg_result_ranks_profile_stats_upd ON result_ranks;
+CREATE TRIGGER trg_result_ranks_profile_stats_upd
+    AFTER UPDATE ON result_ranks
+    REFERENCING OLD TABLE AS old_ranks
+    FOR EACH STATEMENT EXECUTE FUNCTION glowshot_ups_ranks_changed();
+
+DROP TRIGGER IF EXISTS trg_result_ranks_profile_stats_del ON result_ranks;
+CREATE TRIGGER trg_result_ranks_profile_stats_del
+    AFTER DELETE ON result_ranks
+    REFERENCING OLD TABLE AS old_ranks
+    FOR EACH STATEMENT EXECUTE FUNCTION glowshot_ups_ranks_changed();
+
+CREATE INDEX IF NOT EXISTS idx_user_profile_stats_reconciled ON user_profile_stats (reconciled_at NULLS FIRST);
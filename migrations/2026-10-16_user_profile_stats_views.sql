@@ -0,0 +1,62 @@
+-- user_profile_stats: stop maintaining view totals in the photos trigger.
+-- Every feed impression bumps photos.views_count, so the trigger turned each view into an
+-- UPDATE of the author's single stats row and serialised all viewers of a popular author
+-- on that row lock. View totals are now summed at read time (database.get_user_stats_overview,
+-- idx_photos_user_id), votes/ratings/uploads stay trigger-maintained.
+-- Safe to run multiple times.
+
+CREATE OR REPLACE FUNCTION glowshot_ups_photos() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.user_id = OLD.user_id THEN
+        IF NEW.votes_count IS NOT DISTINCT FROM OLD.votes_count
+           AND NEW.sum_score IS NOT DISTINCT FROM OLD.sum_score
+           AND NEW.is_deleted IS NOT DISTINCT FROM OLD.is_deleted THEN
+            RETURN NULL;  -- UPDATE OF перечисленной колонки без фактического изменения
+        END IF;
+        UPDATE user_profile_stats
+        SET rating_sum_all = rating_sum_all + (NEW.sum_score - OLD.sum_score),
+            rating_votes_all = rating_votes_all + (NEW.votes_count - OLD.votes_count),
+            active_votes_total = active_votes_total
+                + CASE WHEN NEW.is_deleted = 0 THEN NEW.votes_count ELSE 0 END
+                - CASE WHEN OLD.is_deleted = 0 THEN OLD.votes_count ELSE 0 END,
+            updated_at = NOW()
+        WHERE user_id = NEW.user_id;
+        IF NEW.is_deleted IS DISTINCT FROM OLD.is_deleted THEN
+            PERFORM glowshot_ups_refresh_derived(NEW.user_id);
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE user_profile_stats
+        SET photos_uploaded = photos_uploaded - 1,
+            rating_sum_all = rating_sum_all - OLD.sum_score,
+            rating_votes_all = rating_votes_all - OLD.votes_count,
+            active_votes_total = active_votes_total - CASE WHEN OLD.is_deleted = 0 THEN OLD.votes_count ELSE 0 END,
+            updated_at = NOW()
+        WHERE user_id = OLD.user_id;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        UPDATE user_profile_stats
+        SET photos_uploaded = photos_uploaded + 1,
+            rating_sum_all = rating_sum_all + NEW.sum_score,
+            rating_votes_all = rating_votes_all + NEW.votes_count,
+            active_votes_total = active_votes_total + CASE WHEN NEW.is_deleted = 0 THEN NEW.votes_count ELSE 0 END,
+            updated_at = NOW()
+        WHERE user_id = NEW.user_id;
+    END IF;
+    IF TG_OP = 'UPDATE' THEN
+        PERFORM glowshot_ups_refresh_derived(OLD.user_id);
+        PERFORM glowshot_ups_refresh_derived(NEW.user_id);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_photos_profile_stats ON photos;
+CREATE TRIGGER trg_photos_profile_stats
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, votes_count, sum_score, is_deleted ON photos
+    FOR EACH ROW EXECUTE FUNCTION glowshot_ups_photos();
+
+ALTER TABLE user_profile_stats DROP COLUMN IF EXISTS active_views_total;
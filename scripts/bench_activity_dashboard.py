@@ -0,0 +1,146 @@
+"""
+Бенчмарк дашборда активности: TEXT created_at + ::timestamp против created_ts TIMESTAMPTZ.
+
+Строит синтетический activity_events во временной схеме (по умолчанию 3 млн строк за 90 дней),
+гоняет запросы дашборда (overview / по часам / топ пользователей) за последние 24 часа
+в старом и новом виде и печатает медиану. Схема удаляется в конце.
+
+    DATABASE_URL=postgres://... python scripts/bench_activity_dashboard.py --rows 3000000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+
+_SCHEMA = "bench_activity"
+
+_QUERIES = {
+    "overview": (
+        """
+        SELECT COUNT(*)::int, COUNT(DISTINCT user_id)::int
+        FROM activity_events
+        WHERE created_at::timestamp >= $1::timestamp AND created_at::timestamp < $2::timestamp
+        """,
+        """
+        SELECT COUNT(*)::int, COUNT(DISTINCT user_id)::int
+        FROM activity_events
+        WHERE created_ts >= $1 AND created_ts < $2
+        """,
+    ),
+    "by_hour": (
+        """
+        SELECT date_trunc('hour', created_at::timestamp), COUNT(*)
+        FROM activity_events
+        WHERE created_at::timestamp >= $1::timestamp AND created_at::timestamp < $2::timestamp
+        GROUP BY 1 ORDER BY 1
+        """,
+        """
+        SELECT date_trunc('hour', created_ts AT TIME ZONE 'Europe/Moscow'), COUNT(*)
+        FROM activity_events
+        WHERE created_ts >= $1 AND created_ts < $2
+        GROUP BY 1 ORDER BY 1
+        """,
+    ),
+    "top_users": (
+        """
+        SELECT user_id, COUNT(*) AS cnt
+        FROM activity_events
+        WHERE created_at::timestamp >= $1::timestamp AND created_at::timestamp < $2::timestamp
+        GROUP BY user_id ORDER BY cnt DESC LIMIT 10
+        """,
+        """
+        SELECT user_id, COUNT(*) AS cnt
+        FROM activity_events
+        WHERE created_ts >= $1 AND created_ts < $2
+        GROUP BY user_id ORDER BY cnt DESC LIMIT 10
+        """,
+    ),
+}
+
+
+async def _setup(conn: asyncpg.Connection, rows: int, days: int) -> None:
+    await conn.execute(f"DROP SCHEMA IF EXISTS {_SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {_SCHEMA}")
+    await conn.execute(f"SET search_path TO {_SCHEMA}")
+    await conn.execute(
+        """
+        CREATE TABLE activity_events (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            kind TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            created_ts TIMESTAMPTZ
+        )
+        """
+    )
+    started = time.perf_counter()
+    await conn.execute(
+        """
+        INSERT INTO activity_events (user_id, kind, created_at, created_ts)
+        SELECT (random() * 50000)::bigint,
+               (ARRAY['message','callback','rate','upload'])[1 + (random() * 3)::int],
+               ts::text,
+               ts
+        FROM (
+            SELECT NOW() - random() * make_interval(days => $2) AS ts
+            FROM generate_series(1, $1)
+        ) g
+        """,
+        int(rows),
+        int(days),
+    )
+    # индексы как в проде: старые по TEXT и новые по created_ts
+    await conn.execute("CREATE INDEX ON activity_events (created_at)")
+    await conn.execute("CREATE INDEX ON activity_events (user_id, created_at)")
+    await conn.execute("CREATE INDEX ON activity_events (created_ts)")
+    await conn.execute("CREATE INDEX ON activity_events (user_id, created_ts)")
+    await conn.execute("ANALYZE activity_events")
+    print(f"setup: {rows} rows over {days} days in {time.perf_counter() - started:.1f}s")
+
+
+async def _time_query(conn: asyncpg.Connection, sql: str, args: tuple, repeat: int) -> float:
+    await conn.fetch(sql, *args)  # прогрев кэша
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await conn.fetch(sql, *args)
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(samples)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="не удалять схему после прогона")
+    args = parser.parse_args()
+
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("DATABASE_URL is not set")
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        await _setup(conn, args.rows, args.days)
+        end = datetime.now(timezone.utc)
+        start = end - timedelta(hours=24)
+        naive = (start.replace(tzinfo=None), end.replace(tzinfo=None))
+        print(f"{'query':<12}{'text ms':>12}{'tstz ms':>12}{'speedup':>10}")
+        for name, (old_sql, new_sql) in _QUERIES.items():
+            old_ms = await _time_query(conn, old_sql, naive, args.repeat)
+            new_ms = await _time_query(conn, new_sql, (start, end), args.repeat)
+            print(f"{name:<12}{old_ms:>12.1f}{new_ms:>12.1f}{old_ms / max(new_ms, 0.001):>9.1f}x")
+    finally:
+        if not args.keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {_SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
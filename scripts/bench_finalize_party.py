@@ -0,0 +1,203 @@
+"""
+Бенчмарк закрытия партии: старый построчный цикл против set-based чанков (database._FINALIZE_PARTY_CHUNK_SQL).
+
+Строит во временной схеме синтетический день (по умолчанию 100k истёкших фото, часть с выключенными
+оценками и без submit_day), закрывает его обоими способами на одинаковых копиях данных,
+печатает время и сверяет, что места в result_ranks совпадают. Схема удаляется в конце.
+
+    DATABASE_URL=postgres://... python scripts/bench_finalize_party.py --photos 100000
+
+SQL берётся из database.py, поэтому запускать в окружении бота (config читает переменные окружения).
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import _FINALIZE_PARTY_CHUNK_SQL  # noqa: E402
+
+_SCHEMA = "bench_finalize"
+
+
+async def _setup(conn: asyncpg.Connection, photos: int, day) -> None:
+    await conn.execute(f"DROP SCHEMA IF EXISTS {_SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {_SCHEMA}")
+    await conn.execute(f"SET search_path TO {_SCHEMA}")
+    await conn.execute(
+        """
+        CREATE TABLE photos (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            submit_day DATE,
+            expires_at TIMESTAMPTZ,
+            status TEXT NOT NULL DEFAULT 'active',
+            votes_count INTEGER NOT NULL DEFAULT 0,
+            avg_score NUMERIC(6,3) NOT NULL DEFAULT 0,
+            ratings_enabled INTEGER NOT NULL DEFAULT 1,
+            is_deleted INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+        """
+    )
+    await conn.execute(
+        """
+        CREATE TABLE result_ranks (
+            photo_id BIGINT NOT NULL,
+            submit_day DATE NOT NULL,
+            final_rank INTEGER NOT NULL,
+            finalized_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (photo_id, submit_day)
+        )
+        """
+    )
+    started = time.perf_counter()
+    await conn.execute(
+        """
+        INSERT INTO photos (user_id, submit_day, expires_at, votes_count, avg_score, ratings_enabled, created_at)
+        SELECT g,
+               CASE WHEN random() < 0.02 THEN NULL ELSE $2::date END,
+               NOW() - INTERVAL '1 minute',
+               (random() * 60)::int,
+               round((random() * 10)::numeric, 1),
+               CASE WHEN random() < 0.05 THEN 0 ELSE 1 END,
+               ($2::date + make_interval(secs => random() * 86399))::timestamp::text
+        FROM generate_series(1, $1) g
+        """,
+        int(photos),
+        day,
+    )
+    await conn.execute("CREATE INDEX ON photos (status, expires_at)")
+    await conn.execute("CREATE INDEX ON photos (submit_day, status)")
+    await conn.execute("CREATE TABLE photos_seed AS SELECT * FROM photos")
+    await conn.execute("ANALYZE photos")
+    print(f"setup: {photos} photos in {time.perf_counter() - started:.1f}s")
+
+
+async def _reset(conn: asyncpg.Connection) -> None:
+    await conn.execute("TRUNCATE result_ranks")
+    await conn.execute("UPDATE photos p SET status=s.status FROM photos_seed s WHERE s.id=p.id")
+    await conn.execute("VACUUM ANALYZE photos")
+
+
+async def _finalize_loop(conn: asyncpg.Connection, limit: int, today) -> None:
+    """Старая реализация finalize_party: места в Python, по запросу на фото."""
+    rank_by_day: dict[str, int] = {}
+    while True:
+        async with conn.transaction():
+            rows = await conn.fetch(
+                """
+                SELECT *
+                FROM photos
+                WHERE is_deleted=0
+                  AND COALESCE(status,'active')='active'
+                  AND (expires_at <= NOW())
+                ORDER BY submit_day NULLS LAST, avg_score DESC, votes_count DESC, created_at ASC, id ASC
+                LIMIT $1
+                """,
+                int(limit),
+            )
+            if not rows:
+                break
+            for r in rows:
+                sd = r.get("submit_day")
+                if sd is None:
+                    try:
+                        sd = datetime.fromisoformat(str(r.get("created_at"))).date()
+                    except Exception:
+                        sd = today
+                rank = None
+                if bool(r.get("ratings_enabled", 1)):
+                    rank_by_day[str(sd)] = rank_by_day.get(str(sd), 0) + 1
+                    rank = rank_by_day[str(sd)]
+                if rank is not None:
+                    await conn.execute(
+                        """
+                        INSERT INTO result_ranks (photo_id, submit_day, final_rank, finalized_at)
+                        VALUES ($1,$2,$3,NOW())
+                        ON CONFLICT (photo_id, submit_day)
+                        DO UPDATE SET final_rank=EXCLUDED.final_rank, finalized_at=EXCLUDED.finalized_at
+                        """,
+                        int(r["id"]),
+                        sd,
+                        rank,
+                    )
+                await conn.execute("UPDATE photos SET status='archived' WHERE id=$1", int(r["id"]))
+        if len(rows) < limit:
+            break
+
+
+async def _finalize_set(conn: asyncpg.Connection, limit: int, today) -> None:
+    rank_by_day: dict = {}
+    while True:
+        async with conn.transaction():
+            rows = await conn.fetch(
+                _FINALIZE_PARTY_CHUNK_SQL,
+                None,
+                int(limit),
+                today,
+                list(rank_by_day.keys()),
+                list(rank_by_day.values()),
+            )
+        for r in rows:
+            if r["final_rank"] is not None:
+                rank_by_day[r["eff_day"]] = max(rank_by_day.get(r["eff_day"], 0), int(r["final_rank"]))
+        if len(rows) < limit:
+            break
+
+
+async def _ranks(conn: asyncpg.Connection) -> list:
+    return await conn.fetch("SELECT photo_id, submit_day, final_rank FROM result_ranks ORDER BY photo_id")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=100_000)
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--keep", action="store_true", help="не удалять схему после прогона")
+    args = parser.parse_args()
+
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("DATABASE_URL is not set")
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        today = datetime.now().date()
+        await _setup(conn, args.photos, today - timedelta(days=1))
+
+        started = time.perf_counter()
+        await _finalize_loop(conn, args.limit, today)
+        loop_s = time.perf_counter() - started
+        loop_ranks = await _ranks(conn)
+
+        await _reset(conn)
+        started = time.perf_counter()
+        await _finalize_set(conn, args.limit, today)
+        set_s = time.perf_counter() - started
+        set_ranks = await _ranks(conn)
+
+        # повторный прогон ничего не должен менять
+        await _finalize_set(conn, args.limit, today)
+        rerun_ranks = await _ranks(conn)
+
+        print(f"{'impl':<10}{'seconds':>10}{'ranks':>10}")
+        print(f"{'loop':<10}{loop_s:>10.2f}{len(loop_ranks):>10}")
+        print(f"{'set':<10}{set_s:>10.2f}{len(set_ranks):>10}")
+        print(f"speedup: {loop_s / max(set_s, 0.001):.1f}x")
+        print(f"identical ranks: {[tuple(r) for r in loop_ranks] == [tuple(r) for r in set_ranks]}")
+        print(f"idempotent: {[tuple(r) for r in set_ranks] == [tuple(r) for r in rerun_ranks]}")
+    finally:
+        if not args.keep:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {_SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
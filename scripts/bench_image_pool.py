@@ -0,0 +1,103 @@
+"""
+Бенчмарк задержки event loop при одновременных загрузках: водяной знак прямо в корутине
+(как было) против utils.image_pool (пул процессов).
+
+Генерирует синтетический JPEG (по умолчанию 6000x4000), запускает --uploads одновременных
+«загрузок» и параллельно меряет, насколько опаздывает тик event loop каждые 5 мс.
+Печатает p50/p99/max задержки и общее время.
+
+    python scripts/bench_image_pool.py --uploads 16 --side 6000
+
+Нужны Pillow и переменные окружения config (utils.image_pool читает настройки пула).
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+
+from PIL import Image  # type: ignore[import]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.image_pool import shutdown_image_pool, watermark_image  # noqa: E402
+from utils.watermark import apply_text_watermark  # noqa: E402
+
+_TICK_SECONDS = 0.005
+_TEXT = "Ⓒ 2026 Benchmark Author. ALL RIGHTS RESERVED"
+
+
+def _make_jpeg(width: int, height: int) -> bytes:
+    noise = Image.effect_noise((width, height), 48).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    img = Image.blend(noise, gradient, 0.6)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=92)
+    return out.getvalue()
+
+
+async def _lag_monitor(stop: asyncio.Event, samples: list[float]) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + _TICK_SECONDS
+        await asyncio.sleep(_TICK_SECONDS)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def _upload_inline(data: bytes) -> bytes:
+    await asyncio.sleep(0)
+    return apply_text_watermark(data, _TEXT, highlight_text="2026", max_side=4096)
+
+
+async def _upload_pool(data: bytes) -> bytes:
+    return await watermark_image(data, _TEXT, highlight_text="2026", max_side=4096)
+
+
+def _pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _run(name: str, upload, data: bytes, uploads: int) -> tuple[str, float, float, float, float]:
+    samples: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_lag_monitor(stop, samples))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(*(upload(data) for _ in range(uploads)))
+    total = time.perf_counter() - started
+    stop.set()
+    await monitor
+    lag_ms = [s * 1000 for s in samples]
+    return name, statistics.median(lag_ms) if lag_ms else 0.0, _pct(lag_ms, 0.99), max(lag_ms or [0.0]), total
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=16)
+    parser.add_argument("--side", type=int, default=6000, help="длинная сторона синтетического JPEG")
+    args = parser.parse_args()
+
+    data = _make_jpeg(int(args.side), int(args.side * 2 / 3))
+    print(f"image: {len(data) / 1e6:.1f} MB, uploads: {args.uploads}")
+
+    # прогрев пула (старт процессов и импорт Pillow не должны попасть в замер)
+    await _upload_pool(data)
+
+    rows = [
+        await _run("inline", _upload_inline, data, args.uploads),
+        await _run("pool", _upload_pool, data, args.uploads),
+    ]
+    print(f"{'impl':<8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'total s':>10}")
+    for name, p50, p99, worst, total in rows:
+        print(f"{name:<8}{p50:>10.1f}{p99:>10.1f}{worst:>10.1f}{total:>10.2f}")
+    shutdown_image_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""
+Бенчмарк и сверка статистики профиля: прежние агрегаты по photos/votes/result_ranks
+против чтения одной строки user_profile_stats (database.get_user_stats_overview).
+
+По умолчанию берёт самого «тяжёлого» автора (больше всего фото), можно --user id.
+Печатает медианное время обоих способов и расхождения значений. Код выхода 1, если
+значения не совпали. В базу ничего не пишет (кроме разового бэкфилла отсутствующей строки).
+
+    python scripts/bench_profile_stats.py --runs 50
+
+Запускать в окружении бота (DATABASE_URL и переменные config).
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+_KEYS = ("photos_uploaded", "my_votes_total", "my_views_total", "votes_given", "best_rank", "avg_rank", "top10_count", "positive_percent")
+
+
+async def _overview_live(conn, uid: int) -> dict:
+    """Старая реализация: агрегаты по сырым таблицам на каждое открытие профиля."""
+    ids = [uid]
+    tg_id = await conn.fetchval("SELECT tg_id FROM users WHERE id=$1", uid)
+    if tg_id is not None and int(tg_id) not in ids:
+        ids.append(int(tg_id))
+    ph = await conn.fetchrow(
+        """
+        SELECT
+            COUNT(*)::int AS photos_uploaded,
+            COALESCE(SUM(votes_count) FILTER (WHERE COALESCE(is_deleted,0)=0), 0)::int AS my_votes_total,
+            COALESCE(SUM(views_count) FILTER (WHERE COALESCE(is_deleted,0)=0), 0)::int AS my_views_total
+        FROM photos
+        WHERE user_id = ANY($1::bigint[])
+        """,
+        ids,
+    )
+    votes_given = await conn.fetchval("SELECT COUNT(*)::int FROM votes WHERE voter_id=$1", uid)
+    rk = await conn.fetchrow(
+        """
+        SELECT
+            MIN(rr.final_rank)::int AS best_rank,
+            AVG(rr.final_rank)::float AS avg_rank,
+            COUNT(*) FILTER (WHERE rr.final_rank <= 10)::int AS top10_count
+        FROM result_ranks rr
+        JOIN photos p ON p.id = rr.photo_id
+        WHERE p.user_id = ANY($1::bigint[])
+          AND COALESCE(p.is_deleted,0)=0
+        """,
+        ids,
+    )
+    pos = await conn.fetchrow(
+        """
+        SELECT
+            COALESCE(SUM(CASE WHEN v.score BETWEEN 6 AND 10 THEN 1 ELSE 0 END), 0)::int AS positive_votes,
+            COUNT(v.*)::int AS total_votes
+        FROM photos p
+        LEFT JOIN votes v ON v.photo_id = p.id
+        WHERE p.user_id = ANY($1::bigint[])
+          AND COALESCE(p.is_deleted,0)=0
+        """,
+        ids,
+    )
+    total = int(pos["total_votes"] or 0)
+    return {
+        "photos_uploaded": int(ph["photos_uploaded"] or 0),
+        "my_votes_total": int(ph["my_votes_total"] or 0),
+        "my_views_total": int(ph["my_views_total"] or 0),
+        "votes_given": int(votes_given or 0),
+        "best_rank": int(rk["best_rank"] or 0) or None,
+        "avg_rank": float(rk["avg_rank"]) if rk["avg_rank"] is not None else None,
+        "top10_count": int(rk["top10_count"] or 0),
+        "positive_percent": int(round(int(pos["positive_votes"] or 0) / total * 100)) if total > 0 else None,
+    }
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and abs(float(a) - float(b)) < 1e-6
+    return a == b
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user", type=int, default=None, help="users.id; по умолчанию автор с наибольшим числом фото")
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    await database.init_db()
+    try:
+        p = database._assert_pool()
+        async with p.acquire() as conn:
+            uid = args.user
+            if uid is None:
+                uid = await conn.fetchval(
+                    "SELECT user_id FROM photos GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"
+                )
+            uid = int(uid)
+            photos = await conn.fetchval("SELECT COUNT(*) FROM photos WHERE user_id=$1", uid)
+            print(f"user {uid}: {photos} photos")
+
+            live_times = []
+            live = {}
+            for _ in range(max(1, args.runs)):
+                started = time.perf_counter()
+                live = await _overview_live(conn, uid)
+                live_times.append(time.perf_counter() - started)
+
+        row_times = []
+        snap = {}
+        for _ in range(max(1, args.runs)):
+            started = time.perf_counter()
+            snap = await database.get_user_stats_overview(uid, include_author_metrics=True)
+            row_times.append(time.perf_counter() - started)
+
+        live_ms = statistics.median(live_times) * 1000
+        row_ms = statistics.median(row_times) * 1000
+        print(f"{'impl':<10}{'median ms':>12}")
+        print(f"{'live':<10}{live_ms:>12.2f}")
+        print(f"{'snapshot':<10}{row_ms:>12.2f}")
+        print(f"speedup: {live_ms / max(row_ms, 0.001):.1f}x")
+
+        mismatches = [k for k in _KEYS if not _same(live.get(k), snap.get(k))]
+        for k in mismatches:
+            print(f"{k}: live={live.get(k)} snapshot={snap.get(k)}")
+        print(f"mismatches: {len(mismatches)}")
+        return 1 if mismatches else 0
+    finally:
+        await database.close_db()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,108 @@
+"""
+Бенчмарк водяного знака: прежний полнокадровый RGBA-оверлей против кэшированной полоски
+с текстом, которая накладывается только на нижнюю полосу (utils.watermark).
+
+Для каждой ширины рендерит знак обоими способами, сверяет пиксели (результат должен
+совпадать бит в бит, в том числе на ширинах, не кратных 64) и печатает время на картинку
+и объём RGBA-буферов под оверлей.
+
+    python scripts/bench_watermark.py --runs 10
+
+Нужен только Pillow.
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageDraw, ImageOps  # type: ignore[import]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import watermark  # noqa: E402
+
+_TEXT = "© 2026 Benchmark Author. ALL RIGHTS RESERVED"
+_HIGHLIGHT = "2026"
+
+
+def _render_full_overlay(image_bytes: bytes, text: str, highlight_text: str | None, max_side: int) -> Image.Image:
+    """Прежняя реализация: всё фото в RGBA + оверлей во весь кадр."""
+    src = Image.open(io.BytesIO(image_bytes))
+    src = ImageOps.exif_transpose(src)
+    if src.mode != "RGBA":
+        src = src.convert("RGBA")
+    width, height = src.size
+    if max(width, height) > max_side > 0:
+        ratio = float(max_side) / float(max(width, height))
+        width, height = max(1, int(width * ratio)), max(1, int(height * ratio))
+        src = src.resize((width, height), Image.Resampling.LANCZOS)
+
+    overlay = Image.new("RGBA", src.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    parts = watermark._split_colored_parts(text, highlight_text=highlight_text)
+    font_size = int(max(12, min(52, width * 0.028)))
+    font = watermark._load_font(font_size)
+    while font_size > 10:
+        if sum(watermark._calc_text_size(draw, p, font)[0] for p, _ in parts) <= int(width * 0.94):
+            break
+        font_size -= 1
+        font = watermark._load_font(font_size)
+    sizes = [watermark._calc_text_size(draw, p, font) for p, _ in parts]
+    total_w = sum(w for w, _ in sizes)
+    max_h = max((h for _, h in sizes), default=0)
+    x = max(2, (width - total_w) // 2)
+    y = max(2, height - max(6, int(height * 0.04)) - max_h)
+    cur_x = x
+    for idx, (part, color) in enumerate(parts):
+        if not part:
+            continue
+        draw.text((cur_x + 1, y + 1), part, font=font, fill=(0, 0, 0, 14))
+        draw.text((cur_x, y), part, font=font, fill=color)
+        cur_x += sizes[idx][0]
+    return Image.alpha_composite(src, overlay).convert("RGB")
+
+
+def _make_png(width: int, height: int) -> bytes:
+    # PNG без потерь и без draft(): оба способа получают одинаковые исходные пиксели
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'size':<12}{'full ms':>10}{'band ms':>10}{'overlay MB':>12}{'strip MB':>10}{'identical':>11}")
+    mismatched = 0
+    for width, height in ((1080, 810), (1280, 853), (2560, 1707), (4096, 2731), (4000, 3000)):
+        data = _make_png(width, height)
+
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            full = _render_full_overlay(data, _TEXT, _HIGHLIGHT, 4096)
+        full_ms = (time.perf_counter() - started) * 1000 / args.runs
+
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            band, _fmt = watermark._render_rgba_with_watermark(data, _TEXT, highlight_text=_HIGHLIGHT, max_side=4096)
+        band_ms = (time.perf_counter() - started) * 1000 / args.runs
+
+        strip = watermark._get_text_strip(_TEXT, _HIGHLIGHT, width)[0]
+        band_rgb = band.convert("RGB")
+        same = ImageChops.difference(full, band_rgb).getbbox() is None
+        mismatched += not same
+        print(
+            f"{f'{width}x{height}':<12}{full_ms:>10.1f}{band_ms:>10.1f}"
+            f"{width * height * 4 * 2 / 1e6:>12.1f}{strip.width * strip.height * 4 / 1e6:>10.2f}"
+            f"{str(same):>11}"
+        )
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,65 @@
+"""
+Проверка SQL материализации получателей рассылки (database._broadcast_audience_query)
+для каждой аудитории из database._BROADCAST_AUDIENCE_WHERE.
+
+Для каждой аудитории сверяет, что плейсхолдеры $1..$N идут подряд и их ровно столько,
+сколько передаётся аргументов (лишний аргумент Postgres отвергает: «could not determine
+data type of parameter»). С DATABASE_URL дополнительно готовит каждый запрос на сервере
+(PREPARE без выполнения — в broadcast_deliveries ничего не пишется).
+
+    python scripts/check_broadcast_sql.py
+
+Запускать в окружении бота (переменные config; DATABASE_URL — по желанию).
+Код выхода 1, если хоть одна аудитория не прошла.
+"""
+
+import asyncio
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+def _check_placeholders(target: str, sql: str, args: tuple) -> str | None:
+    used = {int(n) for n in re.findall(r"\$(\d+)", sql)}
+    expected = set(range(1, len(args) + 1))
+    if used != expected:
+        return f"placeholders {sorted(used)} but {len(args)} args"
+    return None
+
+
+async def main() -> int:
+    queries = {}
+    failed = 0
+    for target in database._BROADCAST_AUDIENCE_WHERE:
+        sql, *args = database._broadcast_audience_query(target, 1, 12345)
+        queries[target] = sql
+        error = _check_placeholders(target, sql, tuple(args))
+        print(f"{target:<12}{len(args)} args  {error or 'ok'}")
+        failed += bool(error)
+
+    if database.DB_DSN:
+        await database.init_db()
+        try:
+            async with database._assert_pool().acquire() as conn:
+                for target, sql in queries.items():
+                    try:
+                        await conn.prepare(sql)
+                        print(f"{target:<12}prepare ok")
+                    except Exception as e:
+                        failed += 1
+                        print(f"{target:<12}prepare failed: {e}")
+        finally:
+            await database.close_db()
+    else:
+        print("DATABASE_URL is not set, server-side PREPARE skipped")
+
+    print(f"targets: {len(queries)}, failed: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,57 @@
+"""
+Сверка рангов: построчный calc_user_rank_points (эталон) против пакетного расчёта
+database._calc_rank_points_bulk, которым пишет фоновый recompute_dirty_ranks.
+
+Берёт случайную выборку живых пользователей (или --user id ...), считает очки обоими способами
+и печатает расхождения. Код выхода 1, если хоть одно не совпало. В users ничего не пишет.
+
+    python scripts/check_rank_equivalence.py --sample 500
+
+Запускать в окружении бота (DATABASE_URL и переменные config).
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sample", type=int, default=500)
+    parser.add_argument("--user", type=int, action="append", default=[], help="users.id, можно несколько раз")
+    args = parser.parse_args()
+
+    await database.init_db()
+    try:
+        p = database._assert_pool()
+        async with p.acquire() as conn:
+            if args.user:
+                user_ids = [int(x) for x in args.user]
+            else:
+                rows = await conn.fetch(
+                    "SELECT id FROM users WHERE is_deleted=0 ORDER BY random() LIMIT $1",
+                    int(args.sample),
+                )
+                user_ids = [int(r["id"]) for r in rows]
+            bulk = await database._calc_rank_points_bulk(conn, user_ids)
+
+        mismatches = 0
+        for uid in user_ids:
+            expected = await database.calc_user_rank_points(uid)
+            got = bulk.get(uid)
+            if got != expected:
+                mismatches += 1
+                print(f"user {uid}: per-user={expected} bulk={got}")
+        print(f"checked {len(user_ids)} users, mismatches: {mismatches}")
+        return 1 if mismatches else 0
+    finally:
+        await database.close_db()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+# =============================================================
+# ==== ДВИЖОК РАССЫЛОК ========================================
+# =============================================================
+# Админка / планировщик только создают broadcast_jobs (+ строки получателей),
+# а отправляет этот цикл в процессе основного бота:
+#   - общий token bucket бота (utils.telegram_limiter, делится с уведомлениями);
+#   - не чаще одного сообщения в секунду в один чат;
+#   - RetryAfter ставит на паузу весь bucket и возвращает получателя в очередь;
+#   - 403 -> users.bot_blocked_at, такие больше не попадают в аудитории;
+#   - прогресс чекпоинтится пачками, после рестарта 'sending' -> 'pending'.
+
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from utils.telegram_limiter import TELEGRAM_SEND_LIMITER
+from database import (
+    get_running_broadcast_jobs,
+    reset_stale_broadcast_deliveries,
+    claim_broadcast_deliveries,
+    record_broadcast_results,
+    finish_broadcast_job_if_complete,
+    mark_scheduled_broadcast_sent,
+)
+
+logger = logging.getLogger(__name__)
+
+_BROADCAST_WORKERS = 8
+_BROADCAST_CLAIM_BATCH = 200
+_BROADCAST_CHECKPOINT_SEC = 1.0
+_BROADCAST_IDLE_SLEEP_SEC = 2.0
+_BROADCAST_MAX_ATTEMPTS = 3
+_BROADCAST_CHAT_INTERVAL_SEC = 1.0
+
+
+def broadcast_header(target: str) -> str:
+    if target == "all":
+        return ""
+    if target == "premium":
+        return "💎 <b>Сообщение для GlowShot Premium</b>"
+    if target == "test":
+        return "🧪 <b>Тестовая рассылка</b>"
+    return "👥 <b>Сообщение для команды GlowShot</b>"
+
+
+def broadcast_text(target: str, text_body: str) -> str:
+    header = broadcast_header(target)
+    return text_body if not header else f"{header}\n\n{text_body}"
+
+
+def _seen_markup():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="✅ Просмотрено", callback_data="admin:notif_read")
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+_CHAT_LAST_SENT: dict[int, float] = {}
+
+
+async def _send_one(bot: Bot, job: dict, tg_id: int, attempts: int, markup) -> tuple[int, str, str | None, float | None]:
+    """Одна отправка -> (tg_id, status, error, retry_in) для record_broadcast_results."""
+    last = _CHAT_LAST_SENT.get(tg_id)
+    if last is not None:
+        wait = _BROADCAST_CHAT_INTERVAL_SEC - (time.monotonic() - last)
+        if wait > 0:
+            return (tg_id, "retry", None, wait)
+
+    await TELEGRAM_SEND_LIMITER.acquire()
+    try:
+        await bot.send_message(
+            chat_id=tg_id,
+            text=broadcast_text(str(job.get("target") or ""), str(job.get("text") or "")),
+            reply_markup=markup,
+        )
+        _CHAT_LAST_SENT[tg_id] = time.monotonic()
+        return (tg_id, "sent", None, None)
+    except TelegramRetryAfter as e:
+        retry_in = float(getattr(e, "retry_after", 1) or 1)
+        TELEGRAM_SEND_LIMITER.pause(retry_in)
+        # лимит бота, а не ошибка получателя — попытку не засчитываем
+        return (tg_id, "retry", None, retry_in)
+    except TelegramForbiddenError as e:
+        return (tg_id, "blocked", str(e), None)
+    except TelegramBadRequest as e:
+        return (tg_id, "failed", str(e), None)
+    except Exception as e:
+        if int(attempts) + 1 >= _BROADCAST_MAX_ATTEMPTS:
+            return (tg_id, "failed", str(e), None)
+        return (tg_id, "retry", str(e), float(2 ** (int(attempts) + 1)))
+
+
+async def _run_job(bot: Bot, job: dict) -> None:
+    job_id = int(job["id"])
+    markup = _seen_markup() if job.get("with_seen_button") else None
+    queue: asyncio.Queue = asyncio.Queue(maxsize=_BROADCAST_CLAIM_BATCH)
+    results: list[tuple[int, str, str | None, float | None]] = []
+
+    async def _worker() -> None:
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                results.append(await _send_one(bot, job, int(item["tg_id"]), int(item.get("attempts") or 0), markup))
+            finally:
+                queue.task_done()
+
+    async def _checkpoint() -> None:
+        if not results:
+            return
+        batch = results[:]
+        del results[: len(batch)]
+        await record_broadcast_results(job_id, batch)
+
+    workers = [asyncio.create_task(_worker()) for _ in range(_BROADCAST_WORKERS)]
+    try:
+        last_checkpoint = time.monotonic()
+        while True:
+            claimed = await claim_broadcast_deliveries(job_id, _BROADCAST_CLAIM_BATCH)
+            if not claimed:
+                break
+            for item in claimed:
+                await queue.put(item)
+                if time.monotonic() - last_checkpoint >= _BROADCAST_CHECKPOINT_SEC:
+                    await _checkpoint()
+                    last_checkpoint = time.monotonic()
+            await queue.join()
+            await _checkpoint()
+            last_checkpoint = time.monotonic()
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers, return_exceptions=True)
+        try:
+            await _checkpoint()
+        except Exception:
+            logger.exception("broadcast.checkpoint_failed", extra={"job_id": job_id})
+
+    done = await finish_broadcast_job_if_complete(job_id)
+    if done and done.get("scheduled_id"):
+        await mark_scheduled_broadcast_sent(
+            int(done["scheduled_id"]),
+            total_count=int(done.get("total_count") or 0),
+            sent_count=int(done.get("sent_count") or 0),
+        )
+
+
+async def broadcast_engine_loop(bot: Bot) -> None:
+    """Фоновый цикл: берёт running-рассылки по очереди и досылает их."""
+    try:
+        for job in await get_running_broadcast_jobs():
+            await reset_stale_broadcast_deliveries(int(job["id"]))
+    except Exception:
+        logger.exception("broadcast.resume_failed")
+
+    while True:
+        try:
+            jobs = await get_running_broadcast_jobs()
+        except Exception:
+            jobs = []
+
+        for job in jobs:
+            try:
+                await _run_job(bot, job)
+            except Exception:
+                logger.exception("broadcast.job_failed", extra={"job_id": job.get("id")})
+
+        if len(_CHAT_LAST_SENT) > 50000:
+            cutoff = time.monotonic() - _BROADCAST_CHAT_INTERVAL_SEC
+            for k, v in list(_CHAT_LAST_SENT.items()):
+                if v < cutoff:
+                    _CHAT_LAST_SENT.pop(k, None)
+
+        await asyncio.sleep(_BROADCAST_IDLE_SLEEP_SEC)
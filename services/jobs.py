@@ -1,19 +1,35 @@
 import asyncio
+import logging
 from datetime import datetime, time, timedelta, date
 from typing import Callable
 
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 
 from utils.time import get_bot_now
+from utils.telegram_limiter import TELEGRAM_SEND_LIMITER
+from config import FSM_TTL_SECONDS
+from services.media_identity import prewarm_support_file_ids
 from database import (
     finalize_party,
     publish_daily_results,
     grant_daily_credits_once,
     fetch_pending_notifications,
-    mark_notification_done,
+    ack_notifications,
+    reclaim_stuck_notifications,
+    get_next_notification_due_in,
+    listen_notification_queue,
     activate_scheduled_photos,
+    rebuild_photo_rating_aggregates,
+    refresh_activity_rollups,
+    run_log_maintenance,
+    recompute_dirty_ranks,
+    prune_fsm_storage,
+    reconcile_user_profile_stats,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def _next_run(at_time: time) -> datetime:
     """Return the next datetime in bot TZ at given wall-clock time."""
@@ -81,33 +97,166 @@ async def scheduled_photos_activate_job(bot: Bot) -> None:
         await asyncio.sleep(20)
 
 
+async def photo_rating_aggregates_repair_job(bot: Bot) -> None:
+    """При старте и ежедневно 04:30 — сверяем photos.ratings_* с сырыми ratings (первичное заполнение — в ensure_schema)."""
+    try:
+        await rebuild_photo_rating_aggregates(batch_size=500)
+    except Exception:
+        logger.exception("jobs.rating_aggregates.repair_failed")
+    while True:
+        target = _next_run(time(4, 30))
+        await _sleep_until(target)
+        try:
+            await rebuild_photo_rating_aggregates(batch_size=500)
+        except Exception:
+            logger.exception("jobs.rating_aggregates.repair_failed")
+
+
+async def activity_rollups_job(bot: Bot) -> None:
+    """Каждую минуту докатывает свёртки активности/ошибок для админ-дашборда."""
+    while True:
+        try:
+            await refresh_activity_rollups()
+        except Exception:
+            logger.exception("jobs.activity_rollups.refresh_failed")
+        await asyncio.sleep(60)
+
+
+async def rank_recompute_job(bot: Bot) -> None:
+    """Пересчитывает ранги инвалидированных/устаревших пользователей пачками (профиль только читает кеш)."""
+    while True:
+        written = 0
+        try:
+            written = await recompute_dirty_ranks()
+        except Exception:
+            logger.exception("jobs.ranks.recompute_failed")
+        # упёрлись в max_batches — есть ещё работа, не спим долго
+        await asyncio.sleep(1 if written >= 5000 else 30)
+
+
+async def fsm_storage_cleanup_job(bot: Bot) -> None:
+    """Раз в час удаляет пустые и протухшие FSM-записи."""
+    while True:
+        try:
+            await prune_fsm_storage(FSM_TTL_SECONDS)
+        except Exception:
+            logger.exception("jobs.fsm.prune_failed")
+        await asyncio.sleep(3600)
+
+
+async def profile_stats_reconcile_job(bot: Bot) -> None:
+    """При старте — бэкфилл недостающих строк user_profile_stats, ежедневно 04:45 — полная сверка."""
+    try:
+        created = await reconcile_user_profile_stats(only_missing=True)
+        if created:
+            logger.info("jobs.profile_stats.backfilled", extra={"users": created})
+    except Exception:
+        logger.exception("jobs.profile_stats.backfill_failed")
+    while True:
+        await _sleep_until(_next_run(time(4, 45)))
+        try:
+            await reconcile_user_profile_stats()
+        except Exception:
+            logger.exception("jobs.profile_stats.reconcile_failed")
+
+
+async def support_media_prewarm_job(bot: Bot) -> None:
+    """Каждые 30 секунд: file_id бота поддержки для фото, попавших в очереди модерации."""
+    while True:
+        try:
+            await prewarm_support_file_ids()
+        except Exception:
+            logger.exception("jobs.media.prewarm_failed")
+        await asyncio.sleep(30)
+
+
+async def log_maintenance_job(bot: Bot) -> None:
+    """При старте и ежедневно 03:30 — партиции логов на будущее и удаление старых по retention."""
+    await asyncio.sleep(120)  # даём created_ts-бэкфиллу и свёрткам стартовать первыми
+    while True:
+        try:
+            result = await run_log_maintenance()
+            if result.get("converted") or result.get("dropped"):
+                logger.info("jobs.log_maintenance.done", extra={"result": result})
+            if result.get("pending"):
+                # ещё не всё сконвертировано (ждём бэкфилл created_ts) — повторим через час
+                await asyncio.sleep(3600)
+                continue
+        except Exception:
+            logger.exception("jobs.log_maintenance.failed")
+        await _sleep_until(_next_run(time(3, 30)))
+
+
+_NOTIFY_BATCH = 50
+_NOTIFY_CONCURRENCY = 8
+_NOTIFY_MAX_IDLE_SEC = 30.0
+_NOTIFY_RECLAIM_EVERY_SEC = 300.0
+
+
+async def _deliver_notification(send_fn, item: dict) -> tuple[int, str, str | None, float | None]:
+    """Одна доставка -> (id, status, error, retry_in) для ack_notifications."""
+    nid = int(item["id"])
+    if not send_fn:
+        return (nid, "sent", None, None)
+    try:
+        await send_fn(nid, item)
+        return (nid, "sent", None, None)
+    except TelegramRetryAfter as e:
+        retry_in = float(getattr(e, "retry_after", 1) or 1)
+        TELEGRAM_SEND_LIMITER.pause(retry_in)
+        return (nid, "pending", str(e), retry_in)
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        # повтор не поможет: бот заблокирован / чат удалён / кривой текст
+        return (nid, "failed", str(e), None)
+    except Exception as e:
+        attempts = int(item.get("attempts") or 0)
+        return (nid, "failed", str(e), float(min(900, max(30, attempts * 60))))
+
+
 async def notifications_worker(bot: Bot, send_fn: Callable[[int, dict], asyncio.Future] | None = None) -> None:
     """
     Постоянный воркер: достаёт pending уведомления партиями и отправляет.
     send_fn: кастомная функция доставки; если None — noop (очередь просто очищается).
+
+    Просыпается по NOTIFY из enqueue_notification (или к ближайшему run_after),
+    шлёт пачку параллельно под общим лимитом бота и закрывает её одним UPDATE.
     """
-    while True:
-        try:
-            batch = await fetch_pending_notifications(limit=50)
-            if not batch:
-                await asyncio.sleep(60)
+    wake = asyncio.Event()
+    listener = asyncio.create_task(listen_notification_queue(wake.set))
+    sem = asyncio.Semaphore(_NOTIFY_CONCURRENCY)
+
+    async def _guarded(item: dict):
+        async with sem:
+            return await _deliver_notification(send_fn, item)
+
+    last_reclaim = 0.0
+    try:
+        while True:
+            try:
+                loop_now = asyncio.get_running_loop().time()
+                if loop_now - last_reclaim >= _NOTIFY_RECLAIM_EVERY_SEC:
+                    await reclaim_stuck_notifications()
+                    last_reclaim = loop_now
+
+                # сбрасываем до выборки: NOTIFY, пришедший во время отправки, не потеряется
+                wake.clear()
+                batch = await fetch_pending_notifications(limit=_NOTIFY_BATCH)
+                if batch:
+                    results = await asyncio.gather(*(_guarded(item) for item in batch))
+                    await ack_notifications(list(results))
+                    continue
+
+                due_in = await get_next_notification_due_in()
+                timeout = _NOTIFY_MAX_IDLE_SEC if due_in is None else min(_NOTIFY_MAX_IDLE_SEC, due_in)
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=max(0.5, timeout))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("jobs.notifications.worker_error")
+                await asyncio.sleep(10)
                 continue
-            for item in batch:
-                nid = int(item["id"])
-                status = "sent"
-                backoff = None
-                if send_fn:
-                    try:
-                        await send_fn(nid, item)
-                    except Exception as e:
-                        status = "failed"
-                        attempts = int(item.get("attempts") or 0)
-                        backoff = min(900, max(30, attempts * 60))
-                        await mark_notification_done(nid, status=status, error=str(e), backoff_seconds=backoff)
-                        await asyncio.sleep(1.0)
-                        continue
-                await mark_notification_done(nid, status=status)
-                await asyncio.sleep(0.3)  # мягкий rate limit
-        except Exception:
-            await asyncio.sleep(10)
-            continue
+    finally:
+        listener.cancel()
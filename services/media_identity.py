@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+# =============================================================
+# ==== FILE_ID ФОТО ДЛЯ ОСНОВНОГО БОТА И БОТА ПОДДЕРЖКИ ========
+# =============================================================
+# file_id в Telegram действителен только для бота, который его получил:
+#   - основной бот: photos.file_id_public / photos.file_id;
+#   - бот поддержки (модерация): photos.file_id_support.
+# Картинка переходит из основного бота в бот поддержки один раз: скачиваем её основным ботом,
+# загружаем ботом поддержки, а полученный file_id сохраняем и дальше шлём только его.
+# Одновременные запросы одного фото в процессе ждут одну загрузку (single-flight).
+# Фото, попавшие в очередь модерации, прогреваются заранее (prewarm_support_file_ids)
+# через MEDIA_CACHE_CHAT_ID.
+
+import asyncio
+import io
+import logging
+import time
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InlineKeyboardMarkup
+
+from config import BOT_TOKEN, SUPPORT_BOT_TOKEN, MEDIA_CACHE_CHAT_ID
+from database import (
+    get_photo_file_id_support,
+    set_photo_file_id_support,
+    get_moderation_photos_missing_support_file_id,
+)
+
+_PREWARM_BATCH = 20
+_PREWARM_RETRY_SECONDS = 3600
+# ответы Telegram на file_id, который этому боту больше не годится
+_STALE_FILE_ID_MARKERS = ("wrong file identifier", "wrong remote file identifier", "file_id_invalid", "file reference")
+
+logger = logging.getLogger(__name__)
+
+_bots: dict[str, Bot] = {}
+# photo_id -> future с file_id бота поддержки (или None, если перенести не вышло)
+_support_uploads: dict[int, asyncio.Future] = {}
+# photo_id -> monotonic-время неудачного прогрева (не долбим битые файлы каждый цикл)
+_prewarm_failed: dict[int, float] = {}
+
+
+def is_support_bot(bot: Bot) -> bool:
+    try:
+        return bool(SUPPORT_BOT_TOKEN) and getattr(bot, "token", None) == SUPPORT_BOT_TOKEN
+    except Exception:
+        return False
+
+
+def main_file_id(photo: dict) -> str | None:
+    raw = photo.get("file_id_public") or photo.get("file_id")
+    return str(raw) if raw else None
+
+
+def cached_file_id(photo: dict, bot: Bot) -> str | None:
+    """file_id, который этот бот может отправить без загрузки (None — нужна загрузка)."""
+    if is_support_bot(bot):
+        raw = photo.get("file_id_support")
+        return str(raw) if raw else None
+    return main_file_id(photo)
+
+
+def _is_stale_file_id_error(e: TelegramBadRequest) -> bool:
+    text = str(getattr(e, "message", "") or e).lower()
+    return any(marker in text for marker in _STALE_FILE_ID_MARKERS)
+
+
+def _get_bot(token: str | None) -> Bot | None:
+    if not token:
+        return None
+    bot = _bots.get(token)
+    if bot is None:
+        bot = Bot(token)
+        _bots[token] = bot
+    return bot
+
+
+async def _download_from_main_bot(file_id: str) -> bytes | None:
+    main_bot = _get_bot(BOT_TOKEN)
+    if main_bot is None:
+        return None
+    try:
+        tg_file = await main_bot.get_file(file_id)
+        buff = io.BytesIO()
+        await main_bot.download_file(tg_file.file_path, destination=buff)
+        return buff.getvalue()
+    except Exception as e:
+        logger.warning("media.download_failed", extra={"error": f"{type(e).__name__}: {e}"})
+        return None
+
+
+async def _acquire_support_file_id(
+    photo: dict,
+    upload: Callable[[BufferedInputFile], Awaitable[str | None]],
+) -> str | None:
+    """Получить file_id бота поддержки, перенеся картинку не больше одного раза.
+
+    upload(input_file) загружает картинку ботом поддержки и возвращает новый file_id.
+    Если перенос этого фото уже идёт в процессе — ждём его, а не качаем заново.
+    """
+    photo_id = int(photo["id"])
+    pending = _support_uploads.get(photo_id)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    fut = asyncio.get_running_loop().create_future()
+    _support_uploads[photo_id] = fut
+    file_id: str | None = None
+    try:
+        # другой процесс (бот поддержки / прогрев) мог уже перенести
+        file_id = await get_photo_file_id_support(photo_id)
+        if not file_id:
+            src = main_file_id(photo)
+            data = await _download_from_main_bot(src) if src else None
+            if data:
+                file_id = await upload(BufferedInputFile(data, filename=f"photo_{photo_id}.jpg"))
+                if file_id:
+                    await set_photo_file_id_support(photo_id, file_id)
+    except Exception:
+        logger.exception("media.support_upload_failed", extra={"photo_id": photo_id})
+    finally:
+        fut.set_result(file_id)
+        _support_uploads.pop(photo_id, None)
+    if file_id:
+        photo["file_id_support"] = file_id
+    return file_id
+
+
+async def send_photo(
+    bot: Bot,
+    *,
+    chat_id: int,
+    photo: dict,
+    caption: str,
+    reply_markup: InlineKeyboardMarkup,
+    parse_mode: str = "HTML",
+) -> bool:
+    """Отправить фото из photos любым из ботов, сохраняя file_id бота поддержки после первой загрузки."""
+    kwargs = dict(chat_id=chat_id, caption=caption, reply_markup=reply_markup, parse_mode=parse_mode, disable_notification=True)
+
+    file_id = cached_file_id(photo, bot)
+    if file_id:
+        try:
+            await bot.send_photo(photo=file_id, **kwargs)
+            return True
+        except TelegramBadRequest as e:
+            if not is_support_bot(bot) or not _is_stale_file_id_error(e):
+                return False
+            # протухший file_id поддержки — перенесём заново
+            photo["file_id_support"] = None
+            await set_photo_file_id_support(int(photo["id"]), None)
+        except Exception:
+            # сеть, flood wait, заблокированный чат — file_id тут ни при чём, не трогаем его
+            return False
+
+    if not is_support_bot(bot):
+        return False
+
+    sent_direct = False
+
+    async def _upload_here(input_file: BufferedInputFile) -> str | None:
+        # первая загрузка — это и есть отправка модератору, отдельной не нужно
+        nonlocal sent_direct
+        msg = await bot.send_photo(photo=input_file, **kwargs)
+        sent_direct = True
+        return msg.photo[-1].file_id if msg and msg.photo else None
+
+    file_id = await _acquire_support_file_id(photo, _upload_here)
+    if sent_direct:
+        return True
+    if not file_id:
+        return False
+    try:
+        await bot.send_photo(photo=file_id, **kwargs)
+        return True
+    except Exception:
+        return False
+
+
+async def prewarm_support_file_ids(*, limit: int = _PREWARM_BATCH) -> int:
+    """Заранее получить file_id бота поддержки для фото в очередях модерации. -> сколько прогрето."""
+    support_bot = _get_bot(SUPPORT_BOT_TOKEN)
+    if support_bot is None or MEDIA_CACHE_CHAT_ID is None:
+        return 0
+
+    async def _upload_to_cache_chat(input_file: BufferedInputFile) -> str | None:
+        msg = await support_bot.send_photo(chat_id=int(MEDIA_CACHE_CHAT_ID), photo=input_file, disable_notification=True)
+        try:
+            await support_bot.delete_message(chat_id=int(MEDIA_CACHE_CHAT_ID), message_id=msg.message_id)
+        except Exception:
+            pass
+        return msg.photo[-1].file_id if msg and msg.photo else None
+
+    now = time.monotonic()
+    for pid, ts in list(_prewarm_failed.items()):
+        if now - ts > _PREWARM_RETRY_SECONDS:
+            _prewarm_failed.pop(pid, None)
+
+    warmed = 0
+    for photo in await get_moderation_photos_missing_support_file_id(limit + len(_prewarm_failed)):
+        if int(photo["id"]) in _prewarm_failed:
+            continue
+        if await _acquire_support_file_id(photo, _upload_to_cache_chat):
+            warmed += 1
+        else:
+            _prewarm_failed[int(photo["id"])] = time.monotonic()
+        if warmed >= limit:
+            break
+    return warmed
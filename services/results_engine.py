@@ -22,7 +22,6 @@ from database_results import (
     PERIOD_DAY,
     SCOPE_GLOBAL,
     KIND_TOP_PHOTOS,
-    ensure_results_schema,
     upsert_results_items,
     has_results,
 )
@@ -79,8 +78,6 @@ async def recalc_day_global(*, day_key: str, limit: int = 10) -> int:
     - кэш: если уже есть готовые итоги и пересчёт не требуется — выходим.
     """
 
-    await ensure_results_schema()
-
     # Кэш: не пересчитываем, если уже есть сохранённые итоги на этот день.
     if await has_results(
         period=PERIOD_DAY,
@@ -303,8 +300,6 @@ from services.results_queries import (
 )
 
 async def recalc_day_city(*, day_key: str, city: str, limit: int = 10) -> int:
-    await ensure_results_schema()
-
     p = _pool()
     async with p.acquire() as conn:
         pop = await count_active_authors_city(conn, city=str(city))
@@ -352,8 +347,6 @@ async def recalc_day_city(*, day_key: str, city: str, limit: int = 10) -> int:
 
 
 async def recalc_day_country(*, day_key: str, country: str, limit: int = 10) -> int:
-    await ensure_results_schema()
-
     p = _pool()
     async with p.acquire() as conn:
         pop = await count_active_authors_country(conn, country=str(country))
@@ -27,13 +27,14 @@ async def get_global_mean_and_count(conn: asyncpg.Connection) -> tuple[float, in
         w = float(LINK_RATING_WEIGHT)
     except Exception:
         w = 0.5
+    # running totals, поддерживаются database.add_rating* / admin-очистками
     row = await conn.fetchrow(
         """
         SELECT
-            COALESCE(SUM(value * CASE WHEN source='link' THEN $1 ELSE 1 END), 0)::float AS sum_w,
-            COALESCE(SUM(CASE WHEN source='link' THEN $1 ELSE 1 END), 0)::float AS cnt_w,
-            COUNT(*)::int AS cnt_raw
-        FROM ratings
+            (COALESCE(SUM(direct_sum), 0) + COALESCE(SUM(link_sum), 0) * $1::float)::float AS sum_w,
+            (COALESCE(SUM(direct_count), 0) + COALESCE(SUM(link_count), 0) * $1::float)::float AS cnt_w,
+            (COALESCE(SUM(direct_count), 0) + COALESCE(SUM(link_count), 0))::bigint AS cnt_raw
+        FROM rating_totals
         """,
         float(w),
     )
@@ -19,7 +19,7 @@ from aiogram.types import (
 from aiogram.fsm.context import FSMContext
 from aiogram.dispatcher.event.bases import SkipHandler
 
-from config import SUPPORT_BOT_TOKEN, SUPPORT_CHAT_ID
+from config import SUPPORT_BOT_TOKEN, SUPPORT_CHAT_ID, FSM_STORAGE, FSM_TTL_SECONDS
 from database import (
     init_db,
     get_support_users_full,
@@ -38,6 +38,7 @@ from database import (
 from handlers.admin import router as admin_router
 from handlers import moderator
 from html import escape
+from utils.fsm_storage import FSMWriteBatchMiddleware, make_fsm_storage
 
 # tickets[(user_id, ticket_id)] = информация о тикете (сообщение в чате поддержки и текст пользователя)
 tickets: Dict[tuple[int, int], dict] = {}
@@ -154,7 +155,9 @@ async def main():
         SUPPORT_BOT_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
-    dp = Dispatcher()
+    storage = make_fsm_storage(FSM_STORAGE, ttl_seconds=FSM_TTL_SECONDS)
+    dp = Dispatcher(storage=storage)
+    dp.update.middleware(FSMWriteBatchMiddleware(storage))
     dp.update.middleware(ErrorsToDbMiddleware())
 
     def find_ticket_key_by_id(ticket_id: int) -> tuple[int, int] | None:
@@ -1,12 +1,16 @@
 """Простая in-memory защита от спама нажатиями.
 
-Используем монотонное время и словарь { (user_id, action): last_ts }.
-Не хранит ничего в БД, подходит для single-process бота.
+Используем монотонное время и словарь { (user_id, action): last_ts } с LRU-вытеснением,
+поэтому память ограничена. Это дебаунс кнопок внутри процесса; общий флуд-контроль
+по настройкам protection.* делает ProtectionMiddleware (utils.rate_limit).
 """
 
+from collections import OrderedDict
 from time import monotonic
 
-_LAST_HIT: dict[tuple[int, str], float] = {}
+_MAX_ENTRIES = 50000
+
+_LAST_HIT: "OrderedDict[tuple[int, str], float]" = OrderedDict()
 
 
 def should_throttle(user_id: int, action: str, min_interval: float = 1.0) -> bool:
@@ -17,5 +21,7 @@ def should_throttle(user_id: int, action: str, min_interval: float = 1.0) -> boo
     if last is not None and (now - last) < min_interval:
         return True
     _LAST_HIT[key] = now
+    _LAST_HIT.move_to_end(key)
+    while len(_LAST_HIT) > _MAX_ENTRIES:
+        _LAST_HIT.popitem(last=False)
     return False
-
@@ -0,0 +1,222 @@
+"""FSM-хранилище aiogram в Postgres (таблица fsm_storage).
+
+- state и data переживают рестарт/деплой, один пользователь может попадать в разные воркеры;
+- data хранится как pickle (BYTEA): компактно и без ограничений json на типы;
+- записи внутри одного апдейта копятся в буфере (FSMWriteBatchMiddleware) и уходят
+  в БД одним запросом в конце — повторные update_data/set_state не дают лишних UPDATE;
+- если запись в конце апдейта не прошла, грязные ключи остаются в памяти процесса, читаются
+  оттуда и дописываются следующим флашем;
+- строки без state/data и не трогавшиеся дольше FSM_TTL_SECONDS чистит prune_fsm_storage.
+
+make_fsm_storage("memory") оставляет штатный MemoryStorage (локальная разработка).
+"""
+
+from __future__ import annotations
+
+import logging
+import pickle
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import TelegramObject
+
+# ключ -> {"state": str | None, "data": dict, "state_dirty": bool, "data_dirty": bool}
+_BATCH: ContextVar[dict | None] = ContextVar("glowshot_fsm_batch", default=None)
+# последнее чтение вне буфера (его делает FSMContextMiddleware aiogram до наших мидлварей)
+_LAST_LOAD: ContextVar[tuple | None] = ContextVar("glowshot_fsm_last_load", default=None)
+_LAST_LOAD_MAX_AGE_SECONDS = 2.0
+_PENDING_MAX_KEYS = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def _key_str(key: StorageKey) -> str:
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    thread_id = getattr(key, "thread_id", None)
+    business_id = getattr(key, "business_connection_id", None)
+    parts.append(str(thread_id) if thread_id is not None else "")
+    parts.append(str(business_id) if business_id is not None else "")
+    parts.append(str(getattr(key, "destiny", "default")))
+    return ":".join(parts)
+
+
+def _state_str(state: StateType) -> Optional[str]:
+    if isinstance(state, State):
+        return state.state
+    return state
+
+
+def _dump(data: Mapping[str, Any]) -> bytes | None:
+    if not data:
+        return None
+    return pickle.dumps(dict(data), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load(raw: bytes | None) -> dict:
+    if not raw:
+        return {}
+    try:
+        return dict(pickle.loads(raw))
+    except Exception:
+        return {}
+
+
+def _row(k: str, entry: dict) -> tuple:
+    return (k, entry["state"], _dump(entry["data"]), entry["state_dirty"], entry["data_dirty"])
+
+
+def _merge_pending(entry: dict, pending: dict | None) -> dict:
+    """entry прочитана из очереди недописанного: поля, не тронутые сейчас, всё равно надо дописать."""
+    if pending is None:
+        return entry
+    return {
+        **entry,
+        "state_dirty": entry["state_dirty"] or pending["state_dirty"],
+        "data_dirty": entry["data_dirty"] or pending["data_dirty"],
+    }
+
+
+class PostgresStorage(BaseStorage):
+    def __init__(self, ttl_seconds: int) -> None:
+        self.ttl_seconds = int(ttl_seconds)
+        # ключ -> запись, которую не удалось сохранить (новее, чем строка в БД)
+        self._pending: dict[str, dict] = {}
+
+    async def _fetch(self, k: str) -> dict:
+        from database import fsm_storage_load
+
+        pending = self._pending.get(k)
+        if pending is not None:
+            entry = {
+                "state": pending["state"],
+                "data": dict(pending["data"]),
+                "state_dirty": False,
+                "data_dirty": False,
+            }
+            _LAST_LOAD.set((k, time.monotonic(), entry["state"], entry["data"]))
+            return entry
+        row = await fsm_storage_load(k, self.ttl_seconds)
+        entry = {
+            "state": row[0] if row else None,
+            "data": _load(row[1]) if row else {},
+            "state_dirty": False,
+            "data_dirty": False,
+        }
+        _LAST_LOAD.set((k, time.monotonic(), entry["state"], entry["data"]))
+        return entry
+
+    async def _entry(self, key: StorageKey) -> dict:
+        k = _key_str(key)
+        batch = _BATCH.get()
+        if batch is None:
+            return await self._fetch(k)
+        entry = batch.get(k)
+        if entry is None:
+            last = _LAST_LOAD.get()
+            if last is not None and last[0] == k and time.monotonic() - last[1] < _LAST_LOAD_MAX_AGE_SECONDS:
+                entry = {"state": last[2], "data": dict(last[3]), "state_dirty": False, "data_dirty": False}
+            else:
+                entry = await self._fetch(k)
+            batch[k] = entry
+        return entry
+
+    async def _write(self, key: StorageKey, entry: dict) -> None:
+        if _BATCH.get() is not None:
+            return  # допишется в конце апдейта
+        from database import fsm_storage_store_many
+
+        k = _key_str(key)
+        entry = _merge_pending(entry, self._pending.pop(k, None))
+        try:
+            await fsm_storage_store_many([_row(k, entry)], self.ttl_seconds)
+        except BaseException:
+            self._pending.setdefault(k, entry)
+            raise
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry["state"] = _state_str(state)
+        entry["state_dirty"] = True
+        await self._write(key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key))["state"]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry["data"] = dict(data)
+        entry["data_dirty"] = True
+        await self._write(key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._entry(key))["data"])
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        entry = await self._entry(key)
+        entry["data"] = {**entry["data"], **dict(data)}
+        entry["data_dirty"] = True
+        await self._write(key, entry)
+        return dict(entry["data"])
+
+    async def close(self) -> None:
+        pass
+
+    async def flush(self, batch: dict) -> None:
+        """Записать грязные ключи апдейта вместе с недописанными раньше. На сбое они остаются в очереди."""
+        from database import fsm_storage_store_many
+
+        dirty, self._pending = self._pending, {}
+        for k, e in batch.items():
+            if not (e["state_dirty"] or e["data_dirty"]):
+                continue
+            dirty[k] = _merge_pending(e, dirty.get(k))
+        if not dirty:
+            return
+        try:
+            await fsm_storage_store_many([_row(k, e) for k, e in dirty.items()], self.ttl_seconds)
+        except BaseException:
+            # ключи, которые за это время уже снова попали в очередь, новее наших
+            for k, e in dirty.items():
+                self._pending.setdefault(k, e)
+            while len(self._pending) > _PENDING_MAX_KEYS:
+                self._pending.pop(next(iter(self._pending)))
+            raise
+
+
+class FSMWriteBatchMiddleware(BaseMiddleware):
+    """Копит записи FSM за время обработки апдейта и пишет их одним запросом в конце."""
+
+    def __init__(self, storage: BaseStorage) -> None:
+        self.storage = storage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(self.storage, PostgresStorage) or _BATCH.get() is not None:
+            return await handler(event, data)
+        batch: dict = {}
+        token = _BATCH.set(batch)
+        try:
+            return await handler(event, data)
+        finally:
+            _BATCH.reset(token)
+            _LAST_LOAD.set(None)
+            try:
+                await self.storage.flush(batch)
+            except Exception:
+                logger.exception("fsm.flush_failed", extra={"pending": len(self.storage._pending)})
+
+
+def make_fsm_storage(name: str | None, *, ttl_seconds: int) -> BaseStorage:
+    """'postgres' (по умолчанию) или 'memory'."""
+    if str(name or "").strip().lower() == "memory":
+        return MemoryStorage()
+    return PostgresStorage(ttl_seconds=ttl_seconds)
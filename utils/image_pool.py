@@ -0,0 +1,126 @@
+"""Тяжёлая обработка изображений вне event loop.
+
+Pillow (декодирование, LANCZOS-ресайз, JPEG optimize/progressive) держит GIL и занимает
+сотни миллисекунд на большой картинке — в event loop это задержка апдейтов всех пользователей.
+Здесь задачи уходят в ограниченный пул процессов:
+  - одновременно не больше IMAGE_POOL_MAX_PENDING задач (ожидающих + выполняемых);
+    остальные ждут места не дольше IMAGE_QUEUE_WAIT_SECONDS и получают ImagePoolBusy;
+  - результат ждём не дольше IMAGE_JOB_TIMEOUT_SECONDS (ImageJobTimeout); зависшая задача
+    продолжает занимать место в очереди, пока процесс её не доделает, — пул не переполняется;
+  - процессы стартуют через forkserver: сервер заранее импортирует utils.watermark (Pillow),
+    но каждый воркер, как и при spawn, при старте ещё импортирует главный модуль процесса
+    (bot.py) как __mp_main__ — один раз на процесс, пул долгоживущий; шрифты кэшируются
+    внутри процесса между задачами.
+IMAGE_POOL_WORKERS=0 — выполнять в потоке (asyncio.to_thread), без отдельных процессов.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable
+
+from config import (
+    IMAGE_POOL_WORKERS,
+    IMAGE_POOL_MAX_PENDING,
+    IMAGE_QUEUE_WAIT_SECONDS,
+    IMAGE_JOB_TIMEOUT_SECONDS,
+)
+from utils.watermark import apply_text_watermark, convert_to_jpeg, read_image_size
+
+
+class ImagePoolBusy(RuntimeError):
+    """Очередь обработки переполнена дольше IMAGE_QUEUE_WAIT_SECONDS."""
+
+
+class ImageJobTimeout(RuntimeError):
+    """Задача не уложилась в IMAGE_JOB_TIMEOUT_SECONDS."""
+
+
+_executor: ProcessPoolExecutor | None = None
+_slots: asyncio.Semaphore | None = None
+
+
+def _get_executor() -> ProcessPoolExecutor | None:
+    global _executor
+    if IMAGE_POOL_WORKERS <= 0:
+        return None
+    if _executor is None:
+        try:
+            ctx = multiprocessing.get_context("forkserver")
+            # по умолчанию сервер грузит __main__ (bot.py со всеми хендлерами) — ему нужен только Pillow
+            ctx.set_forkserver_preload(["utils.watermark"])
+        except ValueError:
+            ctx = multiprocessing.get_context("spawn")
+        _executor = ProcessPoolExecutor(max_workers=int(IMAGE_POOL_WORKERS), mp_context=ctx)
+    return _executor
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(max(1, int(IMAGE_POOL_MAX_PENDING)))
+    return _slots
+
+
+async def run_image_job(fn: Callable[..., Any], *args: Any, timeout: float | None = None) -> Any:
+    """Выполнить fn(*args) вне event loop. fn и аргументы должны сериализоваться pickle."""
+    slots = _get_slots()
+    try:
+        await asyncio.wait_for(slots.acquire(), timeout=IMAGE_QUEUE_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        raise ImagePoolBusy("image processing queue is full") from None
+
+    try:
+        executor = _get_executor()
+        if executor is None:
+            fut = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+        else:
+            # submit бросает BrokenProcessPool сразу, если пул сломался раньше и его ещё не сбросили
+            fut = asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    except BaseException as e:
+        slots.release()
+        if isinstance(e, BrokenProcessPool):
+            shutdown_image_pool()
+        raise
+    # место освобождается, когда задача реально закончилась, а не когда вызывающий перестал ждать
+    fut.add_done_callback(lambda _f: slots.release())
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(fut), timeout=timeout or IMAGE_JOB_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise ImageJobTimeout("image job timed out") from None
+    except BrokenProcessPool:
+        # воркер умер (OOM на огромной картинке и т.п.) — следующая задача поднимет новый пул
+        shutdown_image_pool()
+        raise
+
+
+async def watermark_image(
+    image_bytes: bytes,
+    text: str,
+    *,
+    highlight_text: str | None = None,
+    max_side: int = 4096,
+) -> bytes:
+    # run_in_executor передаёт только позиционные аргументы — kwargs через partial
+    job = partial(apply_text_watermark, highlight_text=highlight_text, max_side=int(max_side))
+    return await run_image_job(job, image_bytes, text)
+
+
+async def to_jpeg(image_bytes: bytes) -> bytes | None:
+    return await run_image_job(convert_to_jpeg, image_bytes)
+
+
+async def image_size(image_bytes: bytes) -> tuple[int, int] | None:
+    return await run_image_job(read_image_size, image_bytes)
+
+
+def shutdown_image_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,168 @@
+"""Ограничение частоты апдейтов (флуд-контроль) для ProtectionMiddleware.
+
+Скользящее окно считается по двум соседним фиксированным окнам с интерполяцией:
+    estimate = prev * (1 - elapsed / window) + cur
+Память ограничена: счётчики и кулдауны живут в LRU на _MAX_KEYS ключей.
+
+Бэкенд подключаемый:
+  - MemoryRateLimitBackend — по умолчанию, на процесс, без обращений к БД;
+  - PostgresRateLimitBackend — общий для нескольких процессов бота (UNLOGGED-таблицы,
+    один запрос на апдейт), включается RATE_LIMIT_BACKEND=postgres.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Protocol
+
+_MAX_KEYS = 50000
+_PRUNE_INTERVAL_SECONDS = 60.0
+
+
+def _sliding_estimate(prev: float, cur: float, elapsed_fraction: float) -> float:
+    frac = min(1.0, max(0.0, float(elapsed_fraction)))
+    return float(prev) * (1.0 - frac) + float(cur)
+
+
+class RateLimitBackend(Protocol):
+    async def hit(self, counters: list[tuple[str, int]], cooldown_key: str) -> tuple[list[float], float]:
+        """Засчитать событие в счётчики [(key, window_seconds)] -> (оценки по окнам, остаток кулдауна в секундах)."""
+        ...
+
+    async def set_cooldown(self, key: str, seconds: float) -> None:
+        ...
+
+
+class MemoryRateLimitBackend:
+    """Счётчики в памяти процесса (LRU: при переполнении выкидываются давно не трогавшиеся ключи)."""
+
+    def __init__(self, max_keys: int = _MAX_KEYS) -> None:
+        self.max_keys = int(max_keys)
+        # key -> [window_index, prev, cur]
+        self._counters: OrderedDict[str, list] = OrderedDict()
+        self._cooldowns: OrderedDict[str, float] = OrderedDict()
+
+    def _touch(self, d: OrderedDict, key: str, value) -> None:
+        d[key] = value
+        d.move_to_end(key)
+        while len(d) > self.max_keys:
+            d.popitem(last=False)
+
+    def _hit_one(self, key: str, window: int, now: float) -> float:
+        idx = int(now // window)
+        slot = self._counters.get(key)
+        if slot is None or slot[0] < idx - 1:
+            slot = [idx, 0, 0]
+        elif slot[0] == idx - 1:
+            slot = [idx, slot[2], 0]
+        slot[2] += 1
+        self._touch(self._counters, key, slot)
+        return _sliding_estimate(slot[1], slot[2], (now - idx * window) / window)
+
+    async def hit(self, counters: list[tuple[str, int]], cooldown_key: str) -> tuple[list[float], float]:
+        now = time.time()
+        until = self._cooldowns.get(cooldown_key)
+        if until is not None:
+            if until > now:
+                # в кулдауне ничего не считаем — флуд отбрасывается за O(1)
+                return [0.0 for _ in counters], until - now
+            self._cooldowns.pop(cooldown_key, None)
+        return [self._hit_one(k, int(w), now) for k, w in counters], 0.0
+
+    async def set_cooldown(self, key: str, seconds: float) -> None:
+        self._touch(self._cooldowns, key, time.time() + float(seconds))
+
+
+class PostgresRateLimitBackend:
+    """Общие счётчики в Postgres; кулдауны дополнительно кэшируются локально, чтобы не ходить в БД во время флуда."""
+
+    def __init__(self) -> None:
+        self._local_cooldowns: OrderedDict[str, float] = OrderedDict()
+        self._last_prune = 0.0
+        self._prune_task: asyncio.Task | None = None
+
+    def _maybe_prune(self) -> None:
+        now = time.monotonic()
+        if now - self._last_prune < _PRUNE_INTERVAL_SECONDS:
+            return
+        if self._prune_task is not None and not self._prune_task.done():
+            return
+        self._last_prune = now
+        from database import prune_rate_limit_state
+        self._prune_task = asyncio.create_task(prune_rate_limit_state())
+
+    async def hit(self, counters: list[tuple[str, int]], cooldown_key: str) -> tuple[list[float], float]:
+        now = time.time()
+        until = self._local_cooldowns.get(cooldown_key)
+        if until is not None:
+            if until > now:
+                return [0.0 for _ in counters], until - now
+            self._local_cooldowns.pop(cooldown_key, None)
+
+        from database import rate_limit_hit
+        rows, cooldown_left = await rate_limit_hit(counters, cooldown_key)
+        self._maybe_prune()
+        if cooldown_left > 0:
+            self._remember_cooldown(cooldown_key, now + cooldown_left)
+        return [_sliding_estimate(prev, cur, frac) for prev, cur, frac in rows], cooldown_left
+
+    async def set_cooldown(self, key: str, seconds: float) -> None:
+        self._remember_cooldown(key, time.time() + float(seconds))
+        from database import rate_limit_set_cooldown
+        await rate_limit_set_cooldown(key, float(seconds))
+
+    def _remember_cooldown(self, key: str, until: float) -> None:
+        self._local_cooldowns[key] = until
+        self._local_cooldowns.move_to_end(key)
+        while len(self._local_cooldowns) > _MAX_KEYS:
+            self._local_cooldowns.popitem(last=False)
+
+
+_BACKEND: RateLimitBackend = MemoryRateLimitBackend()
+
+
+def set_rate_limit_backend(backend: RateLimitBackend) -> None:
+    global _BACKEND
+    _BACKEND = backend
+
+
+def get_rate_limit_backend() -> RateLimitBackend:
+    return _BACKEND
+
+
+def make_rate_limit_backend(name: str | None) -> RateLimitBackend:
+    """'memory' (по умолчанию) или 'postgres'."""
+    if str(name or "").strip().lower() in ("postgres", "pg", "db"):
+        return PostgresRateLimitBackend()
+    return MemoryRateLimitBackend()
+
+
+async def check_flood(
+    user_id: int,
+    *,
+    is_callback: bool,
+    max_actions_per_10s: int,
+    max_callbacks_per_minute: int,
+    cooldown_seconds: int,
+) -> tuple[bool, bool]:
+    """Засчитать апдейт пользователя. -> (отбросить, только что начался кулдаун)."""
+    uid = int(user_id)
+    counters: list[tuple[str, int]] = [(f"a10:{uid}", 10)]
+    if is_callback:
+        counters.append((f"c60:{uid}", 60))
+
+    estimates, cooldown_left = await _BACKEND.hit(counters, f"cd:{uid}")
+    if cooldown_left > 0:
+        return True, False
+
+    over = estimates[0] > int(max_actions_per_10s)
+    if is_callback and estimates[1] > int(max_callbacks_per_minute):
+        over = True
+    if not over:
+        return False, False
+    if int(cooldown_seconds) > 0:
+        await _BACKEND.set_cooldown(f"cd:{uid}", float(cooldown_seconds))
+        return True, True
+    return True, False
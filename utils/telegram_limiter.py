@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+# Общий лимит исходящих сообщений бота (рассылки + уведомления).
+# Telegram допускает ~30 msg/s на бота, держим запас.
+TELEGRAM_RATE_PER_SEC = 25.0
+TELEGRAM_BURST = 25
+
+
+class TokenBucket:
+    """Token bucket на процесс. pause() — глобальная пауза после RetryAfter."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock: asyncio.Lock | None = None
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + float(seconds))
+        self.tokens = 0.0
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+
+TELEGRAM_SEND_LIMITER = TokenBucket(TELEGRAM_RATE_PER_SEC, TELEGRAM_BURST)
@@ -1,6 +1,8 @@
 import hashlib
 import io
 import os
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Tuple
 
 from PIL import Image, ImageDraw, ImageFont, ImageOps  # type: ignore[import]
@@ -31,7 +33,9 @@ def generate_author_code(user_id: int, salt: str) -> str:
     return f"{_PREFIX}{_to_base(num)}"
 
 
+@lru_cache(maxsize=64)
 def _load_font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+    # шрифт парсится один раз на размер и процесс (подбор размера перебирает десятки размеров)
     try:
         return ImageFont.truetype("DejaVuSans.ttf", size=size)
     except Exception:
@@ -77,6 +81,96 @@ def _split_colored_parts(
     return out
 
 
+_STRIP_PAD = 4
+_STRIP_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# (text, highlight, font size) -> (strip RGBA, ox, oy, text_w, text_h)
+_strip_cache: "OrderedDict[tuple, tuple[Image.Image, int, int, int, int]]" = OrderedDict()
+_strip_cache_bytes = 0
+
+
+@lru_cache(maxsize=4096)
+def _strip_font_size(text: str, highlight_text: str | None, width: int) -> int:
+    """Размер шрифта знака для фото шириной width: ~2.8% ширины, но текст не шире 94% кадра."""
+    scratch = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    parts = _split_colored_parts(text, highlight_text=highlight_text)
+
+    font_size = int(max(12, min(52, width * 0.028)))
+    font = _load_font(font_size)
+    while font_size > 10:
+        total_w = sum(_calc_text_size(scratch, part, font)[0] for part, _ in parts)
+        if total_w <= int(width * 0.94):
+            break
+        font_size -= 1
+        font = _load_font(font_size)
+    return font_size
+
+
+def _render_text_strip(text: str, highlight_text: str | None, font_size: int) -> tuple[Image.Image, int, int, int, int]:
+    """Полоска с текстом знака (с тенью) на прозрачном фоне.
+
+    Возвращает (strip, ox, oy, text_w, text_h): точка (ox, oy) полоски — начало текста,
+    text_w/text_h — размеры, по которым текст центрируется на фото.
+    """
+    scratch = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    parts = _split_colored_parts(text, highlight_text=highlight_text)
+    font = _load_font(font_size)
+
+    part_sizes = [_calc_text_size(scratch, part, font) for part, _ in parts]
+    total_w = sum(w for w, _ in part_sizes)
+    max_h = max((h for _, h in part_sizes), default=0)
+
+    # габариты глифов относительно начала текста (bbox может выходить за advance)
+    left, right, bottom = 0, 1, 1
+    cur_x = 0
+    for idx, (part, _) in enumerate(parts):
+        if part:
+            try:
+                bbox = scratch.textbbox((cur_x, 0), part, font=font)
+            except Exception:
+                bbox = (cur_x, 0, cur_x + part_sizes[idx][0], part_sizes[idx][1])
+            left = min(left, bbox[0])
+            right = max(right, bbox[2])
+            bottom = max(bottom, bbox[3])
+        cur_x += part_sizes[idx][0]
+
+    ox = _STRIP_PAD - left
+    oy = _STRIP_PAD
+    strip = Image.new("RGBA", (ox + right + 1 + _STRIP_PAD, oy + bottom + 1 + _STRIP_PAD), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(strip)
+    shadow_fill = (0, 0, 0, 14)
+    cur_x = ox
+    for idx, (part, color) in enumerate(parts):
+        if not part:
+            continue
+        part_w, _ = part_sizes[idx]
+        draw.text((cur_x + 1, oy + 1), part, font=font, fill=shadow_fill)
+        draw.text((cur_x, oy), part, font=font, fill=color)
+        cur_x += part_w
+    return strip, ox, oy, total_w, max_h
+
+
+def _get_text_strip(text: str, highlight_text: str | None, width: int) -> tuple[Image.Image, int, int, int, int]:
+    """Полоска из кэша процесса: тексты знаков (код автора, имя) повторяются постоянно.
+
+    Шрифт подбирается по точной ширине фото, а полоска зависит только от размера шрифта —
+    разные ширины с одним размером делят одну запись кэша.
+    """
+    global _strip_cache_bytes
+    font_size = _strip_font_size(text, highlight_text, width)
+    key = (text, highlight_text, font_size)
+    hit = _strip_cache.get(key)
+    if hit is not None:
+        _strip_cache.move_to_end(key)
+        return hit
+    value = _render_text_strip(text, highlight_text, font_size)
+    _strip_cache[key] = value
+    _strip_cache_bytes += value[0].width * value[0].height * 4
+    while _strip_cache_bytes > _STRIP_CACHE_MAX_BYTES and len(_strip_cache) > 1:
+        _, old = _strip_cache.popitem(last=False)
+        _strip_cache_bytes -= old[0].width * old[0].height * 4
+    return value
+
+
 def _render_rgba_with_watermark(
     image_bytes: bytes,
     text: str,
@@ -86,9 +180,17 @@ def _render_rgba_with_watermark(
 ) -> tuple[Image.Image, str]:
     src = Image.open(io.BytesIO(image_bytes))
     src_format = (src.format or "").upper()
+    longest = max(src.size)
+    if longest > max_side > 0:
+        # JPEG: декодируем сразу в уменьшенном масштабе (1/2, 1/4, 1/8), не меньше целевого размера
+        ratio = float(max_side) / float(longest)
+        src.draft(None, (max(1, int(src.size[0] * ratio)), max(1, int(src.size[1] * ratio))))
     src = ImageOps.exif_transpose(src)
-    if src.mode != "RGBA":
-        src = src.convert("RGBA")
+    # PNG/WEBP сохраняются с альфой; остальное уходит в JPEG — целиком в RGBA не переводим
+    keep_alpha = src_format in ("PNG", "WEBP")
+    target_mode = "RGBA" if keep_alpha else "RGB"
+    if src.mode != target_mode:
+        src = src.convert(target_mode)
 
     width, height = src.size
     longest = max(width, height)
@@ -100,52 +202,23 @@ def _render_rgba_with_watermark(
     else:
         width, height = src.size
 
-    overlay = Image.new("RGBA", src.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-    parts = _split_colored_parts(text, highlight_text=highlight_text)
-
-    font_size = int(max(12, min(52, width * 0.028)))
-    font = _load_font(font_size)
-
-    while font_size > 10:
-        part_sizes: list[tuple[int, int]] = []
-        total_w = 0
-        max_h = 0
-        for part, _ in parts:
-            w, h = _calc_text_size(draw, part, font)
-            total_w += w
-            max_h = max(max_h, h)
-            part_sizes.append((w, h))
-        if total_w <= int(width * 0.94):
-            break
-        font_size -= 1
-        font = _load_font(font_size)
-
-    part_sizes = []
-    total_w = 0
-    max_h = 0
-    for part, _ in parts:
-        w, h = _calc_text_size(draw, part, font)
-        total_w += w
-        max_h = max(max_h, h)
-        part_sizes.append((w, h))
+    strip, ox, oy, text_w, text_h = _get_text_strip(text, highlight_text, width)
 
-    x = max(2, (width - total_w) // 2)
+    x = max(2, (width - text_w) // 2)
     bottom_offset = max(6, int(height * 0.04))
-    y = max(2, height - bottom_offset - max_h)
+    y = max(2, height - bottom_offset - text_h)
 
-    shadow_fill = (0, 0, 0, 14)
-    cur_x = x
-    for idx, (part, color) in enumerate(parts):
-        if not part:
-            continue
-        part_w, _ = part_sizes[idx]
-        draw.text((cur_x + 1, y + 1), part, font=font, fill=shadow_fill)
-        draw.text((cur_x, y), part, font=font, fill=color)
-        cur_x += part_w
-
-    composed = Image.alpha_composite(src, overlay)
-    return composed, src_format
+    # накладываем только полосу под текстом, а не полнокадровый оверлей
+    left, top = x - ox, y - oy
+    box = (max(0, left), max(0, top), min(width, left + strip.width), min(height, top + strip.height))
+    if box[0] < box[2] and box[1] < box[3]:
+        band = src.crop(box)
+        if band.mode != "RGBA":
+            band = band.convert("RGBA")
+        piece = strip.crop((box[0] - left, box[1] - top, box[2] - left, box[3] - top))
+        band = Image.alpha_composite(band, piece)
+        src.paste(band if keep_alpha else band.convert(target_mode), box[:2])
+    return src, src_format
 
 
 def apply_text_watermark(
@@ -180,7 +253,7 @@ def apply_text_watermark(
         elif src_format == "WEBP":
             composed.save(out, format="WEBP", quality=95, method=6)
         else:
-            composed.convert("RGB").save(
+            (composed if composed.mode == "RGB" else composed.convert("RGB")).save(
                 out,
                 format="JPEG",
                 quality=95,
@@ -191,3 +264,23 @@ def apply_text_watermark(
         return out.getvalue()
     except Exception:
         return image_bytes
+
+
+def convert_to_jpeg(image_bytes: bytes) -> bytes | None:
+    """Документ (PNG/WEBP/JPEG-файл) -> JPEG, чтобы Telegram принял его как фото. None — не картинка."""
+    try:
+        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=95, subsampling=0, optimize=True)
+        return out.getvalue()
+    except Exception:
+        return None
+
+
+def read_image_size(image_bytes: bytes) -> tuple[int, int] | None:
+    """Размер по заголовку, без декодирования пикселей."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            return img.size
+    except Exception:
+        return None